@@ -2,9 +2,11 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import sys
 import os
+import logging
 from dotenv import load_dotenv
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
+from contextlib import asynccontextmanager
 
 # 加载.env文件
 load_dotenv()
@@ -12,11 +14,42 @@ load_dotenv()
 # Add the parent directory to the path so we can import from the local modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from backend.routers import agent_router, health_router, user_router
+from backend.services.llm_gateway import llm_gateway  # noqa: E402
+from backend.services.agent_kernel import AgentKernel  # noqa: E402
+from backend.memory.cosmos_memory_store import CosmosMemoryStore  # noqa: E402
+from backend.tools.emotion_prediction_tool import analytics_pool, emotion_batcher  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 进程内共享一个记忆存储（及其 Cosmos 连接池），注入到路由和 AgentKernel
+    memory_store = CosmosMemoryStore()
+    agent_kernel = AgentKernel(mode="default", memory_store=memory_store)
+    # 恢复上次关闭时保存的情绪时间序列（超过有效期的快照会被忽略）
+    memory_store.emotion_series.load_snapshot()
+    app.state.memory_store = memory_store
+    app.state.agent_kernel = agent_kernel
+    app.state.interaction_writer = agent_kernel.interaction_writer
+    # 启动分析进程并预加载情绪模型，第一个请求不承担冷启动开销
+    await analytics_pool.start()
+    yield
+    # 先写完后台队列中的交互记录，再关闭存储和 LLM 客户端的连接池
+    await agent_kernel.close()
+    await emotion_batcher.close()
+    await analytics_pool.close()
+    try:
+        memory_store.emotion_series.save_snapshot()
+    except Exception as e:
+        logger.error(f"保存情绪时间序列快照时出错: {str(e)}")
+    await memory_store.close()
+    await llm_gateway.close()
 
 app = FastAPI(
     title="Emotion Agent API",
     description="Backend for Emotion Agent iOS app",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # Configure CORS for iOS app
@@ -0,0 +1,209 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+# 上下文块名称
+MEMORY_BLOCK = "memories"
+EMOTION_BLOCK = "emotions"
+SUMMARY_BLOCK = "summaries"
+# invalidate() 不指定块时使用的失效记录键
+ALL_BLOCKS = "*"
+
+CacheKey = Tuple[str, str, str]
+
+
+class ContextBlockCache:
+    """
+    按用户缓存已渲染的 prompt 上下文块（记忆、情绪历史、对话摘要）。
+
+    - LRU + TTL 淘汰：超过容量时淘汰最久未使用的条目，超过 TTL 的条目视为未命中
+    - 写入触发失效：记忆存储在写入时调用 invalidate()，只清除受影响的块
+    - 失效代数：未命中时记下 generation()，
+      回填时该块在此之后失效过（读取期间发生了写入）则丢弃，
+      避免把写入前读到的旧内容缓存一个 TTL；失效记录与条目一样最多保留 max_entries 个
+    - 命中/未命中计数，可通过 stats() 查看
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300.0):
+        """
+        初始化缓存
+
+        Args:
+            max_entries: 最大缓存条目数
+            ttl_seconds: 条目有效期（秒）
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (写入时间, 渲染后的内容)
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Any]]" = OrderedDict()
+        # user_id -> 该用户的所有 key，用于按用户失效
+        self._user_keys: Dict[str, Set[CacheKey]] = {}
+        # 每次 invalidate() 递增的全局时钟
+        self._clock = 0
+        # (user_id, block) -> 最近一次失效时的时钟；
+        # block 为 ALL_BLOCKS 时表示整个用户失效
+        self._invalidated: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        # 已淘汰的失效记录中最大的时钟，早于它开始的回填无法判断，一律丢弃
+        self._forgotten = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_fills = 0
+
+    def generation(self, user_id: str, block: str) -> int:
+        """
+        返回块的失效代数，在读取数据源之前获取，回填时传给 set()
+
+        Args:
+            user_id: 用户ID
+            block: 块名称
+
+        Returns:
+            当前的失效时钟；之后该块（或整个用户）失效过时，回填会被丢弃
+        """
+        return self._clock
+
+    def _is_stale(self, user_id: str, block: str, generation: int) -> bool:
+        """回填是否早于该块最近一次失效"""
+        if self._forgotten > generation:
+            return True
+        return (
+            max(
+                self._invalidated.get((user_id, block), 0),
+                self._invalidated.get((user_id, ALL_BLOCKS), 0),
+            )
+            > generation
+        )
+
+    def get(self, user_id: str, block: str, variant: str = "") -> Optional[Any]:
+        """
+        读取缓存的上下文块
+
+        Args:
+            user_id: 用户ID
+            block: 块名称
+            variant: 同一块的不同变体（例如记忆块对应的查询文本）
+
+        Returns:
+            缓存内容，未命中或已过期时返回 None
+        """
+        key = (user_id, block, variant)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(
+        self,
+        user_id: str,
+        block: str,
+        value: Any,
+        variant: str = "",
+        generation: Optional[int] = None,
+    ) -> bool:
+        """
+        写入上下文块
+
+        Args:
+            user_id: 用户ID
+            block: 块名称
+            value: 渲染后的内容
+            variant: 同一块的不同变体
+            generation: 读取数据源之前的 generation()，之后该块失效过时不写入
+
+        Returns:
+            是否写入
+        """
+        if generation is not None and self._is_stale(user_id, block, generation):
+            self.stale_fills += 1
+            return False
+
+        key = (user_id, block, variant)
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        self._user_keys.setdefault(user_id, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+        return True
+
+    def invalidate(self, user_id: str, blocks: Optional[Iterable[str]] = None) -> None:
+        """
+        使用户的上下文块失效
+
+        Args:
+            user_id: 用户ID
+            blocks: 需要失效的块名称，为 None 时清除该用户的全部块
+        """
+        # 即使当前没有缓存条目也要记录失效：可能有正在读取的请求稍后回填
+        self._clock += 1
+        for block in (blocks if blocks is not None else [ALL_BLOCKS]):
+            self._invalidated[(user_id, block)] = self._clock
+            self._invalidated.move_to_end((user_id, block))
+        while len(self._invalidated) > self.max_entries:
+            _, forgotten = self._invalidated.popitem(last=False)
+            self._forgotten = max(self._forgotten, forgotten)
+
+        keys = self._user_keys.get(user_id)
+        if not keys:
+            return
+
+        block_set = set(blocks) if blocks is not None else None
+        for key in list(keys):
+            if block_set is None or key[1] in block_set:
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        """清空缓存（计数器保留）"""
+        self._entries.clear()
+        self._user_keys.clear()
+        if self._invalidated:
+            self._forgotten = self._clock
+            self._invalidated.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "stale_fills": self.stale_fills,
+        }
+
+    def _remove(self, key: CacheKey) -> None:
+        """删除单个条目并维护用户索引"""
+        self._entries.pop(key, None)
+        user_keys = self._user_keys.get(key[0])
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self._user_keys[key[0]]
+
+
+# 进程内共享实例
+context_cache = ContextBlockCache(
+    max_entries=int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", "1024")),
+    ttl_seconds=float(os.getenv("CONTEXT_CACHE_TTL", "300")),
+)
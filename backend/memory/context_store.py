@@ -4,6 +4,8 @@ from typing import Dict, Any, List
 from datetime import datetime
 from pathlib import Path
 
+from backend.memory.emotion_timeseries import EMOTION_SERIES_CAPACITY
+
 class ContextStore:
     """
     Manages contextual memory for the agent.
@@ -73,6 +75,11 @@ class ContextStore:
         # Limit history size (keep last 20 interactions)
         if len(self.memory["users"][user_id]["interactions"]) > 20:
             self.memory["users"][user_id]["interactions"] = self.memory["users"][user_id]["interactions"][-20:]
+        
+        # Emotion history is bounded like the per-user ring buffer in emotion_timeseries
+        if len(self.memory["users"][user_id]["emotion_history"]) > EMOTION_SERIES_CAPACITY:
+            self.memory["users"][user_id]["emotion_history"] = \
+                self.memory["users"][user_id]["emotion_history"][-EMOTION_SERIES_CAPACITY:]
             
         # Update last active timestamp
         self.memory["users"][user_id]["last_active"] = datetime.now().isoformat()
@@ -1,13 +1,53 @@
 import os
+import copy
 import json
+import uuid
+import hashlib
+import asyncio
 import logging
+from collections import OrderedDict
 from typing import Dict, Any, List, Optional
 from datetime import datetime
-from azure.cosmos import CosmosClient, PartitionKey, exceptions
+from azure.cosmos import PartitionKey, exceptions
+from azure.cosmos.aio import CosmosClient
+
+from backend.memory.context_cache import context_cache, MEMORY_BLOCK, EMOTION_BLOCK, SUMMARY_BLOCK
+from backend.memory.request_charge import RequestChargeTracker
+from backend.memory.local_log_store import local_log_store
+from backend.memory.emotion_timeseries import EmotionTimeSeries
+from backend.memory.memory_index import MemoryIndex
+from backend.memory.profile_cache import (
+    ReadThroughCache, PROFILE_CACHE_MAX_ENTRIES, PROFILE_CACHE_TTL,
+    USERNAME_CACHE_MAX_ENTRIES, USERNAME_CACHE_TTL
+)
+from backend.memory.tokenizer import keyword_tokens
+from backend.memory.embeddings import embedding_engine
+from backend.services.summary_worker import SummaryWorker
+
+# Cosmos DB 单个事务批处理最多包含的操作数
+COSMOS_BATCH_MAX_OPERATIONS = 100
+# 对话消息分桶大小（每个分桶文档最多存放的消息数）
+CONVERSATION_BUCKET_SIZE = int(os.getenv("CONVERSATION_BUCKET_SIZE", "50"))
+# 分页读取对话消息时每页的默认消息数
+CONVERSATION_PAGE_SIZE = int(os.getenv("CONVERSATION_PAGE_SIZE", "50"))
+# 进程内缓存活跃对话ID的用户数
+CONVERSATION_CACHE_MAX_USERS = int(os.getenv("CONVERSATION_CACHE_MAX_USERS", "10000"))
+# 单次 patch 最多 10 个操作：头文档还需要 incr 和 set，每块最多追加 8 条消息
+CONVERSATION_PATCH_MAX_MESSAGES = 8
+# 消息写入分桶失败（限流、超时）后的重试次数
+CONVERSATION_APPEND_RETRIES = int(os.getenv("CONVERSATION_APPEND_RETRIES", "3"))
+# 每多少条消息生成一次摘要
+SUMMARY_EVERY_MESSAGES = 10
+# 对话容器中的文档类型
+CONVERSATION_HEADER_TYPE = "conversation"
+CONVERSATION_BUCKET_TYPE = "messages"
 
 class CosmosMemoryStore:
     """
     使用 Azure Cosmos DB 管理情感代理的记忆系统。
+    
+    基于异步 SDK，整个进程共享一个实例（及其连接池），由应用的 lifespan
+    创建和关闭，并注入到路由和 AgentKernel 中。
     """
     
     def __init__(self):
@@ -19,6 +59,28 @@ class CosmosMemoryStore:
         # 初始化日志
         self.logger = logging.getLogger(__name__)
         
+        # 按操作统计 RU 消耗
+        self.request_charges = RequestChargeTracker()
+        
+        # 按用户懒加载的记忆索引（向量 + 关键词）
+        self.memory_index = MemoryIndex(model=embedding_engine.model_name)
+        
+        # 本地模式（以及 Cosmos DB 写入失败时）的追加写日志
+        self.local_log = local_log_store
+        
+        # 用户ID -> 当前活跃对话ID
+        self._active_conversations: "OrderedDict[str, str]" = OrderedDict()
+        
+        # 按用户懒加载的情绪时间序列
+        self.emotion_series = EmotionTimeSeries()
+        
+        # 用户配置文件和用户名 -> 用户ID 的读穿透缓存
+        self.profile_cache = ReadThroughCache(PROFILE_CACHE_MAX_ENTRIES, PROFILE_CACHE_TTL)
+        self.username_cache = ReadThroughCache(USERNAME_CACHE_MAX_ENTRIES, USERNAME_CACHE_TTL)
+        
+        # 对话摘要在后台生成，不占用请求时间
+        self.summary_worker = SummaryWorker(self._write_conversation_summary)
+        
         # 检查环境变量是否存在
         if not self.endpoint or not self.key:
             self.logger.warning("Cosmos DB 环境变量未设置，将使用本地文件存储")
@@ -26,7 +88,7 @@ class CosmosMemoryStore:
             return
             
         try:
-            # 初始化 Cosmos 客户端
+            # 初始化异步 Cosmos 客户端（连接在首次请求时建立）
             self.client = CosmosClient(self.endpoint, credential=self.key)
             self.database = self.client.get_database_client(self.database_name)
             
@@ -42,55 +104,97 @@ class CosmosMemoryStore:
             self.logger.error(f"连接 Cosmos DB 时出错: {str(e)}")
             self.client = None
         
+    async def close(self) -> None:
+        """等待后台摘要任务完成，然后关闭 Cosmos 客户端及其连接池"""
+        await self.summary_worker.close()
+        if self.client is not None:
+            await self.client.close()
+    
+    async def _query_items(self, container, operation: str, query: str,
+                           parameters: Optional[List[Dict[str, Any]]] = None,
+                           user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        执行参数化查询并收集全部结果
+        
+        Args:
+            container: 容器
+            operation: 操作名称，用于统计 RU
+            query: SQL 查询，值通过 @参数 传入
+            parameters: 查询参数
+            user_id: 提供时只查询该用户所在的分区
+        """
+        kwargs = {
+            "parameters": parameters or [],
+            "response_hook": self.request_charges.hook(operation)
+        }
+        if user_id is not None:
+            kwargs["partition_key"] = user_id
+        return [item async for item in container.query_items(query=query, **kwargs)]
+    
+    async def _read_item(self, container, operation: str, item_id: str,
+                         user_id: str) -> Optional[Dict[str, Any]]:
+        """按 id 和分区键点读文档，不存在时返回 None"""
+        try:
+            return await container.read_item(
+                item=item_id,
+                partition_key=user_id,
+                response_hook=self.request_charges.hook(operation)
+            )
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+    
     async def get_user_profile(self, user_id: str) -> Dict[str, Any]:
-        """获取用户配置文件"""
+        """获取用户配置文件（经过进程内缓存，并发未命中只读取一次）"""
         try:
             if not self.client:
                 return self._get_local_user_profile(user_id)
-                
-            query = f"SELECT * FROM c WHERE c.user_id = '{user_id}'"
-            items = list(self.profile_container.query_items(
-                query=query,
-                enable_cross_partition_query=True
-            ))
-            
-            if items:
-                return items[0]
-            else:
-                # 如果用户不存在，创建新的用户配置文件
-                profile = self._create_default_profile(user_id)
-                return profile
+            
+            profile = await self.profile_cache.get_or_load(user_id, lambda: self._load_user_profile(user_id))
+            # 返回副本，调用方修改不会影响缓存
+            return copy.deepcopy(profile)
         except Exception as e:
             self.logger.error(f"获取用户配置文件时出错: {str(e)}")
             return self._get_local_user_profile(user_id)
     
+    async def _load_user_profile(self, user_id: str) -> Dict[str, Any]:
+        """从 Cosmos DB 读取用户配置文件，不存在时创建默认配置"""
+        # 用户配置文件的 id 与 user_id 相同，直接点读
+        profile = await self._read_item(self.profile_container, "get_user_profile", user_id, user_id)
+        if profile:
+            return profile
+        # 如果用户不存在，创建新的用户配置文件
+        return await self._create_default_profile(user_id)
+    
     async def get_user_id_by_username(self, username: str) -> Optional[str]:
-        """通过用户名获取用户ID"""
+        """通过用户名获取用户ID（经过进程内缓存，同一用户名并发未命中只查询或创建一次）"""
         try:
             if not self.client:
                 return username  # 在本地模式下，直接使用username作为user_id
-                
-            query = f"SELECT c.id, c.user_id FROM c WHERE c.username = '{username}'"
-            items = list(self.profile_container.query_items(
-                query=query,
-                enable_cross_partition_query=True
-            ))
-            
-            if items:
-                return items[0]["user_id"]
-            else:
-                # 如果用户名不存在，则创建新用户并返回ID
-                new_profile = await self.create_user_profile(username=username)
-                return new_profile["user_id"]
-                
+            
+            return await self.username_cache.get_or_load(username, lambda: self._resolve_username(username))
         except Exception as e:
             self.logger.error(f"通过用户名获取用户ID时出错: {str(e)}")
             return username  # 出错时返回用户名作为ID
     
+    async def _resolve_username(self, username: str) -> str:
+        """查询用户名对应的配置文件，不存在时创建；配置文件同时写入配置缓存"""
+        # 用户名不是分区键，只能跨分区查询
+        items = await self._query_items(
+            self.profile_container,
+            "get_user_id_by_username",
+            "SELECT TOP 1 * FROM c WHERE c.username = @username",
+            [{"name": "@username", "value": username}]
+        )
+        
+        # 如果用户名不存在，则创建新用户
+        profile = items[0] if items else await self.create_user_profile(username=username)
+        self.profile_cache.set(profile["user_id"], profile)
+        return profile["user_id"]
+    
     async def create_user_profile(self, username: str, metadata: Dict[str, Any] = None) -> Dict[str, Any]:
         """创建新用户配置文件"""
-        # 生成唯一用户ID
-        user_id = f"user_{int(datetime.now().timestamp())}"
+        # 用户ID由用户名确定：多个 worker 同时为同一用户名创建时写入同一个文档
+        user_id = self._user_id_for_username(username)
         
         profile = {
             "id": user_id,
@@ -113,10 +217,17 @@ class CosmosMemoryStore:
                 return profile
                 
             # 保存到 Cosmos DB
-            self.profile_container.create_item(body=profile)
+            await self.profile_container.create_item(
+                body=profile,
+                response_hook=self.request_charges.hook("create_user_profile")
+            )
             self.logger.info(f"创建新用户配置文件: {username} (ID: {user_id})")
             return profile
             
+        except exceptions.CosmosResourceExistsError:
+            # 其他 worker 已经为该用户名创建了配置文件
+            existing = await self._read_item(self.profile_container, "get_user_profile", user_id, user_id)
+            return existing or profile
         except Exception as e:
             self.logger.error(f"创建用户配置文件时出错: {str(e)}")
             self._save_local_user_profile(profile)
@@ -128,154 +239,169 @@ class CosmosMemoryStore:
             if not self.client:
                 return self._update_local_user_preferences(user_id, preferences)
                 
-            # 查询现有配置
-            query = f"SELECT * FROM c WHERE c.user_id = '{user_id}'"
-            items = list(self.profile_container.query_items(
-                query=query,
-                enable_cross_partition_query=True
-            ))
-            
-            if not items:
+            # 点读现有配置
+            profile = await self._read_item(self.profile_container, "update_user_preferences", user_id, user_id)
+            
+            if not profile:
                 raise Exception(f"用户 {user_id} 不存在")
-                
-            profile = items[0]
             
             # 更新偏好设置
             profile["preferences"].update(preferences)
             profile["last_active"] = datetime.now().isoformat()
             
             # 保存更新
-            self.profile_container.replace_item(
+            await self.profile_container.replace_item(
                 item=profile["id"],
-                body=profile
+                body=profile,
+                response_hook=self.request_charges.hook("update_user_preferences")
             )
             
+            # 写穿：缓存中保存更新后的配置
+            self.profile_cache.set(user_id, copy.deepcopy(profile))
             return profile
             
         except Exception as e:
             self.logger.error(f"更新用户偏好设置时出错: {str(e)}")
+            self.profile_cache.invalidate(user_id)
             return self._update_local_user_preferences(user_id, preferences)
     
     async def add_interaction(self, user_id: str, text: str, emotion: str, 
                              suggestion: str, confidence: float = 0.8,
                              metadata: Dict[str, Any] = None) -> str:
         """记录新的用户交互"""
-        timestamp = datetime.now().isoformat()
-        interaction_id = f"int_{int(datetime.now().timestamp())}"
-        
-        # 创建交互文档
-        interaction = {
-            "id": interaction_id,
+        interaction_ids = await self.add_interactions([{
             "user_id": user_id,
-            "timestamp": timestamp,
             "text": text,
             "emotion": emotion,
-            "confidence": confidence,
             "suggestion": suggestion,
-            "metadata": metadata or {}
-        }
+            "confidence": confidence,
+            "metadata": metadata
+        }])
+        return interaction_ids[0]
+    
+    async def add_interactions(self, records: List[Dict[str, Any]], raise_on_error: bool = False) -> List[str]:
+        """
+        批量记录用户交互，每条交互同时写入情绪历史和记忆嵌入
+        
+        Cosmos DB 中按容器和用户分组，以事务批处理写入，减少往返次数。
+        文档以 upsert 写入，带 id 的记录重试时不会重复。
+        
+        Args:
+            records: 交互记录列表，字段同 add_interaction 的参数，可选 id 和 timestamp
+            raise_on_error: Cosmos DB 写入失败时抛出异常，不写入本地存储（由后台写入队列重试或保存）
+            
+        Returns:
+            交互ID列表
+        """
+        interactions = [self._build_interaction(record) for record in records]
+        memories = await self._build_memory_records(interactions)
         
         try:
             if not self.client:
-                self._add_local_interaction(user_id, interaction)
-                return interaction_id
-                
-            # 保存到 Cosmos DB
-            self.interaction_container.create_item(body=interaction)
-            
-            # 同时保存到情绪历史
-            emotion_id = f"emo_{int(datetime.now().timestamp())}"
-            emotion_record = {
-                "id": emotion_id,
-                "user_id": user_id,
-                "timestamp": timestamp,
-                "emotion": emotion,
-                "confidence": confidence,
-                "context_keywords": self._extract_keywords(text)
-            }
-            self.emotion_container.create_item(body=emotion_record)
-            
-            # 创建并保存嵌入
-            await self._create_and_store_embedding(
-                user_id, interaction_id, text, emotion, timestamp
-            )
-            
-            return interaction_id
+                # 本地日志加文件锁并读写整个文件，放到线程中执行，其他进程持锁时不阻塞事件循环
+                await asyncio.to_thread(self._add_local_interactions, interactions)
+            else:
+                emotion_records = [self._build_emotion_record(interaction) for interaction in interactions]
+                await asyncio.gather(
+                    self._upsert_items_batched(self.interaction_container, "add_interactions", interactions),
+                    self._upsert_items_batched(self.emotion_container, "add_emotion_records", emotion_records),
+                    self._upsert_items_batched(self.embedding_container, "add_memory_embeddings", memories)
+                )
         except Exception as e:
+            if raise_on_error:
+                raise
             self.logger.error(f"添加交互记录时出错: {str(e)}")
-            self._add_local_interaction(user_id, interaction)
-            return interaction_id
+            await asyncio.to_thread(self._add_local_interactions, interactions)
+        
+        # 写入成功（或已保存到本地）后才更新内存中的索引，重试不会重复插入
+        # 新记忆增量插入已加载的记忆索引（向量 + 关键词），新情绪追加到时间序列
+        for memory in memories:
+            self.memory_index.add(memory["user_id"], memory)
+        for interaction in interactions:
+            self.emotion_series.add(interaction["user_id"], interaction)
+        # 新交互会改变用户的记忆和情绪历史，使对应的上下文缓存失效
+        for user_id in {interaction["user_id"] for interaction in interactions}:
+            context_cache.invalidate(user_id, [MEMORY_BLOCK, EMOTION_BLOCK])
+        return [interaction["id"] for interaction in interactions]
         
     async def get_recent_emotions(self, user_id: str, limit: int = 5) -> List[Dict[str, Any]]:
-        """获取用户最近的情绪记录"""
+        """
+        获取用户最近的情绪记录（最新的在前）
+        
+        从内存中的情绪时间序列读取：用户第一次读取时从存储加载最近的记录，
+        之后新交互的情绪直接追加，不再每次构建 prompt 都查询一次。
+        """
         try:
-            if not self.client:
-                return self._get_local_recent_emotions(user_id, limit)
-                
-            query = f"""
-                SELECT TOP {limit} * FROM c 
-                WHERE c.user_id = '{user_id}' 
-                ORDER BY c.timestamp DESC
-            """
-            
-            items = list(self.emotion_container.query_items(
-                query=query,
-                enable_cross_partition_query=True
-            ))
-            
-            return items
+            series = await self.emotion_series.get(user_id, lambda: self._load_recent_emotions(user_id))
+            return self.emotion_series.recent(user_id, series, limit)
         except Exception as e:
             self.logger.error(f"获取最近情绪记录时出错: {str(e)}")
-            return self._get_local_recent_emotions(user_id, limit)
+            return await asyncio.to_thread(self._get_local_recent_emotions, user_id, limit)
+    
+    async def get_emotion_trend(self, user_id: str, granularity: str = "hour",
+                                since: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        获取用户情绪的小时或日汇总（增量维护，读取不访问存储）
+        
+        Args:
+            user_id: 用户ID
+            granularity: "hour"（最近 7 天）或 "day"（最近 90 天）
+            since: ISO 时间，只返回该时间之后的时间段
+            
+        Returns:
+            按时间升序的 [{"start", "count", "emotions": {情绪: 次数}, "avg_confidence"}]
+        """
+        try:
+            series = await self.emotion_series.get(user_id, lambda: self._load_recent_emotions(user_id))
+            return self.emotion_series.rollups(series, granularity, since)
+        except Exception as e:
+            self.logger.error(f"获取情绪趋势时出错: {str(e)}")
+            return []
+    
+    async def _load_recent_emotions(self, user_id: str) -> List[Dict[str, Any]]:
+        """从存储加载用户最近的情绪记录，用于构建情绪时间序列"""
+        limit = self.emotion_series.capacity
+        if not self.client:
+            return await asyncio.to_thread(self.local_log.tail, "emotions", user_id, limit)
+        
+        query = """
+            SELECT TOP @limit c.timestamp, c.emotion, c.confidence FROM c 
+            WHERE c.user_id = @user_id 
+            ORDER BY c.timestamp DESC
+        """
+        return await self._query_items(
+            self.emotion_container,
+            "get_recent_emotions",
+            query,
+            [{"name": "@limit", "value": limit}, {"name": "@user_id", "value": user_id}],
+            user_id=user_id
+        )
     
     async def retrieve_relevant_memories(self, user_id: str, query: str, 
                                        top_k: int = 3) -> Dict[str, List[Dict[str, Any]]]:
-        """检索与查询相关的记忆"""
+        """
+        检索与查询相关的记忆
+        
+        用户的记忆在第一次检索时加载到内存索引，之后新写入的记忆增量插入。
+        检索时向量相似度和 BM25 关键词得分各取候选，用倒数排名融合后返回 top-k。
+        """
         try:
-            if not self.client:
-                return self._get_mock_memories()
-                
-            # 为查询生成嵌入向量 (在实际实现中)
-            # query_embedding = await self._generate_embedding(query)
-            
-            # 使用简单的关键词匹配作为临时方案
-            keywords = self._extract_keywords(query)
-            keyword_conditions = " OR ".join([f"ARRAY_CONTAINS(c.keywords, '{kw}')" for kw in keywords])
+            index = await self.memory_index.get(user_id, lambda: self._load_memory_documents(user_id))
             
-            query_str = f"""
-                SELECT TOP {top_k} c.id, c.user_id, c.timestamp, c.summary, 
-                       c.source_type, c.source_id, c.memory_type  
-                FROM c 
-                WHERE c.user_id = '{user_id}' AND ({keyword_conditions})
-                ORDER BY c.timestamp DESC
-            """
+            # 本地模式下还没有任何记忆时，返回示例数据
+            if not self.client and len(index) == 0:
+                return self._get_mock_memories()
             
-            items = list(self.embedding_container.query_items(
-                query=query_str,
-                enable_cross_partition_query=True
-            ))
-            
-            # 如果没有匹配项，返回最近的记忆
-            if not items:
-                recent_query = f"""
-                    SELECT TOP {top_k} c.id, c.user_id, c.timestamp, c.summary, 
-                           c.source_type, c.source_id, c.memory_type
-                    FROM c 
-                    WHERE c.user_id = '{user_id}'
-                    ORDER BY c.timestamp DESC
-                """
-                items = list(self.embedding_container.query_items(
-                    query=recent_query,
-                    enable_cross_partition_query=True
-                ))
+            query_embedding = await self._generate_embedding(query)
+            results = index.search(query_embedding, query, top_k)
             
             # 转换为客户端期望的格式
             memories = []
-            for item in items:
+            for relevance, item in results:
                 memories.append({
                     "summary": item.get("summary", "用户之前的互动"),
                     "embedding_source": f"{item.get('timestamp', datetime.now().isoformat())} {item.get('source_type', 'interaction')}",
-                    "relevance": 0.9,  # 在实际实现中，这将是基于向量相似度的实际得分
+                    "relevance": round(relevance, 4),
                     "memory_type": item.get("memory_type", "general")
                 })
                 
@@ -286,88 +412,113 @@ class CosmosMemoryStore:
             self.logger.error(f"检索记忆时出错: {str(e)}")
             return self._get_mock_memories()
     
+    async def _load_memory_documents(self, user_id: str) -> List[Dict[str, Any]]:
+        """加载用户的全部记忆文档（含嵌入向量），用于构建记忆索引"""
+        if not self.client:
+            # 本地模式没有单独的记忆存储，根据交互记录生成
+            interactions = await asyncio.to_thread(self._get_local_interactions, user_id)
+            return await self._build_memory_records(interactions)
+        
+        query = """
+            SELECT c.id, c.user_id, c.timestamp, c.summary, c.source_type,
+                   c.source_id, c.memory_type, c.emotion, c.embedding, c.embedding_model
+            FROM c
+            WHERE c.user_id = @user_id
+        """
+        # 嵌入模型不同的旧文档也要加载：它们仍参与关键词检索
+        return await self._query_items(
+            self.embedding_container,
+            "load_memory_embeddings",
+            query,
+            [{"name": "@user_id", "value": user_id}],
+            user_id=user_id
+        )
+    
     async def update_or_create_conversation(self, user_id: str, 
                                           message: Dict[str, Any], 
                                           is_new: bool = False) -> str:
-        """更新或创建对话历史"""
-        timestamp = datetime.now().isoformat()
+        """更新或创建对话历史（追加一条消息）"""
+        return await self.append_conversation_messages(user_id, [message], is_new)
+    
+    async def append_conversation_messages(self, user_id: str,
+                                           messages: List[Dict[str, Any]],
+                                           is_new: bool = False) -> str:
+        """
+        向用户当前活跃的对话追加消息，没有活跃对话或 is_new 时创建新对话
+        
+        对话由一个头文档和若干固定大小的消息分桶文档组成：追加消息时先用 patch
+        对头文档的 message_count 做原子自增得到消息位置，再把带位置的消息 patch
+        追加到对应分桶，写入代价与对话长度无关。读取时按位置选取消息，与并发追加
+        到达分桶的顺序无关；分桶写入最终失败时回退头文档中未写入的位置。
         
+        Args:
+            user_id: 用户ID
+            messages: 要追加的消息（同一轮的用户消息和助手回复可以一起写入）
+            is_new: 是否开始新对话
+            
+        Returns:
+            对话ID
+        """
         try:
             if not self.client:
                 return "local_conversation_id"
-                
-            if is_new:
-                # 创建新对话
-                conversation_id = f"conv_{int(datetime.now().timestamp())}"
-                conversation = {
-                    "id": conversation_id,
-                    "user_id": user_id,
-                    "start_time": timestamp,
-                    "last_updated": timestamp,
-                    "messages": [message],
-                    "summary": [],  # 初始化摘要列表
-                    "metadata": {
-                        "emotion_trend": [],
-                        "active": True
-                    }
-                }
-                self.conversation_container.create_item(body=conversation)
-                return conversation_id
-            else:
-                # 更新现有对话
-                query = f"""
-                    SELECT TOP 1 * FROM c 
-                    WHERE c.user_id = '{user_id}' AND c.metadata.active = true
-                    ORDER BY c.last_updated DESC
-                """
-                
-                conversations = list(self.conversation_container.query_items(
-                    query=query,
-                    enable_cross_partition_query=True
-                ))
-                
-                if conversations:
-                    conversation = conversations[0]
-                    conversation["messages"].append(message)
-                    conversation["last_updated"] = timestamp
-                    
-                    # 更新情绪趋势
-                    if message.get("role") == "user" and "emotion" in message:
-                        conversation["metadata"]["emotion_trend"].append(message["emotion"])
-                    
-                    # 检查是否需要生成摘要
-                    if len(conversation["messages"]) % 10 == 0:
-                        # 导入摘要器
-                        from backend.services.summarizer import summarizer
-                        
-                        # 获取最近10条消息
-                        recent_messages = conversation["messages"][-10:]
-                        
-                        # 生成摘要
-                        summary_text = await summarizer.summarize(recent_messages)
-                        
-                        # 将摘要添加到数组
-                        if "summary" not in conversation:
-                            conversation["summary"] = []
-                            
-                        conversation["summary"].append({
-                            "text": summary_text,
-                            "timestamp": timestamp,
-                            "message_range": [len(conversation["messages"])-10, len(conversation["messages"])-1]
-                        })
-                    
-                    self.conversation_container.replace_item(
-                        item=conversation["id"], 
-                        body=conversation
-                    )
-                    return conversation["id"]
-                else:
-                    # 如果没有活跃对话，创建新对话
-                    return await self.update_or_create_conversation(user_id, message, True)
+            
+            conversation_id = None if is_new else await self._get_active_conversation_id(user_id)
+            if conversation_id is None:
+                return await self._create_conversation(user_id, messages)
+            
+            # 单次 patch 最多 10 个操作，按块追加
+            for start in range(0, len(messages), CONVERSATION_PATCH_MAX_MESSAGES):
+                chunk = messages[start:start + CONVERSATION_PATCH_MAX_MESSAGES]
+                try:
+                    header = await self._patch_conversation_header(user_id, conversation_id, chunk)
+                except exceptions.CosmosResourceNotFoundError:
+                    # 对话已被删除，剩余消息写入新对话
+                    self._active_conversations.pop(user_id, None)
+                    return await self._create_conversation(user_id, messages[start:])
+                await self._append_to_buckets(user_id, header, chunk)
+                self._schedule_summary(user_id, header, len(chunk))
+            
+            return conversation_id
         except Exception as e:
             self.logger.error(f"更新对话历史时出错: {str(e)}")
             return "local_conversation_id"
     
+    async def get_conversation_messages(self, user_id: str, conversation_id: str,
+                                        cursor: Optional[int] = None,
+                                        limit: int = CONVERSATION_PAGE_SIZE) -> Dict[str, Any]:
+        """
+        按游标分页读取对话消息
+        
+        Args:
+            user_id: 用户ID
+            conversation_id: 对话ID
+            cursor: 起始消息位置，None 表示从头开始
+            limit: 本页最多返回的消息数
+            
+        Returns:
+            {"messages": [...], "next_cursor": 下一页的起始位置，没有更多消息时为 None}
+        """
+        header = await self._read_item(
+            self.conversation_container, "get_conversation_header", conversation_id, user_id
+        )
+        if not header:
+            return {"messages": [], "next_cursor": None}
+        
+        start = cursor or 0
+        if "messages" in header:
+            # 旧版本把全部消息存放在对话文档中
+            total = len(header["messages"])
+            page = header["messages"][start:start + limit]
+            next_position = start + len(page)
+        else:
+            total = header.get("message_count", 0)
+            next_position = min(start + limit, total)
+            # 写入失败而缺失的位置会被跳过，这一页的消息可能少于 limit
+            page = await self._read_message_range(user_id, header, start, next_position)
+        
+        return {"messages": page, "next_cursor": next_position if next_position < total else None}
+    
     async def get_conversation_history(self, user_id: str, 
                                      conversation_id: str = None) -> List[Dict[str, str]]:
         """获取对话历史"""
@@ -377,27 +528,19 @@ class CosmosMemoryStore:
                     {"role": "user", "content": "模拟本地历史消息1"},
                     {"role": "assistant", "content": "这是一条模拟的助手回复"}
                 ]
-                
-            # 构建查询
-            if conversation_id:
-                query = f"SELECT c.messages FROM c WHERE c.id = '{conversation_id}'"
-            else:
-                query = f"""
-                    SELECT TOP 1 c.messages FROM c 
-                    WHERE c.user_id = '{user_id}' AND c.metadata.active = true
-                    ORDER BY c.last_updated DESC
-                """
-                
-            # 执行查询
-            conversations = list(self.conversation_container.query_items(
-                query=query,
-                enable_cross_partition_query=True
-            ))
-            
-            if conversations and "messages" in conversations[0]:
-                return conversations[0]["messages"]
-            else:
-                return []
+            
+            if not conversation_id:
+                conversation_id = await self._get_active_conversation_id(user_id)
+                if conversation_id is None:
+                    return []
+            
+            messages: List[Dict[str, Any]] = []
+            cursor = 0
+            while cursor is not None:
+                page = await self.get_conversation_messages(user_id, conversation_id, cursor)
+                messages.extend(page["messages"])
+                cursor = page["next_cursor"]
+            return messages
                 
         except Exception as e:
             self.logger.error(f"获取对话历史时出错: {str(e)}")
@@ -411,30 +554,33 @@ class CosmosMemoryStore:
         try:
             if not self.client:
                 return self._get_mock_conversation_summaries(limit)
-                
-            query = f"""
+            
+            # 只查询对话头文档（消息分桶没有 metadata 字段），兼容旧版本的整文档对话
+            query = """
                 SELECT c.id, c.start_time, c.last_updated, c.metadata, 
-                       ARRAY_LENGTH(c.messages) as message_count,
-                       c.summary
+                       c.message_count ?? ARRAY_LENGTH(c.messages) as message_count,
+                       c.summary_root, ARRAY_SLICE(c.summary, -1) as summary
                 FROM c 
-                WHERE c.user_id = '{user_id}'
+                WHERE c.user_id = @user_id AND IS_DEFINED(c.metadata)
                 ORDER BY c.last_updated DESC
-                OFFSET 0 LIMIT {limit}
+                OFFSET 0 LIMIT @limit
             """
             
-            conversations = list(self.conversation_container.query_items(
-                query=query,
-                enable_cross_partition_query=True
-            ))
+            conversations = await self._query_items(
+                self.conversation_container,
+                "get_conversation_summaries",
+                query,
+                [{"name": "@user_id", "value": user_id}, {"name": "@limit", "value": limit}],
+                user_id=user_id
+            )
+            
+            from backend.services.summarizer import latest_summary_text
             
             # 处理结果
             results = []
             for conv in conversations:
-                # 获取最新的摘要文本，如果有
-                latest_summary = ""
-                if "summary" in conv and conv["summary"]:
-                    # 提取最后一条摘要
-                    latest_summary = conv["summary"][-1]["text"] if len(conv["summary"]) > 0 else ""
+                # 根摘要覆盖整个对话，旧对话回退到最后一条窗口摘要
+                latest_summary = latest_summary_text(conv)
                 
                 # 构建结果对象
                 results.append({
@@ -452,9 +598,9 @@ class CosmosMemoryStore:
             self.logger.error(f"获取对话摘要列表时出错: {str(e)}")
             return self._get_mock_conversation_summaries(limit)
     
-    def _create_default_profile(self, user_id: str) -> Dict[str, Any]:
-        """创建默认用户配置文件"""
-        profile = {
+    def _build_default_profile(self, user_id: str) -> Dict[str, Any]:
+        """构造默认用户配置文件"""
+        return {
             "id": user_id,
             "user_id": user_id,
             "username": f"user_{user_id[-6:]}",  # 生成一个默认用户名
@@ -467,10 +613,17 @@ class CosmosMemoryStore:
                 "star_sign": None
             }
         }
+    
+    async def _create_default_profile(self, user_id: str) -> Dict[str, Any]:
+        """创建默认用户配置文件"""
+        profile = self._build_default_profile(user_id)
         
         try:
             if self.client:
-                self.profile_container.create_item(body=profile)
+                await self.profile_container.create_item(
+                    body=profile,
+                    response_hook=self.request_charges.hook("create_user_profile")
+                )
             else:
                 self._save_local_user_profile(profile)
         except Exception as e:
@@ -479,54 +632,381 @@ class CosmosMemoryStore:
             
         return profile
     
+    @staticmethod
+    def _user_id_for_username(username: str) -> str:
+        """根据用户名生成稳定的用户ID"""
+        return "user_" + hashlib.blake2b(username.encode("utf-8"), digest_size=8).hexdigest()
+    
     def _extract_keywords(self, text: str) -> List[str]:
-        """从文本中提取关键词"""
-        # 简单实现：按空格分割并过滤短词
-        words = text.lower().split()
-        return [word for word in words if len(word) > 3]
+        """从文本中提取关键词（中文按字符 2-gram 切分，去重并保持顺序）"""
+        return list(dict.fromkeys(keyword_tokens(text)))
     
     async def _generate_embedding(self, text: str) -> List[float]:
-        """生成文本嵌入向量"""
-        # 在实际实现中，这将调用嵌入API
-        # 目前返回一个假的嵌入向量
-        return [0.1] * 10
-    
-    async def _create_and_store_embedding(self, user_id: str, source_id: str, 
-                                        text: str, emotion: str, timestamp: str) -> None:
-        """创建并存储记忆嵌入"""
-        try:
-            # 生成一个唯一ID
-            memory_id = f"mem_{int(datetime.now().timestamp())}"
-            
-            # 创建一个简单的摘要
-            summary = text[:100] + "..." if len(text) > 100 else text
-            
-            # 提取关键词
-            keywords = self._extract_keywords(text)
-            
-            # 确定记忆类型
-            memory_type = "interaction"
-            
-            # 创建记忆文档
-            memory = {
-                "id": memory_id,
-                "user_id": user_id,
-                "timestamp": timestamp,
-                "source_id": source_id,
+        """生成文本嵌入向量（本地 n-gram 哈希嵌入，带缓存）"""
+        return await embedding_engine.aembed(text)
+    
+    def _build_interaction(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """构造交互文档"""
+        return {
+            # 同一秒内可能有多条交互，使用随机ID避免冲突；调用方预先分配的ID保证重试幂等
+            "id": record.get("id") or f"int_{uuid.uuid4().hex}",
+            "user_id": record["user_id"],
+            "timestamp": record.get("timestamp") or datetime.now().isoformat(),
+            "text": record["text"],
+            "emotion": record["emotion"],
+            "confidence": record.get("confidence", 0.8),
+            "suggestion": record["suggestion"],
+            "metadata": record.get("metadata") or {}
+        }
+    
+    def _build_emotion_record(self, interaction: Dict[str, Any]) -> Dict[str, Any]:
+        """根据交互构造情绪历史文档"""
+        return {
+            "id": "emo_" + interaction["id"][len("int_"):],
+            "user_id": interaction["user_id"],
+            "timestamp": interaction["timestamp"],
+            "emotion": interaction["emotion"],
+            "confidence": interaction["confidence"],
+            "context_keywords": self._extract_keywords(interaction["text"])
+        }
+    
+    async def _build_memory_records(self, interactions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """根据交互构造记忆嵌入文档，整批文本一次计算嵌入"""
+        if not interactions:
+            return []
+        embeddings = await embedding_engine.aembed_batch([interaction["text"] for interaction in interactions])
+        
+        memories = []
+        for interaction, embedding in zip(interactions, embeddings):
+            text = interaction["text"]
+            memories.append({
+                "id": "mem_" + interaction["id"][len("int_"):],
+                "user_id": interaction["user_id"],
+                "timestamp": interaction["timestamp"],
+                "source_id": interaction["id"],
                 "source_type": "interaction",
-                "summary": summary,
-                "keywords": keywords,
-                "emotion": emotion,
-                "memory_type": memory_type,
-                "embedding": await self._generate_embedding(text)  # 在实际实现中，这将是真实的嵌入向量
+                # 创建一个简单的摘要
+                "summary": text[:100] + "..." if len(text) > 100 else text,
+                "keywords": self._extract_keywords(text),
+                "emotion": interaction["emotion"],
+                "memory_type": "interaction",
+                "embedding": embedding.tolist(),
+                "embedding_model": embedding_engine.model_name
+            })
+        return memories
+    
+    async def _upsert_items_batched(self, container, operation: str, items: List[Dict[str, Any]]) -> None:
+        """按用户（分区键）分组，以事务批处理写入文档（upsert，重试时不会因已存在而失败）"""
+        by_user: Dict[str, List[Dict[str, Any]]] = {}
+        for item in items:
+            by_user.setdefault(item["user_id"], []).append(item)
+        
+        for user_id, user_items in by_user.items():
+            if len(user_items) == 1:
+                await container.upsert_item(
+                    body=user_items[0],
+                    response_hook=self.request_charges.hook(operation)
+                )
+                continue
+            for start in range(0, len(user_items), COSMOS_BATCH_MAX_OPERATIONS):
+                chunk = user_items[start:start + COSMOS_BATCH_MAX_OPERATIONS]
+                await container.execute_item_batch(
+                    batch_operations=[("upsert", (item,)) for item in chunk],
+                    partition_key=user_id,
+                    response_hook=self.request_charges.hook(operation)
+                )
+    
+    async def _get_active_conversation_id(self, user_id: str) -> Optional[str]:
+        """获取用户当前活跃对话的ID（进程内缓存，未命中时查询头文档）"""
+        conversation_id = self._active_conversations.get(user_id)
+        if conversation_id is not None:
+            return conversation_id
+        
+        query = """
+            SELECT TOP 1 c.id FROM c 
+            WHERE c.user_id = @user_id AND c.doc_type = @doc_type AND c.metadata.active = true
+            ORDER BY c.last_updated DESC
+        """
+        conversations = await self._query_items(
+            self.conversation_container,
+            "get_active_conversation",
+            query,
+            [{"name": "@user_id", "value": user_id}, {"name": "@doc_type", "value": CONVERSATION_HEADER_TYPE}],
+            user_id=user_id
+        )
+        if not conversations:
+            return None
+        self._remember_active_conversation(user_id, conversations[0]["id"])
+        return conversations[0]["id"]
+    
+    def _remember_active_conversation(self, user_id: str, conversation_id: str) -> None:
+        self._active_conversations[user_id] = conversation_id
+        self._active_conversations.move_to_end(user_id)
+        while len(self._active_conversations) > CONVERSATION_CACHE_MAX_USERS:
+            self._active_conversations.popitem(last=False)
+    
+    async def _create_conversation(self, user_id: str, messages: List[Dict[str, Any]]) -> str:
+        """创建对话头文档和第一个消息分桶（同一分区内的事务批处理）"""
+        timestamp = datetime.now().isoformat()
+        conversation_id = f"conv_{int(datetime.now().timestamp())}_{uuid.uuid4().hex[:8]}"
+        header = {
+            "id": conversation_id,
+            "doc_type": CONVERSATION_HEADER_TYPE,
+            "user_id": user_id,
+            "start_time": timestamp,
+            "last_updated": timestamp,
+            "message_count": len(messages),
+            "bucket_size": CONVERSATION_BUCKET_SIZE,
+            "summary": [],  # 每 10 条消息一条窗口摘要（摘要树的叶子）
+            "summary_tree": {},  # 摘要树第 1 层及以上的节点
+            "summary_root": None,  # 覆盖整个对话的根摘要
+            "metadata": {
+                "emotion_trend": [
+                    message["emotion"] for message in messages
+                    if message.get("role") == "user" and "emotion" in message
+                ],
+                "active": True
             }
-            
-            # 存储到 Cosmos DB
-            if self.client:
-                self.embedding_container.create_item(body=memory)
-                
+        }
+        
+        operations = [("create", (header,))]
+        for bucket, bucket_messages in self._group_by_bucket(0, messages, CONVERSATION_BUCKET_SIZE):
+            operations.append(("create", (self._build_bucket(user_id, conversation_id, bucket, bucket_messages),)))
+        
+        # 单个事务批处理最多 100 个操作，新对话的第一批消息不会超过
+        await self.conversation_container.execute_item_batch(
+            batch_operations=operations,
+            partition_key=user_id,
+            response_hook=self.request_charges.hook("create_conversation")
+        )
+        self._remember_active_conversation(user_id, conversation_id)
+        # 新对话会改变最近的对话摘要列表
+        context_cache.invalidate(user_id, [SUMMARY_BLOCK])
+        self._schedule_summary(user_id, header, len(messages))
+        return conversation_id
+    
+    async def _patch_conversation_header(self, user_id: str, conversation_id: str,
+                                         messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """原子地增加消息计数并更新最后活跃时间、情绪趋势，返回更新后的头文档"""
+        operations = [
+            {"op": "incr", "path": "/message_count", "value": len(messages)},
+            {"op": "set", "path": "/last_updated", "value": datetime.now().isoformat()}
+        ]
+        for message in messages:
+            if message.get("role") == "user" and "emotion" in message:
+                operations.append({"op": "add", "path": "/metadata/emotion_trend/-", "value": message["emotion"]})
+        return await self.conversation_container.patch_item(
+            item=conversation_id,
+            partition_key=user_id,
+            patch_operations=operations,
+            response_hook=self.request_charges.hook("update_conversation")
+        )
+    
+    async def _append_to_buckets(self, user_id: str, header: Dict[str, Any],
+                                 messages: List[Dict[str, Any]]) -> None:
+        """
+        把消息追加到它们所在的分桶，分桶不存在时创建
+
+        某个分桶最终写入失败时，回退头文档中这一块尚未写入的位置后抛出异常，
+        头文档的消息计数不会超前于实际存储的消息。
+        """
+        bucket_size = header.get("bucket_size", CONVERSATION_BUCKET_SIZE)
+        start = header["message_count"] - len(messages)
+        written = 0
+        for bucket, bucket_messages in self._group_by_bucket(start, messages, bucket_size):
+            try:
+                await self._append_to_bucket(user_id, header["id"], bucket, bucket_messages)
+            except Exception:
+                await self._release_positions(user_id, header, messages[written:])
+                raise
+            written += len(bucket_messages)
+    
+    async def _append_to_bucket(self, user_id: str, conversation_id: str, bucket: int,
+                                messages: List[Dict[str, Any]]) -> None:
+        """追加到单个分桶，失败时指数退避重试（重试可能重复追加，读取时按位置去重）"""
+        operations = [{"op": "add", "path": "/messages/-", "value": message} for message in messages]
+        attempt = 0
+        while True:
+            try:
+                try:
+                    await self.conversation_container.patch_item(
+                        item=self._bucket_id(conversation_id, bucket),
+                        partition_key=user_id,
+                        patch_operations=operations,
+                        response_hook=self.request_charges.hook("append_conversation_messages")
+                    )
+                except exceptions.CosmosResourceNotFoundError:
+                    try:
+                        await self.conversation_container.create_item(
+                            body=self._build_bucket(user_id, conversation_id, bucket, messages),
+                            response_hook=self.request_charges.hook("create_conversation_bucket")
+                        )
+                    except exceptions.CosmosResourceExistsError:
+                        # 并发写入的另一条消息先创建了分桶
+                        await self.conversation_container.patch_item(
+                            item=self._bucket_id(conversation_id, bucket),
+                            partition_key=user_id,
+                            patch_operations=operations,
+                            response_hook=self.request_charges.hook("append_conversation_messages")
+                        )
+                return
+            except Exception as e:
+                if attempt >= CONVERSATION_APPEND_RETRIES:
+                    raise
+                attempt += 1
+                delay = min(0.1 * (2 ** attempt), 2.0)
+                self.logger.warning(f"写入对话分桶出错，{delay:.1f}s 后第 {attempt} 次重试: {str(e)}")
+                await asyncio.sleep(delay)
+    
+    async def _release_positions(self, user_id: str, header: Dict[str, Any],
+                                 messages: List[Dict[str, Any]]) -> None:
+        """
+        回退头文档中未能写入分桶的消息位置（这一块位于计数的末尾）
+
+        只有头文档的计数仍等于本次自增后的值时才回退（条件 patch），同时删除这些消息
+        追加的情绪趋势；之后已有其他消息占用了更后面的位置时计数不能回退，
+        改为记录缺失的消息数，读取时按位置跳过这些位置。
+        """
+        end = header["message_count"]
+        trend_length = len(header.get("metadata", {}).get("emotion_trend", []))
+        emotions = sum(1 for message in messages if message.get("role") == "user" and "emotion" in message)
+        operations = [{"op": "incr", "path": "/message_count", "value": -len(messages)}]
+        operations += [
+            {"op": "remove", "path": f"/metadata/emotion_trend/{index}"}
+            for index in range(trend_length - 1, trend_length - 1 - emotions, -1)
+        ]
+        try:
+            try:
+                await self.conversation_container.patch_item(
+                    item=header["id"],
+                    partition_key=user_id,
+                    patch_operations=operations,
+                    filter_predicate=f"FROM c WHERE c.message_count = {end}",
+                    response_hook=self.request_charges.hook("release_conversation_positions")
+                )
+                return
+            except exceptions.CosmosAccessConditionFailedError:
+                pass
+            await self.conversation_container.patch_item(
+                item=header["id"],
+                partition_key=user_id,
+                patch_operations=[{"op": "incr", "path": "/lost_message_count", "value": len(messages)}],
+                response_hook=self.request_charges.hook("release_conversation_positions")
+            )
         except Exception as e:
-            self.logger.error(f"创建记忆嵌入时出错: {str(e)}")
+            self.logger.error(f"回退对话消息位置时出错: {str(e)}")
+    
+    async def _read_message_range(self, user_id: str, header: Dict[str, Any],
+                                  start: int, end: int) -> List[Dict[str, Any]]:
+        """点读覆盖 [start, end) 的分桶，按消息位置返回该范围内的消息（缺失的位置被跳过）"""
+        if start >= end:
+            return []
+        bucket_size = header.get("bucket_size", CONVERSATION_BUCKET_SIZE)
+        first, last = start // bucket_size, (end - 1) // bucket_size
+        buckets = await asyncio.gather(*(
+            self._read_item(self.conversation_container, "read_conversation_bucket",
+                            self._bucket_id(header["id"], bucket), user_id)
+            for bucket in range(first, last + 1)
+        ))
+        
+        by_position: Dict[int, Dict[str, Any]] = {}
+        for bucket, doc in enumerate(buckets, first):
+            for index, message in enumerate((doc or {}).get("messages", [])):
+                # 旧版本的分桶消息没有 position，按数组顺序推算；重试造成的重复只保留一条
+                by_position.setdefault(message.get("position", bucket * bucket_size + index), message)
+        return [
+            {key: value for key, value in by_position[position].items() if key != "position"}
+            for position in range(start, end) if position in by_position
+        ]
+    
+    def _schedule_summary(self, user_id: str, header: Dict[str, Any], appended: int) -> None:
+        """消息数跨过 SUMMARY_EVERY_MESSAGES 的整数倍时，把最近一段消息的摘要任务交给后台队列"""
+        end = header["message_count"]
+        if end // SUMMARY_EVERY_MESSAGES == (end - appended) // SUMMARY_EVERY_MESSAGES:
+            return
+        
+        range_end = end - end % SUMMARY_EVERY_MESSAGES
+        self.summary_worker.submit(header["id"], {
+            "user_id": user_id,
+            "conversation_id": header["id"],
+            "range_start": range_end - SUMMARY_EVERY_MESSAGES,
+            "range_end": range_end
+        })
+    
+    async def _write_conversation_summary(self, job: Dict[str, Any]) -> None:
+        """
+        后台摘要任务：读取一段消息生成窗口摘要，追加到对话的 summary 数组，
+        并更新摘要树和根摘要（同一对话的任务由队列按顺序串行执行）
+        
+        重试或重复提交时，已经写入过的消息范围会被跳过。
+        """
+        # 导入摘要器
+        from backend.services.summarizer import summarizer
+        
+        user_id = job["user_id"]
+        header = await self._read_item(
+            self.conversation_container, "get_conversation_header", job["conversation_id"], user_id
+        )
+        if not header:
+            return
+        message_range = [job["range_start"], job["range_end"] - 1]
+        if any(summary.get("message_range") == message_range for summary in header.get("summary", [])):
+            return
+        
+        messages = await self._read_message_range(user_id, header, job["range_start"], job["range_end"])
+        if not messages:
+            return
+        # LLM 失败（包括熔断）时抛出异常由队列重试，模拟摘要不会作为叶子或根摘要写入
+        leaf = {
+            "text": await summarizer.summarize(messages, raise_on_error=True),
+            "timestamp": datetime.now().isoformat(),
+            "message_range": message_range
+        }
+        # 新叶子与旧根摘要做一次合并得到新的根摘要，必要时向上合并摘要树
+        root, tree = await summarizer.extend_summary_tree(
+            leaf, header.get("summary", []), header.get("summary_tree") or {}, header.get("summary_root"),
+            raise_on_error=True
+        )
+        
+        await self.conversation_container.patch_item(
+            item=header["id"],
+            partition_key=user_id,
+            patch_operations=[
+                {"op": "add", "path": "/summary/-", "value": leaf},
+                {"op": "set", "path": "/summary_root", "value": root},
+                {"op": "set", "path": "/summary_tree", "value": tree}
+            ],
+            response_hook=self.request_charges.hook("add_conversation_summary")
+        )
+        # 生成了新摘要时，使对话摘要的上下文缓存失效
+        context_cache.invalidate(user_id, [SUMMARY_BLOCK])
+    
+    @staticmethod
+    def _bucket_id(conversation_id: str, bucket: int) -> str:
+        return f"{conversation_id}_b{bucket:06d}"
+    
+    def _build_bucket(self, user_id: str, conversation_id: str, bucket: int,
+                      messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """构造消息分桶文档"""
+        return {
+            "id": self._bucket_id(conversation_id, bucket),
+            "doc_type": CONVERSATION_BUCKET_TYPE,
+            "user_id": user_id,
+            "conversation_id": conversation_id,
+            "bucket": bucket,
+            "messages": list(messages)
+        }
+    
+    @staticmethod
+    def _group_by_bucket(start: int, messages: List[Dict[str, Any]], bucket_size: int):
+        """把从位置 start 开始的消息按所在分桶分组，返回 [(分桶序号, 带 position 字段的消息列表)]"""
+        groups: List = []
+        for position, message in enumerate(messages, start):
+            bucket = position // bucket_size
+            if not groups or groups[-1][0] != bucket:
+                groups.append((bucket, []))
+            groups[-1][1].append(dict(message, position=position))
+        return groups
     
     def _get_local_user_profile(self, user_id: str) -> Dict[str, Any]:
         """从本地获取用户配置文件"""
@@ -540,7 +1020,7 @@ class CosmosMemoryStore:
                 with open(profile_path, "r", encoding="utf-8") as f:
                     return json.load(f)
             else:
-                profile = self._create_default_profile(user_id)
+                profile = self._build_default_profile(user_id)
                 self._save_local_user_profile(profile)
                 return profile
                 
@@ -599,47 +1079,34 @@ class CosmosMemoryStore:
                 "error": str(e)
             }
     
-    def _add_local_interaction(self, user_id: str, interaction: Dict[str, Any]) -> None:
-        """添加交互记录到本地存储"""
+    def _get_local_interactions(self, user_id: str) -> List[Dict[str, Any]]:
+        """从本地获取用户的全部交互记录"""
         try:
-            cache_dir = os.path.join(os.path.dirname(__file__), "_local_cache")
-            os.makedirs(cache_dir, exist_ok=True)
-            
-            interactions_path = os.path.join(cache_dir, f"interactions_{user_id}.json")
-            
-            # 读取现有交互
-            interactions = []
-            if os.path.exists(interactions_path):
-                with open(interactions_path, "r", encoding="utf-8") as f:
-                    interactions = json.load(f)
-            
-            # 添加新交互
-            interactions.append(interaction)
-            
-            # 保存更新
-            with open(interactions_path, "w", encoding="utf-8") as f:
-                json.dump(interactions, f, ensure_ascii=False, indent=2)
-                
+            return self.local_log.read_all("interactions", user_id)
         except Exception as e:
-            self.logger.error(f"添加交互记录到本地存储时出错: {str(e)}")
+            self.logger.error(f"从本地获取交互记录时出错: {str(e)}")
+            return []
+    
+    def _add_local_interactions(self, interactions: List[Dict[str, Any]]) -> None:
+        """批量追加交互记录和情绪历史到本地日志，每个用户每种记录只写一次"""
+        by_user: Dict[str, List[Dict[str, Any]]] = {}
+        for interaction in interactions:
+            by_user.setdefault(interaction["user_id"], []).append(interaction)
+        
+        for user_id, user_interactions in by_user.items():
+            try:
+                self.local_log.append("interactions", user_id, user_interactions)
+                self.local_log.append(
+                    "emotions", user_id,
+                    [self._build_emotion_record(interaction) for interaction in user_interactions]
+                )
+            except Exception as e:
+                self.logger.error(f"添加交互记录到本地存储时出错: {str(e)}")
     
     def _get_local_recent_emotions(self, user_id: str, limit: int = 5) -> List[Dict[str, Any]]:
-        """从本地获取最近情绪记录"""
+        """从本地获取最近情绪记录（最新的在前）"""
         try:
-            cache_dir = os.path.join(os.path.dirname(__file__), "_local_cache")
-            os.makedirs(cache_dir, exist_ok=True)
-            
-            emotions_path = os.path.join(cache_dir, f"emotions_{user_id}.json")
-            
-            if os.path.exists(emotions_path):
-                with open(emotions_path, "r", encoding="utf-8") as f:
-                    emotions = json.load(f)
-                    
-                # 返回最近的记录
-                return emotions[-limit:] if len(emotions) > limit else emotions
-            else:
-                return []
-                
+            return self.local_log.tail("emotions", user_id, limit)
         except Exception as e:
             self.logger.error(f"从本地获取最近情绪记录时出错: {str(e)}")
             
@@ -0,0 +1,250 @@
+import os
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from backend.memory.tokenizer import char_ngrams, split_segments
+
+logger = logging.getLogger(__name__)
+
+# 特征哈希的维度
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "512"))
+# 随机投影后的维度，0 表示不投影
+EMBEDDING_PROJECTION_DIM = int(os.getenv("EMBEDDING_PROJECTION_DIM", "0"))
+# 嵌入缓存的最大条目数
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "10000"))
+# 一批中未命中缓存的文本超过该数量时，放到线程中计算，避免阻塞事件循环
+EMBEDDING_THREAD_THRESHOLD = int(os.getenv("EMBEDDING_THREAD_THRESHOLD", "32"))
+
+# 随机投影矩阵的固定种子，保证各进程、各次启动得到相同的向量
+_PROJECTION_SEED = 20240412
+
+
+@lru_cache(maxsize=200000)
+def _feature_hash(feature: str) -> int:
+    """稳定的 64 位特征哈希（不受 PYTHONHASHSEED 影响）"""
+    return int.from_bytes(
+        hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+def extract_features(text: str) -> List[str]:
+    """
+    提取文本的 n-gram 特征
+
+    - 中日韩片段：字符 1-gram、2-gram、3-gram
+    - 其他单词：整个单词，以及加上边界符后的字符 3-gram
+    """
+    features = []
+    for segment, is_cjk in split_segments(text):
+        if is_cjk:
+            for n in (1, 2, 3):
+                if len(segment) >= n:
+                    features.extend(f"c{n}:{gram}" for gram in char_ngrams(segment, n))
+        else:
+            features.append(f"w:{segment}")
+            features.extend(f"t:{gram}" for gram in char_ngrams(f"<{segment}>", 3))
+    return features
+
+
+class HashedNgramEmbedder:
+    """
+    离线的字符 n-gram 哈希嵌入
+
+    每个特征哈希到固定维度的一个位置并带随机符号，整批文本在一个矩阵中累加后
+    做 L2 归一化；可选地再乘以固定种子的高斯随机矩阵降维。
+    """
+
+    def __init__(
+        self, dim: int = EMBEDDING_DIM, projection_dim: int = EMBEDDING_PROJECTION_DIM
+    ):
+        """
+        Args:
+            dim: 特征哈希维度
+            projection_dim: 随机投影后的维度，0 表示不投影
+        """
+        self.dim = dim
+        self.projection_dim = projection_dim
+        self._projection: Optional[np.ndarray] = None
+        if projection_dim:
+            rng = np.random.default_rng(_PROJECTION_SEED)
+            self._projection = (
+                rng.standard_normal((dim, projection_dim)) / np.sqrt(projection_dim)
+            ).astype(np.float32)
+
+    @property
+    def output_dim(self) -> int:
+        """输出向量的维度"""
+        return self.projection_dim or self.dim
+
+    @property
+    def model_name(self) -> str:
+        """模型标识，写入记忆文档，便于区分不同配置生成的向量"""
+        name = f"hashed-ngram-{self.dim}"
+        return f"{name}-rp{self.projection_dim}" if self.projection_dim else name
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        批量计算嵌入
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            (len(texts), output_dim) 的 float32 矩阵，每行已归一化（空文本为零向量）
+        """
+        rows, cols, signs = [], [], []
+        for row, text in enumerate(texts):
+            for feature in extract_features(text):
+                h = _feature_hash(feature)
+                rows.append(row)
+                cols.append(h % self.dim)
+                signs.append(1.0 if (h >> 63) & 1 else -1.0)
+
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if rows:
+            np.add.at(
+                matrix,
+                (np.asarray(rows), np.asarray(cols)),
+                np.asarray(signs, dtype=np.float32),
+            )
+        if self._projection is not None:
+            matrix = matrix @ self._projection
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+class EmbeddingCache:
+    """按文本内容哈希缓存嵌入向量的 LRU 缓存"""
+
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(model_name: str, text: str) -> bytes:
+        """缓存键：模型标识和文本内容的哈希"""
+        return hashlib.blake2b(
+            f"{model_name}\x00{text}".encode("utf-8"), digest_size=16
+        ).digest()
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        vector = self._entries.get(key)
+        if vector is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return vector
+
+    def set(self, key: bytes, vector: np.ndarray) -> None:
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class LocalEmbeddingEngine:
+    """
+    本地嵌入引擎：哈希 n-gram 嵌入 + 嵌入缓存
+
+    只对未命中缓存的文本做一次批量计算；批量较大时放到线程中执行。
+    """
+
+    def __init__(
+        self,
+        embedder: Optional[HashedNgramEmbedder] = None,
+        cache: Optional[EmbeddingCache] = None,
+        thread_threshold: int = EMBEDDING_THREAD_THRESHOLD,
+    ):
+        self.embedder = embedder or HashedNgramEmbedder()
+        self.cache = cache or EmbeddingCache()
+        self.thread_threshold = thread_threshold
+
+    @property
+    def model_name(self) -> str:
+        return self.embedder.model_name
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        """同步批量计算嵌入（优先使用缓存）"""
+        result, missing = self._from_cache(texts)
+        if missing:
+            self._store(result, missing, self.embedder.embed_batch(list(missing)))
+        return result
+
+    async def aembed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        """异步批量计算嵌入，未命中缓存的文本较多时在线程中计算"""
+        result, missing = self._from_cache(texts)
+        if missing:
+            pending = list(missing)
+            if len(pending) > self.thread_threshold:
+                vectors = await asyncio.to_thread(self.embedder.embed_batch, pending)
+            else:
+                vectors = self.embedder.embed_batch(pending)
+            self._store(result, missing, vectors)
+        return result
+
+    async def aembed(self, text: str) -> List[float]:
+        """计算单条文本的嵌入，返回可直接存入文档的列表"""
+        return (await self.aembed_batch([text]))[0].tolist()
+
+    def stats(self) -> Dict[str, object]:
+        return {"model": self.model_name, "cache": self.cache.stats()}
+
+    def _from_cache(self, texts: Sequence[str]):
+        """
+        从缓存填充结果矩阵
+
+        Returns:
+            (结果矩阵, 未命中的文本 -> 结果行号列表)，同一批中的重复文本只计算一次
+        """
+        result = np.empty((len(texts), self.embedder.output_dim), dtype=np.float32)
+        missing: "OrderedDict[str, List[int]]" = OrderedDict()
+        for i, text in enumerate(texts):
+            if text in missing:
+                missing[text].append(i)
+                continue
+            vector = self.cache.get(EmbeddingCache.key(self.model_name, text))
+            if vector is None:
+                missing[text] = [i]
+            else:
+                result[i] = vector
+        return result, missing
+
+    def _store(
+        self,
+        result: np.ndarray,
+        missing: "OrderedDict[str, List[int]]",
+        vectors: np.ndarray,
+    ) -> None:
+        """把新计算的向量写入缓存和结果矩阵"""
+        for (text, rows), vector in zip(missing.items(), vectors):
+            self.cache.set(EmbeddingCache.key(self.model_name, text), vector)
+            result[rows] = vector
+
+
+# 进程内共享实例
+embedding_engine = LocalEmbeddingEngine()
@@ -0,0 +1,454 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List
+
+import numpy as np
+
+from backend.memory.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# 每个用户保留的最近情绪记录数
+EMOTION_SERIES_CAPACITY = int(os.getenv("EMOTION_SERIES_CAPACITY", "512"))
+# 内存中最多保留的用户数，超出时淘汰最久未使用的用户
+EMOTION_SERIES_MAX_USERS = int(os.getenv("EMOTION_SERIES_MAX_USERS", "10000"))
+# 用户时间序列的有效期（秒），过期后从存储重新加载，以看到其他 worker 的写入
+EMOTION_SERIES_TTL = float(os.getenv("EMOTION_SERIES_TTL", "300"))
+# 快照文件
+EMOTION_SNAPSHOT_PATH = os.getenv(
+    "EMOTION_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(__file__), "_local_cache", "emotion_series.npz"),
+)
+
+# 汇总保留的时间段数：最近 7 天的小时汇总、最近 90 天的日汇总（按 UTC 划分）
+HOUR_SECONDS = 3600
+DAY_SECONDS = 86400
+HOURLY_SLOTS = 24 * 7
+DAILY_SLOTS = 90
+
+# 情绪标签编码为 uint8；汇总只为前 MAX_ROLLUP_CODES 个编码单独计数，其余计入最后一列
+MAX_ROLLUP_CODES = 16
+DEFAULT_LABELS = ("neutral", "P", "N", "D")
+
+SeriesLoader = Callable[[], Awaitable[List[Dict[str, Any]]]]
+
+
+class EmotionVocabulary:
+    """情绪标签 <-> uint8 编码，新标签按出现顺序分配编码"""
+
+    def __init__(self, labels=DEFAULT_LABELS):
+        self.labels: List[str] = []
+        self._codes: Dict[str, int] = {}
+        for label in labels:
+            self.encode(label)
+
+    def encode(self, label: str) -> int:
+        code = self._codes.get(label)
+        if code is None:
+            if len(self.labels) >= 256:
+                return self._codes["neutral"]
+            code = self._codes[label] = len(self.labels)
+            self.labels.append(label)
+        return code
+
+    def decode(self, code: int) -> str:
+        return self.labels[code] if code < len(self.labels) else "neutral"
+
+
+def to_epoch_us(timestamp: Any) -> int:
+    """把 ISO 时间字符串、datetime 或秒数转换为微秒时间戳"""
+    if isinstance(timestamp, str) and timestamp:
+        try:
+            timestamp = datetime.fromisoformat(timestamp)
+        except ValueError:
+            timestamp = None
+    if isinstance(timestamp, datetime):
+        return int(round(timestamp.timestamp() * 1_000_000))
+    if isinstance(timestamp, (int, float)):
+        return int(timestamp * 1_000_000)
+    return int(time.time() * 1_000_000)
+
+
+class _Rollup:
+    """固定时间段数的环形汇总：每个时间段内各情绪的次数和置信度之和"""
+
+    def __init__(self, bucket_seconds: int, slots: int):
+        self.bucket_us = bucket_seconds * 1_000_000
+        self.slots = slots
+        # 每个槽当前对应的时间段序号，-1 表示空
+        self.buckets = np.full(slots, -1, dtype=np.int64)
+        self.counts = np.zeros((slots, MAX_ROLLUP_CODES), dtype=np.uint32)
+        self.confidence = np.zeros(slots, dtype=np.float32)
+
+    def add(self, ts_us: int, code: int, confidence: float) -> None:
+        bucket = ts_us // self.bucket_us
+        slot = bucket % self.slots
+        if self.buckets[slot] != bucket:
+            if self.buckets[slot] > bucket:
+                # 比槽内数据还早一整圈的记录，已超出汇总范围
+                return
+            self.buckets[slot] = bucket
+            self.counts[slot] = 0
+            self.confidence[slot] = 0.0
+        self.counts[slot, min(code, MAX_ROLLUP_CODES - 1)] += 1
+        self.confidence[slot] += confidence
+
+    def merge_older(self, previous: "_Rollup", boundary_us: int) -> None:
+        """
+        用 previous 补齐 boundary_us 所在时间段及更早的时间段
+
+        重新加载只读到最近的 capacity 条记录，更早的时间段只存在于之前的汇总中；
+        boundary_us 所在时间段两边都可能只有部分记录，取次数较多的一份。
+
+        Args:
+            previous: 重新加载前的汇总
+            boundary_us: 本次加载的最早记录时间
+        """
+        boundary = boundary_us // self.bucket_us
+        old, new = previous.buckets, self.buckets
+        old_total = previous.counts.sum(axis=1)
+        new_total = self.counts.sum(axis=1)
+        take = (
+            (old >= 0)
+            & (old <= boundary)
+            & ((new < old) | ((new == old) & (old_total > new_total)))
+        )
+        self.buckets[take] = old[take]
+        self.counts[take] = previous.counts[take]
+        self.confidence[take] = previous.confidence[take]
+
+    def read(
+        self, vocabulary: EmotionVocabulary, since_us: int = 0
+    ) -> List[Dict[str, Any]]:
+        """按时间升序返回 since_us 之后的非空时间段"""
+        valid = np.flatnonzero(self.buckets >= since_us // self.bucket_us)
+        result = []
+        for slot in valid[np.argsort(self.buckets[valid])]:
+            total = int(self.counts[slot].sum())
+            nonzero = np.flatnonzero(self.counts[slot])
+            result.append(
+                {
+                    "start": datetime.fromtimestamp(
+                        int(self.buckets[slot]) * self.bucket_us / 1_000_000
+                    ).isoformat(),
+                    "count": total,
+                    "emotions": {
+                        vocabulary.decode(int(code)): int(self.counts[slot, code])
+                        for code in nonzero
+                    },
+                    "avg_confidence": (
+                        round(float(self.confidence[slot]) / total, 4) if total else 0.0
+                    ),
+                }
+            )
+        return result
+
+
+class EmotionRingBuffer:
+    """
+    单个用户的情绪时间序列
+
+    时间戳（微秒，int64）、情绪编码（uint8）和置信度（float32）分别存放在定长数组中，
+    写满后覆盖最旧的记录；时间戳保持单调不减（乱序到达的记录取上一条的时间），
+    因此时间范围查询可以二分定位。同时增量维护小时和日汇总。
+    """
+
+    def __init__(self, capacity: int = EMOTION_SERIES_CAPACITY):
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.codes = np.zeros(capacity, dtype=np.uint8)
+        self.confidences = np.zeros(capacity, dtype=np.float32)
+        # 下一条记录写入的位置
+        self.head = 0
+        self.size = 0
+        self.hourly = _Rollup(HOUR_SECONDS, HOURLY_SLOTS)
+        self.daily = _Rollup(DAY_SECONDS, DAILY_SLOTS)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, ts_us: int, code: int, confidence: float) -> None:
+        """追加一条记录，O(1)"""
+        if self.size:
+            ts_us = max(ts_us, int(self.timestamps[(self.head - 1) % self.capacity]))
+        self.timestamps[self.head] = ts_us
+        self.codes[self.head] = code
+        self.confidences[self.head] = confidence
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.hourly.add(ts_us, code, confidence)
+        self.daily.add(ts_us, code, confidence)
+
+    def recent(self, n: int) -> np.ndarray:
+        """最近 n 条记录的数组下标，最新的在前，O(n)"""
+        n = max(0, min(n, self.size))
+        return (self.head - 1 - np.arange(n)) % self.capacity
+
+    def between(self, start_us: int, end_us: int) -> np.ndarray:
+        """时间戳在 [start_us, end_us) 内的记录下标，按时间升序，O(log n + k)"""
+        oldest = (self.head - self.size) % self.capacity
+        # 按时间顺序排列的两段连续内存
+        first = np.arange(oldest, oldest + min(self.size, self.capacity - oldest))
+        second = np.arange(0, self.size - len(first))
+        result = []
+        for part in (first, second):
+            if len(part) == 0:
+                continue
+            values = self.timestamps[part[0] : part[-1] + 1]
+            lo, hi = np.searchsorted(values, [start_us, end_us], side="left")
+            result.append(part[lo:hi])
+        return np.concatenate(result) if result else np.zeros(0, dtype=np.int64)
+
+
+class EmotionTimeSeries:
+    """
+    按用户懒加载的情绪时间序列集合
+
+    - 用户第一次读取时通过 loader 从存储加载最近的情绪记录，之后新记录增量追加
+    - 同一用户并发读取只加载一次；超过 TTL 后重新加载，
+      最近记录以外的小时/日汇总沿用加载前的结果
+    - 超过 max_users 时淘汰最久未使用的用户
+    - 可保存为 npz 快照，重启后恢复
+    """
+
+    def __init__(
+        self,
+        capacity: int = EMOTION_SERIES_CAPACITY,
+        max_users: int = EMOTION_SERIES_MAX_USERS,
+        ttl_seconds: float = EMOTION_SERIES_TTL,
+    ):
+        self.capacity = capacity
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.vocabulary = EmotionVocabulary()
+        # user_id -> (加载时间, 时间序列)
+        self._series: "OrderedDict[str, tuple]" = OrderedDict()
+        self._flights = SingleFlight()
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+
+    async def get(self, user_id: str, loader: SeriesLoader) -> EmotionRingBuffer:
+        """
+        获取用户的时间序列，未加载或已过期时调用 loader 加载
+
+        Args:
+            user_id: 用户ID
+            loader: 返回该用户最近情绪记录
+                （含 timestamp、emotion、confidence，最新的在前）的协程函数
+        """
+        entry = self._series.get(user_id)
+        if entry is not None and time.monotonic() - entry[0] <= self.ttl_seconds:
+            self._series.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+        return await self._flights.do(
+            user_id, lambda: self._load(user_id, loader, entry)
+        )
+
+    async def _load(
+        self, user_id: str, loader: SeriesLoader, entry: Any
+    ) -> EmotionRingBuffer:
+        self._pending[user_id] = []
+        try:
+            records = await loader()
+            series = EmotionRingBuffer(self.capacity)
+            # 按时间升序追加；时间相同的记录保持写入顺序（loader 返回的是最新的在前）
+            ordered = sorted(
+                reversed(records),
+                key=lambda record: to_epoch_us(record.get("timestamp")),
+            )
+            for record in ordered + self._pending[user_id]:
+                self._append(series, record)
+            if entry is not None:
+                # 缓冲区之外的时间段沿用过期序列的汇总，
+                # 避免每次重新加载丢失较早的小时/日汇总
+                oldest = (
+                    int(series.timestamps[(series.head - series.size) % self.capacity])
+                    if series.size
+                    else to_epoch_us(None)
+                )
+                series.hourly.merge_older(entry[1].hourly, oldest)
+                series.daily.merge_older(entry[1].daily, oldest)
+            self.loads += 1
+            self._store(user_id, series, time.monotonic())
+            return series
+        finally:
+            self._pending.pop(user_id, None)
+
+    def add(self, user_id: str, record: Dict[str, Any]) -> None:
+        """增量追加一条情绪记录；用户尚未加载时不做处理（之后加载时会从存储读到）"""
+        if user_id in self._pending:
+            self._pending[user_id].append(record)
+            return
+        entry = self._series.get(user_id)
+        if entry is not None:
+            self._append(entry[1], record)
+
+    def recent(
+        self, user_id: str, series: EmotionRingBuffer, limit: int
+    ) -> List[Dict[str, Any]]:
+        """最近 limit 条记录，最新的在前（与 get_recent_emotions 的返回格式一致）"""
+        return self._records(user_id, series, series.recent(limit))
+
+    def between(
+        self, user_id: str, series: EmotionRingBuffer, start: Any, end: Any
+    ) -> List[Dict[str, Any]]:
+        """时间范围内的记录，按时间升序"""
+        return self._records(
+            user_id, series, series.between(to_epoch_us(start), to_epoch_us(end))
+        )
+
+    def rollups(
+        self, series: EmotionRingBuffer, granularity: str = "hour", since: Any = None
+    ) -> List[Dict[str, Any]]:
+        """
+        小时或日汇总
+
+        Args:
+            series: 用户时间序列
+            granularity: "hour" 或 "day"
+            since: 只返回该时间之后的时间段，None 表示全部
+        """
+        rollup = series.hourly if granularity == "hour" else series.daily
+        return rollup.read(
+            self.vocabulary, to_epoch_us(since) if since is not None else 0
+        )
+
+    def invalidate(self, user_id: str) -> None:
+        """丢弃用户的时间序列，下次读取时重新加载"""
+        self._series.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回统计信息"""
+        return {
+            "users": len(self._series),
+            "records": sum(len(series) for _, series in self._series.values()),
+            "capacity": self.capacity,
+            "labels": len(self.vocabulary.labels),
+            "loads": self.loads,
+            "hits": self.hits,
+            "evictions": self.evictions,
+        }
+
+    def save_snapshot(self, path: str = EMOTION_SNAPSHOT_PATH) -> int:
+        """
+        把所有用户的时间序列保存为 npz 快照（先写临时文件再替换）
+
+        Returns:
+            保存的用户数
+        """
+        users = list(self._series.keys())
+        if not users:
+            return 0
+        series_list = [self._series[user_id][1] for user_id in users]
+        order = [series.recent(series.size)[::-1] for series in series_list]
+        arrays = {
+            "users": np.array(users, dtype=str),
+            "labels": np.array(self.vocabulary.labels, dtype=str),
+            "capacity": np.array(self.capacity),
+            "saved_at": np.array(time.time()),
+            "lengths": np.array([len(idx) for idx in order], dtype=np.int64),
+            "timestamps": np.concatenate(
+                [s.timestamps[idx] for s, idx in zip(series_list, order)]
+            ),
+            "codes": np.concatenate(
+                [s.codes[idx] for s, idx in zip(series_list, order)]
+            ),
+            "confidences": np.concatenate(
+                [s.confidences[idx] for s, idx in zip(series_list, order)]
+            ),
+        }
+        for name in ("hourly", "daily"):
+            rollups = [getattr(series, name) for series in series_list]
+            arrays[f"{name}_buckets"] = np.stack([r.buckets for r in rollups])
+            arrays[f"{name}_counts"] = np.stack([r.counts for r in rollups])
+            arrays[f"{name}_confidence"] = np.stack([r.confidence for r in rollups])
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        return len(users)
+
+    def load_snapshot(self, path: str = EMOTION_SNAPSHOT_PATH) -> int:
+        """
+        从 npz 快照恢复时间序列；快照时间计入 TTL，过期的快照不恢复
+
+        Returns:
+            恢复的用户数
+        """
+        if not os.path.exists(path):
+            return 0
+        try:
+            with np.load(path) as data:
+                age = time.time() - float(data["saved_at"])
+                if age > self.ttl_seconds:
+                    return 0
+                loaded_at = time.monotonic() - age
+                # 快照中的编码按快照的标签表解释，转换为当前进程的编码
+                mapping = np.array(
+                    [self.vocabulary.encode(str(label)) for label in data["labels"]],
+                    dtype=np.uint8,
+                )
+                offsets = np.concatenate([[0], np.cumsum(data["lengths"])])
+                for i, user_id in enumerate(data["users"]):
+                    series = EmotionRingBuffer(self.capacity)
+                    start, end = offsets[i], offsets[i + 1]
+                    count = min(end - start, self.capacity)
+                    rows = slice(end - count, end)
+                    series.timestamps[:count] = data["timestamps"][rows]
+                    series.codes[:count] = mapping[data["codes"][rows]]
+                    series.confidences[:count] = data["confidences"][rows]
+                    series.size = count
+                    series.head = count % self.capacity
+                    for name in ("hourly", "daily"):
+                        rollup = getattr(series, name)
+                        rollup.buckets[:] = data[f"{name}_buckets"][i]
+                        counts = np.zeros_like(rollup.counts)
+                        for code, target in enumerate(mapping[:MAX_ROLLUP_CODES]):
+                            counts[:, min(int(target), MAX_ROLLUP_CODES - 1)] += data[
+                                f"{name}_counts"
+                            ][i][:, code]
+                        rollup.counts[:] = counts
+                        rollup.confidence[:] = data[f"{name}_confidence"][i]
+                    self._store(str(user_id), series, loaded_at)
+                return len(data["users"])
+        except Exception as e:
+            logger.error(f"恢复情绪时间序列快照时出错: {str(e)}")
+            return 0
+
+    def _append(self, series: EmotionRingBuffer, record: Dict[str, Any]) -> None:
+        series.append(
+            to_epoch_us(record.get("timestamp")),
+            self.vocabulary.encode(record.get("emotion") or "neutral"),
+            float(record.get("confidence", 0.8) or 0.0),
+        )
+
+    def _records(
+        self, user_id: str, series: EmotionRingBuffer, indexes: np.ndarray
+    ) -> List[Dict[str, Any]]:
+        return [
+            {
+                "user_id": user_id,
+                "timestamp": datetime.fromtimestamp(
+                    int(series.timestamps[i]) / 1_000_000
+                ).isoformat(),
+                "emotion": self.vocabulary.decode(int(series.codes[i])),
+                "confidence": round(float(series.confidences[i]), 4),
+            }
+            for i in indexes
+        ]
+
+    def _store(self, user_id: str, series: EmotionRingBuffer, loaded_at: float) -> None:
+        self._series[user_id] = (loaded_at, series)
+        self._series.move_to_end(user_id)
+        while len(self._series) > self.max_users:
+            self._series.popitem(last=False)
+            self.evictions += 1
@@ -0,0 +1,87 @@
+import math
+import os
+from collections import Counter
+from typing import Any, Dict, List, Sequence, Tuple
+
+# BM25 参数
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+
+class UserKeywordIndex:
+    """
+    单个用户记忆的倒排索引，使用 BM25 打分
+
+    每条记忆写入时增量更新倒排表和文档长度，查询时只访问查询词项的倒排表。
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        # 词项 -> {文档行号: 词频}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._lengths: List[int] = []
+        self._payloads: List[Dict[str, Any]] = []
+        self._rows: Dict[str, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+    def add(self, doc_id: str, tokens: Sequence[str], payload: Dict[str, Any]) -> bool:
+        """
+        插入一条记忆
+
+        Args:
+            doc_id: 记忆ID，重复插入会被忽略
+            tokens: 记忆文本的词项
+            payload: 检索结果中返回的记忆内容
+
+        Returns:
+            是否插入成功
+        """
+        if doc_id in self._rows or not tokens:
+            return False
+        row = len(self._payloads)
+        for term, count in Counter(tokens).items():
+            self._postings.setdefault(term, {})[row] = count
+        self._rows[doc_id] = row
+        self._lengths.append(len(tokens))
+        self._payloads.append(payload)
+        self._total_length += len(tokens)
+        return True
+
+    def search(
+        self, query_tokens: Sequence[str], top_k: int = 3
+    ) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        BM25 检索
+
+        Args:
+            query_tokens: 查询词项
+            top_k: 返回数量
+
+        Returns:
+            按得分从高到低排列的 (得分, 记忆内容) 列表，只包含至少命中一个词项的记忆
+        """
+        if not self._payloads or top_k <= 0:
+            return []
+        count = len(self._payloads)
+        average_length = self._total_length / count
+        scores: Dict[int, float] = {}
+        for term in set(query_tokens):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            for row, tf in postings.items():
+                norm = self.k1 * (
+                    1 - self.b + self.b * self._lengths[row] / average_length
+                )
+                scores[row] = scores.get(row, 0.0) + idf * tf * (self.k1 + 1) / (
+                    tf + norm
+                )
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))[:top_k]
+        return [(score, self._payloads[row]) for row, score in ranked]
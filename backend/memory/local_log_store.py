@@ -0,0 +1,217 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# 本地存储目录（未配置 Cosmos DB 时使用）
+LOCAL_CACHE_DIR = os.getenv(
+    "LOCAL_CACHE_DIR", os.path.join(os.path.dirname(__file__), "_local_cache")
+)
+
+
+@contextmanager
+def _file_lock(f, exclusive: bool) -> Iterator[None]:
+    """
+    对已打开的文件加进程间锁（多个 worker 进程共享同一目录时使用）
+
+    POSIX 使用 flock（读共享、写独占）；Windows 使用 msvcrt 锁定第一个字节（始终独占）。
+    """
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return
+
+    position = f.tell()
+    f.seek(0)
+    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+    f.seek(position)
+    try:
+        yield
+    finally:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        f.seek(position)
+
+
+class _LineIndex:
+    """单个日志文件中每一行的起始偏移，只记录以换行结尾的完整行"""
+
+    def __init__(self):
+        self.offsets: List[int] = []
+        # 已建立索引的字节数（之后的内容由其他进程或本进程追加，读取时补建）
+        self.size = 0
+        self.lock = threading.Lock()
+
+
+class LocalLogStore:
+    """
+    按用户分文件的追加写 JSONL 日志
+
+    - 写入只追加新行，一批记录一次 write，不再读出并重写整个文件
+    - 写入加独占文件锁、读取加共享锁，多个 worker 进程并发写同一用户不会损坏文件
+    - 进程内为每个文件维护行偏移索引，读取最近 N 条时直接 seek 到对应行；
+      其他进程追加的内容在下次读取时只扫描新增部分
+    """
+
+    def __init__(self, base_dir: str = LOCAL_CACHE_DIR):
+        self.base_dir = base_dir
+        self._indexes: Dict[str, _LineIndex] = {}
+        self._indexes_lock = threading.Lock()
+
+    def path(self, stream: str, user_id: str) -> str:
+        """日志文件路径，例如 interactions_<user_id>.jsonl"""
+        return os.path.join(self.base_dir, f"{stream}_{self._safe_name(user_id)}.jsonl")
+
+    def append(self, stream: str, user_id: str, records: List[Dict[str, Any]]) -> None:
+        """
+        追加记录
+
+        Args:
+            stream: 日志类型，例如 "interactions"、"emotions"
+            user_id: 用户ID
+            records: 要追加的记录
+        """
+        if not records:
+            return
+        path = self.path(stream, user_id)
+        os.makedirs(self.base_dir, exist_ok=True)
+        self._migrate_legacy(stream, user_id, path)
+        self._write(path, records)
+
+    @staticmethod
+    def _write(path: str, records: List[Dict[str, Any]]) -> None:
+        data = "".join(
+            json.dumps(record, ensure_ascii=False) + "\n" for record in records
+        ).encode("utf-8")
+        with open(path, "ab") as f:
+            with _file_lock(f, exclusive=True):
+                f.seek(0, os.SEEK_END)
+                f.write(data)
+                f.flush()
+
+    def read_all(self, stream: str, user_id: str) -> List[Dict[str, Any]]:
+        """按写入顺序读取全部记录"""
+        return self._read(stream, user_id, None)
+
+    def tail(self, stream: str, user_id: str, limit: int) -> List[Dict[str, Any]]:
+        """
+        读取最近的 limit 条记录
+
+        Returns:
+            最新的记录在前（与 Cosmos DB 查询的 ORDER BY timestamp DESC 一致）
+        """
+        if limit <= 0:
+            return []
+        return list(reversed(self._read(stream, user_id, limit)))
+
+    def count(self, stream: str, user_id: str) -> int:
+        """记录条数"""
+        path = self.path(stream, user_id)
+        if not os.path.exists(path):
+            return 0
+        index = self._index(path)
+        with index.lock, open(path, "rb") as f:
+            with _file_lock(f, exclusive=False):
+                self._refresh(index, f)
+            return len(index.offsets)
+
+    def _read(
+        self, stream: str, user_id: str, limit: Optional[int]
+    ) -> List[Dict[str, Any]]:
+        path = self.path(stream, user_id)
+        self._migrate_legacy(stream, user_id, path)
+        if not os.path.exists(path):
+            return []
+
+        index = self._index(path)
+        with index.lock, open(path, "rb") as f:
+            with _file_lock(f, exclusive=False):
+                self._refresh(index, f)
+                if not index.offsets:
+                    return []
+                start = 0 if limit is None else max(len(index.offsets) - limit, 0)
+                f.seek(index.offsets[start])
+                data = f.read(index.size - index.offsets[start])
+
+        records = []
+        for line in data.splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                logger.warning(f"跳过无法解析的日志行: {path}")
+        return records
+
+    def _index(self, path: str) -> _LineIndex:
+        with self._indexes_lock:
+            index = self._indexes.get(path)
+            if index is None:
+                index = self._indexes[path] = _LineIndex()
+            return index
+
+    @staticmethod
+    def _refresh(index: _LineIndex, f) -> None:
+        """扫描上次索引之后新增的完整行"""
+        end = os.fstat(f.fileno()).st_size
+        if end < index.size:
+            # 文件被截断或替换，重新建立索引
+            index.offsets, index.size = [], 0
+        if end == index.size:
+            return
+        f.seek(index.size)
+        position = index.size
+        for line in f:
+            if not line.endswith(b"\n"):
+                # 其他进程写了一半的行，等下次读取
+                break
+            index.offsets.append(position)
+            position += len(line)
+        index.size = position
+
+    def _migrate_legacy(self, stream: str, user_id: str, path: str) -> None:
+        """把旧版本整文件重写的 <stream>_<user_id>.json 转换为 JSONL（只执行一次）"""
+        legacy_path = os.path.join(self.base_dir, f"{stream}_{user_id}.json")
+        if os.path.exists(path) or not os.path.exists(legacy_path):
+            return
+        try:
+            # 多个进程可能同时首次访问：持有独占锁后重新检查，只由一个进程转换
+            with open(legacy_path + ".lock", "ab") as lock_file:
+                with _file_lock(lock_file, exclusive=True):
+                    if os.path.exists(path) or not os.path.exists(legacy_path):
+                        return
+                    with open(legacy_path, "r", encoding="utf-8") as f:
+                        records = json.load(f)
+                    self._write(path, records)
+                    os.replace(legacy_path, legacy_path + ".migrated")
+            logger.info(f"已将 {legacy_path} 转换为追加写日志")
+        except Exception as e:
+            logger.error(f"转换旧版本本地记录时出错: {str(e)}")
+
+    @staticmethod
+    def _safe_name(user_id: str) -> str:
+        """把用户ID转换为安全的文件名，包含特殊字符时附加哈希避免冲突"""
+        name = re.sub(r"[^\w\-]", "_", user_id)
+        if name != user_id:
+            name += (
+                "_"
+                + hashlib.blake2b(user_id.encode("utf-8"), digest_size=4).hexdigest()
+            )
+        return name
+
+
+# 进程内共享实例
+local_log_store = LocalLogStore()
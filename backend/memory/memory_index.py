@@ -0,0 +1,229 @@
+import os
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from backend.memory.keyword_index import UserKeywordIndex
+from backend.memory.single_flight import SingleFlight
+from backend.memory.tokenizer import keyword_tokens
+from backend.memory.vector_index import UserVectorIndex
+
+logger = logging.getLogger(__name__)
+
+# 内存中最多保留索引的用户数，超出时淘汰最久未使用的用户
+MEMORY_INDEX_MAX_USERS = int(os.getenv("MEMORY_INDEX_MAX_USERS", "1000"))
+# 倒数排名融合（RRF）的平滑常数
+RRF_K = int(os.getenv("RRF_K", "60"))
+# 每路检索取回的候选数量 = max(top_k * 倍数, 最小值)
+HYBRID_CANDIDATE_MULTIPLIER = 4
+HYBRID_MIN_CANDIDATES = 20
+
+MemoryLoader = Callable[[], Awaitable[List[Dict[str, Any]]]]
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Tuple[float, Dict[str, Any]]]],
+    top_k: int,
+    k: int = RRF_K,
+) -> List[Tuple[float, Dict[str, Any]]]:
+    """
+    倒数排名融合：每路结果按名次贡献 1 / (k + rank)，只看名次不看原始得分，
+    因此余弦相似度和 BM25 得分不需要归一化到同一量纲。
+
+    Args:
+        rankings: 多路检索结果，
+            每路为按得分降序排列的 (得分, 记忆内容) 列表，记忆内容需含 id
+        top_k: 返回数量
+        k: 平滑常数
+
+    Returns:
+        按融合得分降序排列的 (相关度, 记忆内容) 列表，相关度归一化到 0~1
+        （在所有检索路中都排第一时为 1）
+    """
+    scores: Dict[str, float] = {}
+    payloads: Dict[str, Dict[str, Any]] = {}
+    for ranking in rankings:
+        for rank, (_, payload) in enumerate(ranking, start=1):
+            memory_id = payload["id"]
+            scores[memory_id] = scores.get(memory_id, 0.0) + 1.0 / (k + rank)
+            payloads.setdefault(memory_id, payload)
+
+    best = len(rankings) / (k + 1) if rankings else 1.0
+    ranked = sorted(scores.items(), key=lambda item: -item[1])[:top_k]
+    return [(score / best, payloads[memory_id]) for memory_id, score in ranked]
+
+
+class UserMemoryIndex:
+    """
+    单个用户的混合记忆索引：向量索引 + BM25 倒排索引，两者共享同一批记忆文档
+    """
+
+    def __init__(self, model: Optional[str] = None):
+        """
+        Args:
+            model: 嵌入模型标识，提供时只把 embedding_model 相同的文档加入向量索引
+        """
+        self.model = model
+        self.vectors = UserVectorIndex()
+        self.keywords = UserKeywordIndex()
+        self._ids = set()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, memory_id: str) -> bool:
+        return memory_id in self._ids
+
+    def add(self, document: Dict[str, Any]) -> bool:
+        """
+        插入一条记忆文档
+
+        嵌入模型不一致的旧文档仍会进入关键词索引；文档中的向量不保留在返回内容里。
+
+        Returns:
+            是否至少进入了一个索引
+        """
+        memory_id = document.get("id")
+        if not memory_id or memory_id in self._ids:
+            return False
+        payload = {key: value for key, value in document.items() if key != "embedding"}
+
+        added = False
+        embedding = document.get("embedding")
+        if embedding and (
+            self.model is None or document.get("embedding_model") == self.model
+        ):
+            added = self.vectors.add(memory_id, embedding, payload)
+        tokens = keyword_tokens(document.get("summary") or "")
+        if self.keywords.add(memory_id, tokens, payload):
+            added = True
+
+        if added:
+            self._ids.add(memory_id)
+        return added
+
+    def search(
+        self, query_embedding: Optional[Sequence[float]], query: str, top_k: int = 3
+    ) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        混合检索：向量相似度和 BM25 各取候选，再用 RRF 融合为一个排序
+
+        Args:
+            query_embedding: 查询向量，None 时只做关键词检索
+            query: 查询文本
+            top_k: 返回数量
+
+        Returns:
+            按融合相关度降序排列的 (相关度, 记忆内容) 列表
+        """
+        candidates = max(top_k * HYBRID_CANDIDATE_MULTIPLIER, HYBRID_MIN_CANDIDATES)
+        rankings = []
+        if query_embedding is not None:
+            # 相似度不为正的向量结果与查询无关，不参与融合
+            rankings.append(
+                [
+                    hit
+                    for hit in self.vectors.search(query_embedding, candidates)
+                    if hit[0] > 0
+                ]
+            )
+        rankings.append(self.keywords.search(keyword_tokens(query), candidates))
+        return reciprocal_rank_fusion(rankings, top_k)
+
+
+class MemoryIndex:
+    """
+    按用户懒加载的记忆索引集合
+
+    - 用户第一次检索时通过 loader 从存储加载全部记忆文档
+    - 同一用户并发检索只加载一次
+    - 新记忆写入时增量插入已加载的索引，加载过程中到达的记录在加载完成后补入
+    - 超过 max_users 时淘汰最久未使用的用户
+    """
+
+    def __init__(
+        self, max_users: int = MEMORY_INDEX_MAX_USERS, model: Optional[str] = None
+    ):
+        """
+        Args:
+            max_users: 最多保留索引的用户数
+            model: 嵌入模型标识，提供时只把 embedding_model 相同的文档加入向量索引
+        """
+        self.max_users = max_users
+        self.model = model
+        self._indexes: "OrderedDict[str, UserMemoryIndex]" = OrderedDict()
+        self._flights = SingleFlight()
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+
+    async def get(self, user_id: str, loader: MemoryLoader) -> UserMemoryIndex:
+        """
+        获取用户的索引，未加载时调用 loader 加载
+
+        Args:
+            user_id: 用户ID
+            loader: 返回该用户全部记忆文档（含 summary 和 embedding 字段）的协程函数
+
+        Returns:
+            用户的记忆索引
+        """
+        index = self._indexes.get(user_id)
+        if index is not None:
+            self._indexes.move_to_end(user_id)
+            self.hits += 1
+            return index
+
+        return await self._flights.do(user_id, lambda: self._load(user_id, loader))
+
+    async def _load(self, user_id: str, loader: MemoryLoader) -> UserMemoryIndex:
+        self._pending[user_id] = []
+        try:
+            documents = await loader()
+            index = UserMemoryIndex(model=self.model)
+            for document in documents + self._pending[user_id]:
+                index.add(document)
+            self.loads += 1
+            self._store(user_id, index)
+            return index
+        finally:
+            self._pending.pop(user_id, None)
+
+    def add(self, user_id: str, document: Dict[str, Any]) -> None:
+        """
+        增量插入一条记忆文档；用户索引尚未加载时不做处理（之后加载时会从存储读到）
+        """
+        if user_id in self._pending:
+            self._pending[user_id].append(document)
+            return
+        index = self._indexes.get(user_id)
+        if index is not None:
+            index.add(document)
+
+    def invalidate(self, user_id: str) -> None:
+        """丢弃用户的索引，下次检索时重新加载"""
+        self._indexes.pop(user_id, None)
+
+    def clear(self) -> None:
+        """清空所有索引"""
+        self._indexes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回索引统计信息"""
+        return {
+            "users": len(self._indexes),
+            "documents": sum(len(index) for index in self._indexes.values()),
+            "vectors": sum(len(index.vectors) for index in self._indexes.values()),
+            "loads": self.loads,
+            "hits": self.hits,
+            "evictions": self.evictions,
+        }
+
+    def _store(self, user_id: str, index: UserMemoryIndex) -> None:
+        self._indexes[user_id] = index
+        self._indexes.move_to_end(user_id)
+        while len(self._indexes) > self.max_users:
+            self._indexes.popitem(last=False)
+            self.evictions += 1
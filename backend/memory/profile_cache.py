@@ -0,0 +1,141 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from backend.memory.single_flight import SingleFlight
+
+# 用户配置文件缓存
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "10000"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "300"))
+# 用户名 -> 用户ID 缓存（映射创建后不再变化，TTL 可以更长）
+USERNAME_CACHE_MAX_ENTRIES = int(os.getenv("USERNAME_CACHE_MAX_ENTRIES", "10000"))
+USERNAME_CACHE_TTL = float(os.getenv("USERNAME_CACHE_TTL", "3600"))
+
+Loader = Callable[[], Awaitable[Any]]
+
+
+class ReadThroughCache:
+    """
+    带 TTL 的读穿透缓存
+
+    - LRU + TTL 淘汰，与 ContextBlockCache 相同
+    - 单飞：同一 key 并发未命中时只调用一次 loader，其他调用方等待同一个结果
+    - loader 返回 None 或抛出异常时不缓存
+    - 写入方通过 set() 写穿或 invalidate() 失效；加载期间发生写入时丢弃加载结果，
+      避免较早开始的读取用旧值覆盖新值（与 ContextBlockCache 的失效代数相同）
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        """
+        Args:
+            max_entries: 最大缓存条目数
+            ttl_seconds: 条目有效期（秒）
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (写入时间, 值)
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._flights = SingleFlight()
+        # 正在加载的 key -> 加载开始后的写入次数
+        # （只为加载中的 key 计数，加载结束即删除）
+        self._generations: Dict[Hashable, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_fills = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """读取缓存，未命中或已过期时返回 None（不计入统计）"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def get_or_load(self, key: Hashable, loader: Loader) -> Any:
+        """
+        读取缓存，未命中时调用 loader 加载并缓存
+
+        Args:
+            key: 缓存键
+            loader: 加载函数（例如查询数据库，不存在时创建）
+
+        Returns:
+            缓存或加载得到的值
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+
+        if self._flights.in_flight(key):
+            self.coalesced += 1
+        return await self._flights.do(key, lambda: self._load(key, loader))
+
+    async def _load(self, key: Hashable, loader: Loader) -> Any:
+        self._generations[key] = 0
+        try:
+            value = await loader()
+        finally:
+            writes = self._generations.pop(key, 0)
+        self.loads += 1
+        if writes:
+            # 读取期间已经写穿或失效，加载到的可能是旧值
+            self.stale_fills += 1
+            cached = self.get(key)
+            return cached if cached is not None else value
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """写入缓存"""
+        self._bump(key)
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        """使单个条目失效"""
+        self._bump(key)
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        """清空缓存（计数器保留）"""
+        for key in self._generations:
+            self._generations[key] += 1
+        self._entries.clear()
+
+    def _bump(self, key: Hashable) -> None:
+        if key in self._generations:
+            self._generations[key] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "loads": self.loads,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "stale_fills": self.stale_fills,
+        }
@@ -0,0 +1,74 @@
+import logging
+from typing import Any, Callable, Dict, Mapping
+
+logger = logging.getLogger(__name__)
+
+# Cosmos DB 在响应头中返回本次请求消耗的 RU
+REQUEST_CHARGE_HEADER = "x-ms-request-charge"
+
+
+class RequestChargeTracker:
+    """
+    按操作统计 Cosmos DB 的请求单位（RU）消耗
+
+    每次调用 SDK 时通过 hook(operation) 取得 response_hook 传入，
+    查询的每一页响应都会累加到该操作上。
+    """
+
+    def __init__(self):
+        # operation -> {"calls", "request_units", "max_request_units"}
+        self._operations: Dict[str, Dict[str, float]] = {}
+
+    def hook(self, operation: str) -> Callable[[Mapping[str, Any], Any], None]:
+        """
+        为一次调用创建 response_hook
+
+        Args:
+            operation: 操作名称，例如 "get_user_profile"
+
+        Returns:
+            传给 SDK 的 response_hook
+        """
+        stats = self._operations.setdefault(
+            operation, {"calls": 0, "request_units": 0.0, "max_request_units": 0.0}
+        )
+        stats["calls"] += 1
+        call_total = [0.0]
+
+        def response_hook(headers: Mapping[str, Any], _result: Any) -> None:
+            try:
+                charge = float(headers.get(REQUEST_CHARGE_HEADER) or 0)
+            except (TypeError, ValueError):
+                return
+            call_total[0] += charge
+            stats["request_units"] += charge
+            stats["max_request_units"] = max(stats["max_request_units"], call_total[0])
+            logger.debug(f"Cosmos {operation} 消耗 {charge} RU")
+
+        return response_hook
+
+    def reset(self) -> None:
+        """清空统计"""
+        self._operations.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回各操作及总计的 RU 消耗"""
+        operations = {
+            name: {
+                "calls": int(stats["calls"]),
+                "request_units": round(stats["request_units"], 2),
+                "avg_request_units": (
+                    round(stats["request_units"] / stats["calls"], 2)
+                    if stats["calls"]
+                    else 0.0
+                ),
+                "max_request_units": round(stats["max_request_units"], 2),
+            }
+            for name, stats in sorted(self._operations.items())
+        }
+        return {
+            "total_request_units": round(
+                sum(s["request_units"] for s in self._operations.values()), 2
+            ),
+            "operations": operations,
+        }
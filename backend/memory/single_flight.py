@@ -0,0 +1,45 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    单飞：同一 key 同时只执行一次加载，并发调用方等待同一个结果
+
+    ReadThroughCache、MemoryIndex 和 EmotionTimeSeries 共用，
+    命中判断和结果缓存由调用方负责。
+    加载在独立的任务中执行，所有调用方（包括发起加载的）都通过 shield 等待：
+    某个调用方被取消（例如 wait_for 超时）只影响它自己，加载继续完成并填充缓存。
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, "asyncio.Task"] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        """key 是否正在加载"""
+        return key in self._tasks
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行 fn，或等待同一 key 正在进行的加载
+
+        Args:
+            key: 加载键
+            fn: 加载协程函数；其异常会传给所有等待者
+
+        Returns:
+            fn 的返回值
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: "asyncio.Task") -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # 所有等待者都已取消时避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,97 @@
+import re
+from typing import List, Tuple
+
+# 中日韩字符范围（与 services/context_packer.py 的 token 估算保持一致）
+CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+
+# 连续的中日韩字符，或连续的其他字母数字
+_SEGMENT_RE = re.compile(f"([{CJK_RANGES}]+)|([^\\W_{CJK_RANGES}]+)")
+
+
+def split_segments(text: str) -> List[Tuple[str, bool]]:
+    """
+    把文本切分为连续的中日韩片段和字母数字单词，标点和空白丢弃
+
+    Args:
+        text: 输入文本
+
+    Returns:
+        (片段, 是否为中日韩片段) 列表，英文已转为小写
+    """
+    segments = []
+    for match in _SEGMENT_RE.finditer(text or ""):
+        cjk, word = match.groups()
+        if cjk:
+            segments.append((cjk, True))
+        else:
+            segments.append((word.lower(), False))
+    return segments
+
+
+def char_ngrams(text: str, n: int) -> List[str]:
+    """返回字符串的所有长度为 n 的字符 n-gram（不足 n 时返回自身）"""
+    if len(text) <= n:
+        return [text]
+    return [text[i : i + n] for i in range(len(text) - n + 1)]
+
+
+# 检索时忽略的常见英文虚词
+_STOPWORDS = frozenset(
+    [
+        "a",
+        "an",
+        "the",
+        "and",
+        "or",
+        "but",
+        "is",
+        "are",
+        "was",
+        "were",
+        "be",
+        "been",
+        "i",
+        "im",
+        "me",
+        "my",
+        "you",
+        "your",
+        "it",
+        "its",
+        "to",
+        "of",
+        "in",
+        "on",
+        "at",
+        "for",
+        "with",
+        "so",
+        "do",
+        "did",
+        "am",
+        "this",
+        "that",
+        "just",
+        "very",
+    ]
+)
+
+
+def keyword_tokens(text: str) -> List[str]:
+    """
+    提取用于关键词检索的词项
+
+    - 中日韩片段：切分为重叠的字符 2-gram（单字片段保留单字），
+      例如 "工作压力" -> ["工作", "作压", "压力"]
+    - 其他单词：小写后去掉常见虚词
+
+    Returns:
+        词项列表（保留重复，用于计算词频）
+    """
+    tokens = []
+    for segment, is_cjk in split_segments(text):
+        if is_cjk:
+            tokens.extend(char_ngrams(segment, 2))
+        elif segment not in _STOPWORDS:
+            tokens.append(segment)
+    return tokens
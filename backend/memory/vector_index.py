@@ -0,0 +1,104 @@
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class UserVectorIndex:
+    """
+    单个用户的记忆向量索引
+
+    向量归一化后按行存放在连续的 float32 矩阵中，容量不足时按倍数扩容，
+    查询时一次矩阵乘法得到全部余弦相似度。
+    """
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 64):
+        """
+        Args:
+            dim: 向量维度，None 表示由第一条向量决定
+            initial_capacity: 初始容量（行数）
+        """
+        self.dim = dim
+        self.size = 0
+        self._capacity = initial_capacity
+        self._matrix: Optional[np.ndarray] = None
+        self._payloads: List[Dict[str, Any]] = []
+        self._rows: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, memory_id: str) -> bool:
+        return memory_id in self._rows
+
+    def add(
+        self, memory_id: str, vector: Sequence[float], payload: Dict[str, Any]
+    ) -> bool:
+        """
+        插入一条记忆向量
+
+        Args:
+            memory_id: 记忆ID，重复插入会被忽略
+            vector: 嵌入向量
+            payload: 检索结果中返回的记忆内容（不含向量）
+
+        Returns:
+            是否插入成功（维度不符或零向量时返回 False）
+        """
+        if memory_id in self._rows:
+            return False
+
+        row = np.asarray(vector, dtype=np.float32)
+        if row.ndim != 1 or (self.dim is not None and row.shape[0] != self.dim):
+            logger.debug(f"跳过维度不符的记忆向量 {memory_id}: {row.shape}")
+            return False
+        norm = float(np.linalg.norm(row))
+        if norm == 0.0 or not np.isfinite(norm):
+            return False
+
+        if self._matrix is None:
+            self.dim = row.shape[0]
+            self._matrix = np.empty((self._capacity, self.dim), dtype=np.float32)
+        elif self.size == self._matrix.shape[0]:
+            grown = np.empty((self._matrix.shape[0] * 2, self.dim), dtype=np.float32)
+            grown[: self.size] = self._matrix[: self.size]
+            self._matrix = grown
+
+        self._matrix[self.size] = row / norm
+        self._rows[memory_id] = self.size
+        self._payloads.append(payload)
+        self.size += 1
+        return True
+
+    def search(
+        self, query_vector: Sequence[float], top_k: int = 3
+    ) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        余弦相似度 top-k 检索
+
+        Args:
+            query_vector: 查询向量
+            top_k: 返回数量
+
+        Returns:
+            按相似度从高到低排列的 (相似度, 记忆内容) 列表
+        """
+        if self.size == 0 or top_k <= 0:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        if query.shape != (self.dim,):
+            return []
+        norm = float(np.linalg.norm(query))
+        if norm == 0.0:
+            return []
+
+        scores = self._matrix[: self.size] @ (query / norm)
+        k = min(top_k, self.size)
+        if k < self.size:
+            candidates = np.argpartition(scores, -k)[-k:]
+        else:
+            candidates = np.arange(self.size)
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(float(scores[i]), self._payloads[i]) for i in ranked]
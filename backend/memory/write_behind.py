@@ -0,0 +1,297 @@
+import os
+import json
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from backend.memory.local_log_store import _file_lock
+
+logger = logging.getLogger(__name__)
+
+# 队列容量，写满后调用方需要等待（背压）
+WRITE_QUEUE_MAX_SIZE = int(os.getenv("WRITE_QUEUE_MAX_SIZE", "1000"))
+# 每批最多写入的记录数
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "50"))
+# 收到第一条记录后等待凑批的时间（秒）
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "0.05"))
+# 队列满时调用方最多等待的时间（秒），超时后直接同步写入
+WRITE_QUEUE_PUT_TIMEOUT = float(os.getenv("WRITE_QUEUE_PUT_TIMEOUT", "2"))
+# 批量写入失败后的重试次数
+WRITE_MAX_RETRIES = int(os.getenv("WRITE_MAX_RETRIES", "3"))
+# 关闭时等待队列写完的时间（秒）
+WRITE_SHUTDOWN_TIMEOUT = float(os.getenv("WRITE_SHUTDOWN_TIMEOUT", "10"))
+
+# 最终写入失败的记录保存位置，下次启动时重新写入
+# （多个 worker 进程共享，追加和领取都加文件锁）
+DEFAULT_SPILL_PATH = os.path.join(
+    os.path.dirname(__file__), "_local_cache", "write_behind_pending.jsonl"
+)
+
+BatchHandler = Callable[[List[Dict[str, Any]]], Awaitable[Any]]
+
+
+class WriteBehindQueue:
+    """
+    有界的后台批量写入队列
+
+    - 调用方把记录放入队列后立即返回，后台任务按批调用 handler 写入
+    - 队列满时调用方等待，等待超时后改为直接写入，不会无限堆积任务
+    - 写入失败按指数退避重试，最终失败的记录追加到本地文件，下次启动时重新写入
+    - close() 时写完队列中剩余的记录
+    """
+
+    def __init__(
+        self,
+        handler: BatchHandler,
+        name: str = "writes",
+        max_size: int = WRITE_QUEUE_MAX_SIZE,
+        batch_size: int = WRITE_BATCH_SIZE,
+        flush_interval: float = WRITE_FLUSH_INTERVAL,
+        put_timeout: float = WRITE_QUEUE_PUT_TIMEOUT,
+        max_retries: int = WRITE_MAX_RETRIES,
+        spill_path: Optional[str] = DEFAULT_SPILL_PATH,
+    ):
+        """
+        Args:
+            handler: 批量写入函数，接收一批记录
+            name: 队列名称，用于日志
+            max_size: 队列容量
+            batch_size: 每批最多记录数
+            flush_interval: 凑批等待时间（秒）
+            put_timeout: 队列满时的最长等待时间（秒）
+            max_retries: 写入失败的重试次数
+            spill_path: 最终失败记录的保存路径，None 表示不保存
+        """
+        self.handler = handler
+        self.name = name
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self.spill_path = spill_path
+
+        # 队列和后台任务在首次使用时创建，绑定到实际运行的事件循环
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._closed = False
+
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.failed = 0
+        self.inline_writes = 0
+
+    @property
+    def depth(self) -> int:
+        """当前排队中的记录数"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, record: Dict[str, Any]) -> None:
+        """
+        提交一条记录
+
+        队列有空位时立即返回；队列满时等待，超过 put_timeout 后由调用方直接写入。
+        队列已关闭时同样直接写入。
+        """
+        if self._closed:
+            await self._write_batch([record])
+            return
+
+        self._ensure_started()
+        try:
+            await asyncio.wait_for(self._queue.put(record), self.put_timeout)
+            self.enqueued += 1
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.name} 写入队列已满（{self.max_size}），直接写入")
+            self.inline_writes += 1
+            await self._write_batch([record])
+
+    async def flush(self) -> None:
+        """等待当前队列中的记录全部写完"""
+        if (
+            self._queue is not None
+            and self._worker is not None
+            and not self._worker.done()
+        ):
+            await self._queue.join()
+
+    async def close(self, timeout: float = WRITE_SHUTDOWN_TIMEOUT) -> None:
+        """
+        停止接收新记录并写完队列
+
+        Args:
+            timeout: 最长等待时间（秒），超时未写完的记录保存到本地文件
+        """
+        self._closed = True
+        if self._worker is None:
+            return
+
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(
+                f"{self.name} 写入队列关闭超时，剩余 {self.depth} 条记录保存到本地"
+            )
+        finally:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        remaining = []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        if remaining:
+            await asyncio.to_thread(self._spill, remaining)
+        self._queue = None
+
+    def stats(self) -> Dict[str, Any]:
+        """返回队列统计信息"""
+        return {
+            "depth": self.depth,
+            "max_size": self.max_size,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "retries": self.retries,
+            "failed": self.failed,
+            "inline_writes": self.inline_writes,
+        }
+
+    def _ensure_started(self) -> None:
+        """首次提交时创建队列并启动后台任务"""
+        if self._worker is not None and not self._worker.done():
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        """后台任务：先重写上次遗留的记录，然后循环凑批写入"""
+        # 领取遗留文件要加文件锁，放到线程中执行，不阻塞事件循环
+        pending = await asyncio.to_thread(self._load_spilled)
+        for start in range(0, len(pending), self.batch_size):
+            await self._write_batch(pending[start : start + self.batch_size])
+
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._write_batch(batch)
+            except asyncio.CancelledError:
+                # 关闭超时被取消时，正在写入的这一批也保存到本地
+                self._spill(batch)
+                raise
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        """写入一批记录，失败时指数退避重试，最终失败的记录保存到本地"""
+        attempt = 0
+        while True:
+            try:
+                await self.handler(batch)
+                self.written += len(batch)
+                self.batches += 1
+                return
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    logger.error(
+                        f"{self.name} 批量写入失败，已重试 {attempt} 次: {str(e)}"
+                    )
+                    self.failed += len(batch)
+                    await asyncio.to_thread(self._spill, batch)
+                    return
+                attempt += 1
+                self.retries += 1
+                delay = min(0.1 * (2**attempt), 5.0)
+                logger.warning(
+                    f"{self.name} 批量写入出错，"
+                    f"{delay:.1f}s 后第 {attempt} 次重试: {str(e)}"
+                )
+                await asyncio.sleep(delay)
+
+    def _spill(self, records: List[Dict[str, Any]]) -> None:
+        """把无法写入的记录追加到本地文件"""
+        if not self.spill_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+            while True:
+                with open(self.spill_path, "a", encoding="utf-8") as f:
+                    with _file_lock(f, exclusive=True):
+                        # 打开后文件被其他进程领取（改名）时，重新打开新文件再写
+                        if not self._is_spill_file(f):
+                            continue
+                        for record in records:
+                            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                        return
+        except Exception as e:
+            logger.error(
+                f"{self.name} 保存未写入记录时出错，丢失 {len(records)} 条: {str(e)}"
+            )
+
+    def _is_spill_file(self, f) -> bool:
+        try:
+            return os.path.samestat(os.fstat(f.fileno()), os.stat(self.spill_path))
+        except FileNotFoundError:
+            return False
+
+    def _load_spilled(self) -> List[Dict[str, Any]]:
+        """
+        领取并读取上次遗留的记录
+
+        先把文件原子地改名为本进程私有的名字，多个 worker 同时启动时只有一个能领取到；
+        再加锁等待正在追加的其他进程写完后读取。无法解析的行（例如崩溃时写了一半）跳过。
+        """
+        if not self.spill_path:
+            return []
+        claimed = f"{self.spill_path}.{os.getpid()}.replay"
+        try:
+            os.replace(self.spill_path, claimed)
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            logger.error(f"{self.name} 领取遗留记录时出错: {str(e)}")
+            return []
+
+        records, skipped = [], 0
+        try:
+            with open(claimed, "r", encoding="utf-8", errors="replace") as f:
+                with _file_lock(f, exclusive=True):
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            skipped += 1
+            os.remove(claimed)
+        except Exception as e:
+            logger.error(
+                f"{self.name} 读取遗留记录时出错（文件保留在 {claimed}）: {str(e)}"
+            )
+            return records
+        if skipped:
+            logger.warning(f"{self.name} 跳过 {skipped} 行无法解析的遗留记录")
+        if records:
+            logger.info(f"{self.name} 重新写入上次遗留的 {len(records)} 条记录")
+        return records
@@ -1,11 +1,15 @@
-from fastapi import APIRouter, HTTPException, Header, UploadFile, File
+from fastapi import APIRouter, HTTPException, Header, UploadFile, File, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 from ..services.agent_kernel import AgentKernel
 from ..memory.cosmos_memory_store import CosmosMemoryStore
+from .dependencies import get_agent_kernel, get_memory_store
 from datetime import datetime
+import json
 import os
 import shutil
+import asyncio
 from pathlib import Path
 
 router = APIRouter(
@@ -13,12 +17,6 @@ router = APIRouter(
     tags=["agent"],
 )
 
-# 创建 AgentKernel 实例，使用默认模式
-agent_kernel = AgentKernel(mode="default")
-
-# 创建数据库客户端
-cosmos_client = CosmosMemoryStore()
-
 # 输入模型
 class ChatRequest(BaseModel):
     message: str
@@ -80,7 +78,7 @@ class SimpleResponse(BaseModel):
 class SummaryResponse(BaseModel):
     summaries: List[Dict[str, Any]]
 
-async def get_user_id(user_id: Optional[str] = None, username: Optional[str] = None, x_user_id: Optional[str] = None):
+async def get_user_id(memory_store: CosmosMemoryStore, user_id: Optional[str] = None, username: Optional[str] = None, x_user_id: Optional[str] = None):
     """统一获取用户ID的辅助函数"""
     # 优先使用请求体中的user_id
     if user_id:
@@ -92,7 +90,7 @@ async def get_user_id(user_id: Optional[str] = None, username: Optional[str] = N
     
     # 最后使用用户名查找或创建用户ID
     if username:
-        return await cosmos_client.get_user_id_by_username(username)
+        return await memory_store.get_user_id_by_username(username)
     
     # 如果都没有提供，使用默认用户ID
     return "default_user"
@@ -100,7 +98,9 @@ async def get_user_id(user_id: Optional[str] = None, username: Optional[str] = N
 @router.post("/chat", response_model=ChatResponse)
 async def chat_with_agent(
     request: ChatRequest,
-    x_user_id: Optional[str] = Header(None)
+    x_user_id: Optional[str] = Header(None),
+    agent_kernel: AgentKernel = Depends(get_agent_kernel),
+    memory_store: CosmosMemoryStore = Depends(get_memory_store)
 ):
     """
     与 AI 进行对话
@@ -110,7 +110,7 @@ async def chat_with_agent(
     """
     try:
         # 获取用户ID
-        user_id = await get_user_id(request.user_id, request.username, x_user_id)
+        user_id = await get_user_id(memory_store, request.user_id, request.username, x_user_id)
         
         response = await agent_kernel.chat(
             query=request.message, 
@@ -122,10 +122,55 @@ async def chat_with_agent(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"对话失败: {str(e)}")
 
+@router.post("/chat/stream")
+async def chat_with_agent_stream(
+    request: ChatRequest,
+    x_user_id: Optional[str] = Header(None),
+    agent_kernel: AgentKernel = Depends(get_agent_kernel),
+    memory_store: CosmosMemoryStore = Depends(get_memory_store)
+):
+    """
+    与 AI 进行流式对话（Server-Sent Events）
+    
+    - 输入: 与 /agent/chat 相同
+    - 输出: text/event-stream，每个事件为 {"delta": "..."}，结束时发送 [DONE]
+    """
+    try:
+        # 获取用户ID
+        user_id = await get_user_id(memory_store, request.user_id, request.username, x_user_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"对话失败: {str(e)}")
+    
+    async def event_stream():
+        try:
+            async for delta in agent_kernel.chat_stream(
+                query=request.message,
+                user_id=user_id,
+                emotion=request.emotion,
+                confidence=request.confidence
+            ):
+                yield f"data: {json.dumps({'delta': delta}, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+        except Exception as e:
+            error = json.dumps({"detail": f"对话失败: {str(e)}"}, ensure_ascii=False)
+            yield f"event: error\ndata: {error}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # 关闭反向代理缓冲，保证片段即时到达客户端
+            "X-Accel-Buffering": "no"
+        }
+    )
+
 @router.post("/analyze", response_model=EmotionAnalyzeResponse)
 async def analyze_emotion(
     request: EmotionAnalyzeRequest,
-    x_user_id: Optional[str] = Header(None)
+    x_user_id: Optional[str] = Header(None),
+    agent_kernel: AgentKernel = Depends(get_agent_kernel),
+    memory_store: CosmosMemoryStore = Depends(get_memory_store)
 ):
     """
     分析消息情绪并返回回复
@@ -167,7 +212,7 @@ async def analyze_emotion(
         
         # 记录到数据库
         if request.conversation_id != "new":
-            # 添加对话
+            # 用户消息和助手回复一次追加到对话
             message = {
                 "role": "user",
                 "content": request.message,
@@ -175,22 +220,15 @@ async def analyze_emotion(
                 "confidence": confidence,
                 "timestamp": str(datetime.now())
             }
-            await cosmos_client.update_or_create_conversation(
-                user_id=user_id, 
-                message=message,
-                is_new=request.conversation_id == "new"
-            )
-            
-            # 添加助手回复
             assistant_message = {
                 "role": "assistant",
                 "content": response,
                 "timestamp": str(datetime.now())
             }
-            await cosmos_client.update_or_create_conversation(
+            await memory_store.append_conversation_messages(
                 user_id=user_id, 
-                message=assistant_message,
-                is_new=False
+                messages=[message, assistant_message],
+                is_new=request.conversation_id == "new"
             )
             
         return {
@@ -203,7 +241,9 @@ async def analyze_emotion(
 @router.post("/followup", response_model=ChatResponse)
 async def followup_with_agent(
     request: FollowupRequest,
-    x_user_id: Optional[str] = Header(None)
+    x_user_id: Optional[str] = Header(None),
+    agent_kernel: AgentKernel = Depends(get_agent_kernel),
+    memory_store: CosmosMemoryStore = Depends(get_memory_store)
 ):
     """
     AI主动发起对话
@@ -213,7 +253,7 @@ async def followup_with_agent(
     """
     try:
         # 获取用户ID
-        user_id = await get_user_id(request.user_id, request.username, x_user_id)
+        user_id = await get_user_id(memory_store, request.user_id, request.username, x_user_id)
         
         response = await agent_kernel.followup(
             user_id=user_id,
@@ -229,7 +269,9 @@ async def followup_with_agent(
 @router.post("/start_conversation", response_model=SimpleResponse)
 async def start_new_conversation(
     request: StartConversationRequest,
-    x_user_id: Optional[str] = Header(None)
+    x_user_id: Optional[str] = Header(None),
+    agent_kernel: AgentKernel = Depends(get_agent_kernel),
+    memory_store: CosmosMemoryStore = Depends(get_memory_store)
 ):
     """
     开始新对话，清除之前的对话历史
@@ -239,7 +281,7 @@ async def start_new_conversation(
     """
     try:
         # 获取用户ID
-        user_id = await get_user_id(request.user_id, request.username, x_user_id)
+        user_id = await get_user_id(memory_store, request.user_id, request.username, x_user_id)
         
         agent_kernel.start_conversation(user_id)
         return {"success": True, "message": f"已为用户 {user_id} 开始新对话"}
@@ -249,7 +291,8 @@ async def start_new_conversation(
 @router.get("/history/{user_id}", response_model=HistoryResponse)
 async def get_chat_history(
     user_id: str,
-    x_user_id: Optional[str] = Header(None)
+    x_user_id: Optional[str] = Header(None),
+    agent_kernel: AgentKernel = Depends(get_agent_kernel)
 ):
     """
     获取指定用户的对话历史
@@ -269,7 +312,9 @@ async def get_chat_history(
 @router.post("/memory/retrieve", response_model=MemoryResponse)
 async def retrieve_memory(
     request: MemoryRetrieveRequest,
-    x_user_id: Optional[str] = Header(None)
+    x_user_id: Optional[str] = Header(None),
+    agent_kernel: AgentKernel = Depends(get_agent_kernel),
+    memory_store: CosmosMemoryStore = Depends(get_memory_store)
 ):
     """
     检索用户相关记忆
@@ -279,9 +324,9 @@ async def retrieve_memory(
     """
     try:
         # 获取用户ID
-        user_id = await get_user_id(request.user_id, request.username, x_user_id)
+        user_id = await get_user_id(memory_store, request.user_id, request.username, x_user_id)
         
-        memories = agent_kernel.retrieve_memory(user_id, request.query, request.top_k)
+        memories = await agent_kernel.retrieve_memory(user_id, request.query, request.top_k)
         return memories
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"记忆检索失败: {str(e)}")
@@ -291,7 +336,8 @@ async def get_conversation_summaries(
     limit: int = 5,
     x_user_id: Optional[str] = Header(None),
     user_id: Optional[str] = None,
-    username: Optional[str] = None
+    username: Optional[str] = None,
+    memory_store: CosmosMemoryStore = Depends(get_memory_store)
 ):
     """
     获取用户的对话摘要列表
@@ -301,9 +347,9 @@ async def get_conversation_summaries(
     """
     try:
         # 获取用户ID
-        effective_user_id = await get_user_id(user_id, username, x_user_id)
+        effective_user_id = await get_user_id(memory_store, user_id, username, x_user_id)
         
-        summaries = await cosmos_client.get_conversation_summaries(effective_user_id, limit)
+        summaries = await memory_store.get_conversation_summaries(effective_user_id, limit)
         return {"summaries": summaries}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取对话摘要失败: {str(e)}")
@@ -313,7 +359,8 @@ async def update_user_preferences(
     preferences: UserPreferences,
     x_user_id: Optional[str] = Header(None),
     user_id: Optional[str] = None,
-    username: Optional[str] = None
+    username: Optional[str] = None,
+    memory_store: CosmosMemoryStore = Depends(get_memory_store)
 ):
     """
     更新用户偏好设置
@@ -323,7 +370,7 @@ async def update_user_preferences(
     """
     try:
         # 获取用户ID
-        effective_user_id = await get_user_id(user_id, username, x_user_id)
+        effective_user_id = await get_user_id(memory_store, user_id, username, x_user_id)
         
         # 过滤掉None值，只更新有值的字段
         preferences_dict = {k: v for k, v in preferences.dict().items() if v is not None}
@@ -331,17 +378,29 @@ async def update_user_preferences(
         if not preferences_dict:
             return {"success": False, "message": "未提供任何有效的偏好设置"}
         
-        await cosmos_client.update_user_preferences(effective_user_id, preferences_dict)
+        await memory_store.update_user_preferences(effective_user_id, preferences_dict)
         return {"success": True, "message": "用户偏好设置已更新"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"更新用户偏好设置失败: {str(e)}")
 
+def _save_upload(source, file_path: str) -> None:
+    """先写入临时文件再替换，预测请求不会读到写了一半的 CSV"""
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as buffer:
+            shutil.copyfileobj(source, buffer)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 @router.post("/upload_health_data", response_model=SimpleResponse)
 async def upload_health_data(
     file: UploadFile = File(...),
     x_user_id: Optional[str] = Header(None),
     user_id: Optional[str] = None,
-    username: Optional[str] = None
+    username: Optional[str] = None,
+    memory_store: CosmosMemoryStore = Depends(get_memory_store)
 ):
     """
     上传健康数据文件
@@ -351,7 +410,7 @@ async def upload_health_data(
     """
     try:
         # 获取用户ID
-        effective_user_id = await get_user_id(user_id, username, x_user_id)
+        effective_user_id = await get_user_id(memory_store, user_id, username, x_user_id)
         
         # 验证文件类型
         if not file.filename.endswith('.csv'):
@@ -362,10 +421,11 @@ async def upload_health_data(
         model_dir = os.path.join(current_dir, "model")
         os.makedirs(model_dir, exist_ok=True)
         
-        # 保存文件
+        # 保存文件并解析 HRV 特征（阻塞的文件读写放到线程中，不占用事件循环）
         file_path = os.path.join(model_dir, "HeartRateVariabilitySDNN.csv")
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await asyncio.to_thread(_save_upload, file.file, file_path)
+        from ..tools.emotion_prediction_tool import _load_health_features
+        await asyncio.to_thread(_load_health_features)
             
         # 构造健康数据用于分析
         mock_health_data = {
@@ -0,0 +1,14 @@
+from fastapi import Request
+
+from ..memory.cosmos_memory_store import CosmosMemoryStore
+from ..services.agent_kernel import AgentKernel
+
+
+def get_memory_store(request: Request) -> CosmosMemoryStore:
+    """获取 lifespan 中创建的共享记忆存储"""
+    return request.app.state.memory_store
+
+
+def get_agent_kernel(request: Request) -> AgentKernel:
+    """获取 lifespan 中创建的共享 AgentKernel"""
+    return request.app.state.agent_kernel
@@ -1,8 +1,12 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 import json
 import os
 from typing import Dict, Any
 from pathlib import Path
+from ..memory.context_cache import context_cache
+from ..services.llm_gateway import llm_gateway
+from ..memory.embeddings import embedding_engine
+from ..tools.emotion_prediction_tool import analytics_pool, emotion_batcher
 
 router = APIRouter(
     prefix="/health",
@@ -38,4 +42,26 @@ async def get_mock_health_data(user_id: str) -> Dict[str, Any]:
             
         return mock_data
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching health data: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error fetching health data: {str(e)}") 
+
+@router.get("/metrics")
+async def get_metrics(request: Request) -> Dict[str, Any]:
+    """
+    Return in-process runtime metrics for this worker.
+    """
+    writer = getattr(request.app.state, "interaction_writer", None)
+    memory_store = getattr(request.app.state, "memory_store", None)
+    return {
+        "context_cache": context_cache.stats(),
+        "llm": llm_gateway.stats(),
+        "write_queue": writer.stats() if writer is not None else None,
+        "cosmos": memory_store.request_charges.stats() if memory_store is not None else None,
+        "memory_index": memory_store.memory_index.stats() if memory_store is not None else None,
+        "summary_queue": memory_store.summary_worker.stats() if memory_store is not None else None,
+        "emotion_series": memory_store.emotion_series.stats() if memory_store is not None else None,
+        "profile_cache": memory_store.profile_cache.stats() if memory_store is not None else None,
+        "username_cache": memory_store.username_cache.stats() if memory_store is not None else None,
+        "embeddings": embedding_engine.stats(),
+        "emotion_batcher": emotion_batcher.stats(),
+        "analytics_pool": analytics_pool.stats()
+    }
@@ -1,16 +1,14 @@
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Header, Depends
 from pydantic import BaseModel
 from typing import Dict, Any, Optional
 from ..memory.cosmos_memory_store import CosmosMemoryStore
+from .dependencies import get_memory_store
 
 router = APIRouter(
     prefix="/users",
     tags=["users"],
 )
 
-# 创建数据库客户端
-cosmos_client = CosmosMemoryStore()
-
 # 用户偏好设置模型
 class UserPreferences(BaseModel):
     username: str
@@ -27,7 +25,8 @@ class UserPreferencesResponse(BaseModel):
 @router.post("/preferences", status_code=201)
 async def save_user_preferences(
     preferences: UserPreferences,
-    x_user_id: Optional[str] = Header(None)
+    x_user_id: Optional[str] = Header(None),
+    memory_store: CosmosMemoryStore = Depends(get_memory_store)
 ):
     """
     保存用户偏好设置
@@ -38,7 +37,7 @@ async def save_user_preferences(
     try:
         # 如果提供了用户名，使用它来查找或创建用户ID
         if preferences.username:
-            user_id = await cosmos_client.get_user_id_by_username(preferences.username)
+            user_id = await memory_store.get_user_id_by_username(preferences.username)
         elif x_user_id:
             user_id = x_user_id
         else:
@@ -56,7 +55,7 @@ async def save_user_preferences(
         prefs_dict = {k: v for k, v in prefs_dict.items() if v is not None}
         
         # 更新用户偏好设置
-        await cosmos_client.update_user_preferences(user_id, prefs_dict)
+        await memory_store.update_user_preferences(user_id, prefs_dict)
         
         return {"success": True, "message": "用户偏好设置已保存"}
     except Exception as e:
@@ -65,7 +64,8 @@ async def save_user_preferences(
 @router.get("/{username}/preferences", response_model=UserPreferencesResponse)
 async def get_user_preferences(
     username: str,
-    x_user_id: Optional[str] = Header(None)
+    x_user_id: Optional[str] = Header(None),
+    memory_store: CosmosMemoryStore = Depends(get_memory_store)
 ):
     """
     获取用户偏好设置
@@ -75,10 +75,10 @@ async def get_user_preferences(
     """
     try:
         # 使用用户名查找用户ID
-        user_id = await cosmos_client.get_user_id_by_username(username)
+        user_id = await memory_store.get_user_id_by_username(username)
         
         # 获取用户配置文件
-        profile = await cosmos_client.get_user_profile(user_id)
+        profile = await memory_store.get_user_profile(user_id)
         
         return {
             "username": profile.get("username", username),
@@ -4,29 +4,88 @@
 使用方法:
 1. 确保已在 .env 文件中设置 COSMOS_ENDPOINT, COSMOS_KEY 和 COSMOS_DATABASE
 2. 运行 python -m backend.scripts.init_cosmos_db
+   初始化数据库和容器，并迁移 memory 目录下的 user_profile.json 和 memory.json
+3. 导入历史导出数据（JSON 数组或 JSONL，逐条流式读取）:
+   python -m backend.scripts.init_cosmos_db --import exports/interactions.jsonl \\
+       --container interactions
+
+迁移以有界并发的批次 upsert，遇到 429 按 retry-after 等待重试；每完成一批写一次检查点，
+中断后重新运行会从检查点继续（加 --restart 从头开始）。
 """
 
 import os
-import sys
 import json
+import time
+import asyncio
+import hashlib
 import logging
+import argparse
 from pathlib import Path
-from azure.cosmos import CosmosClient, PartitionKey, exceptions
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from azure.cosmos import CosmosClient, PartitionKey, ThroughputProperties, exceptions
+from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
+from azure.core.exceptions import ServiceRequestError, ServiceResponseError
 from dotenv import load_dotenv
 
+from backend.memory.tokenizer import keyword_tokens
+from backend.memory.request_charge import RequestChargeTracker
+
 # 设置日志
-logging.basicConfig(level=logging.INFO, 
-                   format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
 logger = logging.getLogger(__name__)
 
-# 确保脚本可以导入上层包
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
-root_dir = os.path.dirname(parent_dir)
-sys.path.append(root_dir)
 
 # 加载环境变量
-load_dotenv(os.path.join(parent_dir, '.env'))
+load_dotenv(os.path.join(parent_dir, ".env"))
+
+# 新建容器的吞吐量：设置了自动缩放上限时使用自动缩放，否则使用手动吞吐量；
+# 两者都为 0 时不指定吞吐量（无服务器账户）
+COSMOS_CONTAINER_THROUGHPUT = int(os.getenv("COSMOS_CONTAINER_THROUGHPUT", "400"))
+COSMOS_AUTOSCALE_MAX_THROUGHPUT = int(os.getenv("COSMOS_AUTOSCALE_MAX_THROUGHPUT", "0"))
+
+# 每批读取并写入的条数（每批完成后写一次检查点）
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "200"))
+# 同时进行的 upsert 请求数
+MIGRATION_CONCURRENCY = int(os.getenv("MIGRATION_CONCURRENCY", "16"))
+# 单条写入遇到限流或临时错误时的重试次数
+MIGRATION_MAX_RETRIES = int(os.getenv("MIGRATION_MAX_RETRIES", "10"))
+# 进度日志间隔（秒）
+MIGRATION_REPORT_INTERVAL = float(os.getenv("MIGRATION_REPORT_INTERVAL", "5"))
+# 检查点和被拒绝条目的存放目录
+MIGRATION_CHECKPOINT_DIR = os.getenv(
+    "MIGRATION_CHECKPOINT_DIR", os.path.join(current_dir, "_migration_checkpoints")
+)
+
+# 容器名 -> 分区键
+CONTAINERS = {
+    "user_profiles": "/user_id",
+    "interactions": "/user_id",
+    "emotion_history": "/user_id",
+    "memory_embeddings": "/user_id",
+    "conversations": "/user_id",
+}
+
+# 可以重试的状态码：限流、重试写入、请求超时、服务不可用
+RETRYABLE_STATUS_CODES = {408, 429, 449, 503}
+RETRY_AFTER_HEADER = "x-ms-retry-after-ms"
+
+JSON_READ_CHUNK_SIZE = 1 << 16
+
+
+def container_throughput():
+    """根据环境变量返回新建容器使用的吞吐量设置"""
+    if COSMOS_AUTOSCALE_MAX_THROUGHPUT > 0:
+        return ThroughputProperties(
+            auto_scale_max_throughput=COSMOS_AUTOSCALE_MAX_THROUGHPUT
+        )
+    if COSMOS_CONTAINER_THROUGHPUT > 0:
+        return COSMOS_CONTAINER_THROUGHPUT
+    return None
+
 
 def create_database_if_not_exists(client, database_name):
     """创建数据库（如果不存在）"""
@@ -38,13 +97,21 @@ def create_database_if_not_exists(client, database_name):
         logger.error(f"创建数据库时出错: {str(e)}")
         raise
 
-def create_container_if_not_exists(database, container_name, partition_key):
-    """创建容器（如果不存在）"""
+
+def create_container_if_not_exists(
+    database, container_name, partition_key, offer_throughput=None
+):
+    """
+    创建容器（如果不存在）
+
+    已存在的容器不会修改吞吐量；大批量导入前可以在门户中临时调高，或使用自动缩放。
+    """
+    if offer_throughput is None:
+        offer_throughput = container_throughput()
+    options = {} if offer_throughput is None else {"offer_throughput": offer_throughput}
     try:
         container = database.create_container_if_not_exists(
-            id=container_name,
-            partition_key=PartitionKey(path=partition_key),
-            offer_throughput=400  # 最小吞吐量
+            id=container_name, partition_key=PartitionKey(path=partition_key), **options
         )
         logger.info(f"确保容器 {container_name} 存在")
         return container
@@ -52,157 +119,673 @@ def create_container_if_not_exists(database, container_name, partition_key):
         logger.error(f"创建容器 {container_name} 时出错: {str(e)}")
         raise
 
-def migrate_json_to_cosmos(container, json_file_path, transform_func=None):
-    """将JSON文件中的数据迁移到Cosmos DB容器"""
-    try:
-        # 检查文件是否存在
-        if not os.path.exists(json_file_path):
-            logger.warning(f"文件 {json_file_path} 不存在，跳过迁移")
+
+class _JsonStream:
+    """
+    增量读取 JSON 文本
+
+    按块读取文件并用 raw_decode 逐个解析值，内存中只保留当前值所需的文本；
+    单个值超过缓冲区时读取量成倍增长，避免反复解析。
+    """
+
+    def __init__(self, f, chunk_size: int = JSON_READ_CHUNK_SIZE):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        """读取更多内容，返回是否读到了新数据"""
+        if self._eof:
+            return False
+        chunk = self._f.read(max(self._chunk_size, len(self._buffer) - self._pos))
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos :] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """跳过空白并返回下一个字符，文件结束时返回空字符串"""
+        while True:
+            while (
+                self._pos < len(self._buffer) and self._buffer[self._pos] in " \t\r\n"
+            ):
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"JSON 格式错误: 期望 {char!r}，实际为 {found!r}")
+        self._pos += 1
+
+    def value(self) -> Any:
+        """解析下一个完整的 JSON 值"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # 值恰好在缓冲区末尾结束时可能是被截断的数字，读取更多内容后重新解析
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def members(self) -> Iterator[str]:
+        """逐个返回对象成员的键，调用方在下一次迭代前必须读取对应的值"""
+        self.expect("{")
+        if self.peek() == "}":
+            self.expect("}")
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.expect(",")
+                continue
+            self.expect("}")
+            return
+
+
+def iter_json_array(path: str, chunk_size: int = JSON_READ_CHUNK_SIZE) -> Iterator[Any]:
+    """
+    流式读取 JSON 数组或 JSONL 文件中的每一项
+
+    Args:
+        path: 文件路径，.jsonl/.ndjson 按行读取；顶层为对象时作为单个条目返回
+        chunk_size: 每次读取的字符数
+
+    Returns:
+        逐条返回的条目
+    """
+    with open(path, "r", encoding="utf-8-sig") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+            return
+
+        stream = _JsonStream(f, chunk_size)
+        if stream.peek() != "[":
+            yield stream.value()
+            return
+        stream.expect("[")
+        if stream.peek() == "]":
             return
-        
-        # 读取JSON文件
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # 使用转换函数处理数据（如果提供）
-        if transform_func:
-            items = transform_func(data)
+        while True:
+            yield stream.value()
+            if stream.peek() == ",":
+                stream.expect(",")
+                continue
+            stream.expect("]")
+            return
+
+
+def iter_json_members(
+    path: str, prefix: Sequence[str] = (), chunk_size: int = JSON_READ_CHUNK_SIZE
+) -> Iterator[Tuple[str, Any]]:
+    """
+    流式读取 JSON 对象的成员
+
+    Args:
+        path: 文件路径
+        prefix: 要展开的对象所在的键路径，例如 ("users",)；为空时展开顶层对象
+        chunk_size: 每次读取的字符数
+
+    Returns:
+        逐个返回的 (键, 值)，每次只在内存中保留一个值
+    """
+    with open(path, "r", encoding="utf-8-sig") as f:
+        stream = _JsonStream(f, chunk_size)
+        for target in prefix:
+            for key in stream.members():
+                if key == target:
+                    break
+                stream.value()
+            else:
+                return
+        for key in stream.members():
+            yield key, stream.value()
+
+
+def _ensure_id(item, container_name):
+    """
+    确保条目有id；没有时根据内容生成稳定的id（重复导入时写入同一文档）
+
+    只有 user_profiles 每个用户一个文档，可以用 user_id 作为id；
+    其他容器中同一用户有多条记录，用 user_id 会让 upsert 互相覆盖
+    """
+    if "id" not in item:
+        digest = hashlib.blake2b(
+            json.dumps(item, sort_keys=True, ensure_ascii=False).encode("utf-8"),
+            digest_size=16,
+        ).hexdigest()
+        if container_name == "user_profiles":
+            item["id"] = item.get("user_id") or digest
         else:
-            items = data
-        
-        # 如果items不是列表，将其转换为列表
-        if not isinstance(items, list):
-            items = [items]
-        
-        # 上传到Cosmos DB
-        for item in items:
-            # 确保每个项目都有id
-            if 'id' not in item:
-                item['id'] = item.get('user_id', str(hash(json.dumps(item))))
-            
-            try:
-                container.create_item(body=item)
-                logger.info(f"成功上传项目: {item['id']}")
-            except exceptions.CosmosResourceExistsError:
-                logger.warning(f"项目 {item['id']} 已存在，跳过")
-            except Exception as e:
-                logger.error(f"上传项目 {item['id']} 时出错: {str(e)}")
-        
-    except Exception as e:
-        logger.error(f"从 {json_file_path} 迁移数据时出错: {str(e)}")
+            item["id"] = digest
+    return item
+
+
+def _user_profile_doc(user_id, profile):
+    """把 user_profile.json 中的一个用户转换为文档"""
+    # 确保每个配置文件都有id字段
+    if "id" not in profile:
+        profile["id"] = user_id
+    return profile
+
+
+def _memory_docs(user_id, user_data):
+    """把 memory.json 中的一个用户转换为 (容器名, 文档) 列表"""
+    result = []
+
+    # 处理交互
+    for i, interaction in enumerate(user_data.get("interactions", [])):
+        interaction_id = f"int_{i}_{user_id}"
+        text = interaction.get("text") or ""
+        new_interaction = {
+            "id": interaction_id,
+            "user_id": user_id,
+            "timestamp": interaction.get("timestamp"),
+            "text": interaction.get("text"),
+            "emotion": interaction.get("emotion"),
+            "suggestion": interaction.get("suggestion"),
+            "metadata": {},
+        }
+        result.append(("interactions", new_interaction))
+
+        # 创建嵌入记录
+        embedding_id = f"emb_{i}_{user_id}"
+        new_embedding = {
+            "id": embedding_id,
+            "user_id": user_id,
+            "source_type": "interaction",
+            "source_id": interaction_id,
+            "timestamp": interaction.get("timestamp"),
+            "text": interaction.get("text"),
+            "summary": f"用户表达了{interaction.get('emotion')}情绪: {text[:50]}...",
+            "memory_type": "emotion",
+            "keywords": list(dict.fromkeys(keyword_tokens(text)))[:10],
+        }
+        result.append(("memory_embeddings", new_embedding))
+
+    # 处理情绪历史
+    for i, emotion in enumerate(user_data.get("emotion_history", [])):
+        emotion_id = f"emo_{i}_{user_id}"
+        new_emotion = {
+            "id": emotion_id,
+            "user_id": user_id,
+            "timestamp": emotion.get("timestamp"),
+            "emotion": emotion.get("emotion"),
+            "confidence": emotion.get("confidence", 0.8),
+        }
+        result.append(("emotion_history", new_emotion))
+
+    return result
+
 
 def transform_user_profiles(data):
     """转换user_profile.json的数据格式"""
     # 如果数据是字典（如user_profile.json），将其转换为列表
     if isinstance(data, dict):
-        result = []
-        for user_id, profile in data.items():
-            # 确保每个配置文件都有id字段
-            if 'id' not in profile:
-                profile['id'] = user_id
-            result.append(profile)
-        return result
+        return [
+            _user_profile_doc(user_id, profile) for user_id, profile in data.items()
+        ]
     return data
 
+
 def transform_memory_data(data):
     """转换memory.json的数据格式"""
     result = []
-    
+
     # 处理用户交互和情绪历史
-    if 'users' in data:
-        for user_id, user_data in data['users'].items():
-            # 处理交互
-            for i, interaction in enumerate(user_data.get('interactions', [])):
-                interaction_id = f"int_{i}_{user_id}"
-                new_interaction = {
-                    'id': interaction_id,
-                    'user_id': user_id,
-                    'timestamp': interaction.get('timestamp'),
-                    'text': interaction.get('text'),
-                    'emotion': interaction.get('emotion'),
-                    'suggestion': interaction.get('suggestion'),
-                    'metadata': {}
-                }
-                result.append(('interactions', new_interaction))
-                
-                # 创建嵌入记录
-                embedding_id = f"emb_{i}_{user_id}"
-                new_embedding = {
-                    'id': embedding_id,
-                    'user_id': user_id,
-                    'source_type': 'interaction',
-                    'source_id': interaction_id,
-                    'timestamp': interaction.get('timestamp'),
-                    'text': interaction.get('text'),
-                    'summary': f"用户表达了{interaction.get('emotion')}情绪: {interaction.get('text')[:50]}...",
-                    'memory_type': 'emotion',
-                    'keywords': interaction.get('text', '').lower().split()[:10]
-                }
-                result.append(('memory_embeddings', new_embedding))
-            
-            # 处理情绪历史
-            for i, emotion in enumerate(user_data.get('emotion_history', [])):
-                emotion_id = f"emo_{i}_{user_id}"
-                new_emotion = {
-                    'id': emotion_id,
-                    'user_id': user_id,
-                    'timestamp': emotion.get('timestamp'),
-                    'emotion': emotion.get('emotion'),
-                    'confidence': emotion.get('confidence', 0.8)
-                }
-                result.append(('emotion_history', new_emotion))
-    
+    for user_id, user_data in data.get("users", {}).items():
+        result.extend(_memory_docs(user_id, user_data))
+
     return result
 
-def main():
+
+def iter_user_profile_items(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """流式读取 user_profile.json，逐个返回 (容器名, 文档)"""
+    for user_id, profile in iter_json_members(path):
+        yield "user_profiles", _user_profile_doc(user_id, profile)
+
+
+def iter_memory_items(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """流式读取 memory.json，每次只加载一个用户的数据"""
+    for user_id, user_data in iter_json_members(path, ("users",)):
+        yield from _memory_docs(user_id, user_data)
+
+
+def iter_export_items(
+    path: str, container_name: str
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """流式读取导出文件（JSON 数组或 JSONL），所有条目写入同一个容器"""
+    for item in iter_json_array(path):
+        yield container_name, _ensure_id(item, container_name)
+
+
+class MigrationError(Exception):
+    """重试耗尽后仍无法写入，迁移中止（已完成的批次保存在检查点中）"""
+
+
+class MigrationCheckpoint:
+    """
+    单个源文件的迁移进度
+
+    记录已完成的条目数（源文件中的顺序）和源文件的大小、修改时间；
+    源文件变化后检查点作废，从头开始。无法写入的条目追加到 .rejected.jsonl。
+    """
+
+    def __init__(
+        self, source_path: str, checkpoint_dir: str = MIGRATION_CHECKPOINT_DIR
+    ):
+        """
+        Args:
+            source_path: 源文件路径
+            checkpoint_dir: 检查点目录
+        """
+        self.source_path = os.path.abspath(source_path)
+        digest = hashlib.blake2b(
+            self.source_path.encode("utf-8"), digest_size=4
+        ).hexdigest()
+        name = f"{Path(source_path).name}_{digest}"
+        self.checkpoint_dir = checkpoint_dir
+        self.path = os.path.join(checkpoint_dir, f"{name}.checkpoint.json")
+        self.rejects_path = os.path.join(checkpoint_dir, f"{name}.rejected.jsonl")
+
+        stat = os.stat(source_path)
+        self.fingerprint = {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+        self.position = 0
+        self.completed = False
+
+    def load(self, restart: bool = False) -> None:
+        """读取检查点，restart 为 True 或源文件已变化时从头开始"""
+        self.position, self.completed = 0, False
+        if restart or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except Exception as e:
+            logger.warning(f"读取检查点 {self.path} 出错，从头开始: {str(e)}")
+            return
+        if state.get("fingerprint") != self.fingerprint:
+            logger.warning(f"{self.source_path} 在上次迁移后已修改，从头开始")
+            return
+        self.position = int(state.get("position", 0))
+        self.completed = bool(state.get("completed", False))
+
+    def save(self) -> None:
+        """原子地写入检查点"""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        state = {
+            "source": self.source_path,
+            "fingerprint": self.fingerprint,
+            "position": self.position,
+            "completed": self.completed,
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def reject(self, container_name: str, item: Dict[str, Any], error: str) -> None:
+        """记录无法写入的条目，便于修正后单独导入"""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        with open(self.rejects_path, "a", encoding="utf-8") as f:
+            f.write(
+                json.dumps(
+                    {"container": container_name, "error": error, "item": item},
+                    ensure_ascii=False,
+                )
+                + "\n"
+            )
+
+
+class BulkMigrator:
+    """
+    把 (容器名, 文档) 流批量 upsert 到 Cosmos DB
+
+    - 按批读取源数据，批内请求并发执行，同时进行的请求数不超过 concurrency
+    - 429/449/408/503 和连接错误按 x-ms-retry-after-ms（没有时指数退避）等待后重试；
+      等待期间占用并发名额，整体写入速度随之降低
+    - 其他错误的条目记录到 rejected 文件后跳过；重试耗尽时中止迁移
+    - 每批完成后写检查点，重新运行时跳过已完成的条目（upsert 保证重复写入是幂等的）
+    """
+
+    def __init__(
+        self,
+        containers: Dict[str, Any],
+        batch_size: int = MIGRATION_BATCH_SIZE,
+        concurrency: int = MIGRATION_CONCURRENCY,
+        max_retries: int = MIGRATION_MAX_RETRIES,
+        report_interval: float = MIGRATION_REPORT_INTERVAL,
+    ):
+        """
+        Args:
+            containers: 容器名 -> 异步容器客户端
+            batch_size: 每批条数
+            concurrency: 最大并发请求数
+            max_retries: 单条写入的最大重试次数
+            report_interval: 进度日志间隔（秒）
+        """
+        self.containers = containers
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.report_interval = report_interval
+        self.request_charges = RequestChargeTracker()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def migrate(
+        self,
+        items: Iterable[Tuple[str, Dict[str, Any]]],
+        checkpoint: MigrationCheckpoint,
+        restart: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        迁移一个源文件
+
+        Args:
+            items: (容器名, 文档) 的迭代器，每次运行必须以相同顺序产生相同条目
+            checkpoint: 该源文件的检查点
+            restart: 是否忽略检查点从头开始
+
+        Returns:
+            本次运行的统计信息
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        checkpoint.load(restart)
+        stats = {
+            "source": checkpoint.source_path,
+            "resumed_from": checkpoint.position,
+            "items": 0,
+            "rejected": 0,
+            "retries": 0,
+            "throttled": 0,
+        }
+        self.request_charges.reset()
+        started = time.monotonic()
+        if checkpoint.completed:
+            logger.info(
+                f"{checkpoint.source_path} 已迁移完成，跳过（使用 --restart 重新迁移）"
+            )
+            return self._report(stats, started)
+        if checkpoint.position:
+            logger.info(
+                f"从检查点继续迁移 {checkpoint.source_path}，"
+                f"跳过前 {checkpoint.position} 条"
+            )
+
+        last_report = started
+        iterator = iter(items)
+        # 跳过已完成的条目（源数据仍需解析，但不再写入）
+        for _ in range(checkpoint.position):
+            if next(iterator, None) is None:
+                break
+
+        while True:
+            batch = [item for _, item in zip(range(self.batch_size), iterator)]
+            if not batch:
+                break
+            await self._write_batch(batch, checkpoint, stats)
+            checkpoint.position += len(batch)
+            checkpoint.save()
+
+            now = time.monotonic()
+            if now - last_report >= self.report_interval:
+                last_report = now
+                report = self._report(stats, started)
+                logger.info(
+                    f"已迁移 {checkpoint.position} 条，"
+                    f"{report['items_per_second']:.0f} 条/秒，"
+                    f"消耗 {report['request_units']:.0f} RU"
+                )
+
+        checkpoint.completed = True
+        checkpoint.save()
+        report = self._report(stats, started)
+        logger.info(
+            f"{checkpoint.source_path} 迁移完成: {report['items']} 条，"
+            f"{report['elapsed_seconds']:.1f} 秒，"
+            f"{report['items_per_second']:.0f} 条/秒，"
+            f"消耗 {report['request_units']:.0f} RU"
+            f"（平均 {report['request_units_per_item']:.2f} RU/条），"
+            f"拒绝 {report['rejected']} 条，限流 {report['throttled']} 次"
+        )
+        return report
+
+    async def _write_batch(
+        self,
+        batch: List[Tuple[str, Dict[str, Any]]],
+        checkpoint: MigrationCheckpoint,
+        stats: Dict[str, Any],
+    ) -> None:
+        """并发写入一批，全部结束后才返回；有条目重试耗尽时抛出 MigrationError"""
+        results = await asyncio.gather(
+            *(
+                self._upsert(container_name, item, checkpoint, stats)
+                for container_name, item in batch
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def _upsert(
+        self,
+        container_name: str,
+        item: Dict[str, Any],
+        checkpoint: MigrationCheckpoint,
+        stats: Dict[str, Any],
+    ) -> None:
+        container = self.containers[container_name]
+        item = _ensure_id(item, container_name)
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                try:
+                    await container.upsert_item(
+                        body=item,
+                        response_hook=self.request_charges.hook(
+                            f"upsert_{container_name}"
+                        ),
+                    )
+                    stats["items"] += 1
+                    return
+                except exceptions.CosmosHttpResponseError as e:
+                    if e.status_code not in RETRYABLE_STATUS_CODES:
+                        logger.error(
+                            f"写入 {container_name}/{item['id']} 失败"
+                            f"（{e.status_code}），已记录到 "
+                            f"{checkpoint.rejects_path}: {str(e)}"
+                        )
+                        checkpoint.reject(container_name, item, str(e))
+                        stats["rejected"] += 1
+                        return
+                    if e.status_code == 429:
+                        stats["throttled"] += 1
+                    error, delay = e, self._retry_delay(e, attempt)
+                except (
+                    ServiceRequestError,
+                    ServiceResponseError,
+                    asyncio.TimeoutError,
+                ) as e:
+                    error, delay = e, self._retry_delay(None, attempt)
+
+                if attempt >= self.max_retries:
+                    raise MigrationError(
+                        f"写入 {container_name}/{item['id']} "
+                        f"重试 {attempt} 次后仍失败: "
+                        f"{str(error)}"
+                    ) from error
+                attempt += 1
+                stats["retries"] += 1
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _retry_delay(
+        error: Optional[exceptions.CosmosHttpResponseError], attempt: int
+    ) -> float:
+        """计算重试等待时间，优先使用服务端返回的 x-ms-retry-after-ms"""
+        headers = getattr(error, "headers", None) or {}
+        retry_after_ms = headers.get(RETRY_AFTER_HEADER)
+        if retry_after_ms is not None:
+            try:
+                return float(retry_after_ms) / 1000
+            except (TypeError, ValueError):
+                pass
+        return min(0.1 * (2**attempt), 5.0)
+
+    def _report(self, stats: Dict[str, Any], started: float) -> Dict[str, Any]:
+        """在统计信息中加入耗时、速率和 RU 消耗"""
+        elapsed = time.monotonic() - started
+        request_units = self.request_charges.stats()["total_request_units"]
+        return {
+            **stats,
+            "elapsed_seconds": round(elapsed, 3),
+            "items_per_second": (
+                round(stats["items"] / elapsed, 1) if elapsed > 0 else 0.0
+            ),
+            "request_units": request_units,
+            "request_units_per_item": (
+                round(request_units / stats["items"], 2) if stats["items"] else 0.0
+            ),
+        }
+
+
+async def run_migrations(
+    cosmos_endpoint: str,
+    cosmos_key: str,
+    database_name: str,
+    jobs: List[Tuple[str, Iterable[Tuple[str, Dict[str, Any]]]]],
+    restart: bool = False,
+    batch_size: int = MIGRATION_BATCH_SIZE,
+    concurrency: int = MIGRATION_CONCURRENCY,
+) -> List[Dict[str, Any]]:
+    """
+    使用异步客户端依次迁移多个源文件
+
+    Args:
+        jobs: (源文件路径, (容器名, 文档) 迭代器) 列表
+        restart: 是否忽略检查点
+
+    Returns:
+        每个源文件的统计信息
+    """
+    reports = []
+    async with AsyncCosmosClient(cosmos_endpoint, credential=cosmos_key) as client:
+        database = client.get_database_client(database_name)
+        containers = {name: database.get_container_client(name) for name in CONTAINERS}
+        migrator = BulkMigrator(
+            containers, batch_size=batch_size, concurrency=concurrency
+        )
+        for source_path, items in jobs:
+            if not os.path.exists(source_path):
+                logger.warning(f"文件 {source_path} 不存在，跳过迁移")
+                continue
+            reports.append(
+                await migrator.migrate(items, MigrationCheckpoint(source_path), restart)
+            )
+    return reports
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="初始化 Cosmos DB 并迁移数据")
+    parser.add_argument(
+        "--import", dest="import_path", help="要导入的 JSON 数组或 JSONL 文件"
+    )
+    parser.add_argument(
+        "--container", choices=sorted(CONTAINERS), help="--import 的目标容器"
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="忽略检查点，从头开始迁移"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=MIGRATION_BATCH_SIZE, help="每批条数"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=MIGRATION_CONCURRENCY, help="最大并发请求数"
+    )
+    args = parser.parse_args(argv)
+    if args.import_path and not args.container:
+        parser.error("--import 需要同时指定 --container")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
     # 从环境变量获取连接信息
     cosmos_endpoint = os.getenv("COSMOS_ENDPOINT")
     cosmos_key = os.getenv("COSMOS_KEY")
     database_name = os.getenv("COSMOS_DATABASE", "emotion_agent_db")
-    
+
     if not cosmos_endpoint or not cosmos_key:
         logger.error("环境变量 COSMOS_ENDPOINT 和 COSMOS_KEY 必须设置")
         return
-    
+
     try:
         # 初始化 Cosmos 客户端
         client = CosmosClient(cosmos_endpoint, credential=cosmos_key)
-        
+
         # 创建数据库
         database = create_database_if_not_exists(client, database_name)
-        
+
         # 创建容器
-        containers = {
-            'user_profiles': create_container_if_not_exists(database, 'user_profiles', '/user_id'),
-            'interactions': create_container_if_not_exists(database, 'interactions', '/user_id'),
-            'emotion_history': create_container_if_not_exists(database, 'emotion_history', '/user_id'),
-            'memory_embeddings': create_container_if_not_exists(database, 'memory_embeddings', '/user_id'),
-            'conversations': create_container_if_not_exists(database, 'conversations', '/user_id')
-        }
-        
-        # 内存文件路径
-        memory_dir = os.path.join(parent_dir, 'memory')
-        
-        # 迁移用户配置文件
-        user_profile_path = os.path.join(memory_dir, 'user_profile.json')
-        migrate_json_to_cosmos(
-            containers['user_profiles'], 
-            user_profile_path, 
-            transform_user_profiles
+        for container_name, partition_key in CONTAINERS.items():
+            create_container_if_not_exists(database, container_name, partition_key)
+
+        if args.import_path:
+            jobs = [
+                (args.import_path, iter_export_items(args.import_path, args.container))
+            ]
+        else:
+            # 内存文件路径
+            memory_dir = os.path.join(parent_dir, "memory")
+            user_profile_path = os.path.join(memory_dir, "user_profile.json")
+            memory_path = os.path.join(memory_dir, "memory.json")
+            jobs = [
+                (user_profile_path, iter_user_profile_items(user_profile_path)),
+                (memory_path, iter_memory_items(memory_path)),
+            ]
+
+        asyncio.run(
+            run_migrations(
+                cosmos_endpoint,
+                cosmos_key,
+                database_name,
+                jobs,
+                restart=args.restart,
+                batch_size=args.batch_size,
+                concurrency=args.concurrency,
+            )
         )
-        
-        # 迁移记忆数据
-        memory_path = os.path.join(memory_dir, 'memory.json')
-        memory_data = transform_memory_data(json.load(open(memory_path, 'r', encoding='utf-8')))
-        
-        # 将转换后的记忆数据分类上传到相应的容器
-        for container_name, item in memory_data:
-            migrate_json_to_cosmos(containers[container_name], None, lambda x: [item])
-        
+
         logger.info("Cosmos DB 初始化和数据迁移完成!")
-        
+
+    except MigrationError as e:
+        logger.error(f"数据迁移中止，重新运行将从检查点继续: {str(e)}")
     except Exception as e:
         logger.error(f"初始化 Cosmos DB 时出错: {str(e)}")
 
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,401 @@
+"""
+后端端到端压测工具
+
+模拟多个并发用户按配置的请求比例和思考时间调用 /agent/chat、/agent/analyze、
+/agent/followup，统计每个端点的 p50/p95/p99 延迟、吞吐量和错误率，并将结果
+写入 JSON 文件，便于不同版本之间对比。
+
+使用方法:
+1. 进程内压测（使用本地存储，并自动启动本地模拟 OpenAI 服务）:
+   python -m backend.scripts.load_test --users 50 --duration 60 --mock-llm \\
+       --output results.json
+2. 压测已启动的服务:
+   python -m backend.scripts.load_test --base-url http://127.0.0.1:8000 \\
+       --users 50 --duration 60
+3. 与上一次结果对比:
+   python -m backend.scripts.load_test --users 50 --duration 60 --mock-llm \\
+       --compare results.json
+"""
+
+import os
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from backend.scripts.mock_openai_server import (
+    LatencyDistribution,
+    MockServerConfig,
+    create_app,
+)
+
+# 设置日志
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = ("chat", "analyze", "followup")
+
+_MESSAGES = [
+    "最近工作压力很大，感觉很累",
+    "今天心情还不错，和朋友出去散步了",
+    "晚上总是睡不好，老是醒",
+    "I'm feeling a bit down today",
+    "项目截止日期快到了，有点焦虑",
+]
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """解析请求比例，例如 "chat=6,analyze=3,followup=1" """
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"未知的端点: {name}，可选: {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """线性插值计算百分位数（输入需已排序）"""
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (
+        rank - low
+    )
+
+
+def _build_request(
+    endpoint: str, user_id: str
+) -> Tuple[str, Dict[str, Any], Dict[str, str]]:
+    """构造某个端点的请求路径、请求体和请求头"""
+    emotion = random.choice(["P", "N", "D"])
+    if endpoint == "chat":
+        body = {
+            "message": random.choice(_MESSAGES),
+            "user_id": user_id,
+            "emotion": emotion,
+            "confidence": round(random.uniform(0.5, 0.95), 2),
+        }
+        return "/agent/chat", body, {}
+    if endpoint == "analyze":
+        body = {"conversation_id": "current", "message": random.choice(_MESSAGES)}
+        return "/agent/analyze", body, {"x-user-id": user_id}
+    body = {
+        "user_id": user_id,
+        "emotion": emotion,
+        "confidence": round(random.uniform(0.5, 0.95), 2),
+        "time_of_day": random.choice(["morning", "afternoon", "evening"]),
+        "reason": "load test",
+    }
+    return "/agent/followup", body, {}
+
+
+class LoadTestResults:
+    """收集每个请求的结果并生成报告"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {name: [] for name in ENDPOINTS}
+        self.errors: Dict[str, int] = {name: 0 for name in ENDPOINTS}
+        self.status_codes: Dict[str, Dict[str, int]] = {name: {} for name in ENDPOINTS}
+
+    def record(self, endpoint: str, latency: float, status: Optional[int]) -> None:
+        """记录一次请求（status 为 None 表示连接错误或超时）"""
+        self.latencies[endpoint].append(latency)
+        key = str(status) if status is not None else "exception"
+        codes = self.status_codes[endpoint]
+        codes[key] = codes.get(key, 0) + 1
+        if status is None or status >= 400:
+            self.errors[endpoint] += 1
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        """生成各端点及总体的统计结果"""
+
+        def summarize(
+            latencies: List[float], errors: int, codes: Dict[str, int]
+        ) -> Dict[str, Any]:
+            ordered = sorted(latencies)
+            count = len(ordered)
+            return {
+                "requests": count,
+                "errors": errors,
+                "error_rate": errors / count if count else 0.0,
+                "throughput_rps": count / elapsed if elapsed else 0.0,
+                "latency_ms": {
+                    "p50": percentile(ordered, 50) * 1000,
+                    "p95": percentile(ordered, 95) * 1000,
+                    "p99": percentile(ordered, 99) * 1000,
+                    "mean": (sum(ordered) / count * 1000) if count else 0.0,
+                    "max": (ordered[-1] * 1000) if count else 0.0,
+                },
+                "status_codes": codes,
+            }
+
+        endpoints = {
+            name: summarize(
+                self.latencies[name], self.errors[name], self.status_codes[name]
+            )
+            for name in ENDPOINTS
+            if self.latencies[name]
+        }
+        all_codes: Dict[str, int] = {}
+        for codes in self.status_codes.values():
+            for code, count in codes.items():
+                all_codes[code] = all_codes.get(code, 0) + count
+        total = summarize(
+            [latency for values in self.latencies.values() for latency in values],
+            sum(self.errors.values()),
+            all_codes,
+        )
+        return {"endpoints": endpoints, "total": total}
+
+
+async def _virtual_user(
+    client: httpx.AsyncClient,
+    user_index: int,
+    args,
+    mix: Dict[str, float],
+    think_time: LatencyDistribution,
+    deadline: float,
+    results: LoadTestResults,
+) -> None:
+    """单个虚拟用户：按比例选择端点发送请求，请求之间等待思考时间"""
+    user_id = f"loadtest_user_{user_index}"
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    # 按 ramp-up 时间错开各用户的开始时间
+    if args.ramp_up > 0:
+        await asyncio.sleep(args.ramp_up * user_index / max(1, args.users))
+
+    sent = 0
+    while time.monotonic() < deadline and (
+        not args.requests_per_user or sent < args.requests_per_user
+    ):
+        endpoint = random.choices(names, weights=weights)[0]
+        path, body, headers = _build_request(endpoint, user_id)
+        started = time.monotonic()
+        try:
+            response = await client.post(path, json=body, headers=headers)
+            status = response.status_code
+        except Exception as e:
+            logger.debug(f"请求 {path} 失败: {str(e)}")
+            status = None
+        results.record(endpoint, time.monotonic() - started, status)
+        sent += 1
+        await asyncio.sleep(think_time.sample())
+
+
+async def run_load_test(args) -> Dict[str, Any]:
+    """执行压测并返回结果"""
+    mix = parse_mix(args.mix)
+    think_time = LatencyDistribution.parse(args.think_time)
+    results = LoadTestResults()
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(
+        max_connections=args.users, max_keepalive_connections=args.users
+    )
+
+    if args.base_url:
+        client = httpx.AsyncClient(
+            base_url=args.base_url, timeout=timeout, limits=limits
+        )
+        lifespan = None
+    else:
+        # 进程内压测：直接通过 ASGI 调用应用，并手动运行其 lifespan
+        from backend.main import app
+
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://loadtest",
+            timeout=timeout,
+        )
+        lifespan = app.router.lifespan_context(app)
+
+    if lifespan is not None:
+        await lifespan.__aenter__()
+    try:
+        async with client:
+            logger.info(
+                f"开始压测: {args.users} 个用户, 持续 {args.duration}s, 请求比例 {mix}"
+            )
+            started = time.monotonic()
+            deadline = started + args.duration
+            await asyncio.gather(
+                *(
+                    _virtual_user(client, i, args, mix, think_time, deadline, results)
+                    for i in range(args.users)
+                )
+            )
+            elapsed = time.monotonic() - started
+    finally:
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+
+    report = results.report(elapsed)
+    return {
+        "label": args.label,
+        "timestamp": datetime.now().isoformat(),
+        "target": args.base_url or "in-process",
+        "config": {
+            "users": args.users,
+            "duration_s": args.duration,
+            "requests_per_user": args.requests_per_user,
+            "think_time": args.think_time,
+            "mix": mix,
+            "ramp_up_s": args.ramp_up,
+            "mock_llm": args.mock_llm,
+            "mock_llm_latency": args.mock_llm_latency if args.mock_llm else None,
+        },
+        "elapsed_s": elapsed,
+        **report,
+    }
+
+
+def _find_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_llm(args) -> str:
+    """在后台线程中启动本地模拟 OpenAI 服务，返回其地址"""
+    import uvicorn
+
+    port = _find_free_port()
+    config = MockServerConfig(
+        latency=args.mock_llm_latency,
+        tokens_per_second=args.mock_llm_tokens_per_second,
+        error_rate=args.mock_llm_error_rate,
+    )
+    server = uvicorn.Server(
+        uvicorn.Config(
+            create_app(config), host="127.0.0.1", port=port, log_level="warning"
+        )
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    url = f"http://127.0.0.1:{port}/"
+    logger.info(f"已启动本地模拟 OpenAI 服务: {url}")
+    return url
+
+
+def print_report(
+    result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None
+) -> None:
+    """打印结果表格，提供基线时同时打印 p95 和吞吐量变化"""
+    header = f"{'endpoint':<10}" + "".join(
+        f"{column:>10}"
+        for column in ("requests", "rps", "p50 ms", "p95 ms", "p99 ms", "errors")
+    )
+    if baseline:
+        header += f"{'Δp95':>10}{'Δrps':>10}"
+    print(header)
+    rows = list(result["endpoints"].items()) + [("total", result["total"])]
+    for name, stats in rows:
+        latency = stats["latency_ms"]
+        line = (
+            f"{name:<10}{stats['requests']:>10}{stats['throughput_rps']:>10.1f}"
+            f"{latency['p50']:>10.1f}{latency['p95']:>10.1f}{latency['p99']:>10.1f}"
+            f"{stats['error_rate']:>9.1%} "
+        )
+        if baseline:
+            base = (
+                baseline["total"]
+                if name == "total"
+                else baseline.get("endpoints", {}).get(name)
+            )
+            if base:
+                line += (
+                    f"{latency['p95'] - base['latency_ms']['p95']:>+10.1f}"
+                    f"{stats['throughput_rps'] - base['throughput_rps']:>+10.1f}"
+                )
+        print(line)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Emotion Agent 后端压测工具")
+    parser.add_argument("--base-url", help="压测已启动的服务；不提供时在进程内压测")
+    parser.add_argument("--users", type=int, default=10, help="并发虚拟用户数")
+    parser.add_argument("--duration", type=float, default=30, help="压测时长（秒）")
+    parser.add_argument(
+        "--requests-per-user",
+        type=int,
+        default=0,
+        help="每个用户的请求数上限，0 表示不限",
+    )
+    parser.add_argument(
+        "--think-time",
+        default="uniform:0.5,2",
+        help="请求间隔分布，例如 fixed:1 或 uniform:0.5,2",
+    )
+    parser.add_argument("--mix", default="chat=6,analyze=3,followup=1", help="请求比例")
+    parser.add_argument(
+        "--ramp-up", type=float, default=0, help="所有用户启动完成所需时间（秒）"
+    )
+    parser.add_argument("--timeout", type=float, default=120, help="单个请求超时（秒）")
+    parser.add_argument(
+        "--mock-llm",
+        action="store_true",
+        help="启动本地模拟 OpenAI 服务（仅进程内压测）",
+    )
+    parser.add_argument("--mock-llm-latency", default="lognormal:-1.6,0.5")
+    parser.add_argument("--mock-llm-tokens-per-second", type=float, default=200)
+    parser.add_argument("--mock-llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--label", default="", help="结果标签，例如版本号")
+    parser.add_argument("--output", help="结果 JSON 文件路径")
+    parser.add_argument("--compare", help="用于对比的上一次结果 JSON 文件")
+    parser.add_argument("--seed", type=int, help="随机种子")
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    if not args.base_url:
+        # 进程内压测使用本地存储；需要在导入应用之前设置环境变量
+        os.environ["COSMOS_ENDPOINT"] = ""
+        os.environ["COSMOS_KEY"] = ""
+        if args.mock_llm:
+            os.environ["AZURE_OPENAI_ENDPOINT"] = start_mock_llm(args)
+            os.environ["AZURE_OPENAI_API_KEY"] = "mock-key"
+            os.environ["USE_MOCK_RESPONSES"] = "0"
+    elif args.mock_llm:
+        parser.error(
+            "--mock-llm 只能用于进程内压测；压测外部服务时请单独启动 mock_openai_server"
+        )
+
+    # 减少压测期间的应用日志
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    result = asyncio.run(run_load_test(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        logger.info(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
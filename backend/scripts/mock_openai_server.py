@@ -0,0 +1,344 @@
+"""
+本地模拟 Azure OpenAI 服务，用于离线压测真实的调用路径
+
+实现 chat completions 接口的常用子集（含流式输出），可配置首字延迟分布、
+生成速度和错误注入。与 USE_MOCK_RESPONSES 不同，后端仍会经过真实的
+OpenAI SDK、HTTP 连接、序列化、重试和超时处理。
+
+使用方法:
+1. 启动模拟服务:
+   python -m backend.scripts.mock_openai_server --port 8001 \\
+       --latency lognormal:-1.6,0.5 --tokens-per-second 40 --error-rate 0.02
+2. 在 .env 中将后端指向模拟服务:
+   AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8001/
+   AZURE_OPENAI_API_KEY=mock-key
+   USE_MOCK_RESPONSES=0
+
+所有命令行参数也可以通过 MOCK_OPENAI_* 环境变量设置。
+"""
+
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import logging
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 设置日志
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# 模拟回复使用的句子
+_REPLY_SENTENCES = [
+    "听起来你今天经历了不少事情...",
+    "我能感受到你现在的心情，",
+    "愿意和我多说说吗？",
+    "有时候停下来深呼吸一下，会让身体轻松一些。",
+    "不管发生什么，我都在这里陪着你。",
+    "你已经做得很好了，",
+    "今晚记得早点休息...",
+]
+
+
+class LatencyDistribution:
+    """
+    首字延迟分布（秒）
+
+    支持的格式:
+    - fixed:0.2
+    - uniform:0.1,0.5
+    - normal:0.3,0.05   (均值, 标准差，小于 0 时截断为 0)
+    - lognormal:-1.6,0.5 (底层正态分布的 mu, sigma)
+    """
+
+    def __init__(self, kind: str, params: List[float]):
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"不支持的延迟分布: {kind}")
+        expected = 1 if kind == "fixed" else 2
+        if len(params) != expected:
+            raise ValueError(f"{kind} 分布需要 {expected} 个参数")
+        self.kind = kind
+        self.params = params
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyDistribution":
+        """从 "kind:p1,p2" 格式解析"""
+        kind, _, raw_params = spec.partition(":")
+        params = [float(p) for p in raw_params.split(",") if p.strip()]
+        return cls(kind.strip(), params)
+
+    def sample(self) -> float:
+        """采样一次延迟"""
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return random.uniform(*self.params)
+        if self.kind == "normal":
+            return max(0.0, random.gauss(*self.params))
+        return random.lognormvariate(*self.params)
+
+    def __str__(self) -> str:
+        return f"{self.kind}:{','.join(str(p) for p in self.params)}"
+
+
+class MockServerConfig:
+    """模拟服务的配置"""
+
+    def __init__(
+        self,
+        latency: str = "fixed:0.2",
+        tokens_per_second: float = 50.0,
+        reply_tokens: int = 60,
+        error_rate: float = 0.0,
+        error_codes: str = "429,500,503",
+        hang_rate: float = 0.0,
+        retry_after_ms: int = 500,
+        seed: Optional[int] = None,
+    ):
+        """
+        Args:
+            latency: 首字延迟分布，见 LatencyDistribution
+            tokens_per_second: 生成速度，<= 0 表示不限速
+            reply_tokens: 每次回复的 token 数（不超过请求的 max_tokens）
+            error_rate: 注入错误的概率
+            error_codes: 注入错误时随机选择的状态码
+            hang_rate: 请求挂起（模拟上游超时）的概率
+            retry_after_ms: 429 响应携带的 retry-after-ms
+            seed: 随机种子，便于复现
+        """
+        self.latency = LatencyDistribution.parse(latency)
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.error_codes = [
+            int(code) for code in str(error_codes).split(",") if code.strip()
+        ]
+        self.hang_rate = hang_rate
+        self.retry_after_ms = retry_after_ms
+        if seed is not None:
+            random.seed(seed)
+
+
+def _count_prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    """粗略估算 prompt 的 token 数"""
+    return sum(len(str(m.get("content", ""))) + 4 for m in messages)
+
+
+def _generate_reply_tokens(count: int) -> List[str]:
+    """生成 count 个 token 的模拟回复（每个汉字视为一个 token）"""
+    text = ""
+    while len(text) < count:
+        text += random.choice(_REPLY_SENTENCES)
+    return list(text[:count])
+
+
+def _error_response(status: int, retry_after_ms: int) -> JSONResponse:
+    """构造与 Azure OpenAI 格式一致的错误响应"""
+    messages = {
+        429: (
+            "Requests to the ChatCompletions_Create Operation have exceeded "
+            "call rate limit."
+        ),
+        500: "The server had an error while processing your request.",
+        503: "The service is temporarily unable to process your request.",
+    }
+    headers = {}
+    if status == 429:
+        headers["retry-after-ms"] = str(retry_after_ms)
+        headers["retry-after"] = str(max(1, retry_after_ms // 1000))
+    body = {
+        "error": {
+            "code": str(status),
+            "message": messages.get(status, "Injected error"),
+        }
+    }
+    return JSONResponse(status_code=status, content=body, headers=headers)
+
+
+def create_app(config: Optional[MockServerConfig] = None) -> FastAPI:
+    """
+    创建模拟服务应用
+
+    Args:
+        config: 服务配置，默认使用环境变量中的配置
+
+    Returns:
+        FastAPI 应用
+    """
+    config = config or MockServerConfig(**_config_from_env())
+    app = FastAPI(title="Mock Azure OpenAI")
+    app.state.config = config
+    app.state.stats = {"requests": 0, "streams": 0, "injected_errors": 0, "hangs": 0}
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        body = await request.json()
+        stats = app.state.stats
+        stats["requests"] += 1
+
+        # 错误注入
+        roll = random.random()
+        if roll < config.hang_rate:
+            stats["hangs"] += 1
+            await asyncio.sleep(3600)
+        elif roll < config.hang_rate + config.error_rate and config.error_codes:
+            stats["injected_errors"] += 1
+            return _error_response(
+                random.choice(config.error_codes), config.retry_after_ms
+            )
+
+        messages = body.get("messages", [])
+        max_tokens = body.get("max_tokens") or config.reply_tokens
+        tokens = _generate_reply_tokens(min(config.reply_tokens, max_tokens))
+        prompt_tokens = _count_prompt_tokens(messages)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        token_delay = (
+            1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        )
+
+        await asyncio.sleep(config.latency.sample())
+
+        if body.get("stream"):
+            stats["streams"] += 1
+            return StreamingResponse(
+                _stream_chunks(completion_id, created, deployment, tokens, token_delay),
+                media_type="text/event-stream",
+            )
+
+        await asyncio.sleep(token_delay * len(tokens))
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": deployment,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(tokens),
+                "total_tokens": prompt_tokens + len(tokens),
+            },
+        }
+
+    @app.get("/stats")
+    async def get_stats():
+        return {**app.state.stats, "latency": str(config.latency)}
+
+    return app
+
+
+async def _stream_chunks(
+    completion_id: str,
+    created: int,
+    deployment: str,
+    tokens: List[str],
+    token_delay: float,
+):
+    """按 Azure OpenAI 的 SSE 格式逐个输出 token"""
+
+    def chunk(choices: List[Dict[str, Any]]) -> str:
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": deployment,
+            "choices": choices,
+        }
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    # Azure 会先返回一个不含 choices 的内容过滤结果块
+    yield chunk([])
+    yield chunk(
+        [
+            {
+                "index": 0,
+                "delta": {"role": "assistant", "content": ""},
+                "finish_reason": None,
+            }
+        ]
+    )
+    for token in tokens:
+        if token_delay:
+            await asyncio.sleep(token_delay)
+        yield chunk([{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+    yield chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+    yield "data: [DONE]\n\n"
+
+
+def _config_from_env() -> Dict[str, Any]:
+    """从 MOCK_OPENAI_* 环境变量读取配置"""
+    seed = os.getenv("MOCK_OPENAI_SEED")
+    return {
+        "latency": os.getenv("MOCK_OPENAI_LATENCY", "fixed:0.2"),
+        "tokens_per_second": float(os.getenv("MOCK_OPENAI_TOKENS_PER_SECOND", "50")),
+        "reply_tokens": int(os.getenv("MOCK_OPENAI_REPLY_TOKENS", "60")),
+        "error_rate": float(os.getenv("MOCK_OPENAI_ERROR_RATE", "0")),
+        "error_codes": os.getenv("MOCK_OPENAI_ERROR_CODES", "429,500,503"),
+        "hang_rate": float(os.getenv("MOCK_OPENAI_HANG_RATE", "0")),
+        "retry_after_ms": int(os.getenv("MOCK_OPENAI_RETRY_AFTER_MS", "500")),
+        "seed": int(seed) if seed else None,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    defaults = _config_from_env()
+    parser = argparse.ArgumentParser(description="本地模拟 Azure OpenAI 服务")
+    parser.add_argument("--host", default=os.getenv("MOCK_OPENAI_HOST", "127.0.0.1"))
+    parser.add_argument(
+        "--port", type=int, default=int(os.getenv("MOCK_OPENAI_PORT", "8001"))
+    )
+    parser.add_argument(
+        "--latency",
+        default=defaults["latency"],
+        help="首字延迟分布，例如 fixed:0.2 或 lognormal:-1.6,0.5",
+    )
+    parser.add_argument(
+        "--tokens-per-second", type=float, default=defaults["tokens_per_second"]
+    )
+    parser.add_argument("--reply-tokens", type=int, default=defaults["reply_tokens"])
+    parser.add_argument("--error-rate", type=float, default=defaults["error_rate"])
+    parser.add_argument("--error-codes", default=defaults["error_codes"])
+    parser.add_argument("--hang-rate", type=float, default=defaults["hang_rate"])
+    parser.add_argument(
+        "--retry-after-ms", type=int, default=defaults["retry_after_ms"]
+    )
+    parser.add_argument("--seed", type=int, default=defaults["seed"])
+    args = parser.parse_args(argv)
+
+    config = MockServerConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        reply_tokens=args.reply_tokens,
+        error_rate=args.error_rate,
+        error_codes=args.error_codes,
+        hang_rate=args.hang_rate,
+        retry_after_ms=args.retry_after_ms,
+        seed=args.seed,
+    )
+    logger.info(
+        f"模拟 Azure OpenAI 服务: http://{args.host}:{args.port}/ "
+        f"(延迟 {config.latency}, {config.tokens_per_second} token/s,"
+        f"错误率 {config.error_rate})"
+    )
+
+    import uvicorn
+
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
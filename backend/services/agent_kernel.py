@@ -1,14 +1,22 @@
 import os
 import json
-from openai import AzureOpenAI
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, AsyncIterator, Awaitable, Callable
 import asyncio
+import uuid
 import random
+from datetime import datetime
 from dotenv import load_dotenv
 import logging
 
 # 导入CosmosMemoryStore
 from backend.memory.cosmos_memory_store import CosmosMemoryStore
+from backend.memory.context_cache import context_cache, MEMORY_BLOCK, EMOTION_BLOCK, SUMMARY_BLOCK
+from backend.memory.write_behind import WriteBehindQueue
+from backend.services.context_packer import (
+    ContextPacker, ContextSection, ConversationBuffer,
+    PRIORITY_MEMORY, PRIORITY_SUMMARY, PRIORITY_EMOTION
+)
+from backend.services.llm_gateway import llm_gateway, CircuitOpenError
 
 # 设置日志
 logging.basicConfig(level=logging.INFO, 
@@ -18,22 +26,26 @@ logger = logging.getLogger(__name__)
 # 加载环境变量
 load_dotenv()
 
-# 从环境变量获取Azure OpenAI配置
-endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-api_key = os.getenv("AZURE_OPENAI_API_KEY")
-deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o-mini")
-api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2025-01-01-preview")
-
 # 是否使用模拟响应
 USE_MOCK_RESPONSES = os.getenv("USE_MOCK_RESPONSES", "0") == "1"
 
+# 构建prompt时每个上下文来源（记忆、情绪历史、对话摘要）的超时时间（秒）
+CONTEXT_FETCH_TIMEOUT = float(os.getenv("CONTEXT_FETCH_TIMEOUT", "1.5"))
+
+# 模拟模式下流式回复每个片段的字符数
+MOCK_STREAM_CHUNK_SIZE = 4
+
+# 上下文来源获取失败的标记（失败结果不写入缓存）
+_FETCH_FAILED = object()
+
 class AgentKernel:
-    def __init__(self, mode="default"):
+    def __init__(self, mode="default", memory_store: Optional[CosmosMemoryStore] = None):
         """
         初始化 AgentKernel
         
         Args:
             mode: 运行模式 (default 或 mock)
+            memory_store: 共享的记忆存储实例，未提供时自行创建
         """
         # 如果环境变量设置为使用模拟响应，则强制使用mock模式
         if USE_MOCK_RESPONSES:
@@ -43,8 +55,12 @@ class AgentKernel:
             self.mode = mode
             logger.info(f"mode: {mode}")
         
-        # 初始化 CosmosMemoryStore
-        self.memory_store = CosmosMemoryStore()
+        # 记忆存储（应用中由 lifespan 创建并注入共享实例）
+        self._owns_memory_store = memory_store is None
+        self.memory_store = memory_store if memory_store is not None else CosmosMemoryStore()
+        
+        # 对话交互在后台批量写入记忆系统
+        self.interaction_writer = WriteBehindQueue(self._persist_interactions, name="interactions")
         
         # 情绪状态映射
         self.statuses = ["P", "N", "D"]  # Positive, Neutral, Depressed
@@ -56,32 +72,16 @@ class AgentKernel:
             "stress": "D"      # 压力 -> 消极
         }
         
-        # 初始化 OpenAI 客户端
-        try:
-           
-            logger.info(f"Endpoint: {endpoint}")
-            logger.info(f"API Key 是否存在: {bool(api_key)}")
-            logger.info(f"Deployment: {deployment}")
-            logger.info(f"API Version: {api_version}")
-                
-
-            if self.mode != "mock":
-                logger.info(f"尝试初始化 OpenAI 客户端...")
-                self.client = AzureOpenAI(
-                    api_version=api_version,
-                    azure_endpoint=endpoint,
-                    api_key=api_key,
-                )
-                logger.info(f"成功初始化 OpenAI 客户端，使用API版本: {api_version}")
-            else:
-                self.client = None
-                logger.info("模拟模式下不初始化真实OpenAI客户端")
-        except Exception as e:
-            logger.error(f"初始化 OpenAI 客户端时出错: {str(e)}")
-            self.client = None
+        # 共享的 LLM 网关（连接复用、并发限制、重试和熔断）
+        self.llm = llm_gateway
+        if self.mode != "mock" and not self.llm.available:
+            logger.warning("未配置 Azure OpenAI 端点或密钥，将使用模拟回复")
+        
+        # 存储用户对话历史的字典（user_id -> ConversationBuffer）
+        self.conversation_history: Dict[str, ConversationBuffer] = {}
         
-        # 存储用户对话历史的字典
-        self.conversation_history = {}
+        # 按 token 预算组装 prompt
+        self.context_packer = ContextPacker()
     
     def convert_emotion_to_status(self, emotion_data: Dict[str, Any]) -> Tuple[str, float]:
         """
@@ -168,7 +168,7 @@ class AgentKernel:
                     "confidence": 0.5
                 }
     
-    def get_user_context_from_memory(self, user_id: str, query: str = "") -> List[Dict[str, Any]]:
+    async def get_user_context_from_memory(self, user_id: str, query: str = "") -> List[Dict[str, Any]]:
         """
         从记忆系统中获取用户上下文
         
@@ -180,11 +180,11 @@ class AgentKernel:
             相关记忆列表
         """
         # 获取记忆数据
-        memories = self.retrieve_memory(user_id, query)
+        memories = await self.retrieve_memory(user_id, query)
         return memories["memories"]
     
     # 使用 CosmosMemoryStore 检索记忆
-    def retrieve_memory(self, user_id: str, query: str = "", top_k: int = 3) -> Dict[str, List[Dict[str, Any]]]:
+    async def retrieve_memory(self, user_id: str, query: str = "", top_k: int = 3) -> Dict[str, List[Dict[str, Any]]]:
         """
         从记忆系统检索相关记忆
         
@@ -197,12 +197,7 @@ class AgentKernel:
             包含相关记忆的字典
         """
         try:
-            # 如果是模拟模式或者检索失败，返回模拟数据
-            if self.mode == "mock":
-                return asyncio.run(self.memory_store.retrieve_relevant_memories(user_id, query, top_k))
-            else:
-                # 使用 Cosmos DB 检索记忆
-                return asyncio.run(self.memory_store.retrieve_relevant_memories(user_id, query, top_k))
+            return await self.memory_store.retrieve_relevant_memories(user_id, query, top_k)
         except Exception as e:
             logger.error(f"检索记忆时出错: {str(e)}")
             # 返回模拟数据
@@ -229,44 +224,124 @@ class AgentKernel:
                 ]
             }
     
-    def build_prompt_with_memories_and_history(self, user_id: str, query: str = "", 
-                                              emotion: Optional[str] = None, 
-                                              confidence: Optional[float] = None,
-                                              time_of_day: Optional[str] = None,
-                                              reason: Optional[str] = None) -> List[Dict[str, str]]:
+    async def _fetch_context_source(self, name: str, coro, default: Any) -> Any:
         """
-        构建包含记忆上下文和对话历史的prompt
+        在超时限制内获取单个上下文来源，失败时返回默认值
+        
+        Args:
+            name: 来源名称（用于日志）
+            coro: 获取数据的协程
+            default: 超时或出错时使用的默认值
+            
+        Returns:
+            获取到的数据或默认值
         """
         try:
-            # 获取相关记忆
-            memories = self.get_user_context_from_memory(user_id, query)
-            
-            # 构建记忆上下文
-            memory_context = ""
-            if memories:
-                memory_context = "这是我们之前的一些回忆：\n"
-                for memory in memories:
-                    memory_context += f"- {memory['summary']}\n"
-            
-            # 获取最近的情绪历史
-            emotion_history = asyncio.run(self.memory_store.get_recent_emotions(user_id, limit=3))
-            emotion_context = ""
-            if emotion_history:
-                emotion_context = "\n我记得你最近的状态：\n"
-                for e in emotion_history:
-                    emotion_context += f"- {e['timestamp']}: 那时的你{e['emotion']}\n"
+            return await asyncio.wait_for(coro, timeout=CONTEXT_FETCH_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"获取{name}超时（{CONTEXT_FETCH_TIMEOUT}s），本次跳过该部分上下文")
+        except Exception as e:
+            logger.error(f"获取{name}时出错: {str(e)}")
+        return default
+    
+    async def _get_context_block(self, user_id: str, block: str, name: str,
+                                 fetch: Callable[[], Awaitable[Any]],
+                                 render: Callable[[Any], ContextSection],
+                                 variant: str = "") -> Optional[ContextSection]:
+        """
+        获取渲染后的上下文块，未命中缓存时从记忆系统获取并渲染
+        
+        Args:
+            user_id: 用户ID
+            block: 块名称
+            name: 来源名称（用于日志）
+            fetch: 返回获取数据协程的函数
+            render: 将数据渲染为文本的函数
+            variant: 同一块的不同变体（例如记忆块对应的查询文本）
             
-            # 获取对话摘要
-            conversation_summaries = asyncio.run(self.memory_store.get_conversation_summaries(user_id, limit=2))
-            summary_context = ""
-            if conversation_summaries:
-                summary_context = "\n我们上次聊到：\n"
-                for summary in conversation_summaries:
-                    if summary.get('summary'):
-                        summary_context += f"{summary['summary']}\n"
+        Returns:
+            渲染后的上下文块，获取失败时返回 None
+        """
+        cached = context_cache.get(user_id, block, variant)
+        if cached is not None:
+            return cached
+        
+        # 读取期间发生写入时，读到的可能是写入前的数据，不回填缓存
+        generation = context_cache.generation(user_id, block)
+        result = await self._fetch_context_source(name, fetch(), _FETCH_FAILED)
+        if result is _FETCH_FAILED:
+            return None
+        
+        rendered = render(result)
+        context_cache.set(user_id, block, rendered, variant, generation=generation)
+        return rendered
+    
+    @staticmethod
+    def _render_memory_block(memories: List[Dict[str, Any]]) -> ContextSection:
+        """渲染记忆上下文（按相关度排列）"""
+        return ContextSection(
+            MEMORY_BLOCK,
+            "这是我们之前的一些回忆：",
+            [f"- {memory['summary']}" for memory in memories or []],
+            PRIORITY_MEMORY
+        )
+    
+    @staticmethod
+    def _render_emotion_block(emotion_history: List[Dict[str, Any]]) -> ContextSection:
+        """渲染情绪历史上下文（从新到旧）"""
+        return ContextSection(
+            EMOTION_BLOCK,
+            "我记得你最近的状态：",
+            [f"- {e['timestamp']}: 那时的你{e['emotion']}" for e in emotion_history or []],
+            PRIORITY_EMOTION
+        )
+    
+    @staticmethod
+    def _render_summary_block(conversation_summaries: List[Dict[str, Any]]) -> ContextSection:
+        """渲染对话摘要上下文（从新到旧）"""
+        return ContextSection(
+            SUMMARY_BLOCK,
+            "我们上次聊到：",
+            [summary["summary"] for summary in conversation_summaries or [] if summary.get("summary")],
+            PRIORITY_SUMMARY
+        )
+    
+    async def build_prompt_with_memories_and_history(self, user_id: str, query: str = "", 
+                                                    emotion: Optional[str] = None, 
+                                                    confidence: Optional[float] = None,
+                                                    time_of_day: Optional[str] = None,
+                                                    reason: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        构建包含记忆上下文和对话历史的prompt
+        
+        记忆、情绪历史和对话摘要三个来源并发获取，每个来源单独超时；
+        某个来源超时或失败时只省略对应部分，其余上下文照常使用。
+        渲染结果按用户缓存，记忆系统写入时失效。
+        上下文块和对话历史按 token 预算放入，超出预算时按优先级和时间先后舍弃。
+        """
+        try:
+            # 并发获取记忆、情绪历史和对话摘要三个上下文块（优先使用缓存）
+            sections = await asyncio.gather(
+                self._get_context_block(
+                    user_id, MEMORY_BLOCK, "相关记忆",
+                    lambda: self.get_user_context_from_memory(user_id, query),
+                    self._render_memory_block,
+                    variant=query
+                ),
+                self._get_context_block(
+                    user_id, EMOTION_BLOCK, "情绪历史",
+                    lambda: self.memory_store.get_recent_emotions(user_id, limit=3),
+                    self._render_emotion_block
+                ),
+                self._get_context_block(
+                    user_id, SUMMARY_BLOCK, "对话摘要",
+                    lambda: self.memory_store.get_conversation_summaries(user_id, limit=2),
+                    self._render_summary_block
+                ),
+            )
             
-            # 构建系统提示词
-            system_prompt = (
+            # 系统提示词的固定指令
+            instructions = (
                 "你是一个温暖、善解人意的AI伙伴。你的目标是通过分析用户的健康数据，真诚地关心他们的状态。\n"
                 "在分析数据时，请记住：\n"
                 "1. 不要生硬地列举数据，要用温柔的语气表达关心\n"
@@ -274,24 +349,26 @@ class AgentKernel:
                 "3. 如果发现异常数据，要委婉地表达担忧\n"
                 "4. 鼓励用户分享他们的感受，而不是简单地给出建议\n"
                 "5. 记得称呼用户为'你'，保持亲近感\n"
-                f"{memory_context}\n"
-                f"{emotion_context}\n"
-                f"{summary_context}\n"
             )
             
             # 添加当前情绪状态
+            closing = ""
             if emotion:
                 if emotion == "D":
-                    system_prompt += "\n我注意到数据显示你最近的状态不太好...请多关心用户的感受，给予温暖的支持。"
+                    closing = "\n我注意到数据显示你最近的状态不太好...请多关心用户的感受，给予温暖的支持。"
                 elif emotion == "P":
-                    system_prompt += "\n数据告诉我你最近的状态很棒！和用户一起分享这份愉快。"
+                    closing = "\n数据告诉我你最近的状态很棒！和用户一起分享这份愉快。"
                 else:
-                    system_prompt += "\n让我们一起关注你的健康状态，倾听你想说的话。"
+                    closing = "\n让我们一起关注你的健康状态，倾听你想说的话。"
             
-            return [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": query}
-            ]
+            # 按 token 预算放入上下文块和对话历史
+            return self.context_packer.pack(
+                instructions=instructions,
+                sections=[section for section in sections if section is not None],
+                history=self.conversation_history.get(user_id),
+                query=query,
+                closing=closing
+            )
             
         except Exception as e:
             print(f"构建prompt时出错: {str(e)}")
@@ -316,11 +393,10 @@ class AgentKernel:
             助手的回复
         """
         # 确保用户在历史记录中有条目
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = []
+        self._get_history_buffer(user_id)
         
         # 构建包含记忆和历史的消息
-        messages = self.build_prompt_with_memories_and_history(
+        messages = await self.build_prompt_with_memories_and_history(
             user_id=user_id, 
             query=query,
             emotion=emotion,
@@ -331,52 +407,143 @@ class AgentKernel:
         logger.info(f"向模型发送的消息: {json.dumps(messages, ensure_ascii=False, indent=2)}")
         
         # 模拟模式返回模拟回复
-        if self.mode == "mock" or self.client is None:
+        if self.mode == "mock" or not self.llm.available:
             logger.info("使用模拟模式生成回复")
             full_response = self._generate_mock_response(query, emotion)
         else:
             try:
                 # 使用非流式响应
-                response = await asyncio.to_thread(
-                    self.client.chat.completions.create,
-                    messages=messages,
+                full_response = await self.llm.complete(
+                    messages,
                     max_tokens=4096,
                     temperature=0.7,
-                    top_p=1.0,
-                    model=deployment
+                    top_p=1.0
                 )
-                
-                # 获取响应内容
-                full_response = response.choices[0].message.content
+            except CircuitOpenError:
+                logger.warning("LLM 上游熔断中，使用模拟回复")
+                full_response = self._generate_mock_response(query, emotion)
             except Exception as e:
                 logger.error(f"调用OpenAI API时出错: {str(e)}")
                 # 出错时使用模拟响应作为备份
-                full_response = f"抱歉，我遇到了技术问题。错误信息: {str(e)}"
+                full_response = self._generate_mock_response(query, emotion)
         
-        # 更新对话历史
-        if query:  # 只有在有用户输入的情况下才更新对话历史
-            self.conversation_history[user_id].append({"role": "user", "content": query})
-            self.conversation_history[user_id].append({"role": "assistant", "content": full_response})
-            
-            # 如果对话历史太长，可以进行截断以避免超出模型的上下文限制
-            # 保留最近的10轮对话（20条消息）
-            if len(self.conversation_history[user_id]) > 20:
-                self.conversation_history[user_id] = self.conversation_history[user_id][-20:]
-                
-            # 将对话存储到记忆系统
-            try:
-                asyncio.create_task(self.memory_store.add_interaction(
-                    user_id=user_id,
-                    text=query,
-                    emotion=emotion or "neutral",
-                    suggestion=full_response,
-                    confidence=confidence or 0.8
-                ))
-            except Exception as e:
-                logger.error(f"存储对话到记忆系统时出错: {str(e)}")
+        # 更新对话历史并存储到记忆系统
+        await self._record_chat_turn(user_id, query, full_response, emotion, confidence)
         
         return full_response
     
+    async def chat_stream(self, query: str, user_id: str = "default_user",
+                          emotion: Optional[str] = None,
+                          confidence: Optional[float] = None) -> AsyncIterator[str]:
+        """
+        以流式方式处理用户查询，模型每生成一段文本就立即产出
+        
+        流结束（包括客户端提前断开）后，已生成的完整回复会写入对话历史和记忆系统。
+        
+        Args:
+            query: 用户查询
+            user_id: 用户ID
+            emotion: 用户情绪状态
+            confidence: 情绪置信度
+            
+        Yields:
+            助手回复的增量文本片段
+        """
+        # 确保用户在历史记录中有条目
+        self._get_history_buffer(user_id)
+        
+        # 构建包含记忆和历史的消息
+        messages = await self.build_prompt_with_memories_and_history(
+            user_id=user_id,
+            query=query,
+            emotion=emotion,
+            confidence=confidence
+        )
+        
+        # 记录发送的消息
+        logger.info(f"向模型发送的消息(流式): {json.dumps(messages, ensure_ascii=False, indent=2)}")
+        
+        chunks: List[str] = []
+        try:
+            if self.mode == "mock" or not self.llm.available:
+                logger.info("使用模拟模式生成流式回复")
+                mock_response = self._generate_mock_response(query, emotion)
+                for i in range(0, len(mock_response), MOCK_STREAM_CHUNK_SIZE):
+                    delta = mock_response[i:i + MOCK_STREAM_CHUNK_SIZE]
+                    chunks.append(delta)
+                    yield delta
+                    await asyncio.sleep(0)
+            else:
+                try:
+                    async for delta in self.llm.stream(
+                        messages,
+                        max_tokens=4096,
+                        temperature=0.7,
+                        top_p=1.0
+                    ):
+                        chunks.append(delta)
+                        yield delta
+                except Exception as e:
+                    if isinstance(e, CircuitOpenError):
+                        logger.warning("LLM 上游熔断中，使用模拟回复")
+                    else:
+                        logger.error(f"调用OpenAI流式API时出错: {str(e)}")
+                    # 尚未输出任何内容时，使用模拟回复作为备份
+                    if not chunks:
+                        fallback = self._generate_mock_response(query, emotion)
+                        chunks.append(fallback)
+                        yield fallback
+        finally:
+            full_response = "".join(chunks)
+            if full_response:
+                await self._record_chat_turn(user_id, query, full_response, emotion, confidence)
+    
+    async def _record_chat_turn(self, user_id: str, query: str, full_response: str,
+                          emotion: Optional[str] = None,
+                          confidence: Optional[float] = None) -> None:
+        """
+        将一轮对话写入对话历史，并放入后台队列存储到记忆系统
+        
+        Args:
+            user_id: 用户ID
+            query: 用户查询
+            full_response: 助手的完整回复
+            emotion: 用户情绪状态
+            confidence: 情绪置信度
+        """
+        if not query:  # 只有在有用户输入的情况下才更新对话历史
+            return
+        
+        # 追加时增量计算 token 数，超出历史 token 上限时丢弃最早的对话
+        history = self._get_history_buffer(user_id)
+        history.append({"role": "user", "content": query})
+        history.append({"role": "assistant", "content": full_response})
+            
+        # 放入后台写入队列，队列满时在这里等待（背压）
+        try:
+            await self.interaction_writer.submit({
+                # 入队时分配ID，队列重试或启动时重放都写入同一文档
+                "id": f"int_{uuid.uuid4().hex}",
+                "user_id": user_id,
+                "text": query,
+                "emotion": emotion or "neutral",
+                "suggestion": full_response,
+                "confidence": confidence or 0.8,
+                "timestamp": datetime.now().isoformat()
+            })
+        except Exception as e:
+            logger.error(f"存储对话到记忆系统时出错: {str(e)}")
+    
+    async def _persist_interactions(self, records: List[Dict[str, Any]]) -> None:
+        """后台写入队列的批量写入函数：写入失败时抛出异常，由队列重试，最终失败的记录保存到本地"""
+        await self.memory_store.add_interactions(records, raise_on_error=True)
+    
+    async def close(self) -> None:
+        """写完后台队列中剩余的交互记录，并关闭自行创建的记忆存储"""
+        await self.interaction_writer.close()
+        if self._owns_memory_store:
+            await self.memory_store.close()
+    
     async def followup(self, user_id: str = "default_user", 
                      emotion: Optional[str] = None, 
                      confidence: Optional[float] = None,
@@ -396,11 +563,10 @@ class AgentKernel:
             助手的主动回复
         """
         # 确保用户在历史记录中有条目
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = []
+        self._get_history_buffer(user_id)
         
         # 构建包含记忆和历史的消息，没有用户查询
-        messages = self.build_prompt_with_memories_and_history(
+        messages = await self.build_prompt_with_memories_and_history(
             user_id=user_id,
             emotion=emotion,
             confidence=confidence,
@@ -419,34 +585,28 @@ class AgentKernel:
         logger.info(f"向模型发送的消息: {json.dumps(messages, ensure_ascii=False, indent=2)}")
         
         # 模拟模式返回模拟回复
-        if self.mode == "mock" or self.client is None:
+        if self.mode == "mock" or not self.llm.available:
             logger.info("使用模拟模式生成主动对话")
             full_response = self._generate_mock_followup(emotion, time_of_day)
         else:
             try:
                 # 使用非流式响应
-                response = await asyncio.to_thread(
-                    self.client.chat.completions.create,
-                    messages=messages,
+                full_response = await self.llm.complete(
+                    messages,
                     max_tokens=4096,
                     temperature=0.7,
-                    top_p=1.0,
-                    model=deployment
+                    top_p=1.0
                 )
-                
-                # 获取响应内容
-                full_response = response.choices[0].message.content
+            except CircuitOpenError:
+                logger.warning("LLM 上游熔断中，使用模拟主动对话")
+                full_response = self._generate_mock_followup(emotion, time_of_day)
             except Exception as e:
                 logger.error(f"调用OpenAI API时出错: {str(e)}")
                 # 出错时使用模拟响应作为备份
-                full_response = f"嗨，我注意到你已经有一段时间没有互动了。你现在还好吗？"
+                full_response = self._generate_mock_followup(emotion, time_of_day)
         
         # 更新对话历史
-        self.conversation_history[user_id].append({"role": "assistant", "content": full_response})
-        
-        # 如果对话历史太长，可以进行截断以避免超出模型的上下文限制
-        if len(self.conversation_history[user_id]) > 20:
-            self.conversation_history[user_id] = self.conversation_history[user_id][-20:]
+        self._get_history_buffer(user_id).append({"role": "assistant", "content": full_response})
         
         return full_response
     
@@ -457,7 +617,7 @@ class AgentKernel:
         Args:
             user_id: 用户ID
         """
-        self.conversation_history[user_id] = []
+        self.conversation_history[user_id] = ConversationBuffer()
         print(f"已为用户 {user_id} 开始新对话")
 
     def get_conversation_history(self, user_id: str) -> List[Dict[str, str]]:
@@ -471,8 +631,14 @@ class AgentKernel:
             用户的对话历史
         """
         if user_id in self.conversation_history:
-            return self.conversation_history[user_id]
+            return self.conversation_history[user_id].messages
         return []
+    
+    def _get_history_buffer(self, user_id: str) -> ConversationBuffer:
+        """获取用户的对话历史缓冲区，不存在时创建"""
+        if user_id not in self.conversation_history:
+            self.conversation_history[user_id] = ConversationBuffer()
+        return self.conversation_history[user_id]
 
     def _generate_mock_response(self, query: str, emotion: Optional[str] = None) -> str:
         """生成模拟回复"""
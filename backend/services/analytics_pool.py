@@ -0,0 +1,294 @@
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 分析进程数，0 表示不使用进程池（在线程中执行）
+ANALYTICS_POOL_WORKERS = int(os.getenv("ANALYTICS_POOL_WORKERS", "2"))
+# 单个任务的超时时间（秒），超时后进程池被替换，旧进程在其他任务完成后终止
+ANALYTICS_TASK_TIMEOUT = float(os.getenv("ANALYTICS_TASK_TIMEOUT", "10"))
+# 不小于该字节数的 NumPy 输入通过共享内存传给 worker，更小的直接序列化（开销更低）
+ANALYTICS_SHM_MIN_BYTES = int(os.getenv("ANALYTICS_SHM_MIN_BYTES", "32768"))
+
+
+class AnalyticsTimeoutError(Exception):
+    """分析任务超时"""
+
+
+class _SharedArray:
+    """共享内存中 NumPy 数组的句柄（只包含名称、形状和类型，序列化开销固定）"""
+
+    def __init__(self, name: str, shape: Tuple[int, ...], dtype: str):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+
+def _attach(handle: _SharedArray, attached: List[SharedMemory]) -> np.ndarray:
+    # spawn 启动的 worker 与主进程共用同一个 resource_tracker，
+    # attach 时的重复注册不会造成泄漏告警
+    shm = SharedMemory(name=handle.name)
+    attached.append(shm)
+    array = np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=shm.buf)
+    array.flags.writeable = False
+    return array
+
+
+def _invoke(fn: Callable[..., Any], args: Sequence[Any]) -> Any:
+    """在 worker 中执行任务：共享内存中的输入直接映射为只读数组，worker 中不再复制"""
+    attached: List[SharedMemory] = []
+    resolved: List[Any] = []
+    try:
+        resolved = [
+            _attach(arg, attached) if isinstance(arg, _SharedArray) else arg
+            for arg in args
+        ]
+        return fn(*resolved)
+    finally:
+        # 先释放数组视图，共享内存才能关闭
+        del resolved
+        for shm in attached:
+            try:
+                shm.close()
+            except BufferError:
+                # 返回值仍引用输入数组时，映射在其被回收后释放
+                pass
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class AnalyticsPool:
+    """
+    CPU 密集型健康分析的进程池
+
+    - worker 通过 initializer 预加载参考数据和模型，启动时预热，请求不承担冷启动开销
+    - 较大的 NumPy 输入由主进程复制一次到共享内存，
+      worker 直接映射读取，不经过 pickle 和管道
+    - 每个任务有超时；超时只让该任务失败，
+      新任务交给新的进程池，旧进程池中的其他任务继续执行，
+      全部完成（或超过各自的超时）后再终止旧进程；
+      worker 崩溃时立即重建。调用方收到异常后可以降级
+    - 计算不在事件循环中执行，聊天请求的延迟不受分析任务影响
+    """
+
+    def __init__(
+        self,
+        initializer: Optional[Callable[[], None]] = None,
+        name: str = "analytics",
+        workers: int = ANALYTICS_POOL_WORKERS,
+        timeout: float = ANALYTICS_TASK_TIMEOUT,
+        shm_min_bytes: int = ANALYTICS_SHM_MIN_BYTES,
+    ):
+        """
+        Args:
+            initializer: worker 启动时执行的预加载函数（必须可以被子进程导入）
+            name: 名称，用于日志
+            workers: 进程数，0 表示在线程中执行
+            timeout: 默认任务超时（秒）
+            shm_min_bytes: 使用共享内存的最小数组字节数
+        """
+        self.initializer = initializer
+        self.name = name
+        self.workers = max(0, workers)
+        self.timeout = timeout
+        self.shm_min_bytes = shm_min_bytes
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._warmup: Optional[asyncio.Task] = None
+        # 进程池 -> 其中未完成的任务及各自的截止时间（事件循环时间）
+        self._deadlines: Dict[ProcessPoolExecutor, Dict[Future, float]] = {}
+        # 等待旧进程池中其他任务完成后终止旧进程的后台任务
+        self._retiring: Set[asyncio.Task] = set()
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self.in_flight = 0
+        self.shared_bytes = 0
+
+    async def start(self) -> None:
+        """创建进程池并预热全部 worker（执行 initializer）"""
+        if self.workers == 0:
+            return
+        executor = self._ensure_executor()
+        try:
+            # 每个 ping 都要等 worker 执行完 initializer，
+            # 全部返回即预热完成（不计入任务统计）
+            pings = [
+                asyncio.wrap_future(executor.submit(_ping)) for _ in range(self.workers)
+            ]
+            await asyncio.wait_for(asyncio.gather(*pings), self.timeout)
+            logger.info(f"{self.name} 进程池已启动 {self.workers} 个 worker")
+        except Exception as e:
+            logger.error(f"{self.name} 进程池预热失败: {str(e)}")
+
+    async def run(
+        self, fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None
+    ) -> Any:
+        """
+        在 worker 中执行 fn(*args)
+
+        Args:
+            fn: 模块级函数（必须可以被子进程导入），返回值不能引用输入数组
+            args: 参数，NumPy 数组按大小决定是否经共享内存传递
+            timeout: 超时（秒），默认使用 self.timeout
+
+        Returns:
+            fn 的返回值
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if self.workers == 0:
+            return await asyncio.wait_for(asyncio.to_thread(fn, *args), timeout)
+
+        shared: List[SharedMemory] = []
+        self.submitted += 1
+        self.in_flight += 1
+        try:
+            call_args = [self._share(arg, shared) for arg in args]
+            executor = self._ensure_executor()
+            task = executor.submit(_invoke, fn, call_args)
+            deadlines = self._deadlines.setdefault(executor, {})
+            deadlines[task] = asyncio.get_running_loop().time() + timeout
+            try:
+                result = await asyncio.wait_for(asyncio.wrap_future(task), timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                self._recycle(executor, f"任务超时（{timeout}s）", stuck=task)
+                raise AnalyticsTimeoutError(
+                    f"{self.name} 任务 {getattr(fn, '__name__', fn)} 超过 {timeout}s"
+                )
+            except BrokenProcessPool:
+                self.failed += 1
+                self._recycle(executor, "worker 异常退出")
+                raise
+            except Exception:
+                self.failed += 1
+                raise
+            finally:
+                deadlines.pop(task, None)
+            self.completed += 1
+            return result
+        finally:
+            self.in_flight -= 1
+            for shm in shared:
+                shm.close()
+                shm.unlink()
+
+    async def close(self) -> None:
+        """关闭进程池"""
+        if self._warmup is not None:
+            self._warmup.cancel()
+            self._warmup = None
+        # 不再等待旧进程池中的任务，直接终止
+        for retiring in list(self._retiring):
+            retiring.cancel()
+        if self._retiring:
+            await asyncio.gather(*self._retiring, return_exceptions=True)
+        executor, self._executor = self._executor, None
+        self._deadlines.pop(executor, None)
+        if executor is not None:
+            await asyncio.to_thread(executor.shutdown, True, cancel_futures=True)
+
+    def stats(self):
+        """返回进程池统计信息"""
+        return {
+            "workers": self.workers,
+            "running": self._executor is not None,
+            "in_flight": self.in_flight,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts,
+            "shared_bytes": self.shared_bytes,
+        }
+
+    def _ensure_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn：不继承主进程的线程和事件循环状态
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=self.initializer,
+            )
+        return self._executor
+
+    def _share(self, arg: Any, shared: List[SharedMemory]) -> Any:
+        """把较大的数组复制到共享内存，返回句柄"""
+        if (
+            not isinstance(arg, np.ndarray)
+            or arg.nbytes == 0
+            or arg.nbytes < self.shm_min_bytes
+        ):
+            return arg
+        shm = SharedMemory(create=True, size=arg.nbytes)
+        shared.append(shm)
+        np.ndarray(arg.shape, dtype=arg.dtype, buffer=shm.buf)[...] = arg
+        self.shared_bytes += arg.nbytes
+        return _SharedArray(shm.name, arg.shape, arg.dtype.str)
+
+    def _recycle(
+        self, executor: ProcessPoolExecutor, reason: str, stuck: Optional[Future] = None
+    ) -> None:
+        """
+        替换卡住或损坏的进程池，新任务交给新的进程池
+
+        Args:
+            executor: 出问题的进程池
+            reason: 原因，用于日志
+            stuck: 超时的任务；为 None 表示 worker 已崩溃，旧进程池中的任务都已失败
+        """
+        if self._executor is not executor:
+            # 其他任务已经替换过，旧进程会在其剩余任务结束后终止
+            return
+        logger.error(f"{self.name} 进程池重建: {reason}")
+        self._executor = None
+        self.restarts += 1
+        deadlines = self._deadlines.pop(executor, {})
+        # ProcessPoolExecutor 不能取消正在执行的任务，只能终止 worker 进程；
+        # 其他调用方的任务仍在正常执行，等它们完成或超过各自的超时后再终止
+        others = {
+            task: deadline
+            for task, deadline in deadlines.items()
+            if task is not stuck and not task.done()
+        }
+        # shutdown() 会清空进程表，先记下要终止的进程
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=stuck is None)
+        loop = asyncio.get_running_loop()
+        retiring = loop.create_task(self._retire(processes, others))
+        self._retiring.add(retiring)
+        retiring.add_done_callback(self._retiring.discard)
+        # 在后台预热新的 worker
+        self._warmup = loop.create_task(self.start())
+
+    async def _retire(self, processes: List[Any], others: Dict[Future, float]) -> None:
+        """等待旧进程池中其他任务结束，然后终止全部旧进程（包括卡住的那个）"""
+        loop = asyncio.get_running_loop()
+        waiters = [asyncio.wrap_future(task) for task in others]
+        try:
+            if waiters:
+                await asyncio.wait(
+                    waiters, timeout=max(0.0, max(others.values()) - loop.time())
+                )
+        finally:
+            for waiter in waiters:
+                # 任务结果由各自的调用方处理，这里只是等待
+                if waiter.done() and not waiter.cancelled():
+                    waiter.exception()
+                else:
+                    waiter.cancel()
+            for process in processes:
+                process.terminate()
@@ -0,0 +1,243 @@
+import math
+import os
+import re
+import logging
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# prompt 的 token 预算（不含模型回复）
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+# 无论预算多紧张都优先保留的最近对话轮数
+HISTORY_MIN_TURNS = int(os.getenv("HISTORY_MIN_TURNS", "2"))
+# 每个用户在内存中保留的对话历史 token 上限
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", str(PROMPT_TOKEN_BUDGET)))
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 上下文块的优先级，数值越小越先放入 prompt
+PRIORITY_MEMORY = 0
+PRIORITY_SUMMARY = 1
+PRIORITY_EMOTION = 2
+
+# 中日韩字符大约各占一个 token
+_CJK_RANGES = (
+    "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef"
+)
+_CJK_RE = re.compile(f"[{_CJK_RANGES}]")
+_WORD_RE = re.compile(f"[^\\s{_CJK_RANGES}]+")
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    计算文本的 token 数
+
+    安装了 tiktoken 时使用 gpt-4o 的编码精确计算，否则按字符类型估算：
+    中日韩字符每个算一个 token，其余连续字符按每 4 个字符一个 token 计。
+    """
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+
+    cjk_tokens = len(_CJK_RE.findall(text))
+    word_tokens = sum(math.ceil(len(word) / 4) for word in _WORD_RE.findall(text))
+    return cjk_tokens + word_tokens
+
+
+def count_message_tokens(message: Dict[str, str]) -> int:
+    """计算一条聊天消息的 token 数（含格式开销）"""
+    return count_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+class ConversationBuffer:
+    """
+    单个用户的对话历史，随消息追加增量维护 token 总数。
+
+    每条消息的 token 数只在追加时计算一次，裁剪和打包时直接复用。
+    """
+
+    def __init__(self, max_tokens: int = HISTORY_MAX_TOKENS):
+        self.max_tokens = max_tokens
+        self.messages: List[Dict[str, str]] = []
+        self.token_counts: List[int] = []
+        self.total_tokens = 0
+
+    def append(self, message: Dict[str, str]) -> None:
+        """追加一条消息，并在超出 token 上限时丢弃最早的消息"""
+        tokens = count_message_tokens(message)
+        self.messages.append(message)
+        self.token_counts.append(tokens)
+        self.total_tokens += tokens
+        self._trim()
+
+    def clear(self) -> None:
+        """清空对话历史"""
+        self.messages = []
+        self.token_counts = []
+        self.total_tokens = 0
+
+    def turns(self) -> Iterator[List[int]]:
+        """
+        从新到旧遍历对话轮次
+
+        Yields:
+            每一轮对话的消息下标列表（一轮以用户消息开头）
+        """
+        end = len(self.messages)
+        index = end - 1
+        while index >= 0:
+            if self.messages[index]["role"] == "user" or index == 0:
+                yield list(range(index, end))
+                end = index
+            index -= 1
+
+    def _trim(self) -> None:
+        """保留最近的消息，使总 token 数不超过上限（至少保留最后一轮）"""
+        drop = 0
+        total = self.total_tokens
+        while total > self.max_tokens and len(self.messages) - drop > 2:
+            total -= self.token_counts[drop]
+            drop += 1
+        # 因预算丢弃了消息时，不从一轮对话的中间开始
+        # （未丢弃时保留开头的助手消息，例如主动提问）
+        while (
+            0 < drop < len(self.messages) - 1 and self.messages[drop]["role"] != "user"
+        ):
+            total -= self.token_counts[drop]
+            drop += 1
+        if drop:
+            self.messages = self.messages[drop:]
+            self.token_counts = self.token_counts[drop:]
+            self.total_tokens = total
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+
+class ContextSection:
+    """
+    system prompt 中的一个上下文块（记忆、情绪历史或对话摘要）
+
+    items 按重要性从高到低排列，预算不足时从末尾开始舍弃。
+    """
+
+    def __init__(self, name: str, header: str, items: List[str], priority: int):
+        self.name = name
+        self.header = header
+        self.items = items
+        self.priority = priority
+        self.header_tokens = count_tokens(header) if items else 0
+        self.item_tokens = [count_tokens(item) for item in items]
+
+    def render(self, count: Optional[int] = None) -> str:
+        """渲染前 count 条内容，没有内容时返回空字符串"""
+        items = self.items if count is None else self.items[:count]
+        if not items:
+            return ""
+        return self.header + "\n" + "\n".join(items) + "\n"
+
+
+class ContextPacker:
+    """
+    按 token 预算组装 prompt。
+
+    必须包含的部分（系统指令、当前问题）先占用预算，剩余预算依次分配给：
+    1. 最近 HISTORY_MIN_TURNS 轮对话
+    2. 各上下文块，按优先级排列，块内按重要性逐条放入
+    3. 更早的对话轮次，从新到旧直到预算用完
+    """
+
+    def __init__(
+        self,
+        budget: int = PROMPT_TOKEN_BUDGET,
+        min_history_turns: int = HISTORY_MIN_TURNS,
+    ):
+        self.budget = budget
+        self.min_history_turns = min_history_turns
+
+    def pack(
+        self,
+        instructions: str,
+        sections: List[ContextSection],
+        history: Optional[ConversationBuffer],
+        query: str,
+        closing: str = "",
+    ) -> List[Dict[str, str]]:
+        """
+        组装发送给模型的消息列表
+
+        Args:
+            instructions: system prompt 开头的固定指令
+            sections: 候选上下文块
+            history: 用户的对话历史
+            query: 当前用户查询
+            closing: system prompt 末尾的附加提示（例如当前情绪状态）
+
+        Returns:
+            [system, 历史消息..., user] 形式的消息列表
+        """
+        remaining = self.budget
+        remaining -= (
+            count_tokens(instructions) + count_tokens(closing) + MESSAGE_OVERHEAD_TOKENS
+        )
+        remaining -= count_message_tokens({"role": "user", "content": query})
+
+        turns = list(history.turns()) if history is not None else []
+        kept_turns = 0
+
+        # 1. 最近几轮对话，保证多轮对话的连贯性
+        while kept_turns < min(self.min_history_turns, len(turns)):
+            cost = sum(history.token_counts[i] for i in turns[kept_turns])
+            if cost > remaining:
+                break
+            remaining -= cost
+            kept_turns += 1
+
+        # 2. 上下文块，按优先级逐条放入
+        kept_items: Dict[str, int] = {}
+        for section in sorted(sections, key=lambda s: s.priority):
+            kept = 0
+            for tokens in section.item_tokens:
+                cost = tokens + (section.header_tokens if kept == 0 else 0)
+                if cost > remaining:
+                    break
+                remaining -= cost
+                kept += 1
+            kept_items[section.name] = kept
+
+        # 3. 更早的对话轮次，保持连续，放不下即停止
+        if kept_turns == min(self.min_history_turns, len(turns)):
+            while kept_turns < len(turns):
+                cost = sum(history.token_counts[i] for i in turns[kept_turns])
+                if cost > remaining:
+                    break
+                remaining -= cost
+                kept_turns += 1
+
+        dropped = sum(len(s.items) - kept_items.get(s.name, 0) for s in sections)
+        if dropped or kept_turns < len(turns):
+            logger.info(
+                f"prompt 超出 {self.budget} token 预算，舍弃了 {dropped} 条上下文和 "
+                f"{len(turns) - kept_turns} 轮较早的对话"
+            )
+
+        # system prompt 中上下文块保持固定顺序
+        system_prompt = instructions
+        for section in sections:
+            system_prompt += section.render(kept_items.get(section.name, 0)) + "\n"
+        system_prompt += closing
+
+        messages = [{"role": "system", "content": system_prompt}]
+        for turn in reversed(turns[:kept_turns]):
+            messages.extend(history.messages[i] for i in turn)
+        messages.append({"role": "user", "content": query})
+        return messages
@@ -0,0 +1,204 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 凑批的最长等待时间（毫秒），0 表示只合并同一轮事件循环中提交的请求
+INFERENCE_BATCH_WAIT_MS = float(os.getenv("INFERENCE_BATCH_WAIT_MS", "2"))
+# 单批最大条数，达到后立即执行
+INFERENCE_BATCH_MAX_SIZE = int(os.getenv("INFERENCE_BATCH_MAX_SIZE", "64"))
+# 统计分位数时保留的最近样本数
+INFERENCE_METRICS_WINDOW = 1024
+
+# 接收一批输入，按相同顺序返回结果；某一项的结果为异常实例时只有该请求失败
+BatchHandler = Callable[[List[Any]], Awaitable[List[Any]]]
+
+
+class InferenceBatcher:
+    """
+    推理微批调度
+
+    - 请求放入待处理列表后等待；第一条请求到达时开始计时，
+      max_wait_ms 到期或凑满 max_batch_size 条时，把整批交给 handler 做一次批量前向计算
+    - handler 返回的结果按顺序分发给各请求的 future
+    - 待处理列表和计时器只在所属事件循环上访问
+      （首次使用时绑定，原事件循环停止后重新绑定）；
+      其他线程的事件循环（例如同步工具路径中的 asyncio.run）提交时转交给所属事件循环
+    - 统计批大小、排队等待时间和批处理耗时
+    """
+
+    def __init__(
+        self,
+        handler: BatchHandler,
+        name: str = "inference",
+        max_wait_ms: float = INFERENCE_BATCH_WAIT_MS,
+        max_batch_size: int = INFERENCE_BATCH_MAX_SIZE,
+    ):
+        """
+        Args:
+            handler: 批处理协程函数
+            name: 名称，用于日志
+            max_wait_ms: 凑批的最长等待时间（毫秒）
+            max_batch_size: 单批最大条数
+        """
+        self.handler = handler
+        self.name = name
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.max_batch_size = max(1, max_batch_size)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._bind_lock = threading.Lock()
+        # (输入, future, 提交时间)
+        self._pending: List[Tuple[Any, "asyncio.Future", float]] = []
+        self._timer: Optional[asyncio.Handle] = None
+        self._running: Set[asyncio.Task] = set()
+
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.largest_batch = 0
+        self._batch_sizes: Deque[int] = deque(maxlen=INFERENCE_METRICS_WINDOW)
+        self._wait_ms: Deque[float] = deque(maxlen=INFERENCE_METRICS_WINDOW)
+        self._run_ms: Deque[float] = deque(maxlen=INFERENCE_METRICS_WINDOW)
+
+    @property
+    def pending(self) -> int:
+        """等待凑批的请求数"""
+        return len(self._pending)
+
+    async def submit(self, item: Any) -> Any:
+        """
+        提交一条推理请求并等待结果
+
+        Args:
+            item: 单条输入
+
+        Returns:
+            该输入对应的结果
+        """
+        loop = asyncio.get_running_loop()
+        owner = self._bind(loop)
+        if owner is not loop:
+            # 所属事件循环在其他线程中运行：提交给它，与其他请求一起凑批
+            return await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(self.submit(item), owner)
+            )
+
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    async def close(self) -> None:
+        """执行剩余的请求并等待进行中的批次完成"""
+        if self._pending:
+            self._flush()
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回批处理统计信息"""
+
+        def percentiles(samples: Deque[float]) -> Dict[str, float]:
+            if not samples:
+                return {"avg": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+            values = np.fromiter(samples, dtype=np.float64)
+            p50, p95 = np.percentile(values, [50, 95])
+            return {
+                "avg": round(float(values.mean()), 3),
+                "p50": round(float(p50), 3),
+                "p95": round(float(p95), 3),
+                "max": round(float(values.max()), 3),
+            }
+
+        return {
+            "max_wait_ms": self.max_wait * 1000,
+            "max_batch_size": self.max_batch_size,
+            "pending": self.pending,
+            "batches": self.batches,
+            "items": self.items,
+            "errors": self.errors,
+            "largest_batch": self.largest_batch,
+            "batch_size": percentiles(self._batch_sizes),
+            "wait_ms": percentiles(self._wait_ms),
+            "run_ms": percentiles(self._run_ms),
+        }
+
+    def _flush(self) -> None:
+        """取出当前待处理的请求，作为一批执行"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = self._loop.create_task(self._run(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[Tuple[Any, "asyncio.Future", float]]) -> None:
+        started = time.perf_counter()
+        self.batches += 1
+        self.items += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        self._batch_sizes.append(len(batch))
+        self._wait_ms.extend((started - submitted) * 1000 for _, _, submitted in batch)
+
+        try:
+            results = await self.handler([item for item, _, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(
+                    f"{self.name} 批处理返回 {len(results)} 个结果，"
+                    f"应为 {len(batch)} 个"
+                )
+        except Exception as e:
+            logger.error(f"{self.name} 批处理（{len(batch)} 条）出错: {str(e)}")
+            results = [e] * len(batch)
+        except BaseException:
+            # 批处理被取消：让这一批的调用方得到异常，而不是一直等待
+            error = RuntimeError(f"{self.name} 批处理被取消")
+            for _, future, _ in batch:
+                if not future.done():
+                    self.errors += 1
+                    future.set_exception(error)
+            raise
+        finally:
+            self._run_ms.append((time.perf_counter() - started) * 1000)
+
+        for (_, future, _), result in zip(batch, results):
+            if future.done():
+                # 调用方已取消
+                continue
+            if isinstance(result, BaseException):
+                self.errors += 1
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _bind(self, loop: asyncio.AbstractEventLoop) -> asyncio.AbstractEventLoop:
+        """返回所属事件循环；尚未绑定或原事件循环已停止时绑定到 loop"""
+        with self._bind_lock:
+            if (
+                self._loop is None
+                or self._loop.is_closed()
+                or not self._loop.is_running()
+            ):
+                if self._pending:
+                    logger.warning(
+                        f"{self.name} 原事件循环已停止，"
+                        f"丢弃 {len(self._pending)} 条未执行的请求"
+                    )
+                self._loop = loop
+                self._pending = []
+                self._timer = None
+            return self._loop
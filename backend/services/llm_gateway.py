@@ -0,0 +1,352 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import openai
+from openai import AsyncAzureOpenAI
+from dotenv import load_dotenv
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 加载环境变量
+load_dotenv()
+
+# 从环境变量获取Azure OpenAI配置
+endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+api_key = os.getenv("AZURE_OPENAI_API_KEY")
+deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o-mini")
+api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2025-01-01-preview")
+
+# 并发、重试和熔断配置
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_DEPLOYMENT_CONCURRENCY = int(os.getenv("LLM_DEPLOYMENT_CONCURRENCY", "16"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+LLM_BREAKER_RECOVERY_TIMEOUT = float(os.getenv("LLM_BREAKER_RECOVERY_TIMEOUT", "30"))
+
+# 可以重试的上游错误：限流、5xx、连接失败和超时
+_RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+)
+
+
+class CircuitOpenError(Exception):
+    """上游服务熔断中，请求被快速拒绝"""
+
+
+class CircuitBreaker:
+    """
+    简单的熔断器
+
+    - closed: 正常放行，连续失败达到阈值后打开
+    - open: 直接拒绝请求，冷却时间过后进入 half_open
+    - half_open: 只放行一个探测请求，成功则关闭，失败则重新打开
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = LLM_BREAKER_FAILURE_THRESHOLD,
+        recovery_timeout: float = LLM_BREAKER_RECOVERY_TIMEOUT,
+    ):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        """当前状态：closed / open / half_open"""
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.recovery_timeout:
+            return "half_open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        """判断是否放行一个请求"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        """记录成功，关闭熔断器"""
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        """记录失败，达到阈值或探测失败时打开熔断器"""
+        self.failures += 1
+        if self._probe_in_flight or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._probe_in_flight:
+                logger.warning(
+                    f"LLM 上游连续失败 {self.failures} 次，"
+                    f"熔断 {self.recovery_timeout}s"
+                )
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """探测请求因非上游原因结束时，释放探测名额"""
+        self._probe_in_flight = False
+
+
+class LLMGateway:
+    """
+    进程内共享的异步 LLM 网关
+
+    - 复用同一个 AsyncAzureOpenAI 客户端（及其连接池）
+    - 全局和按部署的并发信号量，避免突发流量同时打到上游
+    - 对 429 / 5xx / 连接错误做指数退避重试，优先遵循 retry-after
+    - 按部署熔断，上游持续异常时直接抛出 CircuitOpenError，由调用方降级
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        deployment_concurrency: int = LLM_DEPLOYMENT_CONCURRENCY,
+        max_retries: int = LLM_MAX_RETRIES,
+        backoff_base: float = LLM_BACKOFF_BASE,
+        backoff_max: float = LLM_BACKOFF_MAX,
+    ):
+        self.max_concurrency = max_concurrency
+        self.deployment_concurrency = deployment_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.default_deployment = deployment
+
+        self._client: Optional[AsyncAzureOpenAI] = None
+        # 信号量在首次使用时创建，绑定到实际运行的事件循环
+        self._global_semaphore: Optional[asyncio.Semaphore] = None
+        self._deployment_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+        self.in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+
+    @property
+    def available(self) -> bool:
+        """是否配置了可用的上游"""
+        return bool(endpoint and api_key)
+
+    @property
+    def client(self) -> AsyncAzureOpenAI:
+        """共享的 OpenAI 客户端（首次使用时创建）"""
+        if self._client is None:
+            logger.info(f"初始化 OpenAI 客户端: {endpoint}，API版本: {api_version}")
+            self._client = AsyncAzureOpenAI(
+                api_version=api_version,
+                azure_endpoint=endpoint,
+                api_key=api_key,
+                # 重试由网关统一处理
+                max_retries=0,
+                timeout=LLM_REQUEST_TIMEOUT,
+            )
+        return self._client
+
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        deployment_name: Optional[str] = None,
+        **params: Any,
+    ) -> str:
+        """
+        调用聊天补全接口并返回完整回复
+
+        Args:
+            messages: 聊天消息列表
+            deployment_name: 部署名称，默认使用 AZURE_OPENAI_DEPLOYMENT_NAME
+            **params: 透传给 chat.completions.create 的参数
+
+        Returns:
+            模型回复文本
+
+        Raises:
+            CircuitOpenError: 上游熔断中
+        """
+        model = deployment_name or self.default_deployment
+        breaker = self._acquire_breaker(model)
+
+        # 等待并发名额时被取消也要释放探测名额，否则熔断器会一直停在 half_open
+        try:
+            async with self._limit(model):
+                response = await self._with_retries(
+                    lambda: self.client.chat.completions.create(
+                        messages=messages, model=model, **params
+                    )
+                )
+        except _RETRYABLE_ERRORS:
+            breaker.record_failure()
+            self.failures += 1
+            raise
+        except BaseException:
+            breaker.release_probe()
+            raise
+
+        breaker.record_success()
+        return response.choices[0].message.content
+
+    async def stream(
+        self,
+        messages: List[Dict[str, str]],
+        deployment_name: Optional[str] = None,
+        **params: Any,
+    ) -> AsyncIterator[str]:
+        """
+        以流式方式调用聊天补全接口
+
+        只在收到第一个片段之前重试，已经输出内容后出错直接抛出。
+
+        Yields:
+            模型回复的增量文本
+
+        Raises:
+            CircuitOpenError: 上游熔断中
+        """
+        model = deployment_name or self.default_deployment
+        breaker = self._acquire_breaker(model)
+
+        try:
+            async with self._limit(model):
+                stream = await self._with_retries(
+                    lambda: self.client.chat.completions.create(
+                        messages=messages, model=model, stream=True, **params
+                    )
+                )
+                async for chunk in stream:
+                    # Azure 会先返回一个不含 choices 的内容过滤结果块
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yield delta
+        except _RETRYABLE_ERRORS:
+            breaker.record_failure()
+            self.failures += 1
+            raise
+        except BaseException:
+            breaker.release_probe()
+            raise
+
+        breaker.record_success()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回网关统计信息"""
+        return {
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "breakers": {
+                name: breaker.state for name, breaker in self._breakers.items()
+            },
+        }
+
+    async def close(self) -> None:
+        """关闭共享客户端及其连接池"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def _acquire_breaker(self, model: str) -> CircuitBreaker:
+        """检查熔断器，熔断中直接拒绝"""
+        breaker = self._breakers.setdefault(model, CircuitBreaker())
+        if not breaker.allow_request():
+            self.rejected += 1
+            raise CircuitOpenError(f"部署 {model} 熔断中")
+        return breaker
+
+    def _limit(self, model: str) -> "_ConcurrencyLimit":
+        """获取全局和部署级并发名额"""
+        if self._global_semaphore is None:
+            self._global_semaphore = asyncio.Semaphore(self.max_concurrency)
+        if model not in self._deployment_semaphores:
+            self._deployment_semaphores[model] = asyncio.Semaphore(
+                self.deployment_concurrency
+            )
+        return _ConcurrencyLimit(self, self._deployment_semaphores[model])
+
+    async def _with_retries(self, call):
+        """执行调用，对可重试错误做指数退避"""
+        attempt = 0
+        while True:
+            self.requests += 1
+            try:
+                return await call()
+            except _RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    logger.error(f"调用 LLM 失败，已重试 {attempt} 次: {str(e)}")
+                    raise
+                delay = self._retry_delay(e, attempt)
+                attempt += 1
+                self.retries += 1
+                logger.warning(
+                    f"调用 LLM 出错（{type(e).__name__}），"
+                    f"{delay:.2f}s 后第 {attempt} 次重试"
+                )
+                await asyncio.sleep(delay)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """计算重试等待时间，优先使用上游返回的 retry-after"""
+        response = getattr(error, "response", None)
+        if response is not None:
+            retry_after_ms = response.headers.get("retry-after-ms")
+            retry_after = response.headers.get("retry-after")
+            try:
+                if retry_after_ms is not None:
+                    return min(float(retry_after_ms) / 1000, self.backoff_max)
+                if retry_after is not None:
+                    return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        # 指数退避 + 全抖动
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * (2**attempt))
+        )
+
+
+class _ConcurrencyLimit:
+    """依次获取全局和部署级信号量的异步上下文管理器"""
+
+    def __init__(self, gateway: LLMGateway, deployment_semaphore: asyncio.Semaphore):
+        self.gateway = gateway
+        self.deployment_semaphore = deployment_semaphore
+
+    async def __aenter__(self):
+        await self.gateway._global_semaphore.acquire()
+        try:
+            await self.deployment_semaphore.acquire()
+        except BaseException:
+            self.gateway._global_semaphore.release()
+            raise
+        self.gateway.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.gateway.in_flight -= 1
+        self.deployment_semaphore.release()
+        self.gateway._global_semaphore.release()
+        return False
+
+
+# 进程内共享实例
+llm_gateway = LLMGateway()
@@ -1,9 +1,10 @@
 import os
 import logging
-from typing import List, Dict, Any, Optional
-from openai import AzureOpenAI
+from typing import List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
 
+from backend.services.llm_gateway import llm_gateway, CircuitOpenError
+
 # 加载环境变量
 load_dotenv()
 
@@ -12,11 +13,20 @@ logging.basicConfig(level=logging.INFO,
                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# 从环境变量获取Azure OpenAI配置
-endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-api_key = os.getenv("AZURE_OPENAI_API_KEY")
-deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o-mini")
-api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-12-01-preview")
+# 合并摘要（上层节点和根摘要）的最大长度
+MERGED_SUMMARY_MAX_CHARS = int(os.getenv("MERGED_SUMMARY_MAX_CHARS", "120"))
+# 摘要树每多少个节点合并为上一层的一个节点
+SUMMARY_TREE_FANOUT = int(os.getenv("SUMMARY_TREE_FANOUT", "4"))
+
+
+def latest_summary_text(conversation: Dict[str, Any]) -> str:
+    """对话的最新摘要：优先使用根摘要，旧对话回退到最后一条窗口摘要"""
+    root = conversation.get("summary_root")
+    if root and root.get("text"):
+        return root["text"]
+    summaries = conversation.get("summary") or []
+    return summaries[-1].get("text", "") if summaries else ""
+
 
 class ConversationSummarizer:
     """
@@ -26,6 +36,7 @@ class ConversationSummarizer:
     1. 每10条消息生成一次摘要
     2. 摘要长度控制在80个中文字以内
     3. 提供检索历史摘要功能
+    4. 把窗口摘要逐层合并为摘要树，并维护覆盖整个对话的根摘要
     """
     
     def __init__(self, mock_mode: bool = False):
@@ -37,34 +48,27 @@ class ConversationSummarizer:
         """
         self.mock_mode = mock_mode or os.getenv("USE_MOCK_RESPONSES", "0") == "1"
         
-        # 初始化 OpenAI 客户端
-        if not self.mock_mode:
-            try:
-                self.client = AzureOpenAI(
-                    api_version=api_version,
-                    azure_endpoint=endpoint,
-                    api_key=api_key,
-                )
-                logger.info("成功初始化 OpenAI 客户端用于摘要生成")
-            except Exception as e:
-                logger.error(f"初始化 OpenAI 客户端时出错: {str(e)}")
-                self.client = None
-                self.mock_mode = True
-        else:
-            self.client = None
+        # 与 AgentKernel 共享 LLM 网关
+        self.llm = llm_gateway
+        if not self.mock_mode and not self.llm.available:
+            logger.warning("未配置 Azure OpenAI 端点或密钥，摘要生成器使用模拟模式")
+            self.mock_mode = True
+        elif self.mock_mode:
             logger.info("摘要生成器使用模拟模式")
     
-    async def summarize(self, messages: List[Dict[str, Any]]) -> str:
+    async def summarize(self, messages: List[Dict[str, Any]], raise_on_error: bool = False) -> str:
         """
         对会话消息生成摘要
         
         Args:
             messages: 对话消息列表，格式为 [{"role": "user/assistant", "content": "消息内容", "emotion": "情绪标签"}]
+            raise_on_error: LLM 调用失败（包括熔断）时抛出异常，不返回模拟摘要；
+                后台摘要任务使用，由队列重试，模拟摘要不会被持久化
             
         Returns:
             摘要文本，限制在80个中文字符以内
         """
-        if self.mock_mode or not self.client:
+        if self.mock_mode:
             return self._generate_mock_summary(messages)
         
         try:
@@ -101,9 +105,8 @@ class ConversationSummarizer:
             user_prompt = f"请对以下对话生成简短摘要（不超过80个中文字符）：\n\n{conversation_text}{emotion_trend}"
             
             # 调用API生成摘要
-            response = self.client.chat.completions.create(
-                model=deployment,
-                messages=[
+            response = await self.llm.complete(
+                [
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
                 ],
@@ -111,7 +114,7 @@ class ConversationSummarizer:
                 temperature=0.3
             )
             
-            summary = response.choices[0].message.content.strip()
+            summary = response.strip()
             
             # 确保摘要不超过80个中文字符
             if len(summary) > 80:
@@ -120,10 +123,127 @@ class ConversationSummarizer:
             logger.info(f"生成摘要成功: {summary}")
             return summary
             
+        except CircuitOpenError:
+            if raise_on_error:
+                raise
+            logger.warning("LLM 上游熔断中，使用模拟摘要")
+            return self._generate_mock_summary(messages)
         except Exception as e:
+            if raise_on_error:
+                raise
             logger.error(f"生成摘要时出错: {str(e)}")
             return self._generate_mock_summary(messages)
     
+    async def merge(self, summaries: List[str], max_chars: int = MERGED_SUMMARY_MAX_CHARS,
+                    raise_on_error: bool = False) -> str:
+        """
+        把按时间顺序排列的多段摘要合并为一段（输入只有摘要文本，调用开销很小）
+        
+        Args:
+            summaries: 摘要文本列表，较早的在前
+            max_chars: 合并结果的最大长度
+            raise_on_error: LLM 调用失败时抛出异常，不返回模拟合并结果
+            
+        Returns:
+            合并后的摘要
+        """
+        summaries = [summary for summary in summaries if summary]
+        if len(summaries) <= 1:
+            return summaries[0] if summaries else ""
+        if self.mock_mode:
+            return self._generate_mock_merge(summaries, max_chars)
+        
+        try:
+            system_prompt = (
+                "你是一个专业的对话摘要生成器。你的任务是把同一段对话中按时间顺序排列的几段摘要合并成一段。"
+                "合并后的摘要必须：\n"
+                f"1. 不超过{max_chars}个中文字符\n"
+                "2. 保留用户情绪的变化过程和仍未解决的关键诉求\n"
+                "3. 使用第三人称客观描述"
+            )
+            numbered = "\n".join(f"{i + 1}. {summary}" for i, summary in enumerate(summaries))
+            user_prompt = f"请合并以下摘要（不超过{max_chars}个中文字符）：\n\n{numbered}"
+            
+            response = await self.llm.complete(
+                [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                max_tokens=256,
+                temperature=0.3
+            )
+            
+            merged = response.strip()
+            if len(merged) > max_chars:
+                merged = merged[:max_chars - 3] + "..."
+            return merged
+            
+        except CircuitOpenError:
+            if raise_on_error:
+                raise
+            logger.warning("LLM 上游熔断中，使用模拟合并摘要")
+            return self._generate_mock_merge(summaries, max_chars)
+        except Exception as e:
+            if raise_on_error:
+                raise
+            logger.error(f"合并摘要时出错: {str(e)}")
+            return self._generate_mock_merge(summaries, max_chars)
+    
+    async def extend_summary_tree(self, leaf: Dict[str, Any], leaves: List[Dict[str, Any]],
+                                  tree: Dict[str, List[Dict[str, Any]]],
+                                  root: Optional[Dict[str, Any]],
+                                  fanout: int = SUMMARY_TREE_FANOUT,
+                                  raise_on_error: bool = False
+                                  ) -> Tuple[Dict[str, Any], Dict[str, List[Dict[str, Any]]]]:
+        """
+        把一个新的叶子摘要（一个 10 条消息窗口）加入摘要树
+        
+        - 根摘要 = merge(旧根摘要, 新叶子)，每个窗口一次小的合并调用，读取时 O(1)
+        - 每层每积累 fanout 个未合并的节点，合并为上一层的一个节点（摊还每窗口 1/(fanout-1) 次）
+        
+        Args:
+            leaf: 新叶子 {"text", "message_range", ...}
+            leaves: 已有的叶子（第 0 层），不含新叶子
+            tree: 第 1 层及以上的节点，{"1": [...], "2": [...]}
+            root: 当前根摘要，没有时为 None
+            fanout: 每多少个节点合并为上一层的一个节点
+            raise_on_error: 合并失败时抛出异常（见 merge）
+            
+        Returns:
+            (新的根摘要, 新的 tree)
+        """
+        if root and root.get("text"):
+            root_text = await self.merge([root["text"], leaf["text"]], raise_on_error=raise_on_error)
+            covered = [root["message_range"][0], leaf["message_range"][1]]
+        else:
+            root_text = leaf["text"]
+            covered = list(leaf["message_range"])
+        new_root = {"text": root_text, "message_range": covered, "windows": (root or {}).get("windows", 0) + 1}
+        
+        tree = {level: list(nodes) for level, nodes in tree.items()}
+        nodes = list(leaves) + [leaf]
+        level = 0
+        while True:
+            parents = tree.get(str(level + 1), [])
+            unmerged = nodes[len(parents) * fanout:]
+            if len(unmerged) < fanout:
+                break
+            group = unmerged[:fanout]
+            parents.append({
+                "text": await self.merge([node["text"] for node in group], raise_on_error=raise_on_error),
+                "message_range": [group[0]["message_range"][0], group[-1]["message_range"][1]]
+            })
+            tree[str(level + 1)] = parents
+            nodes = parents
+            level += 1
+        
+        return new_root, tree
+    
+    def _generate_mock_merge(self, summaries: List[str], max_chars: int) -> str:
+        """模拟合并：按顺序拼接并截断"""
+        merged = "；".join(summaries)
+        return merged[:max_chars - 3] + "..." if len(merged) > max_chars else merged
+    
     def _generate_mock_summary(self, messages: List[Dict[str, Any]]) -> str:
         """
         生成模拟摘要（在无法连接API时使用）
@@ -172,33 +292,37 @@ class ConversationSummarizer:
         
         Args:
             user_id: 用户ID
-            cosmos_client: CosmosDB客户端
+            cosmos_client: CosmosMemoryStore 实例（异步 SDK）
             current_messages: 当前窗口消息列表
             
         Returns:
             格式化的历史摘要文本
         """
         try:
-            # 获取最近一条对话摘要
+            # 获取最近一个对话的根摘要（旧对话没有根摘要时使用最后一条窗口摘要，不读取整个叶子数组）
             container = cosmos_client.conversation_container
-            query = f"""
-                SELECT TOP 1 c.summary
+            query = """
+                SELECT TOP 1 c.summary_root, ARRAY_SLICE(c.summary, -1) as summary
                 FROM c 
-                WHERE c.user_id = '{user_id}' AND IS_DEFINED(c.summary)
+                WHERE c.user_id = @user_id AND IS_DEFINED(c.summary)
                 ORDER BY c.last_updated DESC
             """
             
-            items = list(container.query_items(
+            # 只查询该用户所在的分区
+            items = [item async for item in container.query_items(
                 query=query,
-                enable_cross_partition_query=True
-            ))
+                parameters=[{"name": "@user_id", "value": user_id}],
+                partition_key=user_id,
+                response_hook=cosmos_client.request_charges.hook("get_relevant_history")
+            )]
             
             # 构建返回的文本
             history_text = ""
             
             # 添加历史摘要
-            if items and 'summary' in items[0]:
-                history_text += f"上次对话摘要: {items[0]['summary']}\n\n"
+            summary_text = latest_summary_text(items[0]) if items else ""
+            if summary_text:
+                history_text += f"上次对话摘要: {summary_text}\n\n"
             
             # 添加当前窗口文本
             if current_messages:
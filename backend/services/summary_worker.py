@@ -0,0 +1,187 @@
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 排队中的摘要任务上限，超出时丢弃新任务（不阻塞请求）
+SUMMARY_QUEUE_MAX_SIZE = int(os.getenv("SUMMARY_QUEUE_MAX_SIZE", "500"))
+# 同时执行的摘要任务数（即同时进行的 LLM 摘要调用数）
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "2"))
+# 摘要任务失败后的重试次数
+SUMMARY_MAX_RETRIES = int(os.getenv("SUMMARY_MAX_RETRIES", "3"))
+# 关闭时等待队列处理完的时间（秒）
+SUMMARY_SHUTDOWN_TIMEOUT = float(os.getenv("SUMMARY_SHUTDOWN_TIMEOUT", "10"))
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class SummaryWorker:
+    """
+    后台摘要任务队列
+
+    - 请求路径只把任务放入队列，立即返回；队列满时丢弃任务并计数，不阻塞请求
+    - 固定数量的 worker 并发执行，限制同时进行的 LLM 调用
+    - 同一 key（对话）的任务按提交顺序串行执行，不同对话之间并行
+    - 失败按指数退避重试，最终失败记录日志
+    """
+
+    def __init__(
+        self,
+        handler: JobHandler,
+        name: str = "summaries",
+        max_size: int = SUMMARY_QUEUE_MAX_SIZE,
+        workers: int = SUMMARY_WORKERS,
+        max_retries: int = SUMMARY_MAX_RETRIES,
+    ):
+        """
+        Args:
+            handler: 执行单个任务的协程函数
+            name: 队列名称，用于日志
+            max_size: 队列容量
+            workers: 并发 worker 数
+            max_retries: 失败重试次数
+        """
+        self.handler = handler
+        self.name = name
+        self.max_size = max_size
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+
+        # 队列和后台任务在首次使用时创建，绑定到实际运行的事件循环
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._key_locks: Dict[str, asyncio.Lock] = {}
+        self._key_refs: Dict[str, int] = {}
+        self._closed = False
+
+        self.enqueued = 0
+        self.completed = 0
+        self.retries = 0
+        self.failed = 0
+        self.dropped = 0
+
+    @property
+    def depth(self) -> int:
+        """当前排队中的任务数"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def submit(self, key: str, job: Dict[str, Any]) -> bool:
+        """
+        提交一个任务
+
+        Args:
+            key: 串行化的键，例如对话ID
+            job: 任务参数，原样传给 handler
+
+        Returns:
+            是否成功放入队列
+        """
+        if self._closed:
+            logger.warning(f"{self.name} 队列已关闭，丢弃任务 {key}")
+            self.dropped += 1
+            return False
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((key, job))
+        except asyncio.QueueFull:
+            logger.warning(f"{self.name} 队列已满（{self.max_size}），丢弃任务 {key}")
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    async def flush(self) -> None:
+        """等待当前队列中的任务全部完成"""
+        if self._queue is not None and self._tasks:
+            await self._queue.join()
+
+    async def close(self, timeout: float = SUMMARY_SHUTDOWN_TIMEOUT) -> None:
+        """
+        停止接收新任务并等待队列处理完
+
+        Args:
+            timeout: 最长等待时间（秒），超时后取消剩余任务
+        """
+        self._closed = True
+        if not self._tasks:
+            return
+
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"{self.name} 队列关闭超时，放弃剩余 {self.depth} 个任务")
+            self.dropped += self.depth
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._tasks = []
+            self._queue = None
+
+    def stats(self) -> Dict[str, Any]:
+        """返回队列统计信息"""
+        return {
+            "depth": self.depth,
+            "max_size": self.max_size,
+            "workers": self.workers,
+            "enqueued": self.enqueued,
+            "completed": self.completed,
+            "retries": self.retries,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+    def _ensure_started(self) -> None:
+        """首次提交时创建队列并启动 worker"""
+        if self._tasks and not all(task.done() for task in self._tasks):
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._run()) for _ in range(self.workers)]
+
+    async def _run(self) -> None:
+        """worker：循环取出任务执行"""
+        while True:
+            key, job = await self._queue.get()
+            try:
+                await self._execute(key, job)
+            finally:
+                self._queue.task_done()
+
+    async def _execute(self, key: str, job: Dict[str, Any]) -> None:
+        """在 key 的锁内执行任务，失败时指数退避重试"""
+        lock = self._key_locks.setdefault(key, asyncio.Lock())
+        self._key_refs[key] = self._key_refs.get(key, 0) + 1
+        try:
+            async with lock:
+                attempt = 0
+                while True:
+                    try:
+                        await self.handler(job)
+                        self.completed += 1
+                        return
+                    except Exception as e:
+                        if attempt >= self.max_retries:
+                            logger.error(
+                                f"{self.name} 任务 {key} 失败，"
+                                f"已重试 {attempt} 次: {str(e)}"
+                            )
+                            self.failed += 1
+                            return
+                        attempt += 1
+                        self.retries += 1
+                        delay = min(0.1 * (2**attempt), 5.0)
+                        logger.warning(
+                            f"{self.name} 任务 {key} 出错，"
+                            f"{delay:.1f}s 后第 {attempt} 次重试: {str(e)}"
+                        )
+                        await asyncio.sleep(delay)
+        finally:
+            self._key_refs[key] -= 1
+            if self._key_refs[key] == 0:
+                del self._key_refs[key]
+                del self._key_locks[key]
@@ -2,6 +2,7 @@ import os
 import pytest
 import asyncio
 from backend.services.agent_kernel import AgentKernel
+from backend.memory.context_cache import context_cache
 
 # 设置测试所需的环境变量
 os.environ["AZURE_OPENAI_DEPLOYMENT_NAME"] = "your-deployment-name"
@@ -48,6 +49,102 @@ async def test_comfort_user_with_memory_mock_mode():
     except Exception as e:
         pytest.fail(f"测试失败: {str(e)}")
 
+@pytest.fixture(autouse=True)
+def _clear_context_cache():
+    """上下文缓存是进程内共享的，每个测试前清空"""
+    context_cache.clear()
+    yield
+    context_cache.clear()
+
+class _SlowMemoryStore:
+    """每个读取接口都延迟返回的假记忆存储"""
+
+    def __init__(self, delay: float, slow_summaries: bool = False):
+        self.delay = delay
+        self.slow_summaries = slow_summaries
+        self.interactions = []
+
+    async def retrieve_relevant_memories(self, user_id, query, top_k=3):
+        await asyncio.sleep(self.delay)
+        return {"memories": [{"summary": "用户喜欢散步"}]}
+
+    async def get_recent_emotions(self, user_id, limit=5):
+        await asyncio.sleep(self.delay)
+        return [{"timestamp": "2024-04-12T20:00:00", "emotion": "N"}]
+
+    async def get_conversation_summaries(self, user_id, limit=5):
+        await asyncio.sleep(self.delay * 20 if self.slow_summaries else self.delay)
+        return [{"summary": "聊到了工作压力"}]
+
+    async def add_interaction(self, **kwargs):
+        return "int_test"
+
+    async def add_interactions(self, records, raise_on_error=False):
+        self.interactions.extend(records)
+        return ["int_test"] * len(records)
+
+@pytest.mark.asyncio
+async def test_build_prompt_fetches_context_concurrently():
+    """三个上下文来源应并发获取，而不是依次等待"""
+    agent = AgentKernel(mode="mock")
+    agent.memory_store = _SlowMemoryStore(delay=0.2)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    messages = await agent.build_prompt_with_memories_and_history("test_user", "你好")
+    elapsed = loop.time() - started
+
+    assert elapsed < 0.5
+    system_prompt = messages[0]["content"]
+    assert "用户喜欢散步" in system_prompt
+    assert "那时的你N" in system_prompt
+    assert "聊到了工作压力" in system_prompt
+
+@pytest.mark.asyncio
+async def test_build_prompt_skips_timed_out_source(monkeypatch):
+    """某个来源超时时，其余上下文仍然保留"""
+    monkeypatch.setattr("backend.services.agent_kernel.CONTEXT_FETCH_TIMEOUT", 0.5)
+    agent = AgentKernel(mode="mock")
+    agent.memory_store = _SlowMemoryStore(delay=0.05, slow_summaries=True)
+
+    messages = await agent.build_prompt_with_memories_and_history("test_user", "你好")
+
+    system_prompt = messages[0]["content"]
+    assert "用户喜欢散步" in system_prompt
+    assert "聊到了工作压力" not in system_prompt
+    assert messages[-1] == {"role": "user", "content": "你好"}
+
+@pytest.mark.asyncio
+async def test_chat_stream_records_full_response():
+    """流式回复结束后，拼接后的完整回复应写入对话历史"""
+    agent = AgentKernel(mode="mock", memory_store=_SlowMemoryStore(delay=0))
+
+    deltas = [delta async for delta in agent.chat_stream("I'm feeling sad", user_id="stream_user")]
+
+    assert len(deltas) > 1
+    history = agent.get_conversation_history("stream_user")
+    assert history[0] == {"role": "user", "content": "I'm feeling sad"}
+    assert history[1] == {"role": "assistant", "content": "".join(deltas)}
+
+    # 关闭时后台队列中的交互记录应全部写入
+    await agent.close()
+    assert len(agent.memory_store.interactions) == 1
+    assert agent.memory_store.interactions[0]["suggestion"] == "".join(deltas)
+
+@pytest.mark.asyncio
+async def test_build_prompt_reuses_cached_context_blocks():
+    """同一用户的第二次构建应命中缓存，不再访问记忆存储"""
+    agent = AgentKernel(mode="mock")
+    agent.memory_store = _SlowMemoryStore(delay=0)
+    await agent.build_prompt_with_memories_and_history("cache_user", "你好")
+
+    hits_before = context_cache.hits
+    agent.memory_store = None  # 再访问存储会直接报错
+    messages = await agent.build_prompt_with_memories_and_history("cache_user", "你好")
+
+    assert context_cache.hits - hits_before == 3
+    assert "聊到了工作压力" in messages[0]["content"]
+
 if __name__ == "__main__":
     # 直接运行测试
     asyncio.run(test_comfort_user_with_memory_mock_mode()) 
\ No newline at end of file
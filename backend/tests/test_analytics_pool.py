@@ -0,0 +1,136 @@
+import os
+import time
+import asyncio
+
+import numpy as np
+import pytest
+
+from backend.services.analytics_pool import AnalyticsPool, AnalyticsTimeoutError
+from backend.tools import emotion_prediction_tool
+
+
+# worker 中执行的函数必须是模块级函数
+def _describe(array, offset):
+    return {
+        "sum": float(array.sum()) + offset,
+        "writeable": array.flags.writeable,
+        "view": not array.flags.owndata,
+        "pid": os.getpid(),
+    }
+
+
+def _reference_points():
+    return emotion_prediction_tool._get_reference_index().points
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+@pytest.mark.asyncio
+async def test_large_arrays_go_through_shared_memory():
+    pool = AnalyticsPool(workers=1, timeout=30, shm_min_bytes=1024)
+    try:
+        await pool.start()
+        large = np.arange(10_000, dtype=np.float64)
+        result = await pool.run(_describe, large, 1.0)
+        assert result["sum"] == float(large.sum()) + 1.0
+        # worker 直接映射共享内存，不复制
+        assert result["writeable"] is False and result["view"] is True
+        assert result["pid"] != os.getpid()
+        assert pool.stats()["shared_bytes"] == large.nbytes
+
+        # 小数组直接序列化
+        small = await pool.run(_describe, np.ones(4), 0.0)
+        assert small == {
+            "sum": 4.0,
+            "writeable": True,
+            "view": False,
+            "pid": result["pid"],
+        }
+        assert pool.stats()["shared_bytes"] == large.nbytes
+        assert pool.stats()["completed"] == 2
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_timeout_recycles_workers():
+    pool = AnalyticsPool(workers=1, timeout=30)
+    try:
+        await pool.start()
+        with pytest.raises(AnalyticsTimeoutError):
+            await pool.run(_sleep, 30, timeout=0.5)
+        stats = pool.stats()
+        assert stats["timeouts"] == 1 and stats["restarts"] == 1
+
+        # 新的 worker 可以继续处理任务
+        assert await pool.run(_sleep, 0) == 0
+        assert pool.stats()["in_flight"] == 0
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_timeout_does_not_fail_other_running_tasks():
+    pool = AnalyticsPool(workers=2, timeout=30)
+    try:
+        await pool.start()
+        old_processes = list(pool._executor._processes.values())
+        stuck = asyncio.ensure_future(pool.run(_sleep, 30, timeout=0.5))
+        healthy = asyncio.ensure_future(pool.run(_sleep, 1.5))
+
+        # 超时只让卡住的任务失败，同一进程池中的另一个任务正常完成
+        with pytest.raises(AnalyticsTimeoutError):
+            await stuck
+        assert await healthy == 1.5
+        assert pool.stats()["restarts"] == 1
+
+        # 其他任务完成后旧进程（包括卡住的）被终止
+        await asyncio.gather(*pool._retiring)
+        for process in old_processes:
+            process.join(5)
+            assert not process.is_alive()
+        assert await pool.run(_sleep, 0) == 0
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["lstm", "knn"])
+async def test_prediction_in_worker_matches_inline(monkeypatch, backend):
+    # 后端在主进程整理输入时选择：lstm 走模型窗口，knn 走 worker 中独立构建的近邻参考集
+    monkeypatch.setattr(emotion_prediction_tool, "EMOTION_PREDICTION_BACKEND", backend)
+    pool = AnalyticsPool(
+        initializer=emotion_prediction_tool._warm_analytics_worker,
+        workers=1,
+        timeout=30,
+    )
+    monkeypatch.setattr(emotion_prediction_tool, "analytics_pool", pool)
+    requests = [
+        {"heart_rate": {"avg": 70 + i}, "hrv": {"sdnn": 20.0 + 7 * i}} for i in range(4)
+    ]
+    requests.append({"hrv": {"sdnn": "n/a"}})
+    try:
+        results = await emotion_prediction_tool._predict_batch_async(requests)
+        # worker 构建的近邻参考集与主进程相同
+        worker_points = await pool.run(_reference_points)
+    finally:
+        await pool.close()
+
+    expected = emotion_prediction_tool._predict_batch(requests)
+    for got, want in zip(results[:-1], expected[:-1]):
+        assert got["predicted_emotion"] == want["predicted_emotion"]
+        if backend == "lstm":
+            # 近邻预测的概率带有随机扰动，只比较 LSTM 的输出
+            np.testing.assert_allclose(
+                list(got["emotion_probabilities"].values()),
+                list(want["emotion_probabilities"].values()),
+                atol=1e-6,
+            )
+    assert isinstance(results[-1], ValueError)
+    np.testing.assert_array_equal(
+        worker_points, emotion_prediction_tool._get_reference_index().points
+    )
+    assert pool.stats()["completed"] == 2
@@ -0,0 +1,115 @@
+from backend.memory.context_cache import (
+    ContextBlockCache,
+    MEMORY_BLOCK,
+    EMOTION_BLOCK,
+    SUMMARY_BLOCK,
+)
+
+
+def test_get_set_and_counters():
+    cache = ContextBlockCache(max_entries=4, ttl_seconds=60)
+
+    assert cache.get("u1", EMOTION_BLOCK) is None
+    cache.set("u1", EMOTION_BLOCK, "情绪块")
+
+    assert cache.get("u1", EMOTION_BLOCK) == "情绪块"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_empty_block_is_a_hit():
+    """空字符串也是有效的渲染结果"""
+    cache = ContextBlockCache()
+    cache.set("u1", SUMMARY_BLOCK, "")
+
+    assert cache.get("u1", SUMMARY_BLOCK) == ""
+
+
+def test_lru_eviction_keeps_recently_used():
+    cache = ContextBlockCache(max_entries=2, ttl_seconds=60)
+    cache.set("u1", EMOTION_BLOCK, "a")
+    cache.set("u2", EMOTION_BLOCK, "b")
+    cache.get("u1", EMOTION_BLOCK)
+    cache.set("u3", EMOTION_BLOCK, "c")
+
+    assert cache.get("u2", EMOTION_BLOCK) is None
+    assert cache.get("u1", EMOTION_BLOCK) == "a"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("backend.memory.context_cache.time.monotonic", lambda: now[0])
+    cache = ContextBlockCache(ttl_seconds=10)
+    cache.set("u1", EMOTION_BLOCK, "a")
+
+    now[0] += 11
+
+    assert cache.get("u1", EMOTION_BLOCK) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_invalidate_only_named_blocks():
+    cache = ContextBlockCache()
+    cache.set("u1", MEMORY_BLOCK, "m1", variant="工作")
+    cache.set("u1", MEMORY_BLOCK, "m2", variant="睡眠")
+    cache.set("u1", SUMMARY_BLOCK, "s")
+    cache.set("u2", MEMORY_BLOCK, "other", variant="工作")
+
+    cache.invalidate("u1", [MEMORY_BLOCK])
+
+    assert cache.get("u1", MEMORY_BLOCK, variant="工作") is None
+    assert cache.get("u1", MEMORY_BLOCK, variant="睡眠") is None
+    assert cache.get("u1", SUMMARY_BLOCK) == "s"
+    assert cache.get("u2", MEMORY_BLOCK, variant="工作") == "other"
+
+
+def test_invalidate_all_blocks_for_user():
+    cache = ContextBlockCache()
+    cache.set("u1", MEMORY_BLOCK, "m")
+    cache.set("u1", SUMMARY_BLOCK, "s")
+
+    cache.invalidate("u1")
+
+    assert cache.stats()["entries"] == 0
+
+
+def test_fill_started_before_invalidate_is_dropped():
+    cache = ContextBlockCache()
+    assert cache.get("u1", SUMMARY_BLOCK) is None
+    generation = cache.generation("u1", SUMMARY_BLOCK)
+
+    # 读取数据源期间发生了写入
+    cache.invalidate("u1", [SUMMARY_BLOCK])
+    assert cache.set("u1", SUMMARY_BLOCK, "旧摘要", generation=generation) is False
+    assert cache.get("u1", SUMMARY_BLOCK) is None
+    assert cache.stats()["stale_fills"] == 1
+
+    # 其他块和之后开始的读取不受影响
+    cache.invalidate("u1")
+    emotion_generation = cache.generation("u1", EMOTION_BLOCK)
+    assert (
+        cache.set("u1", EMOTION_BLOCK, "情绪块", generation=emotion_generation) is True
+    )
+    assert cache.get("u1", EMOTION_BLOCK) == "情绪块"
+
+
+def test_invalidation_records_stay_bounded():
+    cache = ContextBlockCache(max_entries=4)
+    generation = cache.generation("u0", SUMMARY_BLOCK)
+    for i in range(1000):
+        cache.invalidate(f"u{i}", [SUMMARY_BLOCK])
+
+    assert len(cache._invalidated) == 4
+    # 淘汰的失效记录可能覆盖这次读取，回填保守地丢弃
+    assert cache.set("u0", SUMMARY_BLOCK, "旧摘要", generation=generation) is False
+    # 之后开始的读取正常回填
+    assert (
+        cache.set(
+            "u0",
+            SUMMARY_BLOCK,
+            "新摘要",
+            generation=cache.generation("u0", SUMMARY_BLOCK),
+        )
+        is True
+    )
@@ -0,0 +1,97 @@
+from backend.services.context_packer import (
+    ContextPacker,
+    ContextSection,
+    ConversationBuffer,
+    count_message_tokens,
+    count_tokens,
+    PRIORITY_MEMORY,
+    PRIORITY_EMOTION,
+)
+
+
+def _filled_buffer(turns: int, max_tokens: int = 10_000) -> ConversationBuffer:
+    buffer = ConversationBuffer(max_tokens=max_tokens)
+    for i in range(turns):
+        buffer.append({"role": "user", "content": f"第{i}轮的问题"})
+        buffer.append({"role": "assistant", "content": f"第{i}轮的回答"})
+    return buffer
+
+
+def _prompt_tokens(messages) -> int:
+    return sum(count_message_tokens(m) for m in messages)
+
+
+def test_buffer_keeps_leading_assistant_message_within_budget():
+    """助手主动提出的问题在用户回复后仍然保留"""
+    buffer = ConversationBuffer(max_tokens=10_000)
+    buffer.append({"role": "assistant", "content": "最近睡得好吗？"})
+    buffer.append({"role": "user", "content": "不太好"})
+    buffer.append({"role": "assistant", "content": "怎么了？"})
+
+    assert [m["role"] for m in buffer.messages] == ["assistant", "user", "assistant"]
+    assert buffer.total_tokens == _prompt_tokens(buffer.messages)
+
+
+def test_count_tokens_handles_cjk_and_latin():
+    assert count_tokens("") == 0
+    assert count_tokens("最近工作压力很大") >= 8
+    assert count_tokens("stress") >= 1
+
+
+def test_buffer_tracks_running_total():
+    buffer = _filled_buffer(3)
+
+    assert len(buffer) == 6
+    assert buffer.total_tokens == sum(count_message_tokens(m) for m in buffer.messages)
+
+
+def test_buffer_trims_oldest_whole_turns():
+    per_turn = _filled_buffer(1).total_tokens
+    buffer = _filled_buffer(5, max_tokens=per_turn * 2)
+
+    assert buffer.total_tokens <= per_turn * 2
+    assert buffer.messages[0] == {"role": "user", "content": "第3轮的问题"}
+    assert buffer.messages[-1]["content"] == "第4轮的回答"
+
+
+def test_pack_includes_history_in_order():
+    packer = ContextPacker(budget=10_000)
+    messages = packer.pack("指令", [], _filled_buffer(2), "现在的问题")
+
+    assert [m["content"] for m in messages[1:]] == [
+        "第0轮的问题",
+        "第0轮的回答",
+        "第1轮的问题",
+        "第1轮的回答",
+        "现在的问题",
+    ]
+
+
+def test_pack_respects_budget_with_priority_and_recency():
+    history = _filled_buffer(10)
+    memories = ContextSection(
+        "memories", "回忆：", [f"- 记忆{i}" for i in range(5)], PRIORITY_MEMORY
+    )
+    emotions = ContextSection(
+        "emotions", "状态：", [f"- 情绪{i}" for i in range(5)], PRIORITY_EMOTION
+    )
+    packer = ContextPacker(budget=90, min_history_turns=2)
+
+    messages = packer.pack("指令", [memories, emotions], history, "现在的问题")
+
+    assert _prompt_tokens(messages) <= 90
+    # 最近两轮一定保留，且历史保持连续
+    contents = [m["content"] for m in messages[1:-1]]
+    assert contents[-4:] == ["第8轮的问题", "第8轮的回答", "第9轮的问题", "第9轮的回答"]
+    assert len(contents) < len(history)
+    # 记忆优先于情绪历史
+    system_prompt = messages[0]["content"]
+    assert "记忆4" in system_prompt
+    assert "情绪4" not in system_prompt
+
+
+def test_pack_without_history():
+    messages = ContextPacker(budget=100).pack("指令", [], None, "你好")
+
+    assert messages[0]["role"] == "system"
+    assert messages[-1] == {"role": "user", "content": "你好"}
@@ -0,0 +1,639 @@
+import re
+import asyncio
+import copy
+
+import pytest
+from azure.cosmos import exceptions
+
+from backend.memory.cosmos_memory_store import CosmosMemoryStore
+from backend.memory.embeddings import embedding_engine
+
+
+class _AsyncItems:
+    """模拟异步 SDK 返回的分页结果"""
+
+    def __init__(self, items, delay, response_hook=None):
+        self._items = list(items)
+        self._delay = delay
+        self._response_hook = response_hook
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await asyncio.sleep(self._delay)
+        if self._response_hook:
+            self._response_hook({"x-ms-request-charge": "2.5"}, self._items)
+        for item in self._items:
+            yield item
+
+
+class _FakeContainer:
+    """模拟 azure.cosmos.aio 的 ContainerProxy"""
+
+    def __init__(self, items=None, delay=0.0):
+        self.items = list(items or [])
+        self.delay = delay
+        self.created = []
+        self.batches = []
+        self.queries = []
+        self.reads = []
+        self.replaced = []
+        self.upserted = []
+        # 之后的写入请求依次抛出这些异常
+        self.failures = []
+
+    def query_items(self, query, **kwargs):
+        self.queries.append((query, kwargs))
+        return _AsyncItems(self.items, self.delay, kwargs.get("response_hook"))
+
+    async def read_item(self, item, partition_key, response_hook=None, **kwargs):
+        self.reads.append((item, partition_key))
+        if response_hook:
+            response_hook({"x-ms-request-charge": "1"}, None)
+        for doc in self.items + self.created:
+            if doc["id"] == item and doc["user_id"] == partition_key:
+                return doc
+        raise exceptions.CosmosResourceNotFoundError(message="not found")
+
+    async def create_item(self, body, **kwargs):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.created.append(body)
+        return body
+
+    async def replace_item(self, item, body, **kwargs):
+        self.replaced.append(body)
+        return body
+
+    async def upsert_item(self, body, **kwargs):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.upserted.append(body)
+        return body
+
+    async def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.batches.append((partition_key, [args[0] for _, args in batch_operations]))
+        return []
+
+
+def _make_store(delay=0.0, emotions=None):
+    store = CosmosMemoryStore()
+    store.client = object()
+    store.profile_container = _FakeContainer(delay=delay)
+    store.interaction_container = _FakeContainer(delay=delay)
+    store.emotion_container = _FakeContainer(emotions, delay=delay)
+    store.embedding_container = _FakeContainer(delay=delay)
+    store.conversation_container = _FakeContainer(delay=delay)
+    return store
+
+
+@pytest.mark.asyncio
+async def test_queries_do_not_block_event_loop():
+    """慢查询期间事件循环应能处理其他请求"""
+    store = _make_store(delay=0.2, emotions=[{"emotion": "P"}])
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    results = await asyncio.gather(
+        *(store.get_recent_emotions(f"user_{i}") for i in range(5))
+    )
+    elapsed = loop.time() - started
+
+    assert elapsed < 0.5
+    assert [[e["emotion"] for e in result] for result in results] == [["P"]] * 5
+
+
+@pytest.mark.asyncio
+async def test_add_interactions_batches_per_user_and_container():
+    store = _make_store()
+    records = [
+        {
+            "user_id": "alice",
+            "text": "today was long",
+            "emotion": "N",
+            "suggestion": "rest",
+        },
+        {
+            "user_id": "alice",
+            "text": "feeling better",
+            "emotion": "P",
+            "suggestion": "great",
+        },
+        {"user_id": "bob", "text": "hello there", "emotion": "P", "suggestion": "hi"},
+    ]
+
+    ids = await store.add_interactions(records)
+
+    assert len(set(ids)) == 3
+    # 同一用户的多条记录以一个事务批处理写入，单条记录直接创建
+    assert [
+        (pk, [doc["text"] for doc in docs])
+        for pk, docs in store.interaction_container.batches
+    ] == [("alice", ["today was long", "feeling better"])]
+    assert [doc["user_id"] for doc in store.interaction_container.upserted] == ["bob"]
+    assert len(store.emotion_container.batches) == 1
+    assert len(store.embedding_container.batches) == 1
+    assert (
+        store.emotion_container.batches[0][1][0]["id"] == "emo_" + ids[0][len("int_") :]
+    )
+
+
+@pytest.mark.asyncio
+async def test_write_behind_retries_cosmos_failures_without_duplicates(
+    tmp_path, monkeypatch
+):
+    from backend.memory.write_behind import WriteBehindQueue
+
+    async def no_sleep(_):
+        return None
+
+    store = _make_store()
+    local_writes, series_adds = [], []
+    monkeypatch.setattr(store, "_add_local_interactions", local_writes.append)
+    monkeypatch.setattr(
+        store.emotion_series,
+        "add",
+        lambda user_id, record: series_adds.append(record["id"]),
+    )
+    throttled = exceptions.CosmosHttpResponseError(status_code=429, message="throttled")
+    store.emotion_container.failures = [throttled]
+    record = {
+        "id": "int_fixed",
+        "user_id": "alice",
+        "text": "hello there",
+        "emotion": "P",
+        "suggestion": "hi",
+    }
+
+    # 后台写入路径：Cosmos 出错时抛出异常，不写本地存储，也不更新内存索引
+    with pytest.raises(exceptions.CosmosHttpResponseError):
+        await store.add_interactions([record], raise_on_error=True)
+    assert local_writes == []
+    assert series_adds == []
+
+    store.emotion_container.failures = [throttled]
+    monkeypatch.setattr("backend.memory.write_behind.asyncio.sleep", no_sleep)
+    queue = WriteBehindQueue(
+        lambda batch: store.add_interactions(batch, raise_on_error=True),
+        flush_interval=0,
+        spill_path=str(tmp_path / "pending.jsonl"),
+    )
+    await queue.submit(record)
+    await queue.close()
+
+    assert queue.stats()["retries"] == 1 and queue.stats()["written"] == 1
+    # 重试使用同一个ID upsert，不会产生重复文档
+    assert [doc["id"] for doc in store.interaction_container.upserted] == [
+        "int_fixed"
+    ] * 3
+    assert [doc["id"] for doc in store.emotion_container.upserted] == ["emo_fixed"]
+    assert series_adds == ["int_fixed"]
+    assert local_writes == []
+
+
+@pytest.mark.asyncio
+async def test_profile_uses_point_read_and_records_request_charge():
+    store = _make_store()
+    store.profile_container.items = [
+        {"id": "alice", "user_id": "alice", "preferences": {}}
+    ]
+
+    profile = await store.get_user_profile("alice")
+    missing = await store.get_user_profile("bob")
+
+    assert profile["id"] == "alice"
+    assert missing["user_id"] == "bob"
+    assert store.profile_container.queries == []
+    assert store.profile_container.reads == [("alice", "alice"), ("bob", "bob")]
+    stats = store.request_charges.stats()
+    assert stats["operations"]["get_user_profile"] == {
+        "calls": 2,
+        "request_units": 2.0,
+        "avg_request_units": 1.0,
+        "max_request_units": 1.0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_concurrent_first_requests_for_a_username_create_one_profile():
+    store = _make_store()
+    store.profile_container = _FakeContainer(delay=0.02)
+
+    user_ids = await asyncio.gather(
+        *(store.get_user_id_by_username("小明") for _ in range(5))
+    )
+
+    assert len(set(user_ids)) == 1
+    assert len(store.profile_container.queries) == 1
+    assert [p["username"] for p in store.profile_container.created] == ["小明"]
+    # 用户ID由用户名决定，其他 worker 创建时会写入同一个文档
+    assert user_ids[0] == store._user_id_for_username("小明")
+
+    # 之后的查找和配置读取都由缓存提供
+    assert await store.get_user_id_by_username("小明") == user_ids[0]
+    profile = await store.get_user_profile(user_ids[0])
+    assert profile["username"] == "小明"
+    assert store.profile_container.reads == []
+    assert len(store.profile_container.queries) == 1
+
+
+@pytest.mark.asyncio
+async def test_preference_updates_write_through_the_profile_cache():
+    store = _make_store()
+    store.profile_container.items = [
+        {"id": "alice", "user_id": "alice", "preferences": {"tone": "supportive"}}
+    ]
+
+    await store.get_user_profile("alice")
+    await store.update_user_preferences("alice", {"tone": "humorous"})
+    profile = await store.get_user_profile("alice")
+
+    assert profile["preferences"]["tone"] == "humorous"
+    # 第一次读取和更新前各点读一次，更新后的读取命中缓存
+    assert len(store.profile_container.reads) == 2
+    profile["preferences"]["tone"] = "changed by caller"
+    assert (await store.get_user_profile("alice"))["preferences"]["tone"] == "humorous"
+
+
+@pytest.mark.asyncio
+async def test_queries_are_parameterized_and_partition_scoped():
+    store = _make_store()
+    user_id = "o'brien"
+
+    await store.get_recent_emotions(user_id, limit=3)
+    await store.retrieve_relevant_memories(
+        user_id, "feeling anxious about work", top_k=2
+    )
+
+    for container in (store.emotion_container, store.embedding_container):
+        for query, kwargs in container.queries:
+            assert user_id not in query
+            assert kwargs["partition_key"] == user_id
+            assert {"name": "@user_id", "value": user_id} in kwargs["parameters"]
+    assert (
+        store.request_charges.stats()["operations"]["get_recent_emotions"][
+            "request_units"
+        ]
+        == 2.5
+    )
+
+
+@pytest.mark.asyncio
+async def test_retrieve_fuses_vector_and_keyword_rankings_and_indexes_new_memories():
+    store = _make_store()
+
+    def memory(memory_id, text):
+        return {
+            "id": memory_id,
+            "user_id": "alice",
+            "summary": text,
+            "embedding": embedding_engine.embed_batch([text])[0].tolist(),
+            "embedding_model": embedding_engine.model_name,
+        }
+
+    store.embedding_container.items = [
+        memory("mem_1", "最近工作压力很大，经常加班"),
+        memory("mem_2", "晚上总是睡不着，半夜会醒"),
+        # 旧版本生成的向量不参与向量检索，但仍可按关键词检索到
+        {
+            "id": "mem_0",
+            "user_id": "alice",
+            "summary": "和妈妈吵架了",
+            "embedding": [0.1] * 10,
+        },
+    ]
+
+    result = await store.retrieve_relevant_memories(
+        "alice", "这几天又睡不着了", top_k=1
+    )
+    assert [m["summary"] for m in result["memories"]] == ["晚上总是睡不着，半夜会醒"]
+    assert 0 < result["memories"][0]["relevance"] <= 1
+
+    result = await store.retrieve_relevant_memories("alice", "又跟妈妈吵架", top_k=1)
+    assert [m["summary"] for m in result["memories"]] == ["和妈妈吵架了"]
+
+    # 新写入的记忆直接插入已加载的索引，不再重新加载
+    await store.add_interaction("alice", "今天下雨了，不想出门", "N", "在家休息一下")
+    result = await store.retrieve_relevant_memories("alice", "下雨天", top_k=1)
+    assert [m["summary"] for m in result["memories"]] == ["今天下雨了，不想出门"]
+    assert len(store.embedding_container.queries) == 1
+
+
+def test_lifespan_shares_one_memory_store():
+    from fastapi.testclient import TestClient
+    from backend.main import app
+
+    with TestClient(app) as client:
+        assert app.state.agent_kernel.memory_store is app.state.memory_store
+        assert client.get("/health/metrics").status_code == 200
+
+
+class _ConversationContainer(_FakeContainer):
+    """支持事务批处理、patch 和点读的对话容器"""
+
+    def __init__(self):
+        super().__init__()
+        self.docs = {}
+        self.patches = []
+
+    async def read_item(self, item, partition_key, **kwargs):
+        self.reads.append((item, partition_key))
+        doc = self.docs.get((partition_key, item))
+        if doc is None:
+            raise exceptions.CosmosResourceNotFoundError(message="not found")
+        return copy.deepcopy(doc)
+
+    async def create_item(self, body, **kwargs):
+        key = (body["user_id"], body["id"])
+        if key in self.docs:
+            raise exceptions.CosmosResourceExistsError(message="exists")
+        self.docs[key] = copy.deepcopy(body)
+        return body
+
+    async def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        for _, (body,) in batch_operations:
+            await self.create_item(body)
+        return []
+
+    async def patch_item(
+        self, item, partition_key, patch_operations, filter_predicate=None, **kwargs
+    ):
+        doc = self.docs.get((partition_key, item))
+        if doc is None:
+            raise exceptions.CosmosResourceNotFoundError(message="not found")
+        if self.failures and re.search(r"_b\d{6}$", item):
+            raise self.failures.pop(0)
+        if filter_predicate is not None:
+            # 只支持 "FROM c WHERE c.<字段> = <整数>"
+            field, value = re.fullmatch(
+                r"FROM c WHERE c\.(\w+) = (-?\d+)", filter_predicate
+            ).groups()
+            if doc.get(field) != int(value):
+                raise exceptions.CosmosAccessConditionFailedError(
+                    message="precondition failed"
+                )
+        self.patches.append((item, len(patch_operations)))
+        for operation in patch_operations:
+            *parents, name = operation["path"].strip("/").split("/")
+            target = doc
+            for part in parents:
+                target = target[part]
+            if operation["op"] == "incr":
+                target[name] = target.get(name, 0) + operation["value"]
+            elif operation["op"] == "set":
+                target[name] = operation["value"]
+            elif operation["op"] == "remove":
+                del target[int(name) if isinstance(target, list) else name]
+            elif name == "-":
+                target.append(operation["value"])
+        return copy.deepcopy(doc)
+
+
+@pytest.mark.asyncio
+async def test_conversation_appends_go_to_fixed_size_buckets(monkeypatch):
+    from backend.services.summarizer import summarizer
+
+    async def fake_summarize(messages, raise_on_error=False):
+        return f"{messages[0]['content']}..{messages[-1]['content']}"
+
+    monkeypatch.setattr(summarizer, "summarize", fake_summarize)
+    store = _make_store()
+    store.conversation_container = container = _ConversationContainer()
+
+    conversation_id = await store.append_conversation_messages(
+        "alice",
+        [
+            {"role": "user", "content": "m0", "emotion": "N"},
+            {"role": "assistant", "content": "m1"},
+        ],
+        is_new=True,
+    )
+    for turn in range(1, 60):
+        container.patches.clear()
+        assert (
+            await store.append_conversation_messages(
+                "alice",
+                [
+                    {"role": "user", "content": f"m{2 * turn}", "emotion": "P"},
+                    {"role": "assistant", "content": f"m{2 * turn + 1}"},
+                ],
+            )
+            == conversation_id
+        )
+        # 每轮只 patch 头文档和一个分桶（另有后台生成摘要时的一次 patch），
+        # 与对话长度无关
+        assert len(container.patches) <= 3
+
+    await store.summary_worker.flush()
+    header = container.docs[("alice", conversation_id)]
+    assert "messages" not in header
+    assert header["message_count"] == 120
+    assert len(header["metadata"]["emotion_trend"]) == 60
+    buckets = sorted(
+        doc["bucket"]
+        for (_, doc_id), doc in container.docs.items()
+        if doc_id != conversation_id
+    )
+    assert buckets == [0, 1, 2]
+    assert (header["summary"][0]["text"], header["summary"][0]["message_range"]) == (
+        "m0..m9",
+        [0, 9],
+    )
+    assert len(header["summary"]) == 12
+    assert header["summary_root"]["message_range"] == [0, 119]
+    assert [node["message_range"] for node in header["summary_tree"]["1"]] == [
+        [0, 39],
+        [40, 79],
+        [80, 119],
+    ]
+
+    page = await store.get_conversation_messages(
+        "alice", conversation_id, cursor=40, limit=30
+    )
+    assert [m["content"] for m in page["messages"]] == [f"m{i}" for i in range(40, 70)]
+    assert page["next_cursor"] == 70
+    history = await store.get_conversation_history("alice")
+    assert [m["content"] for m in history] == [f"m{i}" for i in range(120)]
+    # 活跃对话ID已缓存，不需要查询
+    assert container.queries == []
+
+
+@pytest.mark.asyncio
+async def test_messages_are_read_by_position_not_arrival_order():
+    store = _make_store()
+    store.conversation_container = container = _ConversationContainer()
+    conversation_id = await store.append_conversation_messages(
+        "alice", [{"role": "user", "content": "m0"}], is_new=True
+    )
+    await store.append_conversation_messages(
+        "alice", [{"role": "assistant", "content": "m1"}]
+    )
+    await store.append_conversation_messages(
+        "alice", [{"role": "user", "content": "m2"}]
+    )
+
+    # 并发追加时后分配位置的消息可能先到达分桶，重试也可能重复追加
+    bucket = container.docs[("alice", store._bucket_id(conversation_id, 0))]
+    bucket["messages"] = [
+        bucket["messages"][2],
+        bucket["messages"][1],
+        bucket["messages"][0],
+        bucket["messages"][1],
+    ]
+
+    history = await store.get_conversation_history("alice")
+    assert history == [
+        {"role": "user", "content": "m0"},
+        {"role": "assistant", "content": "m1"},
+        {"role": "user", "content": "m2"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_failed_bucket_write_does_not_leave_the_count_ahead(monkeypatch):
+    monkeypatch.setattr(
+        "backend.memory.cosmos_memory_store.CONVERSATION_APPEND_RETRIES", 1
+    )
+    monkeypatch.setattr("backend.memory.cosmos_memory_store.asyncio.sleep", _no_sleep)
+    store = _make_store()
+    store.conversation_container = container = _ConversationContainer()
+    conversation_id = await store.append_conversation_messages(
+        "alice",
+        [
+            {"role": "user", "content": "m0", "emotion": "N"},
+            {"role": "assistant", "content": "m1"},
+        ],
+        is_new=True,
+    )
+    header = container.docs[("alice", conversation_id)]
+
+    # 限流一直持续到重试用完：计数和情绪趋势回退到写入前
+    throttled = exceptions.CosmosHttpResponseError(status_code=429, message="throttled")
+    container.failures = [throttled, throttled]
+    lost = [
+        {"role": "user", "content": "lost", "emotion": "P"},
+        {"role": "assistant", "content": "lost"},
+    ]
+    assert (
+        await store.append_conversation_messages("alice", lost)
+        == "local_conversation_id"
+    )
+    assert (header["message_count"], header["metadata"]["emotion_trend"]) == (2, ["N"])
+
+    # 重试成功时正常写入，之后的消息紧接在已存储的消息后面
+    container.failures = [throttled]
+    await store.append_conversation_messages(
+        "alice", [{"role": "user", "content": "m2", "emotion": "P"}]
+    )
+    assert [m["content"] for m in await store.get_conversation_history("alice")] == [
+        "m0",
+        "m1",
+        "m2",
+    ]
+    assert header["metadata"]["emotion_trend"] == ["N", "P"]
+
+    # 失败期间已有其他消息占用了后面的位置：计数不能回退，记录缺失数，读取时跳过空位
+    async def concurrent_append_then_fail(user_id, conversation_id, bucket, messages):
+        header["message_count"] += 1
+        container.docs[("alice", store._bucket_id(conversation_id, 0))][
+            "messages"
+        ].append({"role": "assistant", "content": "m5", "position": 5})
+        raise throttled
+
+    monkeypatch.setattr(store, "_append_to_bucket", concurrent_append_then_fail)
+    await store.append_conversation_messages("alice", lost)
+    assert (header["message_count"], header["lost_message_count"]) == (6, 2)
+    page = await store.get_conversation_messages(
+        "alice", conversation_id, cursor=2, limit=3
+    )
+    assert ([m["content"] for m in page["messages"]], page["next_cursor"]) == (
+        ["m2"],
+        5,
+    )
+    page = await store.get_conversation_messages("alice", conversation_id, cursor=5)
+    assert ([m["content"] for m in page["messages"]], page["next_cursor"]) == (
+        ["m5"],
+        None,
+    )
+
+
+async def _no_sleep(_):
+    return None
+
+
+@pytest.mark.asyncio
+async def test_legacy_whole_document_conversation_is_still_readable():
+    store = _make_store()
+    store.conversation_container = container = _ConversationContainer()
+    container.docs[("alice", "conv_1")] = {
+        "id": "conv_1",
+        "user_id": "alice",
+        "messages": [{"role": "user", "content": f"old{i}"} for i in range(3)],
+    }
+
+    page = await store.get_conversation_messages("alice", "conv_1", cursor=1, limit=5)
+    assert [m["content"] for m in page["messages"]] == ["old1", "old2"]
+    assert page["next_cursor"] is None
+    assert len(await store.get_conversation_history("alice", "conv_1")) == 3
+
+
+@pytest.mark.asyncio
+async def test_summaries_are_generated_off_the_request_path(monkeypatch):
+    from backend.services.summarizer import summarizer
+
+    release = asyncio.Event()
+
+    async def slow_summarize(messages, raise_on_error=False):
+        await release.wait()
+        return "summary"
+
+    monkeypatch.setattr(summarizer, "summarize", slow_summarize)
+    store = _make_store()
+    store.conversation_container = container = _ConversationContainer()
+
+    messages = [{"role": "user", "content": f"m{i}"} for i in range(10)]
+    conversation_id = await asyncio.wait_for(
+        store.append_conversation_messages("alice", messages, is_new=True), timeout=1
+    )
+    assert container.docs[("alice", conversation_id)]["summary"] == []
+    assert store.summary_worker.stats()["enqueued"] == 1
+
+    release.set()
+    await store.summary_worker.close()
+    assert [
+        s["text"] for s in container.docs[("alice", conversation_id)]["summary"]
+    ] == ["summary"]
+
+
+@pytest.mark.asyncio
+async def test_summary_llm_failures_are_retried_not_persisted(monkeypatch):
+    from backend.services.llm_gateway import CircuitOpenError
+    from backend.services.summarizer import summarizer
+
+    calls = []
+
+    async def flaky_summarize(messages, raise_on_error=False):
+        calls.append(raise_on_error)
+        if len(calls) == 1:
+            raise CircuitOpenError("熔断中")
+        return "real summary"
+
+    monkeypatch.setattr(summarizer, "summarize", flaky_summarize)
+    monkeypatch.setattr("backend.services.summary_worker.asyncio.sleep", _no_sleep)
+    store = _make_store()
+    store.conversation_container = container = _ConversationContainer()
+
+    messages = [{"role": "user", "content": f"m{i}"} for i in range(10)]
+    conversation_id = await store.append_conversation_messages(
+        "alice", messages, is_new=True
+    )
+    await store.summary_worker.close()
+
+    header = container.docs[("alice", conversation_id)]
+    assert calls == [True, True]
+    assert [s["text"] for s in header["summary"]] == ["real summary"]
+    assert header["summary_root"]["text"] == "real summary"
+    assert store.summary_worker.stats()["retries"] == 1
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from backend.memory.embeddings import (
+    EmbeddingCache,
+    HashedNgramEmbedder,
+    LocalEmbeddingEngine,
+)
+
+
+def test_similar_chinese_texts_are_closer_than_unrelated_ones():
+    embedder = HashedNgramEmbedder(dim=512)
+    vectors = embedder.embed_batch(
+        ["最近工作压力很大", "工作压力有点大", "今天天气很好"]
+    )
+
+    assert vectors.dtype == np.float32
+    assert np.linalg.norm(vectors, axis=1) == pytest.approx([1.0, 1.0, 1.0], abs=1e-5)
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+
+
+def test_batch_matches_single_and_projection_is_deterministic():
+    texts = ["I feel tired", "睡不好", "", "tired again"]
+    embedder = HashedNgramEmbedder(dim=256, projection_dim=64)
+    batch = embedder.embed_batch(texts)
+
+    assert batch.shape == (4, 64)
+    assert not batch[2].any()
+    for i, text in enumerate(texts):
+        assert embedder.embed_batch([text])[0] == pytest.approx(batch[i], abs=1e-6)
+    assert HashedNgramEmbedder(dim=256, projection_dim=64).embed_batch(
+        texts
+    ) == pytest.approx(batch)
+    assert embedder.model_name == "hashed-ngram-256-rp64"
+
+
+@pytest.mark.asyncio
+async def test_engine_computes_each_distinct_text_once_and_evicts():
+    calls = []
+
+    class CountingEmbedder(HashedNgramEmbedder):
+        def embed_batch(self, texts):
+            calls.append(list(texts))
+            return super().embed_batch(texts)
+
+    engine = LocalEmbeddingEngine(
+        CountingEmbedder(dim=64), EmbeddingCache(max_entries=2), thread_threshold=1
+    )
+
+    first = await engine.aembed_batch(["a", "b", "a"])
+    second = engine.embed_batch(["b", "c"])
+
+    assert calls == [["a", "b"], ["c"]]
+    assert first[0] == pytest.approx(first[2])
+    assert second[0] == pytest.approx(first[1])
+    assert engine.cache.stats()["evictions"] == 1
+    assert engine.cache.hits == 1
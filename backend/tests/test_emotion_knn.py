@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend.tools import emotion_prediction_tool
+from backend.tools.emotion_knn import EmotionKNNIndex
+
+
+def _reference(n, seed=0):
+    rng = np.random.default_rng(seed)
+    features = np.column_stack([rng.normal(50, 15, n), rng.normal(75, 12, n)])
+    labels = rng.choice(["baseline", "stress", "amusement"], n)
+    return features, labels
+
+
+def test_grid_index_matches_brute_force():
+    features, labels = _reference(5000)
+    # 包含重复点
+    features[100:110] = features[0]
+    brute = EmotionKNNIndex(features, labels, brute_force_max=10**9)
+    grid = EmotionKNNIndex(features, labels, brute_force_max=0)
+    assert grid.stats()["mode"] == "grid"
+
+    # 包含远在参考数据范围之外的查询点
+    queries = np.vstack(
+        [_reference(200, seed=1)[0], [[500.0, -100.0], [-50.0, 400.0], features[0]]]
+    )
+    brute_d, brute_i = brute.query(queries, k=7)
+    grid_d, grid_i = grid.query(queries, k=7)
+    np.testing.assert_allclose(grid_d, brute_d)
+    # 距离相同的点可能顺序不同，比较到每个下标的距离
+    np.testing.assert_allclose(
+        np.linalg.norm((features[grid_i] - queries[:, None, :]) / [50, 20], axis=-1),
+        brute_d,
+    )
+    assert brute.predict(queries)[0] == grid.predict(queries)[0]
+
+
+@pytest.mark.parametrize("spread", [0.0, 1e-6])
+def test_grid_with_constant_column_stays_small(spread):
+    features, labels = _reference(5000)
+    # 心率列为常数或几乎为常数
+    features[:, 1] = 75.0 + np.linspace(0, spread, len(features))
+    brute = EmotionKNNIndex(features, labels, brute_force_max=10**9)
+    grid = EmotionKNNIndex(features, labels, brute_force_max=0)
+
+    assert np.prod(grid.stats()["grid_shape"]) <= len(features)
+    queries = np.array([[50.0, 75.0], [500.0, -100.0], [-50.0, 400.0]])
+    np.testing.assert_allclose(
+        grid.query(queries, k=7)[0], brute.query(queries, k=7)[0]
+    )
+
+
+def test_single_query_and_weighted_vote():
+    features = np.array(
+        [[50.0, 70.0], [51.0, 70.0], [80.0, 100.0], [81.0, 100.0], [82.0, 100.0]]
+    )
+    index = EmotionKNNIndex(
+        features, ["stress", "stress", "amusement", "amusement", "amusement"]
+    )
+
+    distances, indices = index.query(np.array([50.0, 70.0]), k=2)
+    assert distances.shape == (2,)
+    assert sorted(indices.tolist()) == [0, 1]
+    # 两个很近的 stress 点权重大于三个很远的 amusement 点
+    emotions, votes = index.predict(np.array([50.0, 70.0]), k=5)
+    assert emotions == ["stress"]
+    assert votes.shape == (1, 2)
+
+    assert index.query(np.array([[0.0, 0.0]]), k=10)[1].shape == (1, 5)
+
+
+def test_prediction_does_not_mutate_reference_data(monkeypatch):
+    features, labels = _reference(300)
+    df = pd.DataFrame(
+        {"hrv_sdnn": features[:, 0], "heart_rate": features[:, 1], "emotion": labels}
+    )
+    snapshot = df.copy()
+    monkeypatch.setattr(emotion_prediction_tool, "_csv_data", df)
+    monkeypatch.setattr(emotion_prediction_tool, "_reference_index", None)
+    monkeypatch.setattr(emotion_prediction_tool, "_reference_index_built", False)
+
+    single = [
+        emotion_prediction_tool._predict_from_csv(
+            {"hrv": {"sdnn": h}, "heart_rate": {"avg": r}}
+        )
+        for h, r in features[:20]
+    ]
+    batch = emotion_prediction_tool._predict_from_features(features[:20])
+
+    pd.testing.assert_frame_equal(df, snapshot)
+    assert [r["predicted_emotion"] for r in single] == [
+        r["predicted_emotion"] for r in batch
+    ]
+    assert all(
+        sum(r["emotion_probabilities"].values()) == pytest.approx(1.0) for r in batch
+    )
@@ -0,0 +1,158 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from backend.memory.emotion_timeseries import (
+    EmotionRingBuffer,
+    EmotionTimeSeries,
+    to_epoch_us,
+)
+
+BASE = datetime(2024, 5, 1, 8, 0, 0)
+
+
+def _records(n, step_minutes=20):
+    emotions = ["P", "N", "D", "neutral"]
+    return [
+        {
+            "timestamp": (BASE + timedelta(minutes=step_minutes * i)).isoformat(),
+            "emotion": emotions[i % 4],
+            "confidence": 0.5 + i % 5 / 10,
+        }
+        for i in range(n)
+    ]
+
+
+def test_ring_buffer_overwrites_oldest_and_range_queries_match_brute_force():
+    buffer = EmotionRingBuffer(capacity=7)
+    stamps = [to_epoch_us(BASE + timedelta(minutes=i)) for i in range(12)]
+    for i, ts in enumerate(stamps):
+        buffer.append(ts, i % 3, 0.5)
+
+    assert len(buffer) == 7
+    assert buffer.timestamps[buffer.recent(3)].tolist() == stamps[:-4:-1]
+    kept = stamps[-7:]
+    for start, end in [
+        (stamps[0], stamps[-1] + 1),
+        (stamps[6], stamps[9]),
+        (stamps[11], stamps[11] + 1),
+    ]:
+        expected = [ts for ts in kept if start <= ts < end]
+        assert buffer.timestamps[buffer.between(start, end)].tolist() == expected
+
+
+def test_out_of_order_records_keep_timestamps_monotonic():
+    buffer = EmotionRingBuffer(capacity=4)
+    buffer.append(100, 0, 0.5)
+    buffer.append(50, 1, 0.5)
+    assert buffer.timestamps[buffer.recent(2)].tolist() == [100, 100]
+
+
+@pytest.mark.asyncio
+async def test_rollups_are_maintained_incrementally():
+    series_store = EmotionTimeSeries(capacity=4)
+
+    async def loader():
+        return list(reversed(_records(9)))
+
+    series = await series_store.get("alice", loader)
+    # 容量只有 4 条，汇总仍然包含全部 9 条记录
+    hourly = series_store.rollups(series, "hour")
+    assert [bucket["count"] for bucket in hourly] == [3, 3, 3]
+    assert hourly[0]["emotions"] == {"P": 1, "N": 1, "D": 1}
+    assert hourly[0]["start"] == BASE.isoformat()
+    series_store.add(
+        "alice",
+        {"timestamp": (BASE + timedelta(hours=3)).isoformat(), "emotion": "anxious"},
+    )
+    daily = series_store.rollups(series, "day")
+    assert daily[0]["count"] == 10 and daily[0]["emotions"]["anxious"] == 1
+    recent_hours = series_store.rollups(series, "hour", since=BASE + timedelta(hours=2))
+    assert [bucket["start"] for bucket in recent_hours] == [
+        (BASE + timedelta(hours=2)).isoformat(),
+        (BASE + timedelta(hours=3)).isoformat(),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_reload_keeps_rollups_older_than_buffer(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(
+        "backend.memory.emotion_timeseries.time.monotonic", lambda: now[0]
+    )
+    series_store = EmotionTimeSeries(capacity=4, ttl_seconds=60)
+    records = _records(12)
+
+    async def load_all():
+        return list(reversed(records))
+
+    async def load_recent():
+        # 存储只返回最近 capacity 条
+        return list(reversed(records[-4:]))
+
+    await series_store.get("alice", load_all)
+    now[0] += 61
+    series = await series_store.get("alice", load_recent)
+
+    assert series_store.loads == 2
+    assert [bucket["count"] for bucket in series_store.rollups(series, "hour")] == [
+        3,
+        3,
+        3,
+        3,
+    ]
+    assert series_store.rollups(series, "day")[0]["count"] == 12
+    assert len(series_store.recent("alice", series, 10)) == 4
+
+
+@pytest.mark.asyncio
+async def test_snapshot_round_trip(tmp_path):
+    original = EmotionTimeSeries(capacity=8)
+
+    async def loader():
+        return list(reversed(_records(12)))
+
+    series = await original.get("alice", loader)
+    original.add(
+        "alice",
+        {
+            "timestamp": (BASE + timedelta(hours=5)).isoformat(),
+            "emotion": "calm",
+            "confidence": 0.9,
+        },
+    )
+    path = str(tmp_path / "series.npz")
+    assert original.save_snapshot(path) == 1
+
+    restored = EmotionTimeSeries(capacity=8)
+    restored.vocabulary.encode("other")  # 标签编码与快照不同也能正确恢复
+    assert restored.load_snapshot(path) == 1
+
+    async def failing_loader():
+        raise AssertionError("restored series should not be reloaded")
+
+    restored_series = await restored.get("alice", failing_loader)
+    assert restored.recent("alice", restored_series, 5) == original.recent(
+        "alice", series, 5
+    )
+    assert restored.rollups(restored_series, "hour") == original.rollups(series, "hour")
+    assert np.array_equal(
+        restored_series.daily.counts.sum(axis=1), series.daily.counts.sum(axis=1)
+    )
+
+    assert EmotionTimeSeries(ttl_seconds=0).load_snapshot(path) == 0
+
+
+@pytest.mark.asyncio
+async def test_store_serves_recent_emotions_from_memory():
+    from backend.tests.test_cosmos_memory_store import _make_store
+
+    store = _make_store(emotions=list(reversed(_records(3))))
+    first = await store.get_recent_emotions("alice", limit=2)
+    await store.add_interaction("alice", "好一点了", "P", "继续保持")
+    second = await store.get_recent_emotions("alice", limit=2)
+
+    assert [e["emotion"] for e in first] == ["D", "N"]
+    assert [e["emotion"] for e in second] == ["P", "D"]
+    assert len(store.emotion_container.queries) == 1
@@ -0,0 +1,133 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend.tools import health_features
+from backend.tools.health_features import (
+    HealthFeatureCache,
+    lag_features,
+    read_healthkit_records,
+    sliding_windows,
+)
+
+SHIPPED_CSV = os.path.join(
+    os.path.dirname(__file__), "..", "..", "model", "HeartRateVariabilitySDNN.csv"
+)
+
+CSV_HEADER = "sourceName,sourceVersion,unit,creationDate,startDate,endDate,value\n"
+
+
+def _row(start, end, value, source="watch"):
+    return f"{source},10.0,ms,{end},{start},{end},{value}\n"
+
+
+def test_windows_match_notebook_on_shipped_export(tmp_path):
+    # model/predict.ipynb 中的特征和窗口构造
+    df = pd.read_csv(SHIPPED_CSV)
+    df["startDate"] = pd.to_datetime(df["startDate"])
+    df = df.sort_values("startDate").reset_index(drop=True)
+    df["HRV_SDNN"] = df["value"]
+    df["HRV_SDNN_lag1"] = df["HRV_SDNN"].shift(1)
+    df["HRV_SDNN_lag2"] = df["HRV_SDNN"].shift(2)
+    X = df[["HRV_SDNN", "HRV_SDNN_lag1", "HRV_SDNN_lag2"]].fillna(0)
+    expected = np.array([X[i : i + 5] for i in range(len(X) - 5)])
+
+    features = HealthFeatureCache(str(tmp_path)).load(SHIPPED_CSV)
+    windows = features.windows(5)
+
+    assert windows.shape == (len(X) - 4, 5, 3)
+    np.testing.assert_allclose(windows[: len(expected)], expected, rtol=1e-6)
+    np.testing.assert_array_equal(features.latest_window(5)[0], windows[-1])
+    assert np.shares_memory(windows, features.features)
+
+
+def test_records_are_sorted_in_utc_and_deduplicated(tmp_path):
+    path = tmp_path / "export.csv"
+    path.write_text(
+        CSV_HEADER + _row("2023-10-28 09:00:00 +0800", "2023-10-28 09:01:00 +0800", 30)
+        # UTC 00:30，早于上一条（UTC 01:00）
+        + _row("2023-10-28 08:30:00 +0800", "2023-10-28 08:31:00 +0800", 20)
+        # UTC 00:00，最早的一条
+        + _row("2023-10-27 19:00:00 -0500", "2023-10-27 19:01:00 -0500", 10)
+        # 重复导出的同一条记录（来源不同）
+        + _row(
+            "2023-10-28 09:00:00 +0800", "2023-10-28 09:01:00 +0800", 30, source="phone"
+        )
+        + _row("not a date", "not a date", 99)
+        + _row("2023-10-28 10:00:00 +0800", "2023-10-28 10:01:00 +0800", ""),
+        encoding="utf-8",
+    )
+
+    starts, values = read_healthkit_records(str(path))
+
+    assert values.tolist() == [10, 20, 30]
+    assert list(np.diff(starts) > 0) == [True, True]
+    assert starts[0] == pd.Timestamp("2023-10-28 00:00:00", tz="UTC").value // 1000
+
+
+def test_export_xml_is_parsed(tmp_path):
+    path = tmp_path / "export.xml"
+    path.write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>\n<HealthData>\n'
+        '<Record type="HKQuantityTypeIdentifierHeartRate" '
+        'startDate="2023-10-28 08:00:00 +0800" '
+        'endDate="2023-10-28 08:00:00 +0800" value="70"/>\n'
+        '<Record type="HKQuantityTypeIdentifierHeartRateVariabilitySDNN" '
+        'startDate="2023-10-28 09:00:00 +0800" '
+        'endDate="2023-10-28 09:01:00 +0800" value="41.5"/>\n'
+        '<Record type="HKQuantityTypeIdentifierHeartRateVariabilitySDNN" '
+        'startDate="2023-10-28 08:00:00 +0800" '
+        'endDate="2023-10-28 08:01:00 +0800" value="35"/>\n'
+        "</HealthData>\n",
+        encoding="utf-8",
+    )
+
+    _, values = read_healthkit_records(str(path))
+    assert values.tolist() == [35, 41.5]
+
+
+def test_lag_features_and_short_series():
+    np.testing.assert_array_equal(
+        lag_features([1, 2, 3]), [[1, 0, 0], [2, 1, 0], [3, 2, 1]]
+    )
+    assert sliding_windows(lag_features([1, 2]), 5).shape == (0, 5, 3)
+
+
+def test_cache_is_reused_and_invalidated_when_the_source_changes(tmp_path, monkeypatch):
+    source = tmp_path / "export.csv"
+    source.write_text(
+        CSV_HEADER
+        + "".join(
+            _row(f"2023-10-28 0{i}:00:00 +0800", f"2023-10-28 0{i}:01:00 +0800", 10 + i)
+            for i in range(6)
+        ),
+        encoding="utf-8",
+    )
+    cache_dir = str(tmp_path / "cache")
+    first = HealthFeatureCache(cache_dir).load(str(source))
+    assert os.path.exists(HealthFeatureCache(cache_dir).cache_path(str(source)))
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("应当读取缓存")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(health_features, "read_healthkit_records", _fail)
+        cached = HealthFeatureCache(cache_dir).load(str(source))
+    assert cached.features.dtype == np.float32
+    np.testing.assert_array_equal(cached.features, first.features)
+    np.testing.assert_array_equal(cached.timestamps, first.timestamps)
+
+    # 重新上传后（大小和修改时间变化）重建
+    with open(source, "a", encoding="utf-8") as f:
+        f.write(_row("2023-10-28 07:00:00 +0800", "2023-10-28 07:01:00 +0800", 50))
+    os.utime(source, ns=(0, os.stat(source).st_mtime_ns + 10**9))
+    assert len(HealthFeatureCache(cache_dir).load(str(source))) == 7
+
+
+def test_non_healthkit_csv_is_rejected(tmp_path):
+    path = tmp_path / "other.csv"
+    path.write_text("hrv_sdnn,heart_rate\n50,70\n", encoding="utf-8")
+    with pytest.raises(ValueError):
+        read_healthkit_records(str(path))
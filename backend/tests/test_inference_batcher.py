@@ -0,0 +1,132 @@
+import time
+import asyncio
+
+import numpy as np
+import pytest
+
+from backend.services.inference_batcher import InferenceBatcher
+from backend.tools import emotion_prediction_tool
+
+
+class _RecordingHandler:
+    """记录每一批输入的假批处理函数"""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.batches = []
+
+    async def __call__(self, items):
+        self.batches.append(list(items))
+        if self.fail_on == "batch":
+            raise RuntimeError("批处理失败")
+        return [
+            ValueError(item) if item == self.fail_on else item * 10 for item in items
+        ]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_batch():
+    handler = _RecordingHandler()
+    batcher = InferenceBatcher(handler, max_wait_ms=20, max_batch_size=100)
+
+    results = await asyncio.gather(*(batcher.submit(i) for i in range(10)))
+
+    assert results == [i * 10 for i in range(10)]
+    assert handler.batches == [list(range(10))]
+    stats = batcher.stats()
+    assert stats["batches"] == 1 and stats["items"] == 10
+    assert stats["batch_size"]["max"] == 10
+    assert stats["wait_ms"]["max"] >= 0
+    assert stats["pending"] == 0
+
+
+@pytest.mark.asyncio
+async def test_full_batch_runs_without_waiting():
+    handler = _RecordingHandler()
+    batcher = InferenceBatcher(handler, max_wait_ms=10_000, max_batch_size=4)
+
+    started = time.perf_counter()
+    results = await asyncio.wait_for(
+        asyncio.gather(*(batcher.submit(i) for i in range(8))), timeout=1
+    )
+
+    assert time.perf_counter() - started < 1
+    assert results == [i * 10 for i in range(8)]
+    assert handler.batches == [[0, 1, 2, 3], [4, 5, 6, 7]]
+    assert batcher.stats()["largest_batch"] == 4
+
+
+@pytest.mark.asyncio
+async def test_errors_are_scattered_to_the_affected_requests():
+    batcher = InferenceBatcher(_RecordingHandler(fail_on=2), max_wait_ms=5)
+    results = await asyncio.gather(
+        *(batcher.submit(i) for i in range(4)), return_exceptions=True
+    )
+    assert [r for i, r in enumerate(results) if i != 2] == [0, 10, 30]
+    assert isinstance(results[2], ValueError)
+
+    failing = InferenceBatcher(_RecordingHandler(fail_on="batch"), max_wait_ms=5)
+    results = await asyncio.gather(
+        *(failing.submit(i) for i in range(3)), return_exceptions=True
+    )
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert failing.stats()["errors"] == 3
+
+
+def test_batched_prediction_matches_individual_predictions(monkeypatch):
+    monkeypatch.setattr(emotion_prediction_tool, "EMOTION_PREDICTION_BACKEND", "lstm")
+    requests = [
+        {"heart_rate": {"avg": 70 + i}, "hrv": {"sdnn": 20.0 + 7 * i}} for i in range(6)
+    ]
+    requests.append({"heart_rate": {"avg": 70}})
+
+    batched = emotion_prediction_tool._predict_batch(requests)
+    individual = [emotion_prediction_tool._predict_batch([r])[0] for r in requests]
+
+    for got, expected in zip(batched, individual):
+        assert got["predicted_emotion"] == expected["predicted_emotion"]
+        np.testing.assert_allclose(
+            list(got["emotion_probabilities"].values()),
+            list(expected["emotion_probabilities"].values()),
+            atol=1e-6,
+        )
+
+    # 没有模型时回退到近邻，无效输入只影响自己
+    monkeypatch.setattr(emotion_prediction_tool, "EMOTION_PREDICTION_BACKEND", "knn")
+    results = emotion_prediction_tool._predict_batch([requests[0], {"hrv": {}}])
+    assert results[0]["predicted_emotion"] in ("baseline", "stress", "amusement")
+    assert isinstance(results[1], ValueError)
+
+
+@pytest.mark.asyncio
+async def test_submit_from_another_thread_joins_the_owner_batch():
+    handler = _RecordingHandler()
+    batcher = InferenceBatcher(handler, max_wait_ms=100, max_batch_size=100)
+
+    # 同步工具路径：线程中用 asyncio.run 提交
+    results = await asyncio.gather(
+        batcher.submit(1), asyncio.to_thread(lambda: asyncio.run(batcher.submit(2)))
+    )
+
+    assert results == [10, 20]
+    assert handler.batches == [[1, 2]]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_batch_fails_its_callers():
+    started = asyncio.Event()
+
+    async def slow_handler(items):
+        started.set()
+        await asyncio.sleep(10)
+
+    batcher = InferenceBatcher(slow_handler, max_wait_ms=0)
+    calls = [asyncio.ensure_future(batcher.submit(i)) for i in range(3)]
+    await started.wait()
+    for task in list(batcher._running):
+        task.cancel()
+
+    results = await asyncio.wait_for(
+        asyncio.gather(*calls, return_exceptions=True), timeout=1
+    )
+    assert all(isinstance(r, RuntimeError) for r in results)
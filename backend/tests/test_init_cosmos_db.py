@@ -0,0 +1,226 @@
+import os
+import json
+import asyncio
+
+import pytest
+from azure.cosmos import exceptions
+
+from backend.scripts.init_cosmos_db import (
+    BulkMigrator,
+    MigrationCheckpoint,
+    MigrationError,
+    iter_export_items,
+    iter_json_array,
+    iter_json_members,
+    iter_memory_items,
+    transform_memory_data,
+)
+
+
+def _http_error(status_code, retry_after_ms=None):
+    error = exceptions.CosmosHttpResponseError(
+        status_code=status_code, message=f"status {status_code}"
+    )
+    if retry_after_ms is not None:
+        error.headers = {"x-ms-retry-after-ms": str(retry_after_ms)}
+    return error
+
+
+class _FakeContainer:
+    """记录 upsert 的假容器，可按 id 注入错误"""
+
+    def __init__(self, errors=None, charge=2.5):
+        # id -> 依次抛出的异常列表
+        self.errors = errors or {}
+        self.charge = charge
+        self.items = {}
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def upsert_item(self, body, response_hook=None):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.001)
+            pending = self.errors.get(body["id"])
+            if pending:
+                raise pending.pop(0)
+            self.items[body["id"]] = dict(body)
+            if response_hook:
+                response_hook({"x-ms-request-charge": str(self.charge)}, body)
+            return body
+        finally:
+            self.in_flight -= 1
+
+
+def _items(n):
+    return [
+        ("interactions", {"id": f"i{i}", "user_id": "alice", "i": i}) for i in range(n)
+    ]
+
+
+def test_streaming_readers_match_whole_file_parsing(tmp_path):
+    array_path = tmp_path / "export.json"
+    records = [{"id": f"r{i}", "text": "情绪" * i, "n": i * 1000} for i in range(50)]
+    array_path.write_text(
+        json.dumps(records, ensure_ascii=False, indent=2), encoding="utf-8"
+    )
+    # 很小的读取块，迫使值和数字跨块边界
+    assert list(iter_json_array(str(array_path), chunk_size=7)) == records
+
+    jsonl_path = tmp_path / "export.jsonl"
+    jsonl_path.write_text(
+        "\n".join(json.dumps(r) for r in records[:3]) + "\n\n", encoding="utf-8"
+    )
+    assert [
+        item for _, item in iter_export_items(str(jsonl_path), "interactions")
+    ] == records[:3]
+
+    nested_path = tmp_path / "nested.json"
+    nested_path.write_text(
+        json.dumps({"meta": {"v": [1, 2]}, "users": {"a": {"x": 1}, "b": {}}}),
+        encoding="utf-8",
+    )
+    assert list(iter_json_members(str(nested_path), ("users",), chunk_size=5)) == [
+        ("a", {"x": 1}),
+        ("b", {}),
+    ]
+    assert list(iter_json_members(str(nested_path), ("missing",))) == []
+
+    memory_path = os.path.join(os.path.dirname(__file__), "..", "memory", "memory.json")
+    with open(memory_path, "r", encoding="utf-8") as f:
+        expected = transform_memory_data(json.load(f))
+    assert list(iter_memory_items(memory_path)) == expected
+
+
+def test_export_items_without_id_get_stable_ids(tmp_path):
+    path = tmp_path / "export.jsonl"
+    path.write_text(json.dumps({"user_id": None, "text": "a"}) + "\n", encoding="utf-8")
+
+    first = [item["id"] for _, item in iter_export_items(str(path), "interactions")]
+    second = [item["id"] for _, item in iter_export_items(str(path), "interactions")]
+    assert first == second
+
+
+@pytest.mark.asyncio
+async def test_id_less_rows_for_same_user_are_not_collapsed(tmp_path):
+    path = tmp_path / "interactions.jsonl"
+    rows = [{"user_id": "alice", "text": "上午"}, {"user_id": "alice", "text": "晚上"}]
+    path.write_text(
+        "\n".join(json.dumps(row, ensure_ascii=False) for row in rows), encoding="utf-8"
+    )
+    container = _FakeContainer()
+    migrator = BulkMigrator(
+        {"interactions": container}, batch_size=10, concurrency=2, report_interval=0
+    )
+
+    await migrator.migrate(
+        iter_export_items(str(path), "interactions"),
+        MigrationCheckpoint(str(path), str(tmp_path / "ckpt")),
+    )
+
+    assert sorted(item["text"] for item in container.items.values()) == ["上午", "晚上"]
+    assert "alice" not in container.items
+    # 用户配置文件每个用户一个文档，仍以 user_id 作为id
+    profiles = [item for _, item in iter_export_items(str(path), "user_profiles")]
+    assert [item["id"] for item in profiles] == ["alice", "alice"]
+
+
+@pytest.mark.asyncio
+async def test_bounded_concurrency_throttling_and_report(tmp_path, monkeypatch):
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def _recording_sleep(delay):
+        if delay > 0.01:
+            delays.append(delay)
+            delay = 0
+        await real_sleep(delay)
+
+    monkeypatch.setattr(asyncio, "sleep", _recording_sleep)
+    source = tmp_path / "source.json"
+    source.write_text("[]", encoding="utf-8")
+    container = _FakeContainer(errors={"i3": [_http_error(429, retry_after_ms=1500)]})
+    migrator = BulkMigrator(
+        {"interactions": container}, batch_size=10, concurrency=4, report_interval=0
+    )
+
+    report = await migrator.migrate(
+        _items(25), MigrationCheckpoint(str(source), str(tmp_path / "ckpt"))
+    )
+
+    assert len(container.items) == 25
+    assert container.max_in_flight <= 4
+    assert delays == [1.5]
+    assert report["items"] == 25
+    assert report["throttled"] == 1 and report["retries"] == 1
+    assert report["request_units"] == 25 * 2.5
+    assert report["request_units_per_item"] == 2.5
+    assert report["items_per_second"] > 0
+
+
+@pytest.mark.asyncio
+async def test_failed_run_resumes_from_checkpoint(tmp_path, monkeypatch):
+    real_sleep = asyncio.sleep
+    monkeypatch.setattr(asyncio, "sleep", lambda delay: real_sleep(0))
+    source = tmp_path / "source.json"
+    source.write_text("[]", encoding="utf-8")
+    checkpoint_dir = str(tmp_path / "ckpt")
+
+    failing = _FakeContainer(errors={"i23": [_http_error(503)] * 10})
+    migrator = BulkMigrator(
+        {"interactions": failing}, batch_size=10, concurrency=4, max_retries=2
+    )
+    with pytest.raises(MigrationError):
+        await migrator.migrate(
+            _items(35), MigrationCheckpoint(str(source), checkpoint_dir)
+        )
+
+    checkpoint = MigrationCheckpoint(str(source), checkpoint_dir)
+    checkpoint.load()
+    assert checkpoint.position == 20 and not checkpoint.completed
+
+    healthy = _FakeContainer()
+    report = await BulkMigrator({"interactions": healthy}, batch_size=10).migrate(
+        _items(35), MigrationCheckpoint(str(source), checkpoint_dir)
+    )
+    assert report["resumed_from"] == 20
+    assert sorted(healthy.items) == sorted(f"i{i}" for i in range(20, 35))
+
+    # 已完成的源文件再次运行时不再写入；--restart 时重新写入全部条目
+    again = _FakeContainer()
+    await BulkMigrator({"interactions": again}).migrate(
+        _items(35), MigrationCheckpoint(str(source), checkpoint_dir)
+    )
+    assert again.calls == 0
+    await BulkMigrator({"interactions": again}).migrate(
+        _items(35), MigrationCheckpoint(str(source), checkpoint_dir), restart=True
+    )
+    assert len(again.items) == 35
+
+    # 源文件变化后检查点作废
+    source.write_text("[1]", encoding="utf-8")
+    changed = MigrationCheckpoint(str(source), checkpoint_dir)
+    changed.load()
+    assert changed.position == 0 and not changed.completed
+
+
+@pytest.mark.asyncio
+async def test_non_retryable_items_are_rejected_without_stopping(tmp_path):
+    source = tmp_path / "source.json"
+    source.write_text("[]", encoding="utf-8")
+    container = _FakeContainer(errors={"i2": [_http_error(400)]})
+    checkpoint = MigrationCheckpoint(str(source), str(tmp_path / "ckpt"))
+
+    report = await BulkMigrator({"interactions": container}, batch_size=4).migrate(
+        _items(6), checkpoint
+    )
+
+    assert report["items"] == 5 and report["rejected"] == 1
+    with open(checkpoint.rejects_path, "r", encoding="utf-8") as f:
+        rejected = [json.loads(line) for line in f]
+    assert [(r["container"], r["item"]["id"]) for r in rejected] == [
+        ("interactions", "i2")
+    ]
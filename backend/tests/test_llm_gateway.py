@@ -0,0 +1,123 @@
+import time
+import types
+import asyncio
+import httpx
+import openai
+import pytest
+from backend.services.llm_gateway import LLMGateway, CircuitBreaker, CircuitOpenError
+
+
+def _status_error(cls, status: int, headers=None):
+    request = httpx.Request("POST", "http://llm.test/chat/completions")
+    response = httpx.Response(status, request=request, headers=headers or {})
+    return cls(f"status {status}", response=response, body=None)
+
+
+def _completion(text: str):
+    message = types.SimpleNamespace(content=text)
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+class _FakeClient:
+    """按顺序返回预设结果（异常或回复文本）的假 OpenAI 客户端"""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.chat = types.SimpleNamespace(
+            completions=types.SimpleNamespace(create=self._create)
+        )
+
+    async def _create(self, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return _completion(outcome)
+
+
+def _gateway(outcomes, **kwargs) -> LLMGateway:
+    gateway = LLMGateway(backoff_base=0.001, backoff_max=0.01, **kwargs)
+    gateway._client = _FakeClient(outcomes)
+    return gateway
+
+
+@pytest.mark.asyncio
+async def test_retries_rate_limit_then_succeeds():
+    gateway = _gateway(
+        [
+            _status_error(openai.RateLimitError, 429, {"retry-after-ms": "1"}),
+            _status_error(openai.InternalServerError, 503),
+            "你好",
+        ]
+    )
+
+    assert await gateway.complete([{"role": "user", "content": "hi"}]) == "你好"
+    assert gateway._client.calls == 3
+    assert gateway.stats()["retries"] == 2
+
+
+@pytest.mark.asyncio
+async def test_does_not_retry_client_errors():
+    gateway = _gateway([_status_error(openai.BadRequestError, 400), "unused"])
+
+    with pytest.raises(openai.BadRequestError):
+        await gateway.complete([{"role": "user", "content": "hi"}])
+    assert gateway._client.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_and_fails_fast():
+    errors = [_status_error(openai.InternalServerError, 500) for _ in range(4)]
+    gateway = _gateway(errors, max_retries=1)
+    gateway._breakers["m"] = CircuitBreaker(failure_threshold=2, recovery_timeout=60)
+
+    for _ in range(2):
+        with pytest.raises(openai.InternalServerError):
+            await gateway.complete([], deployment_name="m")
+
+    with pytest.raises(CircuitOpenError):
+        await gateway.complete([], deployment_name="m")
+    assert gateway._client.calls == 4
+    assert gateway.stats()["breakers"]["m"] == "open"
+
+
+def test_breaker_half_open_allows_single_probe(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("backend.services.llm_gateway.time.monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10)
+    breaker.record_failure()
+    assert not breaker.allow_request()
+
+    now[0] = 11
+    assert breaker.state == "half_open"
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_cancelled_probe_releases_half_open_breaker():
+    gateway = _gateway(["恢复了"], deployment_concurrency=1)
+    breaker = gateway._breakers["m"] = CircuitBreaker(
+        failure_threshold=1, recovery_timeout=10
+    )
+    breaker.opened_at = time.monotonic() - 11
+
+    # 探测请求在等待并发名额时被取消（complete 和 stream 各一次）
+    async with gateway._limit("m"):
+        for probe in (
+            gateway.complete([], deployment_name="m"),
+            gateway.stream([], deployment_name="m").__anext__(),
+        ):
+            task = asyncio.ensure_future(probe)
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert breaker.state == "half_open" and not breaker._probe_in_flight
+
+    assert await gateway.complete([], deployment_name="m") == "恢复了"
+    assert gateway.stats()["breakers"]["m"] == "closed"
@@ -0,0 +1,64 @@
+import argparse
+
+import pytest
+
+from backend.scripts.load_test import (
+    LoadTestResults,
+    parse_mix,
+    percentile,
+    run_load_test,
+)
+
+
+def test_percentile_interpolates():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == pytest.approx(50.5)
+    assert percentile(values, 99) == pytest.approx(99.01)
+    assert percentile([], 95) == 0.0
+
+
+def test_parse_mix_rejects_unknown_endpoint():
+    assert parse_mix("chat=3,followup=1") == {"chat": 3.0, "followup": 1.0}
+    with pytest.raises(ValueError):
+        parse_mix("chat=1,upload=1")
+
+
+def test_results_report_counts_errors_per_endpoint():
+    results = LoadTestResults()
+    results.record("chat", 0.1, 200)
+    results.record("chat", 0.3, 500)
+    results.record("analyze", 0.2, None)
+
+    report = results.report(elapsed=2.0)
+
+    chat = report["endpoints"]["chat"]
+    assert chat["requests"] == 2
+    assert chat["error_rate"] == 0.5
+    assert chat["throughput_rps"] == 1.0
+    assert chat["status_codes"] == {"200": 1, "500": 1}
+    assert "followup" not in report["endpoints"]
+    assert report["total"]["errors"] == 2
+    assert report["total"]["latency_ms"]["max"] == pytest.approx(300)
+
+
+@pytest.mark.asyncio
+async def test_run_load_test_in_process():
+    args = argparse.Namespace(
+        base_url=None,
+        users=2,
+        duration=5,
+        requests_per_user=2,
+        think_time="fixed:0",
+        mix="chat=1,followup=1",
+        ramp_up=0,
+        timeout=30,
+        mock_llm=False,
+        mock_llm_latency="fixed:0",
+        label="test",
+    )
+
+    result = await run_load_test(args)
+
+    assert result["total"]["requests"] == 4
+    assert result["total"]["errors"] == 0
+    assert set(result["endpoints"]) <= {"chat", "followup"}
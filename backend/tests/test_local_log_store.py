@@ -0,0 +1,156 @@
+import json
+import time
+import asyncio
+import threading
+import multiprocessing
+
+import pytest
+
+from backend.memory.cosmos_memory_store import CosmosMemoryStore
+from backend.memory import local_log_store as local_log_store_module
+from backend.memory.local_log_store import LocalLogStore
+
+
+def _append_many(base_dir, worker):
+    store = LocalLogStore(base_dir)
+    for i in range(50):
+        store.append(
+            "interactions", "alice", [{"worker": worker, "i": i, "text": "x" * 500}]
+        )
+
+
+def test_tail_returns_newest_first_and_sees_appends_from_other_instances(tmp_path):
+    writer = LocalLogStore(str(tmp_path))
+    reader = LocalLogStore(str(tmp_path))
+    writer.append("emotions", "alice", [{"i": i} for i in range(10)])
+
+    assert [r["i"] for r in reader.tail("emotions", "alice", 3)] == [9, 8, 7]
+    writer.append("emotions", "alice", [{"i": 10}])
+    assert [r["i"] for r in reader.tail("emotions", "alice", 2)] == [10, 9]
+    assert [r["i"] for r in reader.read_all("emotions", "alice")] == list(range(11))
+    assert reader.tail("emotions", "bob", 5) == []
+
+
+def test_incomplete_trailing_line_is_not_read(tmp_path):
+    store = LocalLogStore(str(tmp_path))
+    store.append("emotions", "alice", [{"i": 0}])
+    with open(store.path("emotions", "alice"), "ab") as f:
+        f.write(b'{"i": 1')
+
+    assert store.tail("emotions", "alice", 5) == [{"i": 0}]
+    with open(store.path("emotions", "alice"), "ab") as f:
+        f.write(b"}\n")
+    assert store.count("emotions", "alice") == 2
+
+
+def test_legacy_json_file_is_converted_once(tmp_path):
+    (tmp_path / "interactions_alice.json").write_text(
+        json.dumps([{"i": 0}, {"i": 1}]), encoding="utf-8"
+    )
+    store = LocalLogStore(str(tmp_path))
+
+    store.append("interactions", "alice", [{"i": 2}])
+    assert [r["i"] for r in store.read_all("interactions", "alice")] == [0, 1, 2]
+    assert not (tmp_path / "interactions_alice.json").exists()
+
+
+def test_concurrent_first_access_converts_legacy_file_once(tmp_path, monkeypatch):
+    (tmp_path / "interactions_alice.json").write_text(
+        json.dumps([{"i": 0}, {"i": 1}]), encoding="utf-8"
+    )
+    real_load = json.load
+
+    def slow_load(f):
+        # 拉长检查和写入之间的窗口，让两个实例同时进入转换
+        time.sleep(0.1)
+        return real_load(f)
+
+    monkeypatch.setattr("backend.memory.local_log_store.json.load", slow_load)
+    stores = [LocalLogStore(str(tmp_path)) for _ in range(2)]
+    threads = [
+        threading.Thread(target=store.read_all, args=("interactions", "alice"))
+        for store in stores
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert [r["i"] for r in stores[0].read_all("interactions", "alice")] == [0, 1]
+
+
+def test_unsafe_user_ids_get_distinct_file_names(tmp_path):
+    store = LocalLogStore(str(tmp_path))
+    assert store.path("emotions", "a/b") != store.path("emotions", "a_b")
+    assert str(tmp_path) in store.path("emotions", "../etc")
+
+
+def test_concurrent_processes_do_not_corrupt_the_log(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=_append_many, args=(str(tmp_path), w)) for w in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=30)
+
+    records = LocalLogStore(str(tmp_path)).read_all("interactions", "alice")
+    assert len(records) == 200
+    assert sorted((r["worker"], r["i"]) for r in records) == [
+        (w, i) for w in range(4) for i in range(50)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_local_mode_writes_emotions_for_recent_emotion_reads(
+    tmp_path, monkeypatch
+):
+    monkeypatch.delenv("COSMOS_ENDPOINT", raising=False)
+    monkeypatch.delenv("COSMOS_KEY", raising=False)
+    store = CosmosMemoryStore()
+    store.local_log = LocalLogStore(str(tmp_path))
+
+    for emotion in ("N", "P", "N"):
+        await store.add_interaction("alice", f"feeling {emotion}", emotion, "ok")
+
+    emotions = await store.get_recent_emotions("alice", limit=2)
+    assert [e["emotion"] for e in emotions] == ["N", "P"]
+    assert len(store._get_local_interactions("alice")) == 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(local_log_store_module.fcntl is None, reason="需要 flock")
+async def test_locked_log_does_not_block_event_loop(tmp_path, monkeypatch):
+    monkeypatch.delenv("COSMOS_ENDPOINT", raising=False)
+    monkeypatch.delenv("COSMOS_KEY", raising=False)
+    store = CosmosMemoryStore()
+    store.local_log = LocalLogStore(str(tmp_path))
+    store.local_log.append(
+        "emotions", "alice", [{"emotion": "N", "timestamp": "2024-05-01T08:00:00"}]
+    )
+
+    # 模拟另一个 worker 进程持有独占锁
+    holder = open(store.local_log.path("emotions", "alice"), "ab")
+    local_log_store_module.fcntl.flock(
+        holder.fileno(), local_log_store_module.fcntl.LOCK_EX
+    )
+    # 在线程中释放，事件循环被阻塞时也能解锁（测试失败而不是卡住）
+    release = threading.Timer(0.2, holder.close)
+    release.start()
+
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticking = asyncio.ensure_future(ticker())
+    emotions = await store.get_recent_emotions("alice")
+    ticking.cancel()
+    release.join()
+
+    assert [e["emotion"] for e in emotions] == ["N"]
+    assert ticks >= 5
@@ -0,0 +1,203 @@
+import os
+import json
+import math
+import asyncio
+
+import h5py
+import numpy as np
+import pytest
+
+from backend.tools import emotion_prediction_tool
+from backend.tools.lstm_inference import LSTM_MODEL_PATH, LSTMEmotionModel
+
+SHIPPED_CSV = os.path.join(
+    os.path.dirname(__file__), "..", "..", "model", "HeartRateVariabilitySDNN.csv"
+)
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+def _reference_lstm(sequence, kernel, recurrent, bias):
+    """逐个标量计算的 Keras LSTM（门顺序 i, f, c, o），返回每个时间步的 h"""
+    units = len(recurrent)
+    h, c, outputs = [0.0] * units, [0.0] * units, []
+    for x in sequence:
+        new_h, new_c = [], []
+        for j in range(units):
+            z = []
+            for gate in range(4):
+                col = gate * units + j
+                total = bias[col]
+                total += sum(x[k] * kernel[k][col] for k in range(len(x)))
+                total += sum(h[m] * recurrent[m][col] for m in range(units))
+                z.append(total)
+            cell = _sigmoid(z[1]) * c[j] + _sigmoid(z[0]) * math.tanh(z[2])
+            new_c.append(cell)
+            new_h.append(_sigmoid(z[3]) * math.tanh(cell))
+        h, c = new_h, new_c
+        outputs.append(h)
+    return outputs
+
+
+def _reference_dense_softmax(h, kernel, bias):
+    logits = [
+        bias[k] + sum(h[m] * kernel[m][k] for m in range(len(h)))
+        for k in range(len(bias))
+    ]
+    top = max(logits)
+    exps = [math.exp(v - top) for v in logits]
+    return [e / sum(exps) for e in exps]
+
+
+def _read_weights(path, layer):
+    with h5py.File(path, "r") as f:
+        group = f["model_weights"][layer]
+        return [
+            np.asarray(group[name]).astype(np.float64).tolist()
+            for name in group.attrs["weight_names"]
+        ]
+
+
+def _write_keras_h5(path, layers, weights):
+    """按 Keras 2 的 HDF5 布局写入 Sequential 模型"""
+    with h5py.File(path, "w") as f:
+        f.attrs["model_config"] = json.dumps(
+            {"class_name": "Sequential", "config": {"layers": layers}}
+        )
+        group = f.create_group("model_weights")
+        for layer in layers:
+            name = layer["config"]["name"]
+            if name not in weights:
+                continue
+            layer_group = group.create_group(name)
+            names = []
+            for weight_name, value in weights[name]:
+                full_name = f"{name}/{weight_name}"
+                layer_group.create_dataset(full_name, data=value.astype(np.float32))
+                names.append(full_name.encode("utf-8"))
+            layer_group.attrs["weight_names"] = names
+
+
+def test_shipped_model_matches_scalar_reference():
+    model = LSTMEmotionModel.from_h5(LSTM_MODEL_PATH)
+    assert model.input_shape == (5, 3)
+    lstm = _read_weights(LSTM_MODEL_PATH, "lstm_5")
+    dense = _read_weights(LSTM_MODEL_PATH, "dense_5")
+
+    rng = np.random.default_rng(0)
+    windows = np.concatenate(
+        [
+            emotion_prediction_tool.load_health_features(SHIPPED_CSV).windows()[:3],
+            rng.normal(50, 20, size=(3, 5, 3)).astype(np.float32),
+        ]
+    )
+    expected = [
+        _reference_dense_softmax(
+            _reference_lstm(w.astype(np.float64).tolist(), *lstm)[-1], *dense
+        )
+        for w in windows
+    ]
+
+    probabilities = model.predict_proba(windows)
+    np.testing.assert_allclose(probabilities, expected, atol=1e-5)
+    np.testing.assert_allclose(model.predict_proba(windows[0]), expected[0], atol=1e-5)
+    np.testing.assert_array_equal(model.predict(windows), np.argmax(expected, axis=1))
+
+
+def test_stacked_lstm_model_from_h5(tmp_path):
+    rng = np.random.default_rng(1)
+    lstm_config = {"activation": "tanh", "recurrent_activation": "sigmoid"}
+    layers = [
+        {
+            "class_name": "InputLayer",
+            "config": {"name": "in", "batch_input_shape": [None, 4, 2]},
+        },
+        {
+            "class_name": "LSTM",
+            "config": {
+                "name": "lstm_a",
+                "units": 3,
+                "return_sequences": True,
+                **lstm_config,
+            },
+        },
+        {
+            "class_name": "LSTM",
+            "config": {
+                "name": "lstm_b",
+                "units": 2,
+                "return_sequences": False,
+                **lstm_config,
+            },
+        },
+        {
+            "class_name": "Dense",
+            "config": {"name": "out", "units": 3, "activation": "softmax"},
+        },
+    ]
+    weights = {
+        "lstm_a": [
+            ("cell/kernel:0", rng.normal(size=(2, 12))),
+            ("cell/recurrent_kernel:0", rng.normal(size=(3, 12))),
+            ("cell/bias:0", rng.normal(size=12)),
+        ],
+        "lstm_b": [
+            ("cell/kernel:0", rng.normal(size=(3, 8))),
+            ("cell/recurrent_kernel:0", rng.normal(size=(2, 8))),
+            ("cell/bias:0", rng.normal(size=8)),
+        ],
+        "out": [("kernel:0", rng.normal(size=(2, 3))), ("bias:0", rng.normal(size=3))],
+    }
+    path = str(tmp_path / "stacked.h5")
+    _write_keras_h5(path, layers, weights)
+
+    def as_lists(name):
+        return [
+            value.astype(np.float32).astype(np.float64).tolist()
+            for _, value in weights[name]
+        ]
+
+    windows = rng.normal(size=(5, 4, 2)).astype(np.float32)
+    expected = []
+    for window in windows.astype(np.float64).tolist():
+        hidden = _reference_lstm(window, *as_lists("lstm_a"))
+        expected.append(
+            _reference_dense_softmax(
+                _reference_lstm(hidden, *as_lists("lstm_b"))[-1], *as_lists("out")
+            )
+        )
+
+    model = LSTMEmotionModel.from_h5(path)
+    np.testing.assert_allclose(model.predict_proba(windows), expected, atol=1e-5)
+    with pytest.raises(ValueError):
+        model.predict_proba(np.zeros((1, 5, 2)))
+
+
+def test_tool_uses_lstm_backend_and_falls_back_to_knn(monkeypatch):
+    monkeypatch.setattr(emotion_prediction_tool, "EMOTION_PREDICTION_BACKEND", "lstm")
+    model = emotion_prediction_tool._get_emotion_model()
+    assert model is not None
+    health_data = {"heart_rate": {"avg": 75}, "hrv": {"sdnn": 30.0}}
+
+    result = asyncio.run(
+        emotion_prediction_tool.predict_emotion_and_generate_question(health_data)
+    )
+    window = emotion_prediction_tool._model_window(health_data, 5)
+    expected = model.predict_proba(window)
+    assert window[-1].tolist() == pytest.approx([30.0, *window[-2][:2].tolist()])
+    assert list(result["emotion_probabilities"].values()) == pytest.approx(
+        expected.tolist()
+    )
+    assert (
+        result["predicted_emotion"]
+        == ["baseline", "stress", "amusement"][int(np.argmax(expected))]
+    )
+
+    monkeypatch.setattr(emotion_prediction_tool, "_emotion_model", None)
+    result = asyncio.run(
+        emotion_prediction_tool.predict_emotion_and_generate_question(health_data)
+    )
+    assert result["predicted_emotion"] in ("baseline", "stress", "amusement")
+    assert "error" not in result
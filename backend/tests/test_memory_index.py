@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+from backend.memory.keyword_index import UserKeywordIndex
+from backend.memory.memory_index import (
+    MemoryIndex,
+    UserMemoryIndex,
+    reciprocal_rank_fusion,
+)
+from backend.memory.tokenizer import keyword_tokens
+
+
+def test_keyword_tokens_split_cjk_into_bigrams():
+    assert keyword_tokens("工作压力好大, I am SO tired") == [
+        "工作",
+        "作压",
+        "压力",
+        "力好",
+        "好大",
+        "tired",
+    ]
+    assert keyword_tokens("累") == ["累"]
+
+
+def test_bm25_prefers_rarer_terms_and_shorter_documents():
+    index = UserKeywordIndex()
+    index.add("m1", keyword_tokens("工作 加班 工作 加班 会议 报告 项目"), {"id": "m1"})
+    index.add("m2", keyword_tokens("工作 加班"), {"id": "m2"})
+    index.add("m3", keyword_tokens("失眠 工作"), {"id": "m3"})
+    assert not index.add("m3", ["重复"], {"id": "m3"})
+
+    # "失眠" 只出现在一篇文档中，比到处出现的 "工作" 权重更高
+    assert [p["id"] for _, p in index.search(keyword_tokens("失眠 工作"), top_k=3)][
+        0
+    ] == "m3"
+    # 词频相同的情况下，较短的文档得分更高
+    assert [p["id"] for _, p in index.search(keyword_tokens("加班"), top_k=2)] == [
+        "m2",
+        "m1",
+    ]
+    assert index.search(keyword_tokens("下雨"), top_k=3) == []
+
+
+def test_rrf_combines_rankings_by_rank():
+    a, b, c = {"id": "a"}, {"id": "b"}, {"id": "c"}
+    fused = reciprocal_rank_fusion(
+        [[(0.9, a), (0.8, b)], [(12.0, b), (3.0, c)]], top_k=3
+    )
+    assert [payload["id"] for _, payload in fused] == ["b", "a", "c"]
+    assert fused[0][0] < 1
+    assert reciprocal_rank_fusion([[(0.9, a)], [(5.0, a)]], top_k=1)[0][
+        0
+    ] == pytest.approx(1.0)
+
+
+def test_hybrid_search_finds_keyword_matches_without_vectors():
+    index = UserMemoryIndex(model="m")
+    # 嵌入模型不同的旧文档只进入关键词索引
+    assert index.add(
+        {
+            "id": "old",
+            "summary": "考试前很焦虑",
+            "embedding": [1.0, 0.0],
+            "embedding_model": "old",
+        }
+    )
+    assert index.add(
+        {
+            "id": "new",
+            "summary": "周末去爬山",
+            "embedding": [0.0, 1.0],
+            "embedding_model": "m",
+        }
+    )
+    assert len(index) == 2 and len(index.vectors) == 1
+
+    results = index.search([1.0, 0.0], "又要考试了", top_k=2)
+    assert [payload["id"] for _, payload in results] == ["old"]
+    assert "embedding" not in results[0][1]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_gets_load_once_and_keep_inserts_made_during_load():
+    memory_index = MemoryIndex()
+    loads = 0
+
+    async def loader():
+        nonlocal loads
+        loads += 1
+        await asyncio.sleep(0.05)
+        return [{"id": "mem_1", "embedding": [1.0, 0.0], "summary": "old"}]
+
+    async def insert_during_load():
+        await asyncio.sleep(0.01)
+        memory_index.add(
+            "alice", {"id": "mem_2", "embedding": [0.0, 1.0], "summary": "new"}
+        )
+
+    indexes = await asyncio.gather(
+        memory_index.get("alice", loader),
+        memory_index.get("alice", loader),
+        insert_during_load(),
+    )
+
+    assert loads == 1
+    assert indexes[0] is indexes[1]
+    assert [
+        payload["summary"]
+        for _, payload in indexes[0].vectors.search([0.0, 1.0], top_k=1)
+    ] == ["new"]
+    assert "embedding" not in indexes[0].vectors.search([1.0, 0.0], top_k=1)[0][1]
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_user_is_evicted():
+    memory_index = MemoryIndex(max_users=2)
+
+    async def loader():
+        return []
+
+    for user_id in ("a", "b", "a", "c"):
+        await memory_index.get(user_id, loader)
+
+    assert memory_index.stats()["users"] == 2
+    assert memory_index.evictions == 1
+    # 未加载的用户不接收增量插入
+    memory_index.add("b", {"id": "mem_1", "embedding": [1.0]})
+    assert memory_index.stats()["documents"] == 0
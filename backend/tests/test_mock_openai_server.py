@@ -0,0 +1,76 @@
+import httpx
+import openai
+import pytest
+from openai import AsyncAzureOpenAI
+from backend.scripts.mock_openai_server import (
+    create_app,
+    MockServerConfig,
+    LatencyDistribution,
+)
+from backend.services.llm_gateway import LLMGateway
+
+
+def _gateway_for(config: MockServerConfig, **kwargs) -> LLMGateway:
+    """创建通过 ASGI 直接连接模拟服务的网关，走真实的 SDK 调用路径"""
+    http_client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=create_app(config))
+    )
+    gateway = LLMGateway(backoff_base=0.001, backoff_max=0.01, **kwargs)
+    gateway._client = AsyncAzureOpenAI(
+        api_version="2025-01-01-preview",
+        azure_endpoint="http://mock-openai",
+        api_key="mock-key",
+        max_retries=0,
+        http_client=http_client,
+    )
+    return gateway
+
+
+def test_latency_distribution_parse():
+    assert LatencyDistribution.parse("fixed:0.25").sample() == 0.25
+    assert 0.1 <= LatencyDistribution.parse("uniform:0.1,0.2").sample() <= 0.2
+    with pytest.raises(ValueError):
+        LatencyDistribution.parse("pareto:1")
+
+
+@pytest.mark.asyncio
+async def test_complete_through_sdk():
+    gateway = _gateway_for(
+        MockServerConfig(latency="fixed:0", tokens_per_second=0, reply_tokens=12)
+    )
+
+    reply = await gateway.complete([{"role": "user", "content": "你好"}], max_tokens=64)
+
+    assert len(reply) == 12
+
+
+@pytest.mark.asyncio
+async def test_stream_through_sdk():
+    gateway = _gateway_for(
+        MockServerConfig(latency="fixed:0", tokens_per_second=0, reply_tokens=8)
+    )
+
+    deltas = [
+        d
+        async for d in gateway.stream(
+            [{"role": "user", "content": "你好"}], max_tokens=64
+        )
+    ]
+
+    assert len(deltas) == 8
+
+
+@pytest.mark.asyncio
+async def test_injected_errors_are_retried_then_surface():
+    config = MockServerConfig(
+        latency="fixed:0",
+        tokens_per_second=0,
+        error_rate=1.0,
+        error_codes="429",
+        retry_after_ms=1,
+    )
+    gateway = _gateway_for(config, max_retries=2)
+
+    with pytest.raises(openai.RateLimitError):
+        await gateway.complete([{"role": "user", "content": "你好"}])
+    assert gateway.stats()["retries"] == 2
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from backend.memory import profile_cache as profile_cache_module
+from backend.memory.profile_cache import ReadThroughCache
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_load():
+    cache = ReadThroughCache(max_entries=10, ttl_seconds=60)
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        return {"user_id": "u1"}
+
+    results = await asyncio.gather(
+        *(cache.get_or_load("alice", loader) for _ in range(10))
+    )
+
+    assert calls == 1
+    assert all(result is results[0] for result in results)
+    assert cache.stats()["coalesced"] == 9
+    await cache.get_or_load("alice", loader)
+    assert calls == 1 and cache.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_failures_and_none_are_not_cached():
+    cache = ReadThroughCache(max_entries=10, ttl_seconds=60)
+
+    async def failing():
+        raise RuntimeError("cosmos unavailable")
+
+    async def missing():
+        return None
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_load("alice", failing)
+    assert await cache.get_or_load("alice", missing) is None
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_entries_expire_and_can_be_invalidated(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(profile_cache_module.time, "monotonic", lambda: now[0])
+    cache = ReadThroughCache(max_entries=10, ttl_seconds=60)
+    cache.set("alice", "u1")
+
+    now[0] += 30
+    assert cache.get("alice") == "u1"
+    cache.invalidate("alice")
+    assert cache.get("alice") is None
+
+    cache.set("alice", "u2")
+    now[0] += 61
+    assert cache.get("alice") is None
+
+
+@pytest.mark.asyncio
+async def test_update_during_load_is_not_overwritten_by_stale_value():
+    cache = ReadThroughCache(max_entries=10, ttl_seconds=60)
+    started = asyncio.Event()
+
+    async def slow_loader():
+        # 读到的是更新之前的配置
+        started.set()
+        await asyncio.sleep(0.02)
+        return {"preferences": {"tone": "old"}}
+
+    load = asyncio.ensure_future(cache.get_or_load("alice", slow_loader))
+    await started.wait()
+    cache.set("alice", {"preferences": {"tone": "new"}})
+
+    assert (await load)["preferences"]["tone"] == "new"
+    assert cache.get("alice")["preferences"]["tone"] == "new"
+    assert cache.stats()["stale_fills"] == 1
+    assert cache._generations == {}
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from backend.memory.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_failure_and_next_call_reloads():
+    flights = SingleFlight()
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        raise RuntimeError("cosmos unavailable")
+
+    results = await asyncio.gather(
+        *(flights.do("alice", failing) for _ in range(5)), return_exceptions=True
+    )
+
+    assert calls == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert not flights.in_flight("alice")
+
+    async def loader():
+        return "ok"
+
+    assert await flights.do("alice", loader) == "ok"
+
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_does_not_cancel_other_callers():
+    flights = SingleFlight()
+    loaded = []
+
+    async def slow_loader():
+        await asyncio.sleep(0.05)
+        loaded.append("alice")
+        return "profile"
+
+    # 发起加载的调用方超时被取消，另一个调用方仍然拿到结果，加载也完成了
+    leader = asyncio.ensure_future(
+        asyncio.wait_for(flights.do("alice", slow_loader), timeout=0.01)
+    )
+    await asyncio.sleep(0)
+    follower = asyncio.ensure_future(flights.do("alice", slow_loader))
+
+    with pytest.raises(asyncio.TimeoutError):
+        await leader
+    assert await follower == "profile"
+    assert loaded == ["alice"]
+    assert not flights.in_flight("alice")
@@ -0,0 +1,115 @@
+import pytest
+
+from backend.services.llm_gateway import CircuitOpenError
+from backend.services.summarizer import ConversationSummarizer, latest_summary_text
+
+
+@pytest.mark.asyncio
+async def test_summary_tree_merges_once_per_window_plus_amortized_levels(monkeypatch):
+    summarizer = ConversationSummarizer(mock_mode=True)
+    merges = []
+
+    async def fake_merge(summaries, max_chars=120, raise_on_error=False):
+        merges.append(list(summaries))
+        return "+".join(summaries)
+
+    monkeypatch.setattr(summarizer, "merge", fake_merge)
+
+    leaves, tree, root = [], {}, None
+    for window in range(16):
+        leaf = {"text": f"w{window}", "message_range": [window * 10, window * 10 + 9]}
+        merges.clear()
+        root, tree = await summarizer.extend_summary_tree(
+            leaf, leaves, tree, root, fanout=4
+        )
+        leaves.append(leaf)
+        # 根摘要每个窗口一次合并，每凑满 4 个节点再向上合并一次
+        assert len(merges) == (0 if window == 0 else 1) + (window % 4 == 3) + (
+            window == 15
+        )
+
+    assert root["message_range"] == [0, 159]
+    assert root["windows"] == 16
+    assert [node["text"] for node in tree["1"]] == [
+        "w0+w1+w2+w3",
+        "w4+w5+w6+w7",
+        "w8+w9+w10+w11",
+        "w12+w13+w14+w15",
+    ]
+    assert [node["message_range"] for node in tree["2"]] == [[0, 159]]
+
+
+@pytest.mark.asyncio
+async def test_mock_merge_respects_length_limit():
+    summarizer = ConversationSummarizer(mock_mode=True)
+    assert await summarizer.merge(["only"]) == "only"
+    merged = await summarizer.merge(
+        ["很长的摘要" * 10, "另一段摘要" * 10], max_chars=40
+    )
+    assert len(merged) == 40 and merged.endswith("...")
+
+
+@pytest.mark.asyncio
+async def test_background_calls_raise_instead_of_returning_fallback_text(monkeypatch):
+    summarizer = ConversationSummarizer(mock_mode=True)
+    summarizer.mock_mode = False
+
+    async def open_circuit(*args, **kwargs):
+        raise CircuitOpenError("熔断中")
+
+    monkeypatch.setattr(summarizer.llm, "complete", open_circuit)
+    messages = [{"role": "user", "content": "最近很累"}]
+
+    # 请求路径仍然回退到模拟摘要
+    assert "最近很累" in await summarizer.summarize(messages)
+    assert await summarizer.merge(["a", "b"]) == "a；b"
+    # 后台路径抛出异常，由任务队列重试
+    with pytest.raises(CircuitOpenError):
+        await summarizer.summarize(messages, raise_on_error=True)
+    with pytest.raises(CircuitOpenError):
+        await summarizer.extend_summary_tree(
+            {"text": "b", "message_range": [10, 19]},
+            [],
+            {},
+            {"text": "a", "message_range": [0, 9]},
+            raise_on_error=True,
+        )
+
+
+def test_latest_summary_prefers_root_and_falls_back_to_last_window():
+    assert (
+        latest_summary_text(
+            {"summary_root": {"text": "root"}, "summary": [{"text": "leaf"}]}
+        )
+        == "root"
+    )
+    assert latest_summary_text({"summary": [{"text": "a"}, {"text": "b"}]}) == "b"
+    assert latest_summary_text({}) == ""
+
+
+@pytest.mark.asyncio
+async def test_relevant_history_reads_root_and_only_the_last_leaf():
+    from backend.memory.request_charge import RequestChargeTracker
+
+    class _Container:
+        def __init__(self):
+            self.queries = []
+
+        async def _items(self):
+            yield {"summary_root": None, "summary": [{"text": "最后一段"}]}
+
+        def query_items(self, query, **kwargs):
+            self.queries.append(query)
+            return self._items()
+
+    class _Store:
+        conversation_container = _Container()
+        request_charges = RequestChargeTracker()
+
+    summarizer = ConversationSummarizer(mock_mode=True)
+    text = await summarizer.get_relevant_history(
+        "alice", _Store(), [{"role": "user", "content": "你好"}]
+    )
+
+    assert text == "上次对话摘要: 最后一段\n\n当前对话:\n用户: 你好"
+    assert "ARRAY_SLICE(c.summary, -1)" in _Store.conversation_container.queries[0]
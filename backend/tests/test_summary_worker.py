@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from backend.services.summary_worker import SummaryWorker
+
+
+@pytest.mark.asyncio
+async def test_jobs_for_one_key_run_in_order_while_keys_run_concurrently():
+    running, peak, order = 0, 0, []
+
+    async def handler(job):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        order.append((job["key"], job["n"]))
+        running -= 1
+
+    worker = SummaryWorker(handler, workers=3)
+    for n in range(4):
+        for key in ("a", "b", "c", "d"):
+            assert worker.submit(key, {"key": key, "n": n})
+    await worker.close()
+
+    assert peak == 3
+    for key in ("a", "b", "c", "d"):
+        assert [n for k, n in order if k == key] == [0, 1, 2, 3]
+    assert worker.stats()["completed"] == 16
+
+
+@pytest.mark.asyncio
+async def test_failed_jobs_are_retried(monkeypatch):
+    monkeypatch.setattr(asyncio, "sleep", _no_sleep(asyncio.sleep))
+    attempts = []
+
+    async def handler(job):
+        attempts.append(job)
+        if len(attempts) < 3:
+            raise RuntimeError("cosmos unavailable")
+
+    worker = SummaryWorker(handler, max_retries=3)
+    worker.submit("a", {})
+    await worker.close()
+
+    assert len(attempts) == 3
+    assert worker.stats()["retries"] == 2 and worker.stats()["failed"] == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue_drops_instead_of_blocking():
+    release = asyncio.Event()
+
+    async def handler(job):
+        await release.wait()
+
+    worker = SummaryWorker(handler, max_size=1, workers=1)
+    assert worker.submit("a", {})
+    await asyncio.sleep(0)  # worker 取走第一个任务
+    assert worker.submit("b", {})
+    assert not worker.submit("c", {})
+    assert worker.stats()["dropped"] == 1
+
+    release.set()
+    await worker.close()
+    assert worker.stats()["completed"] == 2
+    assert not worker.submit("d", {})
+
+
+def _no_sleep(real_sleep):
+    async def sleep(delay, *args, **kwargs):
+        await real_sleep(0)
+
+    return sleep
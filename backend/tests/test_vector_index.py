@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from backend.memory.vector_index import UserVectorIndex
+
+
+def _brute_force_top_k(matrix, query, k):
+    """逐行计算余弦相似度的参考实现"""
+    scores = []
+    for i, row in enumerate(matrix):
+        scores.append(
+            (
+                float(
+                    np.dot(row, query) / (np.linalg.norm(row) * np.linalg.norm(query))
+                ),
+                i,
+            )
+        )
+    scores.sort(key=lambda item: -item[0])
+    return scores[:k]
+
+
+def test_search_matches_brute_force_and_grows_capacity():
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(size=(300, 16)).astype(np.float32)
+    index = UserVectorIndex(initial_capacity=4)
+    for i, row in enumerate(matrix):
+        assert index.add(f"mem_{i}", row.tolist(), {"i": i})
+
+    query = rng.normal(size=16)
+    results = index.search(query.tolist(), top_k=5)
+    expected = _brute_force_top_k(matrix, query, 5)
+
+    assert [payload["i"] for _, payload in results] == [i for _, i in expected]
+    assert [score for score, _ in results] == pytest.approx(
+        [score for score, _ in expected], abs=1e-5
+    )
+
+
+def test_add_skips_duplicates_mismatched_dims_and_zero_vectors():
+    index = UserVectorIndex()
+    assert index.add("a", [1.0, 0.0], {})
+    assert not index.add("a", [0.0, 1.0], {})
+    assert not index.add("b", [1.0, 0.0, 0.0], {})
+    assert not index.add("c", [0.0, 0.0], {})
+    assert len(index) == 1
+    assert index.search([1.0, 0.0, 0.0]) == []
@@ -0,0 +1,135 @@
+import json
+import asyncio
+
+import pytest
+
+from backend.memory.write_behind import WriteBehindQueue
+
+
+class _RecordingHandler:
+    """记录每一批写入的假写入函数"""
+
+    def __init__(self, delay: float = 0.0, failures: int = 0):
+        self.delay = delay
+        self.failures = failures
+        self.batches = []
+
+    async def __call__(self, batch):
+        await asyncio.sleep(self.delay)
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError("写入失败")
+        self.batches.append(list(batch))
+
+
+@pytest.mark.asyncio
+async def test_records_are_batched_and_flushed_on_close(tmp_path):
+    handler = _RecordingHandler()
+    queue = WriteBehindQueue(
+        handler,
+        batch_size=10,
+        flush_interval=0.05,
+        spill_path=str(tmp_path / "pending.jsonl"),
+    )
+
+    for i in range(25):
+        await queue.submit({"i": i})
+    await queue.close()
+
+    written = [record["i"] for batch in handler.batches for record in batch]
+    assert written == list(range(25))
+    assert len(handler.batches) == 3
+    assert queue.stats()["written"] == 25
+    assert queue.depth == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue_applies_backpressure(tmp_path):
+    handler = _RecordingHandler(delay=0.2)
+    queue = WriteBehindQueue(
+        handler,
+        max_size=1,
+        batch_size=1,
+        flush_interval=0,
+        put_timeout=0.05,
+        spill_path=str(tmp_path / "pending.jsonl"),
+    )
+
+    for i in range(4):
+        await queue.submit({"i": i})
+
+    # 队列容量为 1，后提交的记录不会无限堆积，而是由调用方直接写入
+    assert queue.depth <= 1
+    assert queue.inline_writes >= 1
+    await queue.close()
+    assert sorted(record["i"] for batch in handler.batches for record in batch) == [
+        0,
+        1,
+        2,
+        3,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_then_spilled_and_replayed(tmp_path, monkeypatch):
+    monkeypatch.setattr(asyncio, "sleep", _no_sleep(asyncio.sleep))
+    spill_path = tmp_path / "pending.jsonl"
+    handler = _RecordingHandler(failures=10)
+    queue = WriteBehindQueue(
+        handler, max_retries=2, flush_interval=0, spill_path=str(spill_path)
+    )
+
+    await queue.submit({"i": 1})
+    await queue.close()
+
+    assert queue.retries == 2
+    assert queue.failed == 1
+    assert [
+        json.loads(line) for line in spill_path.read_text(encoding="utf-8").splitlines()
+    ] == [{"i": 1}]
+
+    # 下次启动时先重新写入遗留记录
+    handler = _RecordingHandler()
+    queue = WriteBehindQueue(handler, flush_interval=0, spill_path=str(spill_path))
+    await queue.submit({"i": 2})
+    await queue.close()
+
+    assert [record["i"] for batch in handler.batches for record in batch] == [1, 2]
+    assert not spill_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_submit_after_close_writes_inline(tmp_path):
+    handler = _RecordingHandler()
+    queue = WriteBehindQueue(handler, spill_path=str(tmp_path / "pending.jsonl"))
+    await queue.close()
+
+    await queue.submit({"i": 1})
+
+    assert handler.batches == [[{"i": 1}]]
+
+
+def _no_sleep(original_sleep):
+    """把重试退避的等待缩短为 0"""
+
+    async def sleep(delay, *args, **kwargs):
+        await original_sleep(0)
+
+    return sleep
+
+
+def test_spill_file_is_claimed_once_and_torn_lines_are_skipped(tmp_path):
+    spill_path = tmp_path / "pending.jsonl"
+    # 崩溃时写了一半的行不影响其他记录
+    spill_path.write_text('{"i": 1}\n{"i": \n{"i": 2}\n', encoding="utf-8")
+    first = WriteBehindQueue(_RecordingHandler(), spill_path=str(spill_path))
+    second = WriteBehindQueue(_RecordingHandler(), spill_path=str(spill_path))
+
+    assert first._load_spilled() == [{"i": 1}, {"i": 2}]
+    # 另一个 worker 已经领取，不会重复写入
+    assert second._load_spilled() == []
+    assert list(tmp_path.iterdir()) == []
+
+    # 领取之后追加的记录写入新文件，由下一次领取读到
+    second._spill([{"i": 3}])
+    assert first._load_spilled() == [{"i": 3}]
@@ -0,0 +1,256 @@
+import os
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 各特征的归一化尺度（hrv_sdnn / 50，heart_rate / 20），与原先的距离公式一致
+FEATURE_SCALES = (50.0, 20.0)
+# 参考点数量不超过该值时直接对全部点计算距离（比网格查找更快）
+KNN_BRUTE_FORCE_MAX = int(os.getenv("KNN_BRUTE_FORCE_MAX", "2048"))
+# 网格每个单元格平均包含的参考点数
+KNN_POINTS_PER_CELL = float(os.getenv("KNN_POINTS_PER_CELL", "8"))
+# 距离加权投票时的平滑项（避免除以0）
+KNN_WEIGHT_EPSILON = 0.1
+
+
+class EmotionKNNIndex:
+    """
+    情绪预测参考集的 k 近邻索引
+
+    - 构建时把参考数据编译成归一化的 float64 特征矩阵和标签编码，
+      之后只读，可以被并发请求共享
+    - 参考点较少时对整批查询做一次向量化的全量距离计算；
+      较多时按网格单元格排序（CSR 布局），查询只扫描附近单元格，逐圈扩大直到结果确定
+    - 支持单个查询 (2,) 和批量查询 (M, 2)
+    """
+
+    def __init__(
+        self,
+        features: np.ndarray,
+        labels: Sequence[str],
+        scales: Sequence[float] = FEATURE_SCALES,
+        brute_force_max: int = KNN_BRUTE_FORCE_MAX,
+        points_per_cell: float = KNN_POINTS_PER_CELL,
+    ):
+        """
+        Args:
+            features: 原始特征 (N, 2)，列依次为 hrv_sdnn、heart_rate
+            labels: 每个参考点的情绪标签
+            scales: 各特征的归一化尺度
+            brute_force_max: 使用全量计算的最大参考点数
+            points_per_cell: 网格单元格的平均点数
+        """
+        features = np.asarray(features, dtype=np.float64)
+        if features.ndim != 2 or features.shape[0] != len(labels):
+            raise ValueError("features 必须是 (N, 特征数) 且与 labels 数量一致")
+        valid = np.isfinite(features).all(axis=1)
+        self.scales = np.asarray(scales, dtype=np.float64)
+        self.label_names, codes = np.unique(
+            np.asarray(labels, dtype=object)[valid].astype(str), return_inverse=True
+        )
+        self.points = features[valid] / self.scales
+        self.codes = codes.astype(np.intp)
+        self.use_grid = len(self.points) > brute_force_max
+        if self.use_grid:
+            self._build_grid(points_per_cell)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    @classmethod
+    def from_frame(
+        cls,
+        df,
+        feature_columns: Sequence[str] = ("hrv_sdnn", "heart_rate"),
+        label_column: str = "emotion",
+        **kwargs
+    ) -> "EmotionKNNIndex":
+        """从 DataFrame 构建索引（不修改 DataFrame）"""
+        return cls(
+            df[list(feature_columns)].to_numpy(dtype=np.float64),
+            df[label_column].to_numpy(),
+            **kwargs
+        )
+
+    def query(self, features: np.ndarray, k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        查询 k 个最近的参考点
+
+        Args:
+            features: 原始特征，单个 (2,) 或批量 (M, 2)
+            k: 近邻数（超过参考点数时取全部）
+
+        Returns:
+            (距离, 参考点下标)，形状为 (M, k)（单个查询时为 (k,)），按距离升序
+        """
+        queries = np.asarray(features, dtype=np.float64)
+        single = queries.ndim == 1
+        queries = np.atleast_2d(queries) / self.scales
+        k = min(k, len(self.points))
+        if k == 0:
+            empty = np.empty((len(queries), 0))
+            return (
+                (empty[0], empty[0].astype(np.intp))
+                if single
+                else (empty, empty.astype(np.intp))
+            )
+
+        if self.use_grid:
+            results = [self._query_grid(q, k) for q in queries]
+            distances = np.stack([d for d, _ in results])
+            indices = np.stack([i for _, i in results])
+        else:
+            distances, indices = self._query_brute_force(queries, k)
+        return (distances[0], indices[0]) if single else (distances, indices)
+
+    def predict(self, features: np.ndarray, k: int = 5) -> Tuple[List[str], np.ndarray]:
+        """
+        距离加权投票预测情绪
+
+        Args:
+            features: 原始特征，单个 (2,) 或批量 (M, 2)
+            k: 近邻数
+
+        Returns:
+            (每个查询的情绪标签, 各标签的投票权重 (M, 标签数))
+        """
+        distances, indices = self.query(np.atleast_2d(features), k)
+        weights = 1.0 / (distances + KNN_WEIGHT_EPSILON)
+        n_labels = len(self.label_names)
+        slots = self.codes[indices] + (np.arange(len(indices)) * n_labels)[:, None]
+        votes = np.bincount(
+            slots.ravel(), weights=weights.ravel(), minlength=len(indices) * n_labels
+        ).reshape(len(indices), n_labels)
+        return [str(label) for label in self.label_names[votes.argmax(axis=1)]], votes
+
+    def _query_brute_force(
+        self, queries: np.ndarray, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        diff = queries[:, None, :] - self.points[None, :, :]
+        squared = np.einsum("mnd,mnd->mn", diff, diff)
+        return self._smallest(squared, k)
+
+    @staticmethod
+    def _smallest(
+        squared: np.ndarray, k: int, candidates: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """在最后一维取最小的 k 个平方距离，返回升序的距离和下标"""
+        if k < squared.shape[-1]:
+            part = np.argpartition(squared, k - 1, axis=-1)[..., :k]
+        else:
+            part = np.broadcast_to(
+                np.arange(squared.shape[-1]), squared.shape[:-1] + (squared.shape[-1],)
+            )
+        part_sq = np.take_along_axis(squared, part, axis=-1)
+        order = np.argsort(part_sq, axis=-1, kind="stable")
+        indices = np.take_along_axis(part, order, axis=-1)
+        distances = np.sqrt(np.take_along_axis(part_sq, order, axis=-1))
+        if candidates is not None:
+            indices = candidates[indices]
+        return distances, indices
+
+    def _build_grid(self, points_per_cell: float) -> None:
+        """把参考点按单元格排序，cell_start[c]:cell_start[c + 1] 是单元格 c 中的点"""
+        self.grid_min = self.points.min(axis=0)
+        self.grid_max = self.points.max(axis=0)
+        extent = self.grid_max - self.grid_min
+        # 只按有跨度的维度计算单元格大小：某列为常数（或跨度不足一个单元格）时，
+        # 把它算进面积会得到极小的单元格，另一维被切成上百万格
+        active = extent > 0
+        cell = 1.0
+        while active.any():
+            cell = (
+                float(np.prod(extent[active])) * points_per_cell / len(self.points)
+            ) ** (1.0 / active.sum())
+            narrow = active & (extent < cell)
+            if not narrow.any():
+                break
+            active &= ~narrow
+        self.cell_size = cell if np.isfinite(cell) and cell > 0 else 1.0
+        self.grid_shape = np.floor(extent / self.cell_size).astype(np.intp) + 1
+
+        cells = self._cell_of(self.points)
+        flat = cells[:, 0] * self.grid_shape[1] + cells[:, 1]
+        order = np.argsort(flat, kind="stable")
+        self.grid_order = order
+        self.grid_points = self.points[order]
+        counts = np.bincount(flat, minlength=int(np.prod(self.grid_shape)))
+        self.cell_start = np.concatenate(([0], np.cumsum(counts)))
+
+    def _cell_of(self, points: np.ndarray) -> np.ndarray:
+        cells = np.floor((points - self.grid_min) / self.cell_size).astype(np.intp)
+        return np.clip(cells, 0, self.grid_shape - 1)
+
+    def _query_grid(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """从查询点所在单元格开始逐圈扩大，"
+        "直到第 k 近的距离不超过到未扫描区域的最短距离"""
+        center = self._cell_of(query[None, :])[0]
+        nx, ny = int(self.grid_shape[0]), int(self.grid_shape[1])
+        radius = 0
+        while True:
+            x0, x1 = max(center[0] - radius, 0), min(center[0] + radius, nx - 1)
+            y0, y1 = max(center[1] - radius, 0), min(center[1] + radius, ny - 1)
+            # 同一行 x 的单元格 [y0, y1] 在排序后的数组中是连续的一段
+            slices = [
+                np.arange(
+                    self.cell_start[x * ny + y0], self.cell_start[x * ny + y1 + 1]
+                )
+                for x in range(x0, x1 + 1)
+            ]
+            candidates = np.concatenate(slices)
+            covers_all = x0 == 0 and y0 == 0 and x1 == nx - 1 and y1 == ny - 1
+
+            if len(candidates) >= k or covers_all:
+                diff = self.grid_points[candidates] - query
+                squared = np.einsum("nd,nd->n", diff, diff)
+                distances, local = self._smallest(squared, k, candidates)
+                if covers_all or distances[-1] <= self._unscanned_distance(
+                    query, x0, x1, y0, y1
+                ):
+                    return distances, self.grid_order[local]
+            # 候选点不足 k 个（查询点落在稀疏区域或数据范围之外）时成倍扩大，
+            # 避免逐圈重复扫描
+            radius = radius + 1 if len(candidates) >= k else radius * 2 + 1
+
+    def _unscanned_distance(
+        self, query: np.ndarray, x0: int, x1: int, y0: int, y1: int
+    ) -> float:
+        """
+        查询点到已扫描矩形之外任意参考点的最短可能距离
+
+        未扫描区域拆成上下左右四条带，每条带再限制在参考点的包围盒内，取查询点到各带的最短距离；
+        查询点远在参考数据范围之外时，另一维的偏移也计入下界，不必扫描整个网格
+        """
+        low = self.grid_min + np.array([x0, y0]) * self.cell_size
+        high = self.grid_min + (np.array([x1, y1]) + 1) * self.cell_size
+        box_low, box_high = self.grid_min, self.grid_max
+        strips = []
+        if x0 > 0:
+            strips.append(((box_low[0], box_low[1]), (low[0], box_high[1])))
+        if x1 < self.grid_shape[0] - 1:
+            strips.append(((high[0], box_low[1]), (box_high[0], box_high[1])))
+        if y0 > 0:
+            strips.append(((low[0], box_low[1]), (high[0], low[1])))
+        if y1 < self.grid_shape[1] - 1:
+            strips.append(((low[0], high[1]), (high[0], box_high[1])))
+        if not strips:
+            return np.inf
+        lows = np.array([strip[0] for strip in strips])
+        highs = np.array([strip[1] for strip in strips])
+        gaps = np.maximum(np.maximum(lows - query, query - highs), 0.0)
+        return float(np.sqrt(np.einsum("sd,sd->s", gaps, gaps)).min())
+
+    def stats(self) -> Dict[str, object]:
+        """返回索引信息"""
+        info = {
+            "points": len(self.points),
+            "labels": [str(label) for label in self.label_names],
+            "mode": "grid" if self.use_grid else "brute_force",
+        }
+        if self.use_grid:
+            info["grid_shape"] = [int(n) for n in self.grid_shape]
+            info["cell_size"] = float(self.cell_size)
+        return info
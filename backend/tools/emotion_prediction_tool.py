@@ -2,9 +2,22 @@ import numpy as np
 import pandas as pd
 import os
 import random
-from typing import Dict, Any
+import asyncio
+import threading
+from typing import Dict, Any, List, Optional, Tuple
 from pathlib import Path
 
+from backend.tools.emotion_knn import EmotionKNNIndex
+from backend.tools.health_features import HEALTH_FEATURE_COLUMNS, HealthFeatures, lag_features, load_health_features
+from backend.tools.lstm_inference import LSTM_MODEL_PATH, LSTMEmotionModel
+from backend.services.inference_batcher import InferenceBatcher
+from backend.services.analytics_pool import AnalyticsPool
+
+# 情绪预测后端：lstm 使用 model/lstm_emotion_model.h5（模型或 HRV 历史不可用时回退到近邻），knn 只用近邻
+EMOTION_PREDICTION_BACKEND = os.getenv("EMOTION_PREDICTION_BACKEND", "lstm").lower()
+# 模拟参考数据的随机种子：各分析进程分别构建参考集，必须得到相同的数据
+MOCK_DATA_SEED = 42
+
 # 全局变量
 _emotion_labels = {
     0: "baseline",
@@ -25,6 +38,20 @@ _question_templates = {
 
 # CSV数据源
 _csv_data = None
+# 由CSV数据构建的近邻索引（构建后只读，所有请求共享）
+_reference_index = None
+_reference_index_built = False
+_reference_index_lock = threading.Lock()
+# LSTM 情绪模型（首次使用时加载，之后只读）
+_emotion_model = None
+_emotion_model_loaded = False
+_emotion_model_lock = threading.Lock()
+
+def _csv_path() -> str:
+    """上传的健康数据 CSV 路径"""
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(os.path.dirname(current_dir))
+    return os.path.join(project_root, "model", "HeartRateVariabilitySDNN.csv")
 
 def _load_csv_data():
     """加载CSV数据作为情绪预测的数据源"""
@@ -32,9 +59,7 @@ def _load_csv_data():
     if _csv_data is None:
         try:
             # 尝试加载上传的CSV文件
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            project_root = os.path.dirname(os.path.dirname(current_dir))
-            csv_path = os.path.join(project_root, "model", "HeartRateVariabilitySDNN.csv")
+            csv_path = _csv_path()
             
             if os.path.exists(csv_path):
                 _csv_data = pd.read_csv(csv_path)
@@ -43,7 +68,11 @@ def _load_csv_data():
                 # 确保数据包含必要的列
                 required_columns = ['hrv_sdnn', 'heart_rate']
                 if not all(col in _csv_data.columns for col in required_columns):
-                    print("CSV文件缺少必要的列，将使用模拟数据")
+                    if 'startDate' in _csv_data.columns and 'value' in _csv_data.columns:
+                        # HealthKit 导出只有 HRV 序列，由 _load_health_features 解析为模型特征
+                        print("CSV为HealthKit HRV导出，不含心率和情绪标签，近邻参考集将使用模拟数据")
+                    else:
+                        print("CSV文件缺少必要的列，将使用模拟数据")
                     _csv_data = _create_mock_data()
             else:
                 print(f"CSV文件不存在: {csv_path}，将使用模拟数据")
@@ -54,53 +83,77 @@ def _load_csv_data():
     
     return _csv_data
 
+def _load_health_features() -> Optional[HealthFeatures]:
+    """解析上传的 HealthKit CSV 为 HRV 特征（带缓存，文件被重新上传后自动重建），失败时返回 None"""
+    csv_path = _csv_path()
+    if not os.path.exists(csv_path):
+        return None
+    try:
+        return load_health_features(csv_path)
+    except Exception as e:
+        print(f"解析HealthKit数据时出错: {str(e)}")
+        return None
+
 def _create_mock_data():
-    """创建模拟数据"""
+    """创建模拟数据（固定种子，每个进程得到相同的参考集）"""
+    rng = np.random.default_rng(MOCK_DATA_SEED)
     return pd.DataFrame({
-        'timestamp': pd.date_range(start='2023-01-01', periods=100, freq='H'),
-        'hrv_sdnn': np.random.normal(50, 10, 100),
-        'heart_rate': np.random.normal(75, 8, 100),
-        'emotion': np.random.choice(['baseline', 'stress', 'amusement'], 100)
+        'timestamp': pd.date_range(start='2023-01-01', periods=100, freq='h'),
+        'hrv_sdnn': rng.normal(50, 10, 100),
+        'heart_rate': rng.normal(75, 8, 100),
+        'emotion': rng.choice(['baseline', 'stress', 'amusement'], 100)
     })
 
+def _get_reference_index() -> Optional[EmotionKNNIndex]:
+    """获取（首次调用时构建）参考数据的近邻索引，数据缺少情绪标签时返回 None"""
+    global _reference_index, _reference_index_built
+    if _reference_index_built:
+        return _reference_index
+    with _reference_index_lock:
+        if not _reference_index_built:
+            df = _load_csv_data()
+            if all(col in df.columns for col in ('hrv_sdnn', 'heart_rate', 'emotion')):
+                _reference_index = EmotionKNNIndex.from_frame(df)
+                print(f"情绪参考索引已构建: {_reference_index.stats()}")
+            _reference_index_built = True
+    return _reference_index
+
+def _predict_from_features(features: np.ndarray) -> List[Dict]:
+    """
+    批量预测情绪
+
+    Args:
+        features: (M, 2)，列依次为 hrv_sdnn、heart_rate
+
+    Returns:
+        每一行对应的预测结果
+    """
+    features = np.atleast_2d(np.asarray(features, dtype=np.float64))
+    index = _get_reference_index()
+    if index is not None and len(index) > 0:
+        # 找到最近的5个点，按距离加权投票（只读共享索引，不修改参考数据）
+        emotions, _ = index.predict(features, k=5)
+    else:
+        # 使用规则预测
+        emotions = [_predict_by_rule(hrv_sdnn, heart_rate) for hrv_sdnn, heart_rate in features]
+
+    return [
+        {
+            "predicted_emotion": emotion,
+            "emotion_probabilities": _emotion_probabilities(emotion)
+        }
+        for emotion in emotions
+    ]
+
 def _predict_from_csv(health_data: Dict) -> Dict:
     """基于CSV数据预测情绪"""
-    # 加载CSV数据
-    df = _load_csv_data()
-    
     # 获取健康数据
     hrv_sdnn = health_data['hrv']['sdnn']
     heart_rate = health_data['heart_rate']['avg']
-    
-    # 简单方法：找到最接近的数据点
-    if 'hrv_sdnn' in df.columns and 'heart_rate' in df.columns:
-        # 计算欧几里得距离
-        df['distance'] = np.sqrt(
-            ((df['hrv_sdnn'] - hrv_sdnn) / 50) ** 2 + 
-            ((df['heart_rate'] - heart_rate) / 20) ** 2  # 归一化距离
-        )
-        
-        # 获取最近的5个点
-        nearest = df.nsmallest(5, 'distance')
-        
-        if 'emotion' in nearest.columns:
-            # 使用最常见的情绪，考虑距离权重
-            weights = 1 / (nearest['distance'] + 0.1)  # 避免除以0
-            emotion_weights = {}
-            for idx, row in nearest.iterrows():
-                emotion = row['emotion']
-                weight = weights[idx]
-                emotion_weights[emotion] = emotion_weights.get(emotion, 0) + weight
-            
-            predicted_emotion = max(emotion_weights.items(), key=lambda x: x[1])[0]
-        else:
-            # 使用规则预测
-            predicted_emotion = _predict_by_rule(hrv_sdnn, heart_rate)
-    else:
-        # 使用规则预测
-        predicted_emotion = _predict_by_rule(hrv_sdnn, heart_rate)
-    
-    # 生成概率分布
+    return _predict_from_features(np.array([[hrv_sdnn, heart_rate]]))[0]
+
+def _emotion_probabilities(predicted_emotion: str) -> Dict[str, float]:
+    """根据预测的情绪生成概率分布"""
     if predicted_emotion == "baseline":
         probs = [0.7, 0.2, 0.1]
     elif predicted_emotion == "stress":
@@ -115,12 +168,155 @@ def _predict_from_csv(health_data: Dict) -> Dict:
     probs = [p/total for p in probs]  # 归一化
     
     # 创建概率字典
-    emotion_probs = {_emotion_labels[i]: float(prob) for i, prob in enumerate(probs)}
-    
-    return {
-        "predicted_emotion": predicted_emotion,
-        "emotion_probabilities": emotion_probs
-    }
+    return {_emotion_labels[i]: float(prob) for i, prob in enumerate(probs)}
+
+def _get_emotion_model() -> Optional[LSTMEmotionModel]:
+    """获取（首次调用时加载）LSTM 情绪模型，加载失败时返回 None"""
+    global _emotion_model, _emotion_model_loaded
+    if _emotion_model_loaded:
+        return _emotion_model
+    with _emotion_model_lock:
+        if not _emotion_model_loaded:
+            try:
+                model = LSTMEmotionModel.from_h5(LSTM_MODEL_PATH)
+                if model.input_shape[1] != len(HEALTH_FEATURE_COLUMNS):
+                    raise ValueError(f"模型输入特征数 {model.input_shape[1]} 与 HRV 特征不一致")
+                _emotion_model = model
+            except Exception as e:
+                print(f"加载LSTM情绪模型时出错: {str(e)}，将使用近邻预测")
+            _emotion_model_loaded = True
+    return _emotion_model
+
+def _hrv_history(window_size: int) -> np.ndarray:
+    """构造窗口所需的最近 HRV 历史（计算最后 window_size 行的滞后特征需要多取两条）"""
+    features = _load_health_features()
+    if features is None:
+        return np.empty(0, dtype=np.float32)
+    return features.values[-(window_size + len(HEALTH_FEATURE_COLUMNS) - 1):]
+
+def _model_window(health_data: Dict, window_size: int, history: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+    """
+    用 HRV 历史加上本次的 HRV SDNN 构造最新的模型输入窗口
+
+    Returns:
+        (window_size, 3)，数据不足一个窗口时返回 None
+    """
+    if history is None:
+        history = _hrv_history(window_size)
+    current = (health_data.get('hrv') or {}).get('sdnn')
+    values = np.append(history, np.float32(current)) if current is not None else history
+    if len(values) < window_size:
+        return None
+    return lag_features(values)[-window_size:]
+
+def _predict_windows(model: LSTMEmotionModel, windows: np.ndarray) -> List[Dict]:
+    """对一批窗口做一次前向计算"""
+    probabilities = model.predict_proba(windows)
+    return [
+        {
+            "predicted_emotion": _emotion_labels[int(np.argmax(probs))],
+            "emotion_probabilities": {_emotion_labels[i]: float(p) for i, p in enumerate(probs)}
+        }
+        for probs in probabilities
+    ]
+
+def _prepare_batch(health_data_list: List[Dict]) -> Tuple[List[Any], List[int], Optional[np.ndarray],
+                                                          List[int], Optional[np.ndarray]]:
+    """
+    把一批请求整理成模型输入（在主进程中执行，只读取缓存的 HRV 历史）
+
+    有模型输入窗口的请求堆叠成一个 (batch, 5, 3) 张量，其余请求合并为 (M, 2) 的近邻查询特征。
+
+    Returns:
+        (结果占位, 窗口对应的位置, 窗口, 特征对应的位置, 特征)；无效输入在结果占位中为异常实例
+    """
+    results: List[Any] = [None] * len(health_data_list)
+
+    window_positions, windows = [], []
+    model = _get_emotion_model() if EMOTION_PREDICTION_BACKEND == "lstm" else None
+    if model is not None:
+        window_size = model.input_shape[0]
+        history = _hrv_history(window_size)
+        for i, health_data in enumerate(health_data_list):
+            try:
+                window = _model_window(health_data, window_size, history)
+            except Exception as e:
+                results[i] = e
+                continue
+            if window is not None:
+                window_positions.append(i)
+                windows.append(window)
+
+    batched = set(window_positions)
+    feature_positions, features = [], []
+    for i, health_data in enumerate(health_data_list):
+        if results[i] is not None or i in batched:
+            continue
+        try:
+            features.append([float(health_data['hrv']['sdnn']), float(health_data['heart_rate']['avg'])])
+            feature_positions.append(i)
+        except Exception as e:
+            results[i] = ValueError(f"健康数据缺少 hrv.sdnn 或 heart_rate.avg: {str(e)}")
+
+    return (results,
+            window_positions, np.stack(windows) if windows else None,
+            feature_positions, np.array(features, dtype=np.float64) if features else None)
+
+def _run_models(windows: Optional[np.ndarray], features: Optional[np.ndarray]) -> Tuple[List[Dict], List[Dict]]:
+    """
+    对整理好的输入做一次 LSTM 前向计算和一次近邻查询（可以在分析进程中执行）
+
+    Returns:
+        (窗口的预测结果, 特征的预测结果)
+    """
+    window_results: List[Dict] = []
+    if windows is not None:
+        model = _get_emotion_model()
+        if model is None:
+            raise RuntimeError("LSTM情绪模型不可用")
+        window_results = _predict_windows(model, windows)
+    feature_results = _predict_from_features(features) if features is not None else []
+    return window_results, feature_results
+
+def _assemble_batch(results: List[Any], window_positions: List[int], window_results: List[Dict],
+                    feature_positions: List[int], feature_results: List[Dict]) -> List[Any]:
+    for i, result in zip(window_positions, window_results):
+        results[i] = result
+    for i, result in zip(feature_positions, feature_results):
+        results[i] = result
+    return results
+
+def _predict_batch(health_data_list: List[Dict]) -> List[Any]:
+    """
+    批量预测情绪（在当前线程中执行）
+
+    Returns:
+        与输入顺序一致的预测结果；某条输入无效时对应位置为异常实例
+    """
+    results, window_positions, windows, feature_positions, features = _prepare_batch(health_data_list)
+    window_results, feature_results = _run_models(windows, features)
+    return _assemble_batch(results, window_positions, window_results, feature_positions, feature_results)
+
+async def _predict_batch_async(health_data_list: List[Dict]) -> List[Any]:
+    # 读取 HRV 历史可能要解析文件，放到线程中；模型计算交给分析进程，事件循环不被占用
+    results, window_positions, windows, feature_positions, features = await asyncio.to_thread(
+        _prepare_batch, health_data_list)
+    if windows is None and features is None:
+        return results
+    window_results, feature_results = await analytics_pool.run(_run_models, windows, features)
+    return _assemble_batch(results, window_positions, window_results, feature_positions, feature_results)
+
+def _warm_analytics_worker() -> None:
+    """分析进程启动时预加载模型和近邻参考索引（HRV 窗口由主进程构造，worker 不需要读取）"""
+    if EMOTION_PREDICTION_BACKEND == "lstm":
+        _get_emotion_model()
+    _get_reference_index()
+
+# CPU 密集的情绪预测在独立进程中执行，worker 启动时预加载模型和参考数据
+analytics_pool = AnalyticsPool(initializer=_warm_analytics_worker, name="health_analytics")
+
+# 合并并发请求的预测：最多等待 INFERENCE_BATCH_WAIT_MS 毫秒凑成一批
+emotion_batcher = InferenceBatcher(_predict_batch_async, name="emotion_prediction")
 
 def _predict_by_rule(hrv_sdnn: float, heart_rate: float) -> str:
     """使用简单规则预测情绪"""
@@ -153,15 +349,15 @@ async def predict_emotion_and_generate_question(health_data: Dict[str, Any]) ->
     Tool to predict emotion from health data and generate appropriate questions.
     
     This tool:
-    1. Uses CSV data or rules to predict emotional state
+    1. Uses the LSTM model on the HRV history, or CSV data / rules, to predict emotional state
     2. Generates an appropriate question based on the predicted emotion
     
     Input: Dict with health metrics (heart rate, HRV, sleep, etc.)
     Output: Dict with predicted emotion, probabilities and generated question
     """
     try:
-        # 从CSV预测情绪
-        prediction_result = _predict_from_csv(health_data)
+        # 与并发请求合并为一批预测（LSTM 模型，不可用时使用CSV近邻或规则）
+        prediction_result = await emotion_batcher.submit(health_data)
         
         # 生成问题
         question = _generate_question(prediction_result["predicted_emotion"])
@@ -183,8 +379,6 @@ async def predict_emotion_and_generate_question(health_data: Dict[str, Any]) ->
 
 # 使用示例
 if __name__ == "__main__":
-    import asyncio
-    
     # 示例健康数据，与fetch_health_data.py保持一致
     mock_health_data = {
         "heart_rate": {"avg": 75, "min": 62, "max": 110},
@@ -0,0 +1,265 @@
+import os
+import hashlib
+import logging
+import threading
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from backend.memory.local_log_store import LOCAL_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# 特征缓存目录（按源文件大小和修改时间失效）
+HEALTH_FEATURE_CACHE_DIR = os.getenv(
+    "HEALTH_FEATURE_CACHE_DIR", os.path.join(LOCAL_CACHE_DIR, "health_features")
+)
+# 与 model/predict.ipynb 一致：HRV_SDNN 及其滞后1、2期，窗口长度5
+HEALTH_FEATURE_COLUMNS = ("HRV_SDNN", "HRV_SDNN_lag1", "HRV_SDNN_lag2")
+HEALTH_WINDOW_SIZE = 5
+# Apple Health 导出中 HRV 记录的类型
+HRV_SDNN_RECORD_TYPE = "HKQuantityTypeIdentifierHeartRateVariabilitySDNN"
+# Apple Health 导出的时间格式，例如 "2023-10-27 18:28:16 +0800"
+HEALTHKIT_DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+# 缓存格式变化时递增，使旧缓存失效
+_CACHE_VERSION = 1
+
+
+class HealthFeatures:
+    """
+    按时间排序的 HRV 特征
+
+    timestamps 为 startDate（UTC 微秒），features 为 (N, 3) float32，
+    列依次为 HEALTH_FEATURE_COLUMNS。
+    """
+
+    def __init__(self, timestamps: np.ndarray, features: np.ndarray):
+        self.timestamps = timestamps
+        self.features = features
+
+    def __len__(self) -> int:
+        return len(self.features)
+
+    @property
+    def values(self) -> np.ndarray:
+        """原始 HRV SDNN 值（ms）"""
+        return self.features[:, 0]
+
+    def windows(self, window_size: int = HEALTH_WINDOW_SIZE) -> np.ndarray:
+        """全部完整窗口 (N - window_size + 1, window_size, 3)，是 features 的只读视图"""
+        return sliding_windows(self.features, window_size)
+
+    def latest_window(
+        self, window_size: int = HEALTH_WINDOW_SIZE
+    ) -> Optional[np.ndarray]:
+        """以最新一条记录结尾的窗口 (1, window_size, 3)，记录不足时返回 None"""
+        if len(self.features) < window_size:
+            return None
+        return self.features[None, -window_size:]
+
+
+def _parse_dates(dates: pd.Series) -> np.ndarray:
+    """把日期字符串向量化解析为 UTC 微秒；先按 HealthKit 格式解析，不匹配的再通用解析"""
+    parsed = pd.to_datetime(
+        dates, format=HEALTHKIT_DATE_FORMAT, utc=True, errors="coerce"
+    )
+    unparsed = parsed.isna() & dates.notna()
+    if unparsed.any():
+        parsed[unparsed] = pd.to_datetime(dates[unparsed], utc=True, errors="coerce")
+    epoch = pd.Timestamp(0, tz="UTC")
+    microseconds = ((parsed - epoch) // pd.Timedelta(microseconds=1)).to_numpy(
+        dtype=np.float64, na_value=np.nan
+    )
+    return microseconds
+
+
+def _read_csv(path: str) -> pd.DataFrame:
+    columns = pd.read_csv(path, nrows=0).columns
+    usecols = [c for c in ("startDate", "endDate", "value") if c in columns]
+    if "startDate" not in usecols or "value" not in usecols:
+        raise ValueError(
+            f"{path} 不是 HealthKit 导出格式（需要 startDate 和 value 列）"
+        )
+    return pd.read_csv(path, usecols=usecols, dtype={"startDate": str, "endDate": str})
+
+
+def _read_xml(path: str, record_type: str) -> pd.DataFrame:
+    """流式解析 Apple Health 的 export.xml，只保留指定类型的 Record"""
+    starts, ends, values = [], [], []
+    for _, element in ET.iterparse(path, events=("end",)):
+        if element.tag == "Record" and element.get("type") == record_type:
+            starts.append(element.get("startDate"))
+            ends.append(element.get("endDate"))
+            values.append(element.get("value"))
+        element.clear()
+    return pd.DataFrame({"startDate": starts, "endDate": ends, "value": values})
+
+
+def read_healthkit_records(
+    path: str, record_type: str = HRV_SDNN_RECORD_TYPE
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    读取 Apple Health 导出的 HRV 记录
+
+    Args:
+        path: 导出的 CSV（sourceName, startDate, endDate, value 等列）或 export.xml
+        record_type: export.xml 中要读取的记录类型
+
+    Returns:
+        (startDate 的 UTC 微秒 int64, 值 float64)，按 startDate 排序并去除重复记录
+    """
+    df = _read_xml(path, record_type) if path.endswith(".xml") else _read_csv(path)
+    starts = _parse_dates(df["startDate"])
+    ends = _parse_dates(df["endDate"]) if "endDate" in df.columns else starts
+    values = pd.to_numeric(df["value"], errors="coerce").to_numpy(dtype=np.float64)
+
+    valid = np.isfinite(starts) & np.isfinite(values)
+    if not valid.all():
+        logger.warning(
+            f"{path} 中有 {int((~valid).sum())} 条记录的时间或数值无法解析，已跳过"
+        )
+    starts, values = starts[valid].astype(np.int64), values[valid]
+    ends = np.nan_to_num(ends[valid], nan=-1).astype(np.int64)
+
+    # 按 (startDate, endDate, value) 排序，相邻且三者都相同的是重复导出的同一条记录
+    order = np.lexsort((values, ends, starts))
+    starts, ends, values = starts[order], ends[order], values[order]
+    keep = np.ones(len(starts), dtype=bool)
+    keep[1:] = (
+        (starts[1:] != starts[:-1])
+        | (ends[1:] != ends[:-1])
+        | (values[1:] != values[:-1])
+    )
+    return starts[keep], values[keep]
+
+
+def lag_features(
+    values: np.ndarray, lags: int = len(HEALTH_FEATURE_COLUMNS) - 1
+) -> np.ndarray:
+    """
+    构造当前值和滞后特征（等价于 notebook 中的 shift(1)、shift(2) 后 fillna(0)）
+
+    Returns:
+        (N, lags + 1) float32
+    """
+    values = np.asarray(values, dtype=np.float32)
+    features = np.zeros((len(values), lags + 1), dtype=np.float32)
+    for lag in range(lags + 1):
+        features[lag:, lag] = values[: len(values) - lag]
+    return features
+
+
+def sliding_windows(
+    features: np.ndarray, window_size: int = HEALTH_WINDOW_SIZE
+) -> np.ndarray:
+    """
+    滑动窗口（步长为1），不复制数据
+
+    notebook 的循环 range(len(X) - window_size) 少取了以最后一条记录结尾的窗口；
+    这里返回全部完整窗口，前 len(X) - window_size 个与 notebook 相同。
+
+    Returns:
+        (N - window_size + 1, window_size, 特征数) 的只读视图，记录不足时为空
+    """
+    if len(features) < window_size:
+        return np.empty((0, window_size, features.shape[1]), dtype=features.dtype)
+    return sliding_window_view(features, (window_size, features.shape[1]))[:, 0]
+
+
+class HealthFeatureCache:
+    """
+    HealthKit 特征的 npz 缓存
+
+    - 以源文件路径命名，记录源文件大小和修改时间，
+      源文件被替换（例如用户重新上传）后自动重建
+    - 只保存 int64 时间戳和 float32 特征矩阵，不使用 pickle
+    - 进程内再缓存一份，重复调用不读磁盘
+    """
+
+    def __init__(self, cache_dir: str = HEALTH_FEATURE_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._loaded: Dict[str, Tuple[Tuple[int, int], HealthFeatures]] = {}
+        self._lock = threading.Lock()
+
+    def cache_path(self, source_path: str) -> str:
+        source_path = os.path.abspath(source_path)
+        digest = hashlib.blake2b(source_path.encode("utf-8"), digest_size=4).hexdigest()
+        return os.path.join(self.cache_dir, f"{Path(source_path).stem}_{digest}.npz")
+
+    def load(self, source_path: str) -> HealthFeatures:
+        """
+        读取源文件的特征，优先使用缓存
+
+        Args:
+            source_path: HealthKit 导出的 CSV 或 export.xml
+
+        Returns:
+            HealthFeatures
+        """
+        stat = os.stat(source_path)
+        fingerprint = (stat.st_size, stat.st_mtime_ns)
+        key = os.path.abspath(source_path)
+        with self._lock:
+            loaded = self._loaded.get(key)
+            if loaded is not None and loaded[0] == fingerprint:
+                return loaded[1]
+
+            features = self._read_cache(source_path, fingerprint)
+            if features is None:
+                starts, values = read_healthkit_records(source_path)
+                features = HealthFeatures(starts, lag_features(values))
+                self._write_cache(source_path, fingerprint, features)
+            self._loaded[key] = (fingerprint, features)
+            return features
+
+    def _read_cache(
+        self, source_path: str, fingerprint: Tuple[int, int]
+    ) -> Optional[HealthFeatures]:
+        path = self.cache_path(source_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if (
+                    int(data["version"]),
+                    int(data["source_size"]),
+                    int(data["source_mtime_ns"]),
+                ) != (_CACHE_VERSION,) + fingerprint:
+                    return None
+                return HealthFeatures(data["timestamps"], data["features"])
+        except Exception as e:
+            logger.warning(f"读取特征缓存 {path} 出错，重新解析: {str(e)}")
+            return None
+
+    def _write_cache(
+        self, source_path: str, fingerprint: Tuple[int, int], features: HealthFeatures
+    ) -> None:
+        path = self.cache_path(source_path)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    version=np.int64(_CACHE_VERSION),
+                    source_size=np.int64(fingerprint[0]),
+                    source_mtime_ns=np.int64(fingerprint[1]),
+                    timestamps=features.timestamps,
+                    features=features.features,
+                )
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"写入特征缓存 {path} 出错: {str(e)}")
+
+
+# 进程内共享实例
+health_feature_cache = HealthFeatureCache()
+
+
+def load_health_features(source_path: str) -> HealthFeatures:
+    """读取 HealthKit 导出的 HRV 特征（使用共享缓存）"""
+    return health_feature_cache.load(source_path)
@@ -0,0 +1,206 @@
+import os
+import json
+import logging
+from typing import Any, Callable, Dict, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 训练好的情绪模型（Keras 2 保存的 HDF5）
+LSTM_MODEL_PATH = os.getenv(
+    "LSTM_MODEL_PATH",
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+        "model",
+        "lstm_emotion_model.h5",
+    ),
+)
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    # 用 tanh 表示，避免大负数时 exp 溢出
+    return 0.5 * (np.tanh(0.5 * x) + 1.0)
+
+
+def _softmax(x: np.ndarray) -> np.ndarray:
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+_ACTIVATIONS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "linear": lambda x: x,
+    "tanh": np.tanh,
+    "sigmoid": _sigmoid,
+    "relu": lambda x: np.maximum(x, 0),
+    "softmax": _softmax,
+}
+
+
+class _LSTMLayer:
+    """Keras LSTM 层（门的顺序为 i, f, c, o）"""
+
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        kernel: np.ndarray,
+        recurrent_kernel: np.ndarray,
+        bias: np.ndarray,
+    ):
+        for key, supported in (
+            ("go_backwards", False),
+            ("stateful", False),
+            ("return_state", False),
+            ("time_major", False),
+        ):
+            if config.get(key, supported) != supported:
+                raise ValueError(f"不支持 LSTM 配置 {key}={config.get(key)}")
+        self.units = int(config["units"])
+        self.return_sequences = bool(config.get("return_sequences", False))
+        self.activation = _ACTIVATIONS[config.get("activation", "tanh")]
+        self.recurrent_activation = _ACTIVATIONS[
+            config.get("recurrent_activation", "sigmoid")
+        ]
+        self.kernel = kernel
+        self.recurrent_kernel = recurrent_kernel
+        self.bias = bias
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        batch, steps, features = x.shape
+        units = self.units
+        # 所有时间步的输入投影合并为一次矩阵乘法
+        projected = (
+            x.reshape(batch * steps, features) @ self.kernel + self.bias
+        ).reshape(batch, steps, 4 * units)
+        h = np.zeros((batch, units), dtype=x.dtype)
+        c = np.zeros((batch, units), dtype=x.dtype)
+        outputs = []
+        for t in range(steps):
+            z = projected[:, t] + h @ self.recurrent_kernel
+            i = self.recurrent_activation(z[:, :units])
+            f = self.recurrent_activation(z[:, units : 2 * units])
+            g = self.activation(z[:, 2 * units : 3 * units])
+            o = self.recurrent_activation(z[:, 3 * units :])
+            c = f * c + i * g
+            h = o * self.activation(c)
+            if self.return_sequences:
+                outputs.append(h)
+        return np.stack(outputs, axis=1) if self.return_sequences else h
+
+
+class _DenseLayer:
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        kernel: np.ndarray,
+        bias: Optional[np.ndarray] = None,
+    ):
+        self.activation = _ACTIVATIONS[config.get("activation", "linear")]
+        self.kernel = kernel
+        self.bias = bias
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        y = x @ self.kernel
+        if self.bias is not None:
+            y = y + self.bias
+        return self.activation(y)
+
+
+class LSTMEmotionModel:
+    """
+    只依赖 NumPy 的 LSTM 情绪模型推理
+
+    从 Keras 保存的 HDF5 文件读取模型结构和权重（不需要 TensorFlow），
+    对一批窗口 (batch, 时间步, 特征) 做批量矩阵运算的前向计算。
+    支持 Sequential 模型中的 LSTM 和 Dense 层。
+    """
+
+    def __init__(
+        self,
+        layers: Sequence[Callable[[np.ndarray], np.ndarray]],
+        input_shape: Sequence[int],
+    ):
+        """
+        Args:
+            layers: 依次执行的层
+            input_shape: 单个样本的输入形状 (时间步, 特征数)
+        """
+        self.layers = list(layers)
+        self.input_shape = tuple(input_shape)
+
+    @classmethod
+    def from_h5(cls, path: str = LSTM_MODEL_PATH) -> "LSTMEmotionModel":
+        """
+        读取 Keras HDF5 模型
+
+        Args:
+            path: .h5 文件路径
+
+        Returns:
+            LSTMEmotionModel
+        """
+        import h5py
+
+        with h5py.File(path, "r") as f:
+            config = f.attrs["model_config"]
+            config = json.loads(
+                config.decode("utf-8") if isinstance(config, bytes) else config
+            )
+            if config["class_name"] != "Sequential":
+                raise ValueError(
+                    f"只支持 Sequential 模型，实际为 {config['class_name']}"
+                )
+            weights_group = f["model_weights"]
+
+            layers, input_shape = [], None
+            for layer in config["config"]["layers"]:
+                class_name, layer_config = layer["class_name"], layer["config"]
+                if input_shape is None and "batch_input_shape" in layer_config:
+                    input_shape = layer_config["batch_input_shape"][1:]
+                if class_name in ("InputLayer", "Dropout"):
+                    continue
+                group = weights_group[layer_config["name"]]
+                weights = [
+                    np.asarray(group[_decode(name)], dtype=np.float32)
+                    for name in group.attrs["weight_names"]
+                ]
+                if class_name == "LSTM":
+                    layers.append(_LSTMLayer(layer_config, *weights))
+                elif class_name == "Dense":
+                    layers.append(_DenseLayer(layer_config, *weights))
+                else:
+                    raise ValueError(f"不支持的层类型: {class_name}")
+
+        logger.info(f"已加载情绪模型 {path}: 输入 {input_shape}，{len(layers)} 层")
+        return cls(layers, input_shape)
+
+    def predict_proba(self, windows: np.ndarray) -> np.ndarray:
+        """
+        批量前向计算
+
+        Args:
+            windows: (batch, 时间步, 特征) 或单个窗口 (时间步, 特征)
+
+        Returns:
+            (batch, 类别数) 的 softmax 概率（单个窗口时为 (类别数,)）
+        """
+        x = np.asarray(windows, dtype=np.float32)
+        single = x.ndim == 2
+        if single:
+            x = x[None]
+        if tuple(x.shape[1:]) != self.input_shape:
+            raise ValueError(
+                f"输入形状应为 (batch, {self.input_shape[0]}, {self.input_shape[1]})，"
+                f"实际为 {x.shape}"
+            )
+        for layer in self.layers:
+            x = layer(x)
+        return x[0] if single else x
+
+    def predict(self, windows: np.ndarray) -> np.ndarray:
+        """批量预测类别下标（与 notebook 中的 argmax 一致）"""
+        return np.argmax(self.predict_proba(windows), axis=-1)
+
+
+def _decode(name: Any) -> str:
+    return name.decode("utf-8") if isinstance(name, bytes) else name